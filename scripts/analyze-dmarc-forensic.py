@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+DMARCフォレンジックレポート（ruf）分析ツール
+ディレクトリまたは mbox のフォレンジックレポートを1通ずつ読み、ARFフィールドと
+元メールのヘッダー（EmailHeaderAnalyzer で解析）を送信元IP・失敗種別ごとに集計
+"""
+
+import sys
+import argparse
+from typing import TYPE_CHECKING, Dict
+
+# 起動時間短縮のため、email/json や補助モジュールは使用する処理の中で import する
+if TYPE_CHECKING:
+    from dmarc_forensic import ForensicStats
+
+# 進捗を表示する間隔（通）
+PROGRESS_INTERVAL = 10000
+
+
+def header_analyzer_class():
+    """analyze-email-headers.py の EmailHeaderAnalyzer を読み込む"""
+    return __import__('analyze-email-headers').EmailHeaderAnalyzer
+
+
+def ingest(paths, stats: 'ForensicStats', max_bytes: int, analyze_headers: bool = True) -> None:
+    """フォレンジックレポートを1通ずつ読み込み集計（メッセージは保持しない）"""
+    from dmarc_forensic import extract_forensic, iter_messages
+
+    analyzer_class = header_analyzer_class() if analyze_headers else None
+    for path in paths:
+        for origin, raw in iter_messages(path, max_bytes):
+            report = extract_forensic(raw)
+            if report is None:
+                stats.skipped += 1
+                continue
+            analysis = None
+            if analyzer_class is not None and report['original_headers']:
+                analyzer = analyzer_class()
+                analyzer.parse_headers(report['original_headers'])
+                analysis = analyzer.analyze()
+            stats.add(report, analysis)
+            if stats.total % PROGRESS_INTERVAL == 0:
+                print(f"  {stats.total:,} 通処理", file=sys.stderr)
+
+
+def generate_report(stats: 'ForensicStats', top: int = 20) -> str:
+    """集計結果のレポートを生成"""
+    report = []
+    report.append("=" * 70)
+    report.append("DMARCフォレンジックレポート分析結果")
+    report.append("=" * 70)
+    report.append("")
+    report.append(f"レポート数: {stats.total:,}")
+    if stats.skipped:
+        report.append(f"フォレンジックレポート以外（スキップ）: {stats.skipped:,}")
+    report.append("")
+
+    def ranked(counts: Dict[str, int]):
+        return sorted(counts.items(), key=lambda x: (-x[1], x[0]))
+
+    report.append("【失敗種別】")
+    report.append("-" * 40)
+    for kind, count in ranked(stats.by_type):
+        report.append(f"{kind:<20} {count:>10,}")
+        for sample in stats.samples.get(kind, []):
+            report.append(f"  例: {sample}")
+    report.append("")
+
+    report.append("【対象ドメイン】")
+    report.append("-" * 40)
+    for domain, count in ranked(stats.by_domain)[:top]:
+        report.append(f"{domain or '(不明)':<40} {count:>10,}")
+    report.append("")
+
+    if stats.auth_results:
+        report.append("【元メールの認証結果】")
+        report.append("-" * 40)
+        for key, count in ranked(stats.auth_results):
+            report.append(f"{key:<40} {count:>10,}")
+        report.append("")
+
+    report.append(f"【送信元IP（上位{top}件）】")
+    report.append("-" * 60)
+    for ip, source in stats.top_sources(top):
+        types = ', '.join(f"{k}={v}" for k, v in ranked(source['types']))
+        report.append(f"{ip or '(不明)':<40} {source['count']:>8,}  {types}")
+    if stats.pruned_sources:
+        report.append(f"※ 件数の少ない送信元 {stats.pruned_sources:,} 件を集計から除外"
+                      f"（各件数の誤差は最大 {stats.max_error}）")
+    report.append("")
+    report.append("=" * 70)
+    return '\n'.join(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DMARCフォレンジックレポート（ruf）分析ツール')
+    parser.add_argument('paths', nargs='+', help='レポートのディレクトリ・メールファイル・mbox')
+    parser.add_argument('--json', help='JSON形式で出力', metavar='FILE')
+    parser.add_argument('--top', type=int, default=20, help='表示する送信元IPの件数（デフォルト: 20）')
+    parser.add_argument('--max-sources', type=int,
+                        help='集計する送信元IPの上限（デフォルト: 10000）')
+    parser.add_argument('--max-message-bytes', type=int,
+                        help='1通あたりに読み込む最大バイト数（デフォルト: 262144）')
+    parser.add_argument('--no-header-analysis', action='store_true',
+                        help='元メールのヘッダー解析を省略（ARFフィールドのみ集計）')
+
+    args = parser.parse_args()
+
+    from dmarc_forensic import DEFAULT_MAX_MESSAGE_BYTES, DEFAULT_MAX_SOURCES, ForensicStats
+
+    stats = ForensicStats(args.max_sources or DEFAULT_MAX_SOURCES)
+    try:
+        ingest(args.paths, stats, args.max_message_bytes or DEFAULT_MAX_MESSAGE_BYTES,
+               analyze_headers=not args.no_header_analysis)
+    except OSError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(generate_report(stats, args.top))
+
+    if args.json:
+        import json
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(stats.to_dict(), f, indent=2, ensure_ascii=False)
+        print(f"JSON形式で {args.json} に保存しました")
+
+
+if __name__ == "__main__":
+    main()
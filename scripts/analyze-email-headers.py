@@ -2,46 +2,130 @@
 
 """
 メールヘッダー解析ツール
-DKIM、SPF、DMARC認証結果を解析し、詳細なレポートを生成
+DKIM、SPF、DMARC認証結果と Received ヘッダーの配送経路・遅延を解析し、詳細なレポートを生成
+複数のメールをまとめて解析するバッチモードでは、中継サーバーごとの遅延分位点を集計
 """
 
 import sys
 import re
-import json
-import base64
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# この秒数を超える中継遅延を推奨事項で指摘
+SLOW_HOP_SECONDS = 300
+
+# 前の中継より時刻が戻っている場合に時計のずれと判定する秒数
+CLOCK_SKEW_SECONDS = 1
+
+# 解析結果の形式のバージョン（analyze() の結果が変わる変更をしたら上げる）
+# バッチモードのキャッシュはこれとこのファイルの内容のハッシュが変わると破棄される
+ANALYSIS_VERSION = 1
+
+# Received ヘッダーのコメント（括弧内）
+_COMMENT = re.compile(r'\([^()]*\)')
+
+def parse_received(value: str) -> Dict:
+    """Receivedヘッダーを解析（from・by・with・id・送信元IP・日時）"""
+    hop = {
+        'from': None,
+        'by': None,
+        'with': None,
+        'id': None,
+        'ip': None,
+        'timestamp': None,
+        'raw': value
+    }
+    
+    # 日時は最後の ; 以降
+    clauses, _, date_text = value.rpartition(';')
+    if not clauses:
+        clauses, date_text = value, ''
+    if date_text.strip():
+        from email.utils import parsedate_to_datetime
+        try:
+            date = parsedate_to_datetime(date_text.strip())
+            # タイムゾーンのない日時はUTCとみなす
+            if date.tzinfo is None:
+                from datetime import timezone
+                date = date.replace(tzinfo=timezone.utc)
+            hop['timestamp'] = date.timestamp()
+        except (TypeError, ValueError, IndexError):
+            pass
+    
+    ip_match = re.search(r'\[(?:IPv6:)?([0-9A-Fa-f:.]+)\]', clauses)
+    if ip_match:
+        hop['ip'] = ip_match.group(1)
+    
+    # コメントを除いてから各句を抽出（入れ子のコメントは内側から除去）
+    text = clauses
+    while True:
+        stripped = _COMMENT.sub(' ', text)
+        if stripped == text:
+            break
+        text = stripped
+    for field in ('from', 'by', 'with', 'id'):
+        match = re.search(r'\b' + field + r'\s+([^\s;]+)', text, re.IGNORECASE)
+        if match:
+            hop[field] = match.group(1)
+    
+    return hop
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """最近傍順位法による分位点（values は昇順ソート済み、空なら None）"""
+    if not values:
+        return None
+    rank = max(int(-(-q * len(values) // 100)), 1)
+    return values[min(rank, len(values)) - 1]
+
+def format_seconds(seconds: Optional[float]) -> str:
+    """遅延の表示（1分以上は分・時間単位）"""
+    if seconds is None:
+        return '-'
+    sign = '-' if seconds < 0 else ''
+    seconds = abs(seconds)
+    if seconds < 60:
+        return f"{sign}{seconds:.0f}秒"
+    if seconds < 3600:
+        return f"{sign}{seconds / 60:.1f}分"
+    return f"{sign}{seconds / 3600:.1f}時間"
+
+def iter_header_fields(header_text: str) -> Iterator[Tuple[str, str]]:
+    """ヘッダーを (名前, 値) の順に返す（継続行は空白1つで連結）"""
+    current_header = ""
+    # 値は継続行ごとの断片で持ち、ヘッダーの区切りで連結する（長いヘッダーで文字列の再生成を繰り返さない）
+    current_parts = [""]
+    
+    lines = header_text.replace('\r\n', '\n').split('\n')
+    
+    for line in lines:
+        if line.startswith(' ') or line.startswith('\t'):
+            # 継続行
+            current_parts.append(line.strip())
+        else:
+            # 新しいヘッダー
+            if current_header:
+                yield current_header, ' '.join(current_parts)
+            
+            if ':' in line:
+                name, value = line.split(':', 1)
+                current_header = name.strip()
+                current_parts = [value.strip()]
+    
+    # 最後のヘッダー
+    if current_header:
+        yield current_header, ' '.join(current_parts)
 
 class EmailHeaderAnalyzer:
     def __init__(self):
         self.headers = {}
         self.authentication_results = []
         self.dkim_signatures = []
+        self.received_hops = []
         
     def parse_headers(self, header_text: str) -> None:
         """メールヘッダーをパース"""
-        current_header = ""
-        current_value = ""
-        
-        lines = header_text.replace('\r\n', '\n').split('\n')
-        
-        for line in lines:
-            if line.startswith(' ') or line.startswith('\t'):
-                # 継続行
-                current_value += ' ' + line.strip()
-            else:
-                # 新しいヘッダー
-                if current_header:
-                    self._add_header(current_header, current_value)
-                
-                if ':' in line:
-                    parts = line.split(':', 1)
-                    current_header = parts[0].strip()
-                    current_value = parts[1].strip() if len(parts) > 1 else ""
-        
-        # 最後のヘッダーを追加
-        if current_header:
-            self._add_header(current_header, current_value)
+        for name, value in iter_header_fields(header_text):
+            self._add_header(name, value)
     
     def _add_header(self, name: str, value: str) -> None:
         """ヘッダーを追加"""
@@ -56,6 +140,8 @@ class EmailHeaderAnalyzer:
             self.authentication_results.append(self._parse_auth_results(value))
         elif name_lower == 'dkim-signature':
             self.dkim_signatures.append(self._parse_dkim_signature(value))
+        elif name_lower == 'received':
+            self.received_hops.append(parse_received(value))
     
     def _parse_auth_results(self, value: str) -> Dict:
         """Authentication-Resultsヘッダーを解析"""
@@ -169,6 +255,53 @@ class EmailHeaderAnalyzer:
         
         return signature
     
+    def analyze_delivery(self) -> Dict:
+        """配送経路（古い順）と中継ごとの遅延・全体の遅延・時計のずれを解析
+        
+        Received ヘッダーは中継ごとに先頭へ追加されるため、逆順が配送順になる。
+        各中継の遅延は、そのサーバー（by）が受信した時刻と直前の中継の受信時刻の差。
+        """
+        hops = []
+        previous = None
+        for hop in reversed(self.received_hops):
+            hop = dict(hop)
+            hop['delay'] = None
+            hop['clock_skew'] = False
+            if hop['timestamp'] is not None:
+                if previous is not None:
+                    hop['delay'] = hop['timestamp'] - previous
+                    hop['clock_skew'] = hop['delay'] < -CLOCK_SKEW_SECONDS
+                previous = hop['timestamp']
+            hops.append(hop)
+        
+        timestamps = [h['timestamp'] for h in hops if h['timestamp'] is not None]
+        delivery = {
+            'hops': hops,
+            'total_delay': timestamps[-1] - timestamps[0] if len(timestamps) >= 2 else None,
+            'submit_delay': None,
+            'slowest_hop': None,
+            'clock_skew_hops': sum(1 for h in hops if h['clock_skew'])
+        }
+        
+        # Date ヘッダー（送信者の時計）から最初の受信まで
+        if timestamps and self.headers.get('date'):
+            from email.utils import parsedate_to_datetime
+            try:
+                sent = parsedate_to_datetime(self.headers['date'][0])
+                if sent.tzinfo is None:
+                    from datetime import timezone
+                    sent = sent.replace(tzinfo=timezone.utc)
+                delivery['submit_delay'] = timestamps[0] - sent.timestamp()
+            except (TypeError, ValueError, IndexError):
+                pass
+        
+        delays = [h for h in hops if h['delay'] is not None and not h['clock_skew']]
+        if delays:
+            slowest = max(delays, key=lambda h: h['delay'])
+            delivery['slowest_hop'] = {'by': slowest['by'], 'from': slowest['from'],
+                                       'delay': slowest['delay']}
+        return delivery
+    
     def analyze(self) -> Dict:
         """分析結果を生成"""
         analysis = {
@@ -187,6 +320,7 @@ class EmailHeaderAnalyzer:
                 'date': self.headers.get('date', []),
                 'message_id': self.headers.get('message-id', [])
             },
+            'delivery': self.analyze_delivery(),
             'recommendations': []
         }
         
@@ -231,6 +365,7 @@ class EmailHeaderAnalyzer:
                 )
             
             if sig['signature']:
+                import base64
                 # 署名の推定ビット長
                 sig_bytes = len(base64.b64decode(sig['signature'] + '=='))
                 sig_bits = sig_bytes * 8
@@ -239,6 +374,20 @@ class EmailHeaderAnalyzer:
                         f"DKIM鍵長が{sig_bits}ビットです。2048ビット以上を推奨します。"
                     )
         
+        # 配送遅延
+        delivery = analysis['delivery']
+        slowest = delivery['slowest_hop']
+        if slowest and slowest['delay'] > SLOW_HOP_SECONDS:
+            analysis['recommendations'].append(
+                f"中継サーバー {slowest['by'] or '(不明)'} での受信までに{format_seconds(slowest['delay'])}"
+                f"かかっています（{slowest['from'] or '(不明)'} から）。キューや再送の状況を確認してください。"
+            )
+        if delivery['clock_skew_hops']:
+            analysis['recommendations'].append(
+                f"{delivery['clock_skew_hops']}件の中継で時刻が前の中継より戻っています。"
+                "サーバーの時計（NTP）設定を確認してください。"
+            )
+        
         return analysis
     
     def generate_report(self, analysis: Dict) -> str:
@@ -332,6 +481,27 @@ class EmailHeaderAnalyzer:
                             report.append(f"    {key}: {val}")
                 report.append("")
         
+        # 配送経路
+        delivery = analysis.get('delivery')
+        if delivery and delivery['hops']:
+            report.append("【配送経路】")
+            report.append("-" * 30)
+            for i, hop in enumerate(delivery['hops'], 1):
+                if hop['delay'] is None:
+                    delay = ""
+                elif hop['delay'] >= 0:
+                    delay = f" +{format_seconds(hop['delay'])}"
+                else:
+                    delay = f" {format_seconds(hop['delay'])}"
+                skew = " ⚠️ 時計のずれ" if hop['clock_skew'] else ""
+                report.append(f"#{i} {hop['from'] or '(不明)'} → {hop['by'] or '(不明)'}"
+                              f" ({hop['with'] or '-'}){delay}{skew}")
+            if delivery['submit_delay'] is not None:
+                report.append(f"送信から最初の受信まで: {format_seconds(delivery['submit_delay'])}")
+            if delivery['total_delay'] is not None:
+                report.append(f"配送全体: {format_seconds(delivery['total_delay'])}")
+            report.append("")
+        
         # 推奨事項
         if analysis['recommendations']:
             report.append("【推奨事項】")
@@ -344,8 +514,161 @@ class EmailHeaderAnalyzer:
         
         return '\n'.join(report)
 
+class RelayLatencyStats:
+    """バッチモード: 中継サーバー（by）ごとの遅延と配送全体の遅延を集計"""
+    
+    def __init__(self):
+        self.messages = 0
+        self.relays: Dict[str, Dict] = {}
+        self.total_delays: List[float] = []
+    
+    def add(self, delivery: Dict) -> None:
+        """analyze_delivery の結果を加算"""
+        self.messages += 1
+        for hop in delivery['hops']:
+            relay = self.relays.setdefault(hop['by'] or '(不明)', {'delays': [], 'clock_skew': 0})
+            if hop['clock_skew']:
+                relay['clock_skew'] += 1
+            elif hop['delay'] is not None:
+                relay['delays'].append(hop['delay'])
+        if delivery['total_delay'] is not None:
+            self.total_delays.append(delivery['total_delay'])
+    
+    @staticmethod
+    def summarize(delays: List[float]) -> Dict:
+        values = sorted(delays)
+        return {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'max': values[-1] if values else None
+        }
+    
+    def to_dict(self) -> Dict:
+        return {
+            'messages': self.messages,
+            'total': self.summarize(self.total_delays),
+            'relays': {
+                name: dict(self.summarize(relay['delays']), clock_skew=relay['clock_skew'])
+                for name, relay in sorted(self.relays.items())
+            }
+        }
+    
+    def generate_report(self) -> str:
+        data = self.to_dict()
+        report = []
+        report.append("=" * 78)
+        report.append("中継サーバー別 配送遅延レポート")
+        report.append("=" * 78)
+        report.append(f"解析メール数: {data['messages']:,}")
+        total = data['total']
+        if total['count']:
+            report.append(f"配送全体: p50 {format_seconds(total['p50'])} / p90 {format_seconds(total['p90'])}"
+                          f" / p99 {format_seconds(total['p99'])} / 最大 {format_seconds(total['max'])}")
+        report.append("")
+        report.append(f"{'中継サーバー（受信側）':<36} {'件数':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'最大':>8} {'ずれ':>4}")
+        report.append("-" * 78)
+        # p90 の大きい順（遅延を加えている中継が上に来る）
+        for name, relay in sorted(data['relays'].items(),
+                                  key=lambda x: (-(x[1]['p90'] if x[1]['count'] else -1), x[0])):
+            display = name if len(name) <= 36 else name[:33] + "..."
+            report.append(f"{display:<36} {relay['count']:>6} {format_seconds(relay['p50']):>8} "
+                          f"{format_seconds(relay['p90']):>8} {format_seconds(relay['p99']):>8} "
+                          f"{format_seconds(relay['max']):>8} {relay['clock_skew']:>4}")
+        report.append("=" * 78)
+        return '\n'.join(report)
+
+def iter_header_texts(paths: List[str]):
+    """メールファイル・ディレクトリ・mbox からヘッダー部分を1通ずつ返す"""
+    from dmarc_forensic import iter_messages
+    for path in paths:
+        for origin, raw in iter_messages(path):
+            text = raw.decode('utf-8', 'replace').replace('\r\n', '\n')
+            yield origin, text.split('\n\n', 1)[0]
+
+def analyzer_version() -> str:
+    """キャッシュの無効化に使うバージョン（ANALYSIS_VERSION とこのファイルの内容のハッシュ）"""
+    import hashlib
+    with open(__file__, 'rb') as f:
+        source_hash = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+    return f"{ANALYSIS_VERSION}-{source_hash}"
+
+def batch_main(paths: List[str], json_path: Optional[str] = None,
+               cache_path: Optional[str] = None, cache_max_bytes: Optional[int] = None) -> None:
+    """バッチモード: 複数のメールの配送遅延を中継サーバーごとに集計
+    
+    cache_path を指定すると analyze() の結果をヘッダーのハッシュで保存し、前回までに
+    解析したメールは解析せずに集計する。
+    """
+    cache = None
+    if cache_path:
+        from header_cache import DEFAULT_MAX_BYTES, HeaderResultCache, header_key
+        cache = HeaderResultCache(cache_path, analyzer_version(), cache_max_bytes or DEFAULT_MAX_BYTES)
+    
+    stats = RelayLatencyStats()
+    try:
+        for origin, header_text in iter_header_texts(paths):
+            if cache is None:
+                analyzer = EmailHeaderAnalyzer()
+                analyzer.parse_headers(header_text)
+                stats.add(analyzer.analyze_delivery())
+                continue
+            fields = list(iter_header_fields(header_text))
+            key = header_key(fields)
+            analysis = cache.get(key)
+            if analysis is None:
+                analyzer = EmailHeaderAnalyzer()
+                for name, value in fields:
+                    analyzer._add_header(name, value)
+                analysis = analyzer.analyze()
+                cache.put(key, analysis)
+            stats.add(analysis['delivery'])
+    finally:
+        if cache is not None:
+            cache.close()
+    
+    print(stats.generate_report())
+    if cache is not None:
+        note = "（解析ツールの変更により再作成）" if cache.invalidated else ""
+        print(f"キャッシュ: {cache.hits:,} 件ヒット / {cache.misses:,} 件を解析{note}"
+              + (f" / {cache.evicted:,} 件を削除" if cache.evicted else ""))
+    
+    if json_path:
+        import json
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(stats.to_dict(), f, indent=2, ensure_ascii=False)
+        print(f"JSON形式で {json_path} に保存しました")
+
 def main():
     """メイン処理"""
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='メールヘッダー解析ツール（引数なしで対話モード）')
+    parser.add_argument('files', nargs='*',
+                        help='バッチモード: メールファイル・ディレクトリ・mbox（中継サーバー別の遅延を集計）')
+    parser.add_argument('--json', help='バッチモードの結果をJSON形式で保存', metavar='FILE')
+    parser.add_argument('--cache', metavar='FILE',
+                        help='バッチモードの解析結果キャッシュ（SQLite）。前回までに解析したメールは解析しない')
+    parser.add_argument('--cache-max-size', metavar='SIZE',
+                        help='キャッシュの上限（例: 512M、デフォルト: 512M）。超えたら長く使われていないものから削除')
+    args = parser.parse_args()
+    
+    if args.files:
+        cache_max_bytes = None
+        if args.cache_max_size:
+            from dmarc_spill import parse_size
+            try:
+                cache_max_bytes = parse_size(args.cache_max_size)
+            except ValueError as e:
+                parser.error(str(e))
+        try:
+            batch_main(args.files, args.json, args.cache, cache_max_bytes)
+        except OSError as e:
+            print(f"エラー: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+    
     print("メールヘッダー解析ツール")
     print("=" * 40)
     print("メールヘッダーを貼り付けてください。")
@@ -384,6 +707,8 @@ def main():
     report = analyzer.generate_report(analysis)
     print("\n" + report)
     
+    import json
+    
     # JSON出力オプション
     print("\nJSON形式で出力しますか？ (y/n): ", end="")
     if input().lower() == 'y':
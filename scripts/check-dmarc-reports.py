@@ -7,38 +7,63 @@ DMARCレポート受信確認・自動処理ツール
 
 import os
 import sys
-import imaplib
-import email
-import gzip
-import zipfile
-import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta
-from typing import List, Dict, Tuple
-import json
+from typing import TYPE_CHECKING, List, Dict, Optional, Tuple
 import argparse
-import tempfile
-import shutil
+
+# 起動時間短縮のため、gzip/zipfile/xml/json などは使用する処理の中で import する
+from dmarc_aggregate import Aggregate, ReportStats, merge_all, parse_shard, in_shard
+
+if TYPE_CHECKING:
+    from dmarc_parse import ReportHeaderCache
+
+# レポートディレクトリ直下に置くヘッダーキャッシュ
+HEADER_CACHE_FILE = '.header-cache.json'
 
 class DMARCReportChecker:
     def __init__(self, config: Dict):
         self.config = config
         self.reports_dir = config.get('reports_dir', 'dmarc-reports')
         self.processed_dir = os.path.join(self.reports_dir, 'processed')
-        self.stats = {
-            'total_reports': 0,
-            'new_reports': 0,
-            'processed_reports': 0,
-            'failed_reports': 0,
-            'senders': {},
-            'date_range': {'earliest': None, 'latest': None}
-        }
+        self.shard = config.get('shard')
+        # レポート自身の期間（date_range）による絞り込み [since, until)
+        self.since = config.get('since')
+        self.until = config.get('until')
+        # ポリシー公開ドメインによる絞り込み（小文字の集合）
+        domains = config.get('domains')
+        self.domains = {d.lower() for d in domains} if domains else None
+        # XMLパースのバックエンド（None ならデフォルト）
+        self.xml_backend = config.get('xml_backend')
+        # 読み込み・パースの上限（ReportLimits、None ならデフォルト）
+        self.limits = config.get('limits')
+        # レコードの auth_results も読み、DKIMセレクター別・SPFドメイン別に集計する
+        self.auth_results = config.get('auth_results', False)
+        self.filtered_reports = 0
+        self._header_cache = None
+        self.stats = ReportStats()
+        
+        # ディレクトリ作成（集計の結合のみの場合は不要）
+        if config.get('create_dirs', True):
+            os.makedirs(self.reports_dir, exist_ok=True)
+            os.makedirs(self.processed_dir, exist_ok=True)
         
-        # ディレクトリ作成
-        os.makedirs(self.reports_dir, exist_ok=True)
-        os.makedirs(self.processed_dir, exist_ok=True)
+        # アーカイブモード: 処理済みレポートを processed/ のセグメントに格納
+        self.archive = None
+        if config.get('archive'):
+            from dmarc_segments import SegmentStore
+            self.archive = SegmentStore(self.processed_dir)
+        self.archived_reports = 0
+    
+    @property
+    def header_cache(self) -> 'ReportHeaderCache':
+        """レポートディレクトリに保存するヘッダーキャッシュ（初回使用時に読み込む）"""
+        if self._header_cache is None:
+            from dmarc_parse import ReportHeaderCache
+            self._header_cache = ReportHeaderCache(os.path.join(self.reports_dir, HEADER_CACHE_FILE))
+        return self._header_cache
     
     def check_local_reports(self) -> List[str]:
-        """ローカルディレクトリのレポートをチェック"""
+        """ローカルディレクトリのレポートをチェック（シャード・期間指定時はその分のみ）"""
         report_files = []
         
         for root, dirs, files in os.walk(self.reports_dir):
@@ -49,111 +74,47 @@ class DMARCReportChecker:
             for file in files:
                 if file.endswith(('.xml', '.xml.gz', '.zip')):
                     filepath = os.path.join(root, file)
+                    if self.shard and not in_shard(filepath, *self.shard):
+                        continue
                     report_files.append(filepath)
-                    self.stats['total_reports'] += 1
         
+        # 期間・ドメイン指定時はレポート先頭だけを読んで対象外のレポートを除外
+        if self.since is not None or self.until is not None or self.domains is not None:
+            from dmarc_parse import filter_reports
+            report_files, self.filtered_reports = filter_reports(
+                report_files, self.since, self.until, self.domains, self.header_cache)
+        
+        # 何度呼ばれても二重に数えない
+        self.stats.total_reports = len(report_files)
         return report_files
     
     def extract_report(self, filepath: str) -> str:
         """圧縮されたレポートを展開"""
+        from dmarc_parse import read_report
         content = None
         
         try:
-            if filepath.endswith('.gz'):
-                with gzip.open(filepath, 'rt', encoding='utf-8') as f:
-                    content = f.read()
-            elif filepath.endswith('.zip'):
-                with zipfile.ZipFile(filepath, 'r') as z:
-                    for name in z.namelist():
-                        if name.endswith('.xml'):
-                            content = z.read(name).decode('utf-8')
-                            break
-            else:  # Plain XML
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    content = f.read()
+            content = read_report(filepath, self.limits)
         except Exception as e:
             print(f"エラー: {filepath} の展開に失敗: {e}")
-            self.stats['failed_reports'] += 1
+            self.stats.add_failure(getattr(e, 'reason', 'read_error'))
         
         return content
     
-    def parse_report_metadata(self, xml_content: str) -> Dict:
-        """XMLレポートからメタデータを抽出"""
-        metadata = {
-            'org_name': None,
-            'email': None,
-            'report_id': None,
-            'date_begin': None,
-            'date_end': None,
-            'domain': None,
-            'policy': None,
-            'total_messages': 0,
-            'pass_count': 0,
-            'fail_count': 0
-        }
-        
+    def parse_report_metadata(self, xml_content: str) -> Optional[Dict]:
+        """XMLレポートからメタデータを抽出（対象外ドメインのレポートは None）"""
+        from dmarc_parse import (ParseError, ReportLimitError, new_report_metadata,
+                                 parse_report_metadata)
         try:
-            root = ET.fromstring(xml_content)
-            
-            # メタデータセクション
-            report_metadata = root.find('report_metadata')
-            if report_metadata is not None:
-                org_name = report_metadata.find('org_name')
-                if org_name is not None:
-                    metadata['org_name'] = org_name.text
-                
-                email_elem = report_metadata.find('email')
-                if email_elem is not None:
-                    metadata['email'] = email_elem.text
-                
-                report_id = report_metadata.find('report_id')
-                if report_id is not None:
-                    metadata['report_id'] = report_id.text
-                
-                date_range = report_metadata.find('date_range')
-                if date_range is not None:
-                    begin = date_range.find('begin')
-                    end = date_range.find('end')
-                    if begin is not None:
-                        metadata['date_begin'] = int(begin.text)
-                    if end is not None:
-                        metadata['date_end'] = int(end.text)
-            
-            # ポリシー情報
-            policy = root.find('policy_published')
-            if policy is not None:
-                domain = policy.find('domain')
-                if domain is not None:
-                    metadata['domain'] = domain.text
-                
-                p = policy.find('p')
-                if p is not None:
-                    metadata['policy'] = p.text
-            
-            # レコード統計
-            for record in root.findall('record'):
-                row = record.find('row')
-                if row is not None:
-                    count = row.find('count')
-                    if count is not None:
-                        count_val = int(count.text)
-                        metadata['total_messages'] += count_val
-                        
-                        policy_evaluated = row.find('policy_evaluated')
-                        if policy_evaluated is not None:
-                            dkim = policy_evaluated.find('dkim')
-                            spf = policy_evaluated.find('spf')
-                            
-                            if dkim is not None and spf is not None:
-                                if dkim.text == 'pass' and spf.text == 'pass':
-                                    metadata['pass_count'] += count_val
-                                else:
-                                    metadata['fail_count'] += count_val
-            
-        except ET.ParseError as e:
+            return parse_report_metadata(xml_content, self.domains, self.xml_backend, self.limits,
+                                         self.auth_results)
+        except ReportLimitError as e:
+            print(f"レポートを拒否: {e}")
+            self.stats.add_failure(e.reason)
+            return new_report_metadata()
+        except ParseError as e:
             print(f"XMLパースエラー: {e}")
-        
-        return metadata
+            return new_report_metadata()
     
     def analyze_reports(self, report_files: List[str]) -> None:
         """レポートを分析"""
@@ -170,52 +131,67 @@ class DMARCReportChecker:
             
             # メタデータ解析
             metadata = self.parse_report_metadata(content)
+            if metadata is None:
+                print("  ⏭️  対象外のドメイン")
+                self.filtered_reports += 1
+                continue
+            self._process_report(filepath, content, metadata)
+    
+    def analyze_reports_pipelined(self, report_files: List[str], workers: int = None) -> None:
+        """非同期パイプラインでレポートを分析（表示は処理完了順）"""
+        from functools import partial
+        from dmarc_parse import read_report
+        from dmarc_pipeline import IngestPipeline, parse_for_checker
+        
+        print("\n📊 レポート分析（パイプライン）")
+        print("=" * 60)
+        
+        def handle(item) -> None:
+            print(f"\n📄 処理中: {os.path.basename(item.path)}")
+            if item.error_stage == 'read':
+                print(item.error)
+                self.stats.add_failure(item.error_reason)
+                return
+            if item.error_stage == 'parse':
+                print(item.error)
+                # 上限超過は処理失敗として数える（XMLの構文エラーは従来どおり数えない）
+                if item.error_reason != 'parse_error':
+                    self.stats.add_failure(item.error_reason)
+            if item.parsed is not None:
+                self._process_report(item.path, item.content, item.parsed)
+            elif item.error is None:
+                print("  ⏭️  対象外のドメイン")
+                self.filtered_reports += 1
+        
+        parse = partial(parse_for_checker, domains=self.domains, backend=self.xml_backend,
+                        limits=self.limits, auth=self.auth_results)
+        pipeline = IngestPipeline(parse, handle, read=partial(read_report, limits=self.limits),
+                                  parse_workers=workers, keep_content=self.archive is not None)
+        pipeline.run(report_files)
+    
+    def _process_report(self, filepath: str, content: str, metadata: Dict) -> None:
+        """解析済みレポートを集計・表示し、アーカイブモードなら格納する"""
+        if metadata['org_name']:
+            # 送信元統計・日付範囲更新
+            self.stats.add_report(metadata)
             
-            if metadata['org_name']:
-                # 送信元統計
-                sender = metadata['org_name']
-                if sender not in self.stats['senders']:
-                    self.stats['senders'][sender] = {
-                        'count': 0,
-                        'messages': 0,
-                        'pass': 0,
-                        'fail': 0
-                    }
-                
-                self.stats['senders'][sender]['count'] += 1
-                self.stats['senders'][sender]['messages'] += metadata['total_messages']
-                self.stats['senders'][sender]['pass'] += metadata['pass_count']
-                self.stats['senders'][sender]['fail'] += metadata['fail_count']
-                
-                # 日付範囲更新
-                if metadata['date_begin']:
-                    date_begin = datetime.fromtimestamp(metadata['date_begin'])
-                    if not self.stats['date_range']['earliest'] or \
-                       date_begin < self.stats['date_range']['earliest']:
-                        self.stats['date_range']['earliest'] = date_begin
-                
-                if metadata['date_end']:
-                    date_end = datetime.fromtimestamp(metadata['date_end'])
-                    if not self.stats['date_range']['latest'] or \
-                       date_end > self.stats['date_range']['latest']:
-                        self.stats['date_range']['latest'] = date_end
-                
-                # レポート詳細表示
-                print(f"  📍 送信元: {metadata['org_name']}")
-                print(f"  📅 期間: {datetime.fromtimestamp(metadata['date_begin']).strftime('%Y-%m-%d')} - "
-                      f"{datetime.fromtimestamp(metadata['date_end']).strftime('%Y-%m-%d')}")
-                print(f"  📧 メッセージ数: {metadata['total_messages']:,}")
-                print(f"  ✅ 認証成功: {metadata['pass_count']:,}")
-                print(f"  ❌ 認証失敗: {metadata['fail_count']:,}")
-                
-                if metadata['total_messages'] > 0:
-                    pass_rate = (metadata['pass_count'] / metadata['total_messages']) * 100
-                    print(f"  📈 成功率: {pass_rate:.1f}%")
-                
-                self.stats['processed_reports'] += 1
+            # レポート詳細表示
+            print(f"  📍 送信元: {metadata['org_name']}")
+            print(f"  📅 期間: {datetime.fromtimestamp(metadata['date_begin']).strftime('%Y-%m-%d')} - "
+                  f"{datetime.fromtimestamp(metadata['date_end']).strftime('%Y-%m-%d')}")
+            print(f"  📧 メッセージ数: {metadata['total_messages']:,}")
+            print(f"  ✅ 認証成功: {metadata['pass_count']:,}")
+            print(f"  ❌ 認証失敗: {metadata['fail_count']:,}")
             
-            # 処理済みディレクトリへ移動（オプション）
-            # shutil.move(filepath, os.path.join(self.processed_dir, os.path.basename(filepath)))
+            if metadata['total_messages'] > 0:
+                pass_rate = (metadata['pass_count'] / metadata['total_messages']) * 100
+                print(f"  📈 成功率: {pass_rate:.1f}%")
+        
+            # 処理済みレポートをセグメントに格納し、元ファイルを削除（格納済みの重複も削除）
+            if self.archive is not None:
+                if self.archive.append(content, metadata, source=os.path.basename(filepath)):
+                    self.archived_reports += 1
+                os.remove(filepath)
     
     def generate_summary(self) -> str:
         """サマリーレポートを生成"""
@@ -227,33 +203,42 @@ class DMARCReportChecker:
         
         # 基本統計
         report.append("【レポート統計】")
-        report.append(f"総レポート数: {self.stats['total_reports']}")
-        report.append(f"処理済み: {self.stats['processed_reports']}")
-        report.append(f"処理失敗: {self.stats['failed_reports']}")
+        report.append(f"総レポート数: {self.stats.total_reports}")
+        report.append(f"処理済み: {self.stats.processed_reports}")
+        report.append(f"処理失敗: {self.stats.failed_reports}")
+        if self.stats.failure_reasons:
+            reasons = ', '.join(f"{reason} {count}" for reason, count
+                                in sorted(self.stats.failure_reasons.items()))
+            report.append(f"  理由: {reasons}")
+        if self.filtered_reports:
+            report.append(f"対象外で除外: {self.filtered_reports}")
+        if self.archive is not None:
+            store = self.archive.stats()
+            report.append(f"アーカイブ: {self.archived_reports}件を追加 "
+                          f"(計 {store['reports']}件 / {store['segments']}セグメント)")
         report.append("")
         
         # 期間
-        if self.stats['date_range']['earliest'] and self.stats['date_range']['latest']:
+        earliest, latest = self.stats.earliest(), self.stats.latest()
+        if earliest and latest:
             report.append("【データ期間】")
-            report.append(f"最古: {self.stats['date_range']['earliest'].strftime('%Y-%m-%d %H:%M')}")
-            report.append(f"最新: {self.stats['date_range']['latest'].strftime('%Y-%m-%d %H:%M')}")
+            report.append(f"最古: {earliest.strftime('%Y-%m-%d %H:%M')}")
+            report.append(f"最新: {latest.strftime('%Y-%m-%d %H:%M')}")
             
             # 期間計算
-            days_covered = (self.stats['date_range']['latest'] - 
-                          self.stats['date_range']['earliest']).days + 1
+            days_covered = (latest - earliest).days + 1
             report.append(f"カバー期間: {days_covered}日間")
             report.append("")
         
         # 送信元別統計
-        if self.stats['senders']:
+        if self.stats.senders:
             report.append("【送信元別統計】")
             report.append("-" * 60)
             report.append(f"{'送信元':<25} {'レポート':>8} {'メール数':>10} {'成功率':>8}")
             report.append("-" * 60)
             
-            for sender, data in sorted(self.stats['senders'].items(), 
-                                      key=lambda x: x[1]['messages'], 
-                                      reverse=True):
+            for sender, data in sorted(self.stats.senders.items(), 
+                                      key=lambda x: (-x[1]['messages'], x[0])):
                 if data['messages'] > 0:
                     pass_rate = (data['pass'] / data['messages']) * 100
                 else:
@@ -266,19 +251,25 @@ class DMARCReportChecker:
             report.append("-" * 60)
             
             # 総計
-            total_messages = sum(s['messages'] for s in self.stats['senders'].values())
-            total_pass = sum(s['pass'] for s in self.stats['senders'].values())
-            total_fail = sum(s['fail'] for s in self.stats['senders'].values())
+            total_messages = sum(s['messages'] for s in self.stats.senders.values())
+            total_pass = sum(s['pass'] for s in self.stats.senders.values())
+            total_fail = sum(s['fail'] for s in self.stats.senders.values())
             
             if total_messages > 0:
                 overall_pass_rate = (total_pass / total_messages) * 100
             else:
                 overall_pass_rate = 0
             
-            report.append(f"{'総計':<25} {self.stats['total_reports']:>8} "
+            report.append(f"{'総計':<25} {self.stats.total_reports:>8} "
                         f"{total_messages:>10,} {overall_pass_rate:>7.1f}%")
             report.append("")
             
+            report.extend(self._domain_summary())
+            
+            if self.stats.auth_results is not None:
+                from dmarc_auth import format_breakdown
+                report.extend(format_breakdown(self.stats.auth_results))
+            
             # 評価
             report.append("【総合評価】")
             if overall_pass_rate >= 99:
@@ -302,18 +293,58 @@ class DMARCReportChecker:
         
         return '\n'.join(report)
     
+    def _domain_summary(self) -> List[str]:
+        """ドメイン別統計（ドメイン指定時は送信元組織別の内訳も表示）"""
+        if not self.stats.domains:
+            return []
+        lines = ["【ドメイン別統計】", "-" * 70,
+                 f"{'ドメイン':<30} {'ポリシー':<12} {'レポート':>8} {'メール数':>10} {'成功率':>8}",
+                 "-" * 70]
+        totals = {name: self.stats.domain_totals(name) for name in self.stats.domains}
+        for name in sorted(totals, key=lambda n: (-totals[n]['messages'], n)):
+            data = totals[name]
+            pass_rate = (data['pass'] / data['messages']) * 100 if data['messages'] > 0 else 0
+            policy = self.stats.current_policy(name) or '-'
+            if len(self.stats.domains[name]['policies']) > 1:
+                # 期間中にポリシーが変更された
+                policy += '*'
+            display = name or '(不明)'
+            display = display[:28] + ".." if len(display) > 30 else display
+            lines.append(f"{display:<30} {policy:<12} {data['count']:>8} "
+                         f"{data['messages']:>10,} {pass_rate:>7.1f}%")
+            
+            if self.domains is not None:
+                orgs = self.stats.domains[name]['orgs']
+                for org, org_data in sorted(orgs.items(), key=lambda x: (-x[1]['messages'], x[0])):
+                    org_rate = (org_data['pass'] / org_data['messages']) * 100 if org_data['messages'] > 0 else 0
+                    org_display = org[:24] + ".." if len(org) > 26 else org
+                    lines.append(f"  └ {org_display:<26} {'':<12} {org_data['count']:>8} "
+                                 f"{org_data['messages']:>10,} {org_rate:>7.1f}%")
+        lines.append("-" * 70)
+        if any(len(d['policies']) > 1 for d in self.stats.domains.values()):
+            lines.append("* 期間中にポリシー変更あり（表示は最新のレポートのポリシー）")
+        lines.append("")
+        return lines
+    
     def check_recent_reports(self, days: int = 7) -> None:
         """最近のレポートをチェック"""
         print(f"\n🔍 過去{days}日間のレポートを確認中...")
         
-        cutoff_date = datetime.now() - timedelta(days=days)
+        cutoff = (datetime.now() - timedelta(days=days)).timestamp()
         recent_count = 0
         
-        for filepath in self.check_local_reports():
-            # ファイルの更新日時を確認
-            mtime = datetime.fromtimestamp(os.path.getmtime(filepath))
-            if mtime >= cutoff_date:
+        report_files = self.check_local_reports()
+        for filepath in report_files:
+            # レポート自身の期間で判定（コピー・再取得したファイルの更新日時には依存しない）
+            header = self.header_cache.get(filepath)
+            if header is not None and header['date_end'] is not None:
+                report_time = header['date_end']
+            else:
+                report_time = os.path.getmtime(filepath)
+            if report_time >= cutoff:
                 recent_count += 1
+        if report_files:
+            self.header_cache.save()
         
         if recent_count > 0:
             print(f"✅ {recent_count}個の新しいレポートが見つかりました")
@@ -324,8 +355,50 @@ class DMARCReportChecker:
             print("2. スパムフォルダも確認してください")
             print("3. DMARCレコードのruaアドレスを確認してください")
 
+def build_json_output(stats: ReportStats) -> Dict:
+    """JSON出力用のデータを生成"""
+    return {
+        'stats': stats.to_dict(),
+        'timestamp': datetime.now().isoformat()
+    }
+
+def merge_main(argv: List[str]) -> None:
+    """シャードごとの集計ファイルを結合してサマリーを生成"""
+    import json
+    parser = argparse.ArgumentParser(prog='check-dmarc-reports.py merge',
+                                     description='集計ファイル（--dump-aggregate の出力）を結合')
+    parser.add_argument('aggregates', nargs='+', help='集計ファイル')
+    parser.add_argument('--json', action='store_true', help='JSON形式で出力')
+    parser.add_argument('--dump-aggregate', help='結合した集計を保存', metavar='FILE')
+    
+    args = parser.parse_args(argv)
+    
+    try:
+        merged = merge_all(Aggregate.load(path) for path in args.aggregates)
+    except (OSError, ValueError) as e:
+        print(f"エラー: 集計ファイルを読み込めません: {e}")
+        sys.exit(1)
+    if not isinstance(merged, ReportStats):
+        print("エラー: 受信確認ツールの集計ファイルではありません")
+        sys.exit(1)
+    
+    if args.dump_aggregate:
+        merged.save(args.dump_aggregate)
+    
+    checker = DMARCReportChecker({'create_dirs': False})
+    checker.stats = merged
+    if args.json:
+        print(json.dumps(build_json_output(merged), indent=2, ensure_ascii=False))
+    else:
+        print(checker.generate_summary())
+
 def main():
-    parser = argparse.ArgumentParser(description='DMARCレポート受信確認ツール')
+    if sys.argv[1:2] == ['merge']:
+        merge_main(sys.argv[2:])
+        return
+    
+    parser = argparse.ArgumentParser(description='DMARCレポート受信確認ツール',
+                                     epilog='集計ファイルの結合: %(prog)s merge FILE...')
     parser.add_argument('--dir', default='dmarc-reports', 
                        help='レポートディレクトリ（デフォルト: dmarc-reports）')
     parser.add_argument('--days', type=int, default=7,
@@ -333,13 +406,65 @@ def main():
     parser.add_argument('--json', action='store_true',
                        help='JSON形式で出力')
     parser.add_argument('--save', help='結果をファイルに保存')
+    parser.add_argument('--shard', help='ファイル名ハッシュで分割したシャードのみ処理（例: 0/4）', metavar='I/N')
+    parser.add_argument('--dump-aggregate', help='集計をファイルに保存（merge で結合可能）', metavar='FILE')
+    parser.add_argument('--archive', action='store_true',
+                       help='処理済みレポートを processed/ の圧縮セグメントに格納し元ファイルを削除')
+    parser.add_argument('--pipeline', action='store_true',
+                       help='読み込み・展開・パースを並行実行する非同期パイプラインで分析')
+    parser.add_argument('--workers', type=int, help='--pipeline のパース用プロセス数（デフォルト: CPU数）')
+    parser.add_argument('--since', help='レポート期間がこの日付以降のもののみ分析（YYYY-MM-DD）', metavar='DATE')
+    parser.add_argument('--until', help='レポート期間がこの日付より前のもののみ分析（YYYY-MM-DD）', metavar='DATE')
+    parser.add_argument('--domain', action='append', dest='domains', metavar='DOMAIN',
+                       help='このポリシー公開ドメインのレポートのみ分析（複数指定可）')
+    parser.add_argument('--metrics', metavar='FILE',
+                       help='Prometheus textfile collector 形式のメトリクスを書き出す（例: /var/lib/node_exporter/dmarc.prom）')
+    parser.add_argument('--xml-backend', choices=('expat', 'etree'),
+                       help='XMLパースのバックエンド（デフォルト: expat、mail-auth-tools.py bench-xml で比較）')
+    from dmarc_parse import add_limit_arguments, limits_from_args
+    add_limit_arguments(parser)
+    parser.add_argument('--auth-results', action='store_true',
+                       help='レコードの auth_results も同じパースで読み、DKIMセレクター別・SPFドメイン別に集計')
+    parser.add_argument('--recent-only', action='store_true',
+                       help='最近のレポート有無の確認のみ行い、分析はしない')
     
     args = parser.parse_args()
     
     # 設定
     config = {
-        'reports_dir': args.dir
+        'reports_dir': args.dir,
+        'archive': args.archive,
+        'domains': args.domains,
+        'xml_backend': args.xml_backend,
+        'auth_results': args.auth_results
     }
+    limits = limits_from_args(parser, args)
+    if limits is not None:
+        config['limits'] = limits
+    if args.shard:
+        try:
+            config['shard'] = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.since or args.until:
+        from dmarc_segments import parse_date
+        try:
+            config['since'] = parse_date(args.since) if args.since else None
+            config['until'] = parse_date(args.until) if args.until else None
+        except ValueError:
+            parser.error('日付は YYYY-MM-DD 形式で指定してください')
+    
+    # 段ごとの処理時間（--metrics 指定時のみ計測）
+    timer = None
+    if args.metrics:
+        from dmarc_metrics import StageTimer
+        timer = StageTimer()
+    
+    def stage(name: str):
+        if timer is None:
+            from contextlib import nullcontext
+            return nullcontext({})
+        return timer.stage(name)
     
     # チェッカー初期化
     checker = DMARCReportChecker(config)
@@ -349,31 +474,40 @@ def main():
     print("=" * 70)
     print(f"レポートディレクトリ: {args.dir}")
     print(f"確認期間: 過去{args.days}日間")
+    if args.since or args.until:
+        print(f"分析対象期間: {args.since or '-'} 〜 {args.until or '-'}（レポートの date_range）")
     
     # 最近のレポート確認
     checker.check_recent_reports(args.days)
+    if args.recent_only:
+        return
     
     # レポート分析
-    report_files = checker.check_local_reports()
-    if report_files:
-        checker.analyze_reports(report_files)
+    with stage('discover') as record:
+        report_files = checker.check_local_reports()
+        record['items'] = len(report_files)
+    with stage('analyze') as record:
+        if report_files:
+            if args.pipeline:
+                checker.analyze_reports_pipelined(report_files, args.workers)
+            else:
+                checker.analyze_reports(report_files)
+        record['items'] = len(report_files)
+    
+    # 集計の保存
+    if args.dump_aggregate:
+        checker.stats.save(args.dump_aggregate)
+        print(f"集計を {args.dump_aggregate} に保存しました")
     
     # サマリー生成
-    summary = checker.generate_summary()
+    with stage('summary') as record:
+        summary = checker.generate_summary()
+        record['items'] = len(checker.stats.domains)
     
     if args.json:
         # JSON出力
-        json_output = {
-            'stats': checker.stats,
-            'timestamp': datetime.now().isoformat()
-        }
-        # datetime オブジェクトを文字列に変換
-        if checker.stats['date_range']['earliest']:
-            json_output['stats']['date_range']['earliest'] = \
-                checker.stats['date_range']['earliest'].isoformat()
-        if checker.stats['date_range']['latest']:
-            json_output['stats']['date_range']['latest'] = \
-                checker.stats['date_range']['latest'].isoformat()
+        import json
+        json_output = build_json_output(checker.stats)
         
         print("\n" + json.dumps(json_output, indent=2, ensure_ascii=False))
     else:
@@ -387,6 +521,12 @@ def main():
                 f.write("\n\n--- JSON ---\n")
                 f.write(json.dumps(json_output, indent=2, ensure_ascii=False))
         print(f"\n結果を {args.save} に保存しました")
+    
+    # メトリクス出力
+    if args.metrics:
+        from dmarc_metrics import checker_metrics, write_textfile
+        write_textfile(args.metrics, checker_metrics(checker.stats, timer, checker.filtered_reports))
+        print(f"メトリクスを {args.metrics} に保存しました")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -7,155 +7,212 @@ XML形式のDMARC集約レポートを解析し、わかりやすいレポート
 
 import sys
 import os
-import xml.etree.ElementTree as ET
-import gzip
-import zipfile
 from datetime import datetime
-from collections import defaultdict
-import json
 import argparse
-from typing import Dict, List, Tuple
-import socket
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+# 起動時間短縮のため、xml/gzip/zipfile/socket/json や補助モジュールは使用する処理の中で import する
+from dmarc_aggregate import SummaryAggregate
+
+if TYPE_CHECKING:
+    from dmarc_spf import SPFEvaluator
+    from dmarc_segments import SegmentStore
+    from dmarc_rowcache import RowCache, RowCacheWriter
+    from dmarc_columns import ColumnBuilder, ColumnarRows
+    from dmarc_spill import SummarySpill
+    from dmarc_baseline import Baseline
+    from dmarc_parse import ReportLimits
 
 class DMARCReportAnalyzer:
-    def __init__(self):
-        self.reports = []
-        self.summary = {
-            'total_messages': 0,
-            'pass_count': 0,
-            'fail_count': 0,
-            'sources': defaultdict(lambda: {
-                'count': 0,
-                'spf_pass': 0,
-                'dkim_pass': 0,
-                'both_pass': 0,
-                'hostname': None
-            }),
-            'failures': [],
-            'date_range': {'begin': None, 'end': None}
-        }
+    def __init__(self, spf_evaluator: Optional['SPFEvaluator'] = None):
+        self.spf_evaluator = spf_evaluator
+        self.summary = SummaryAggregate()
+        # 解析したレコードをバイナリキャッシュに書き出す場合に設定
+        self.row_writer: Optional['RowCacheWriter'] = None
+        # レコードの書き出し先（バイナリキャッシュ・列指向エンジン）
+        self.row_sinks: List = []
+        # 列指向エンジン（--engine numpy）。読み込み中は column_builder にレコードを貯め、
+        # 読み込み後の columns から全体・送信元別・失敗の集計をベクトル演算で求める
+        # （summary にはレポート情報だけを集計する）
+        self.column_builder: Optional['ColumnBuilder'] = None
+        self.columns: Optional['ColumnarRows'] = None
+        self.breakdowns: List[List[str]] = []
+        # XMLパースのバックエンド（None ならデフォルト）
+        self.xml_backend: Optional[str] = None
+        # 読み込み・パースの上限（ReportLimits、None ならデフォルト）
+        self.limits: Optional['ReportLimits'] = None
+        # レコードの auth_results も読み、DKIMセレクター別・SPFドメイン別に集計する（--auth-results）
+        self.auth_results = False
+        # メモリ上限（--max-memory）。設定時は集計が上限に達するたびにディスクへ退避する
+        self.spill: Optional['SummarySpill'] = None
+        # 送信元・報告組織別のベースライン（--baseline）。設定時は読み込みながら期間順にレポートごとに異常を判定する
+        self.baseline: Optional['Baseline'] = None
+    
+    @property
+    def reports(self) -> List[Dict]:
+        return self.summary.reports
+    
+    @property
+    def columnar(self) -> bool:
+        """列指向エンジンで集計する（レコードを summary に集計しない）"""
+        return self.column_builder is not None or self.columns is not None
+    
+    def use_columns(self) -> None:
+        """列指向エンジンでの集計を始める（読み込みの前に呼ぶ）"""
+        from dmarc_columns import ColumnBuilder
+        self.column_builder = ColumnBuilder()
+        self.row_sinks.append(self.column_builder)
+    
+    def finish_columns(self) -> None:
+        """読み込んだレコードから列データを作る（読み込みの後に呼ぶ）"""
+        if self.column_builder is not None:
+            self.row_sinks.remove(self.column_builder)
+            self.columns = self.column_builder.build()
+            self.column_builder = None
+    
+    def aggregate(self) -> SummaryAggregate:
+        """集計結果（列指向エンジンでは列データから送信元別・失敗の集計を summary に設定する）"""
+        if self.columns is not None:
+            self.columns.fill_summary(self.summary, self._spf_class)
+        return self.summary
     
     def load_report(self, filepath: str) -> None:
-        """DMARCレポートファイルを読み込む"""
-        content = None
+        """DMARCレポートファイルを読み込む（失敗したレポートは理由とともに数える）"""
+        from dmarc_parse import ReportLimitError, ReportReadError, read_report
         
         # ファイル形式に応じて解凍
-        if filepath.endswith('.gz'):
-            with gzip.open(filepath, 'rt', encoding='utf-8') as f:
-                content = f.read()
-        elif filepath.endswith('.zip'):
-            with zipfile.ZipFile(filepath, 'r') as z:
-                # ZIP内の最初のXMLファイルを読む
-                for name in z.namelist():
-                    if name.endswith('.xml'):
-                        content = z.read(name).decode('utf-8')
-                        break
-        else:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-        
+        try:
+            content = read_report(filepath, self.limits)
+        except ReportLimitError as e:
+            print(f"レポートを拒否: {filepath}: {e}", file=sys.stderr)
+            self.summary.add_failure(e.reason)
+            return
+        except ReportReadError as e:
+            print(f"警告: 読み込めません: {filepath}: {e}", file=sys.stderr)
+            self.summary.add_failure(e.reason)
+            return
         if content:
             self._parse_xml_report(content)
     
+    def load_reports_pipelined(self, files: List[str], workers: Optional[int] = None) -> Dict:
+        """非同期パイプラインで読み込み（逐次処理と同じ集計結果になる）"""
+        from functools import partial
+        from dmarc_parse import read_report
+        from dmarc_pipeline import IngestPipeline, parse_for_analyzer, report_ips
+        
+        def handle(item) -> None:
+            if item.error:
+                print(item.error, file=sys.stderr)
+                self.summary.add_failure(item.error_reason)
+            elif item.parsed is not None:
+                report_info, rows = item.parsed
+                self._add_parsed_report(report_info, rows, item.hostnames)
+        
+        parse = partial(parse_for_analyzer, backend=self.xml_backend, limits=self.limits,
+                        auth=self.auth_results)
+        # 入力順に集計する（レポート情報の順序・ベースラインの判定を逐次処理と揃えるため）
+        pipeline = IngestPipeline(parse, handle,
+                                  resolve=self._get_hostname, ips_of=report_ips,
+                                  read=partial(read_report, limits=self.limits),
+                                  parse_workers=workers, ordered=True)
+        return pipeline.run(files)
+    
+    def load_segments(self, store: 'SegmentStore', since: Optional[int] = None,
+                      until: Optional[int] = None) -> int:
+        """セグメントストアから期間内のレポートを読み込む"""
+        loaded = 0
+        for entry, content in store.iter_reports(since, until):
+            self._parse_xml_report(content)
+            loaded += 1
+        return loaded
+    
+    def load_row_cache(self, cache: 'RowCache') -> int:
+        """バイナリキャッシュのレコードを直接集計（XMLの展開・パース・逆引きなし）
+
+        列指向エンジンでは、レコードはキャッシュから列データとして読み込むため、
+        ベースラインを判定する場合だけレコードを走査する。
+        """
+        for info in cache.reports:
+            self.summary.add_report(info)
+        if self.columnar and self.baseline is None:
+            return cache.row_count
+        rows = 0
+        # ベースラインにはレポート単位で渡す（レコードはレポート順に並んでいる）
+        report_rows: List[Tuple] = []
+        current_report = None
+        for source_ip, count, spf, dkim, disposition, hostname, report_index in cache.iter_rows():
+            if not self.columnar:
+                self._add_record(source_ip, count, spf, dkim, disposition, hostname)
+            rows += 1
+            if self.baseline is not None:
+                if report_index != current_report:
+                    if current_report is not None:
+                        self.baseline.add(cache.reports[current_report], report_rows)
+                    current_report, report_rows = report_index, []
+                report_rows.append((source_ip, count, disposition, dkim, spf))
+        if self.baseline is not None and current_report is not None:
+            self.baseline.add(cache.reports[current_report], report_rows)
+        return rows
+    
+    def _add_record(self, source_ip: str, count: int, spf_result: str, dkim_result: str,
+                    disposition: str, hostname: Optional[str]) -> None:
+        """レコード1件を集計に追加"""
+        self.summary.add_record(
+            source_ip, count, spf_result, dkim_result, disposition,
+            hostname=hostname,
+            spf_class=self._spf_class(source_ip, spf_result)
+        )
+        if self.spill is not None:
+            self.spill.maybe_spill(self.summary)
+    
     def _parse_xml_report(self, xml_content: str) -> None:
         """XMLレポートを解析"""
+        from dmarc_parse import ParseError, ReportLimitError, parse_report
         try:
-            root = ET.fromstring(xml_content)
-            
-            # メタデータ取得
-            metadata = root.find('report_metadata')
-            if metadata is not None:
-                date_range = metadata.find('date_range')
-                if date_range is not None:
-                    begin = date_range.find('begin')
-                    end = date_range.find('end')
-                    if begin is not None:
-                        self.summary['date_range']['begin'] = int(begin.text)
-                    if end is not None:
-                        self.summary['date_range']['end'] = int(end.text)
-            
-            # ポリシー情報取得
-            policy = root.find('policy_published')
-            policy_info = {}
-            if policy is not None:
-                policy_info = {
-                    'domain': policy.find('domain').text if policy.find('domain') is not None else '',
-                    'p': policy.find('p').text if policy.find('p') is not None else '',
-                    'sp': policy.find('sp').text if policy.find('sp') is not None else '',
-                    'adkim': policy.find('adkim').text if policy.find('adkim') is not None else '',
-                    'aspf': policy.find('aspf').text if policy.find('aspf') is not None else '',
-                }
-            
-            # レコード解析
-            for record in root.findall('record'):
-                row = record.find('row')
-                if row is None:
-                    continue
-                
-                source_ip = row.find('source_ip').text if row.find('source_ip') is not None else ''
-                count = int(row.find('count').text) if row.find('count') is not None else 0
-                
-                policy_evaluated = row.find('policy_evaluated')
-                if policy_evaluated is None:
-                    continue
-                
-                disposition = policy_evaluated.find('disposition').text if policy_evaluated.find('disposition') is not None else ''
-                
-                # DKIM結果
-                dkim_result = 'fail'
-                dkim_elem = policy_evaluated.find('dkim')
-                if dkim_elem is not None:
-                    dkim_result = dkim_elem.text
-                
-                # SPF結果
-                spf_result = 'fail'
-                spf_elem = policy_evaluated.find('spf')
-                if spf_elem is not None:
-                    spf_result = spf_elem.text
-                
-                # 統計更新
-                self.summary['total_messages'] += count
-                
-                # IPアドレスの逆引き
-                hostname = self._get_hostname(source_ip)
-                self.summary['sources'][source_ip]['hostname'] = hostname
-                self.summary['sources'][source_ip]['count'] += count
-                
-                if spf_result == 'pass':
-                    self.summary['sources'][source_ip]['spf_pass'] += count
-                
-                if dkim_result == 'pass':
-                    self.summary['sources'][source_ip]['dkim_pass'] += count
-                
-                if spf_result == 'pass' and dkim_result == 'pass':
-                    self.summary['sources'][source_ip]['both_pass'] += count
-                    self.summary['pass_count'] += count
-                else:
-                    self.summary['fail_count'] += count
-                    
-                    # 失敗の詳細記録
-                    failure = {
-                        'source_ip': source_ip,
-                        'hostname': hostname,
-                        'count': count,
-                        'spf': spf_result,
-                        'dkim': dkim_result,
-                        'disposition': disposition
-                    }
-                    self.summary['failures'].append(failure)
-            
-            # レポート情報を保存
-            self.reports.append({
-                'metadata': metadata,
-                'policy': policy_info,
-                'summary': dict(self.summary)
-            })
-            
-        except ET.ParseError as e:
+            report_info, rows = parse_report(xml_content, self.xml_backend, self.limits, self.auth_results)
+        except ReportLimitError as e:
+            print(f"レポートを拒否: {e}", file=sys.stderr)
+            self.summary.add_failure(e.reason)
+            return
+        except ParseError as e:
             print(f"XMLパースエラー: {e}", file=sys.stderr)
+            self.summary.add_failure('parse_error')
+            return
+        self._add_parsed_report(report_info, rows)
+    
+    def _add_parsed_report(self, report_info: Dict, rows: List[Tuple],
+                           hostnames: Optional[Dict[str, str]] = None) -> None:
+        """パース済みレポートを集計（hostnames がなければ逆引きする）"""
+        for source_ip, count, disposition, dkim_result, spf_result in rows:
+            # 統計更新（IPアドレスの逆引き付き）
+            if hostnames is not None and source_ip in hostnames:
+                hostname = hostnames[source_ip]
+            else:
+                hostname = self._get_hostname(source_ip)
+            if not self.columnar:
+                self._add_record(source_ip, count, spf_result, dkim_result, disposition, hostname)
+            for sink in self.row_sinks:
+                sink.add_row(source_ip, count, spf_result, dkim_result, disposition, hostname)
+        
+        if self.baseline is not None:
+            self.baseline.add(report_info, rows)
+        
+        # レポート情報を保存
+        self.summary.add_report(report_info)
+        for sink in self.row_sinks:
+            sink.add_report(report_info)
+        if self.spill is not None:
+            self.spill.maybe_spill(self.summary)
+    
+    def _spf_class(self, source_ip: str, spf_result: str) -> Optional[str]:
+        """SPF失敗の分類（SPFレコード外 / SPF内だがアライメント不一致）"""
+        if self.spf_evaluator is not None and spf_result != 'pass':
+            return self.spf_evaluator.classify_failure(source_ip)
+        return None
     
     def _get_hostname(self, ip: str) -> str:
         """IPアドレスから逆引きホスト名を取得"""
+        import socket
         try:
             hostname = socket.gethostbyaddr(ip)[0]
             return hostname
@@ -171,18 +228,22 @@ class DMARCReportAnalyzer:
         report.append("")
         
         # 期間
-        if self.summary['date_range']['begin']:
-            begin = datetime.fromtimestamp(self.summary['date_range']['begin'])
-            end = datetime.fromtimestamp(self.summary['date_range']['end'])
+        if self.summary.date_range['begin']:
+            begin = datetime.fromtimestamp(self.summary.date_range['begin'])
+            end = datetime.fromtimestamp(self.summary.date_range['end'])
             report.append(f"レポート期間: {begin.strftime('%Y-%m-%d %H:%M')} ～ {end.strftime('%Y-%m-%d %H:%M')}")
             report.append("")
         
         # サマリー
         report.append("【全体サマリー】")
         report.append("-" * 40)
-        total = self.summary['total_messages']
-        pass_count = self.summary['pass_count']
-        fail_count = self.summary['fail_count']
+        if self.columns is not None:
+            totals = self.columns.totals()
+            total, pass_count, fail_count = totals['total'], totals['pass'], totals['fail']
+        else:
+            total = self.summary.total_messages
+            pass_count = self.summary.pass_count
+            fail_count = self.summary.fail_count
         
         if total > 0:
             pass_rate = (pass_count / total) * 100
@@ -193,18 +254,39 @@ class DMARCReportAnalyzer:
         report.append(f"総メール数: {total:,}")
         report.append(f"認証成功: {pass_count:,} ({pass_rate:.1f}%)")
         report.append(f"認証失敗: {fail_count:,} ({fail_rate:.1f}%)")
+        if self.summary.failed_reports:
+            reasons = ', '.join(f"{reason} {count}" for reason, count
+                                in sorted(self.summary.failure_reasons.items()))
+            report.append(f"処理失敗レポート: {self.summary.failed_reports:,}（理由: {reasons}）")
         report.append("")
         
         # 送信元別統計
         report.append("【送信元別統計】")
         report.append("-" * 40)
         
-        # ソート（メール数の多い順）
-        sorted_sources = sorted(
-            self.summary['sources'].items(),
-            key=lambda x: x[1]['count'],
-            reverse=True
-        )
+        # ソート（メール数の多い順、同数はIP順で処理順に依存しない）
+        if self.columns is not None:
+            sorted_sources = self.columns.top_sources(20)
+            source_count = self.columns.source_count()
+        elif self.spill is not None:
+            # 退避したランを送信元IP順に合算しながら上位だけを保持
+            from dmarc_spill import top_sources
+            self.spill.finish(self.summary)
+            source_count = 0
+            
+            def counted(sources):
+                nonlocal source_count
+                for item in sources:
+                    source_count += 1
+                    yield item
+            
+            sorted_sources = top_sources(counted(self.spill.iter_sources()), 20)
+        else:
+            sorted_sources = sorted(
+                self.summary.sources.items(),
+                key=lambda x: (-x[1]['count'], x[0])
+            )
+            source_count = len(sorted_sources)
         
         report.append(f"{'IP/ホスト名':<40} {'数量':>8} {'SPF':>6} {'DKIM':>6} {'両方':>6}")
         report.append("-" * 68)
@@ -223,33 +305,59 @@ class DMARCReportAnalyzer:
                 f"{spf_rate:>5.1f}% {dkim_rate:>5.1f}% {both_rate:>5.1f}%"
             )
         
-        if len(sorted_sources) > 20:
-            report.append(f"... 他 {len(sorted_sources) - 20} 件の送信元")
+        if source_count > 20:
+            report.append(f"... 他 {source_count - 20} 件の送信元")
         report.append("")
         
-        # 失敗の詳細
-        if self.summary['failures']:
+        if self.columns is not None:
+            report.extend(self._column_sections())
+        
+        # 失敗の詳細（SPF・DKIMの組み合わせ別と SPF失敗の分類別）
+        from dmarc_spill import group_failures
+        if self.spill is not None:
+            failure_summary, spf_classes = group_failures(self.spill.iter_failures(),
+                                                          self.spill.directory)
+        elif self.columns is not None:
+            failure_summary, spf_classes = group_failures(self.columns.failures(self._spf_class))
+        else:
+            failure_summary, spf_classes = group_failures(self.summary.failures)
+        if failure_summary:
             report.append("【認証失敗の詳細】")
             report.append("-" * 40)
             
-            # 失敗を集計
-            failure_summary = defaultdict(lambda: {'count': 0, 'ips': set()})
-            for failure in self.summary['failures']:
-                key = f"{failure['spf']}_{failure['dkim']}"
-                failure_summary[key]['count'] += failure['count']
-                failure_summary[key]['ips'].add(failure['hostname'])
-            
             for key, data in sorted(failure_summary.items(), key=lambda x: x[1]['count'], reverse=True):
                 spf, dkim = key.split('_')
                 report.append(f"SPF={spf}, DKIM={dkim}: {data['count']:,} メール")
                 
                 # 上位5つのIPを表示
-                for ip in list(data['ips'])[:5]:
+                for ip in data['shown']:
                     report.append(f"  - {ip}")
-                if len(data['ips']) > 5:
-                    report.append(f"  ... 他 {len(data['ips']) - 5} 件")
+                if data['distinct'] > 5:
+                    report.append(f"  ... 他 {data['distinct'] - 5} 件")
                 report.append("")
         
+        if spf_classes and self.spf_evaluator is not None:
+            from dmarc_spf import SPF_CLASS_LABELS
+            report.append(f"【SPF失敗の分類】 ({self.spf_evaluator.domain})")
+            report.append("-" * 40)
+            for spf_class, data in sorted(spf_classes.items(), key=lambda x: x[1]['count'], reverse=True):
+                label = SPF_CLASS_LABELS.get(spf_class, spf_class)
+                report.append(f"{label}: {data['count']:,} メール / {data['distinct']} IP")
+                for ip in data['shown']:
+                    report.append(f"  - {ip}")
+                if data['distinct'] > 5:
+                    report.append(f"  ... 他 {data['distinct'] - 5} 件")
+            for warning in self.spf_evaluator.warnings:
+                report.append(f"  ⚠️ {warning}")
+            report.append("")
+        
+        if self.summary.auth_results is not None:
+            from dmarc_auth import format_breakdown
+            report.extend(format_breakdown(self.summary.auth_results))
+        
+        if self.baseline is not None:
+            report.extend(self._baseline_section())
+        
         # 推奨アクション
         report.append("【推奨アクション】")
         report.append("-" * 40)
@@ -262,10 +370,17 @@ class DMARCReportAnalyzer:
             report.append("❌ 認証率が95%未満です。失敗の原因を調査してください。")
         
         # 問題のある送信元
-        problem_sources = []
-        for ip, stats in self.summary['sources'].items():
-            if stats['count'] >= 10 and stats['both_pass'] / stats['count'] < 0.5:
-                problem_sources.append((ip, stats))
+        if self.columns is not None:
+            problem_sources = self.columns.problem_sources(limit=5)
+        elif self.spill is not None:
+            from dmarc_spill import top_sources
+            problem_sources = top_sources((item for item in self.spill.iter_sources()
+                                           if self._is_problem_source(item[1])), 5)
+        else:
+            problem_sources = []
+            for ip, stats in sorted_sources:
+                if self._is_problem_source(stats):
+                    problem_sources.append((ip, stats))
         
         if problem_sources:
             report.append("")
@@ -279,39 +394,343 @@ class DMARCReportAnalyzer:
         
         return '\n'.join(report)
     
+    @staticmethod
+    def _is_problem_source(stats: Dict) -> bool:
+        """10通以上で両方passが半数未満の送信元"""
+        return stats['count'] >= 10 and stats['both_pass'] / stats['count'] < 0.5
+    
+    def _baseline_section(self) -> List[str]:
+        """ベースライン（送信元・報告組織ごとの履歴）と比べた異常"""
+        summary = self.baseline.summary()
+        lines = ["【異常検知（ベースライン比較）】", "-" * 40]
+        tracked = summary['tracked']
+        lines.append(f"履歴: {summary['history_reports']:,} レポート / 今回: {summary['ingested_reports']:,} レポート"
+                     f"（取り込み済みで除外: {summary['skipped_reports']:,}）"
+                     f" / 送信元 {tracked['sources']:,} 件・報告組織 {tracked['orgs']:,} 件を追跡")
+        if summary['history_reports'] < self.baseline.min_history:
+            lines.append("ベースラインを作成中です。新しい送信元の検知は次回の実行から行います。")
+        counts = summary['counts']
+        if not any(counts.values()):
+            lines.append("✅ 履歴から外れた送信元・報告組織はありません")
+            lines.append("")
+            return lines
+        
+        def label(alert: Dict) -> str:
+            return alert['key'] if alert['scope'] == 'source' else f"報告組織 {alert['key'] or '(不明)'}"
+        
+        def reporter(alert: Dict) -> str:
+            return f", {alert['org_name'] or '(不明)'} の報告" if alert['scope'] == 'source' else ''
+        
+        if counts['new_source']:
+            lines.append(f"⚠️ 認証失敗の多い新しい送信元: {counts['new_source']:,} 件")
+            for block in summary['new_blocks']:
+                lines.append(f"  - {block['block']}: {len(block['ips'])} IP / {block['messages']:,} メール"
+                             f"（成功率 {block['pass_rate'] * 100:.1f}%）")
+        if counts['pass_rate_drop']:
+            lines.append(f"⚠️ 認証成功率の急落: {counts['pass_rate_drop']:,} 件")
+            for alert in summary['pass_rate_drops']:
+                base = alert['baseline']
+                lines.append(f"  - {label(alert)}: {base['pass_rate'] * 100:.1f}% → {alert['pass_rate'] * 100:.1f}%"
+                             f"（SPF {base['spf_rate'] * 100:.1f}% → {alert['spf_rate'] * 100:.1f}%,"
+                             f" DKIM {base['dkim_rate'] * 100:.1f}% → {alert['dkim_rate'] * 100:.1f}%,"
+                             f" {alert['messages']:,} メール{reporter(alert)}）")
+        if counts['volume_spike']:
+            lines.append(f"⚠️ メール数の急増: {counts['volume_spike']:,} 件")
+            for alert in summary['volume_spikes']:
+                base = alert['baseline']
+                lines.append(f"  - {label(alert)}: 平均 {base['volume']:,.0f} → {alert['messages']:,} メール"
+                             f"（成功率 {alert['pass_rate'] * 100:.1f}%{reporter(alert)}）")
+        lines.append("")
+        return lines
+    
+    def _column_sections(self) -> List[str]:
+        """列指向エンジンでのみ出力する分布・内訳"""
+        lines = ["【送信元あたりのメール数の分布】", "-" * 40]
+        totals = self.columns.totals()
+        lines.append(f"レコード数: {totals['rows']:,} / 送信元数: {totals['sources']:,}")
+        percentiles = self.columns.percentiles()
+        lines.append("  ".join(f"p{q:g}: {v:,.0f}" for q, v in percentiles.items()))
+        lines.append("")
+        
+        for fields in self.breakdowns:
+            lines.append(f"【内訳: {' × '.join(fields)}】")
+            lines.append("-" * 40)
+            lines.append(f"{' / '.join(fields):<30} {'メール数':>10} {'レコード':>8} {'送信元':>6}")
+            for group in self.columns.breakdown(fields):
+                label = ' / '.join(v or '-' for v in group['labels'])
+                lines.append(f"{label:<30} {group['messages']:>10,} {group['rows']:>8,} {group['sources']:>6,}")
+            lines.append("")
+        return lines
+    
     def export_json(self, filepath: str) -> None:
         """結果をJSON形式でエクスポート"""
+        if self.spill is not None:
+            self._export_json_spilled(filepath)
+            return
+        import json
+        from dmarc_aggregate import report_sort_key
         # datetime オブジェクトを文字列に変換
         export_data = {
-            'summary': self.summary,
-            'reports': self.reports
+            'summary': self.aggregate().to_dict(),
+            'reports': sorted(self.reports, key=report_sort_key)
         }
+        if self.baseline is not None:
+            export_data['anomalies'] = dict(self.baseline.summary(), alerts=self.baseline.alerts)
         
         with open(filepath, 'w', encoding='utf-8') as f:
             json.dump(export_data, f, indent=2, ensure_ascii=False, default=str)
+    
+    def _export_json_spilled(self, filepath: str) -> None:
+        """退避したランを読みながら export_json と同じ内容を書き出す"""
+        from dmarc_spill import Streamed, dump_json
+        self.spill.finish(self.summary)
+        export_data = {
+            'summary': {
+                'total_messages': self.summary.total_messages,
+                'pass_count': self.summary.pass_count,
+                'fail_count': self.summary.fail_count,
+                'sources': Streamed(self.spill.iter_sources(), pairs=True),
+                'failures': Streamed(self.spill.iter_failures()),
+                'date_range': self.summary.date_range,
+                'failed_reports': self.summary.failed_reports,
+                'failure_reasons': dict(sorted(self.summary.failure_reasons.items()))
+            },
+            'reports': Streamed(self.spill.iter_reports())
+        }
+        if self.summary.auth_results is not None:
+            export_data['summary']['auth_results'] = self.summary.auth_results.to_dict()
+        if self.baseline is not None:
+            export_data['anomalies'] = dict(self.baseline.summary(), alerts=self.baseline.alerts)
+        with open(filepath, 'w', encoding='utf-8') as f:
+            dump_json(export_data, f)
 
-def main():
-    parser = argparse.ArgumentParser(description='DMARC集約レポート分析ツール')
-    parser.add_argument('files', nargs='+', help='DMARCレポートファイル（XML、GZ、ZIP）')
+def output_report(analyzer: DMARCReportAnalyzer, args) -> None:
+    """レポートを出力（標準出力・ファイル・JSON）"""
+    report = analyzer.generate_report()
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+        print(f"レポートを {args.output} に保存しました")
+    else:
+        print(report)
+    
+    if args.json:
+        analyzer.export_json(args.json)
+        print(f"JSON形式で {args.json} に保存しました")
+
+def merge_main(argv: List[str]) -> None:
+    """シャードごとの集計ファイルを結合してレポートを生成"""
+    from dmarc_aggregate import Aggregate, merge_all
+    parser = argparse.ArgumentParser(prog='dmarc-report-analyzer.py merge',
+                                     description='集計ファイル（--dump-aggregate の出力）を結合')
+    parser.add_argument('aggregates', nargs='+', help='集計ファイル')
     parser.add_argument('--json', help='JSON形式で出力', metavar='FILE')
     parser.add_argument('--output', '-o', help='レポートをファイルに保存', metavar='FILE')
+    parser.add_argument('--dump-aggregate', help='結合した集計を保存', metavar='FILE')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    
+    try:
+        merged = merge_all(Aggregate.load(path) for path in args.aggregates)
+    except (OSError, ValueError) as e:
+        print(f"エラー: 集計ファイルを読み込めません: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not isinstance(merged, SummaryAggregate):
+        print("エラー: 分析ツールの集計ファイルではありません", file=sys.stderr)
+        sys.exit(1)
     
     analyzer = DMARCReportAnalyzer()
+    analyzer.summary = merged
     
-    # すべてのファイルを読み込み
-    for filepath in args.files:
-        if os.path.exists(filepath):
-            print(f"読み込み中: {filepath}")
-            analyzer.load_report(filepath)
-        else:
-            print(f"警告: ファイルが見つかりません: {filepath}", file=sys.stderr)
+    if args.dump_aggregate:
+        merged.save(args.dump_aggregate)
+    output_report(analyzer, args)
+
+def _format_rate(rate: Optional[float]) -> str:
+    return f"{rate * 100:5.1f}%" if rate is not None else "    -"
+
+
+def _format_delta(delta: Optional[float]) -> str:
+    return f"{delta * 100:+6.1f}pt" if delta is not None else "      -"
+
+
+def generate_diff_report(result: Dict, hostnames: Optional[Dict[str, str]] = None) -> str:
+    """dmarc_diff.compare の結果から比較レポートを生成"""
+    from dmarc_diff import rate_delta
+    hostnames = hostnames or {}
+    report = []
+    report.append("=" * 70)
+    report.append("DMARC集約レポート比較結果")
+    report.append("=" * 70)
+    report.append("")
     
-    # レポート生成
-    report = analyzer.generate_report()
+    report.append("【全体】")
+    report.append("-" * 40)
+    for label, name in (('before', '前'), ('after', '後')):
+        totals = result['totals'][label]
+        period = ''
+        if totals['date_range']['begin']:
+            begin = datetime.fromtimestamp(totals['date_range']['begin'])
+            end = datetime.fromtimestamp(totals['date_range']['end'])
+            period = f"  {begin.strftime('%Y-%m-%d')} ～ {end.strftime('%Y-%m-%d')}"
+        report.append(f"{name}: {totals['reports']:,} レポート / {totals['messages']:,} メール / "
+                      f"認証成功 {_format_rate(totals['pass_rate']).strip()}{period}")
+    before, after = result['totals']['before'], result['totals']['after']
+    report.append(f"変化: メール数 {after['messages'] - before['messages']:+,} / "
+                  f"認証成功率 {_format_delta(rate_delta(after['pass_rate'], before['pass_rate'])).strip()}")
+    report.append("")
+    
+    for dimension, title in (('sources', '送信元'), ('orgs', '報告組織')):
+        diff = result[dimension]
+        report.append(f"【{title}別】 共通 {diff['common']:,} / 新規 {diff['new_count']:,} / 消滅 {diff['gone_count']:,}")
+        report.append("-" * 40)
+        
+        def label_of(key: str) -> str:
+            label = hostnames.get(key, key) if dimension == 'sources' else key
+            label = label or '(不明)'
+            return label if len(label) <= 38 else label[:35] + "..."
+        
+        for section, name in (('worse', '悪化'), ('better', '改善')):
+            if not diff[section]:
+                continue
+            report.append(f"{name}（影響の大きい順）")
+            report.append(f"  {'':<38} {'前':>8} {'後':>8} {'成功率':>8} {'SPF':>8} {'DKIM':>8} {'影響':>8}")
+            for entry in diff[section]:
+                report.append(
+                    f"  {label_of(entry['key']):<38} {entry['before']['messages']:>8,} "
+                    f"{entry['after']['messages']:>8,} {_format_delta(entry['pass_rate_delta']):>8} "
+                    f"{_format_delta(entry['spf_rate_delta']):>8} {_format_delta(entry['dkim_rate_delta']):>8} "
+                    f"{entry['impact']:>+8,.0f}")
+        for section, name, side in (('new', '新規（メール数の多い順）', 'after'),
+                                    ('gone', '消滅（メール数の多い順）', 'before')):
+            if not diff[section]:
+                continue
+            report.append(name)
+            for entry in diff[section]:
+                stats = entry[side]
+                report.append(f"  {label_of(entry['key']):<38} {stats['messages']:>8,} "
+                              f"成功率 {_format_rate(stats['pass_rate'])}")
+        report.append("")
+    
+    report.append("=" * 70)
+    return '\n'.join(report)
+
+
+def _parse_range(value: str) -> Tuple[Optional[int], Optional[int]]:
+    """SINCE:UNTIL（YYYY-MM-DD、片側は省略可）を [since, until) の UNIX 時刻に"""
+    from dmarc_segments import parse_date
+    since, sep, until = value.partition(':')
+    if not sep:
+        raise ValueError(value)
+    return (parse_date(since) if since else None, parse_date(until) if until else None)
+
+
+def print_failures(failures: Dict[str, int]) -> None:
+    """読み込み・パースに失敗したレポートの件数を理由別に標準エラーへ"""
+    if failures:
+        reasons = ', '.join(f"{reason} {count}" for reason, count in sorted(failures.items()))
+        print(f"処理失敗: {sum(failures.values())} ファイル（理由: {reasons}）", file=sys.stderr)
+
+
+def diff_main(argv: List[str]) -> None:
+    """2つの期間・レポート群を1回の読み込みで集計し、送信元別・報告組織別の変化を表示"""
+    parser = argparse.ArgumentParser(
+        prog='dmarc-report-analyzer.py diff',
+        description='2つの期間（またはレポート群）の送信元別・報告組織別の変化を比較',
+        epilog='例: %(prog)s reports/*.xml.gz --split 2024-03-01 / '
+               '%(prog)s --before old/*.xml --after new/*.xml')
+    parser.add_argument('files', nargs='*', help='DMARCレポートファイル（期間で前後に振り分け）')
+    parser.add_argument('--split', metavar='DATE',
+                       help='この日付より前に始まるレポートを前、以降を後とする（YYYY-MM-DD）')
+    parser.add_argument('--before-range', metavar='SINCE:UNTIL',
+                       help='前の期間（レポートの開始日時で判定、例: 2024-02-01:2024-03-01）')
+    parser.add_argument('--after-range', metavar='SINCE:UNTIL', help='後の期間')
+    parser.add_argument('--before', nargs='+', metavar='FILE', help='前のレポート群')
+    parser.add_argument('--after', nargs='+', metavar='FILE', help='後のレポート群')
+    parser.add_argument('--top', type=int, help='各一覧の表示件数（デフォルト: 20）')
+    parser.add_argument('--max-keys', type=int,
+                       help='メモリ上に保持するキー数の上限。超えたら一時ファイルに退避（デフォルト: 200000）')
+    parser.add_argument('--spill-dir', help='一時ファイルの置き場所（デフォルト: TMPDIR）', metavar='DIR')
+    parser.add_argument('--resolve', action='store_true', help='表示する送信元IPを逆引きする')
+    parser.add_argument('--xml-backend', choices=('expat', 'etree'), help='XMLパースのバックエンド')
+    from dmarc_parse import add_limit_arguments, limits_from_args
+    add_limit_arguments(parser)
+    parser.add_argument('--json', help='JSON形式で出力', metavar='FILE')
+    parser.add_argument('--output', '-o', help='レポートをファイルに保存', metavar='FILE')
+    
+    args = parser.parse_args(argv)
+    limits = limits_from_args(parser, args)
+    
+    # (ファイル, 振り分け方) の一覧。振り分け方は固定の側か、期間で判定する
+    windows = None
+    if args.before or args.after:
+        if not (args.before and args.after) or args.files or args.split or args.before_range or args.after_range:
+            parser.error('--before と --after は両方を指定し、ファイル・期間の指定とは併用できません')
+        inputs = [(path, 'before') for path in args.before] + [(path, 'after') for path in args.after]
+    else:
+        if not args.files:
+            parser.error('レポートファイルか --before/--after を指定してください')
+        try:
+            if args.split:
+                if args.before_range or args.after_range:
+                    parser.error('--split と --before-range/--after-range は併用できません')
+                split = _parse_range(args.split + ':')[0]
+                windows = {'before': (None, split), 'after': (split, None)}
+            elif args.before_range and args.after_range:
+                windows = {'before': _parse_range(args.before_range),
+                           'after': _parse_range(args.after_range)}
+            else:
+                parser.error('--split か、--before-range と --after-range の両方を指定してください')
+        except ValueError:
+            parser.error('日付は YYYY-MM-DD（期間は SINCE:UNTIL）形式で指定してください')
+        inputs = [(path, None) for path in args.files]
+    
+    import tempfile
+    from functools import partial
+    from dmarc_diff import DEFAULT_MAX_KEYS, DEFAULT_TOP, SIDES, DiffSide, compare
+    from dmarc_parse import parse_report, read_and_parse
+    
+    parse = partial(parse_report, backend=args.xml_backend, limits=limits)
+    failures: Dict[str, int] = {}
+    with tempfile.TemporaryDirectory(prefix='dmarc-diff-', dir=args.spill_dir) as directory:
+        sides = {label: DiffSide(directory, label, args.max_keys or DEFAULT_MAX_KEYS)
+                 for label in SIDES}
+        outside = 0
+        for filepath, side in inputs:
+            parsed, error, reason = read_and_parse(filepath, parse, limits)
+            if error:
+                print(error, file=sys.stderr)
+                failures[reason] = failures.get(reason, 0) + 1
+                continue
+            if parsed is None:
+                continue
+            report_info, rows = parsed
+            if side is None:
+                begin = report_info.get('date_begin')
+                side = next((label for label, (since, until) in windows.items()
+                             if begin is not None
+                             and (since is None or begin >= since)
+                             and (until is None or begin < until)), None)
+                if side is None:
+                    outside += 1
+                    continue
+            sides[side].add_report(report_info, rows)
+        if outside:
+            print(f"どちらの期間にも入らないレポートを除外: {outside} ファイル", file=sys.stderr)
+        print_failures(failures)
+        
+        result = compare(sides['before'], sides['after'], args.top or DEFAULT_TOP)
+    
+    hostnames = {}
+    if args.resolve:
+        analyzer = DMARCReportAnalyzer()
+        for section in ('worse', 'better', 'new', 'gone'):
+            for entry in result['sources'][section]:
+                if entry['key'] not in hostnames:
+                    hostnames[entry['key']] = analyzer._get_hostname(entry['key'])
     
-    # 出力
+    report = generate_diff_report(result, hostnames)
     if args.output:
         with open(args.output, 'w', encoding='utf-8') as f:
             f.write(report)
@@ -319,10 +738,384 @@ def main():
     else:
         print(report)
     
-    # JSON出力
     if args.json:
-        analyzer.export_json(args.json)
+        import json
+        if hostnames:
+            result['hostnames'] = hostnames
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
         print(f"JSON形式で {args.json} に保存しました")
 
+def generate_simulation_report(result: Dict) -> str:
+    """dmarc_simulate.simulate の結果から試算レポートを生成"""
+    report = []
+    report.append("=" * 70)
+    report.append("DMARCポリシー試算結果")
+    report.append("=" * 70)
+    report.append("")
+    
+    period = ''
+    if result['date_range']['begin']:
+        begin = datetime.fromtimestamp(result['date_range']['begin'])
+        end = datetime.fromtimestamp(result['date_range']['end'])
+        period = f"（{begin.strftime('%Y-%m-%d')} ～ {end.strftime('%Y-%m-%d')}）"
+    report.append(f"対象: {result['reports']:,} レポート / {result['records']:,} レコード / "
+                  f"{result['messages']:,} メール{period}")
+    observed = result['observed']
+    report.append(f"報告された処理: none {observed['none']:,} / quarantine {observed['quarantine']:,} / "
+                  f"reject {observed['reject']:,}")
+    report.append("")
+    
+    report.append("【候補別】（pct が100未満の件数は期待値）")
+    report.append("-" * 40)
+    report.append(f"  {'ポリシー':<34} {'none':>9} {'隔離':>7} {'拒否':>7} {'影響率':>4} {'うち認証済':>5}")
+    for candidate in result['candidates']:
+        report.append(f"  {candidate['policy']:<38} {candidate['none']:>9,} {candidate['quarantine']:>9,} "
+                      f"{candidate['reject']:>9,} {candidate['affected_rate'] * 100:6.1f}% "
+                      f"{candidate['authenticated']:>10,}")
+    report.append("  ※うち認証済: SPF か DKIM は pass しているがアライメントが取れないメール")
+    report.append("")
+    
+    for candidate in result['candidates']:
+        if not candidate['affected']:
+            continue
+        report.append(f"【{candidate['policy']}】 隔離・拒否 {candidate['affected']:,} 通")
+        report.append("-" * 40)
+        for dimension, title in (('sources', '送信元'), ('orgs', '報告組織')):
+            if not candidate[dimension]:
+                continue
+            report.append(f"{title}別（影響の大きい順）")
+            for entry in candidate[dimension]:
+                label = entry['key'] or '(不明)'
+                label = label if len(label) <= 38 else label[:35] + "..."
+                report.append(f"  {label:<38} {entry['affected']:>9,} / {entry['messages']:>9,} "
+                              f"うち認証済 {entry['authenticated']:,}")
+        report.append("")
+    
+    report.append("=" * 70)
+    return '\n'.join(report)
+
+
+def simulate_main(argv: List[str]) -> None:
+    """過去のレポートを候補のポリシーで評価し直し、隔離・拒否されるメールを試算"""
+    parser = argparse.ArgumentParser(
+        prog='dmarc-report-analyzer.py simulate',
+        description='過去のレポートのレコードを候補のDMARCポリシーで評価し直し、影響を試算',
+        epilog="例: %(prog)s reports/*.xml.gz --policy 'p=quarantine; pct=50' --policy 'p=reject; aspf=s'")
+    parser.add_argument('files', nargs='*', help='DMARCレポートファイル（XML、GZ、ZIP）')
+    parser.add_argument('--segments', help='check-dmarc-reports.py --archive のセグメントストアから読み込む', metavar='DIR')
+    parser.add_argument('--since', help='この日付以降のレポートのみ（YYYY-MM-DD）', metavar='DATE')
+    parser.add_argument('--until', help='この日付より前のレポートのみ（YYYY-MM-DD）', metavar='DATE')
+    parser.add_argument('--policy', action='append', metavar='SPEC',
+                       help="試算するポリシー（例: 'p=reject; sp=quarantine; pct=50; adkim=s'、複数指定可。"
+                            "デフォルト: none から reject までの代表的な候補）")
+    parser.add_argument('--top', type=int, help='送信元・報告組織の表示件数（デフォルト: 10）')
+    from dmarc_parse import add_limit_arguments, limits_from_args
+    add_limit_arguments(parser)
+    parser.add_argument('--json', help='JSON形式で出力', metavar='FILE')
+    parser.add_argument('--output', '-o', help='レポートをファイルに保存', metavar='FILE')
+    
+    args = parser.parse_args(argv)
+    limits = limits_from_args(parser, args)
+    
+    from dmarc_simulate import DEFAULT_CANDIDATES, DEFAULT_TOP, PolicyCandidate, SimulationRows, simulate
+    from dmarc_segments import SegmentStore, parse_date
+    
+    if not args.files and not args.segments:
+        parser.error('レポートファイルか --segments を指定してください')
+    try:
+        since = parse_date(args.since) if args.since else None
+        until = parse_date(args.until) if args.until else None
+    except ValueError:
+        parser.error('日付は YYYY-MM-DD 形式で指定してください')
+    try:
+        candidates = [PolicyCandidate.parse(spec) for spec in args.policy or DEFAULT_CANDIDATES]
+    except ValueError as e:
+        parser.error(str(e))
+    
+    from dmarc_columns import require_numpy
+    try:
+        require_numpy()
+    except RuntimeError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        sys.exit(1)
+    
+    from functools import partial
+    from dmarc_parse import (ParseError, ReportLimitError, filter_reports, parse_report_auth,
+                             read_and_parse)
+    
+    rows = SimulationRows()
+    failures: Dict[str, int] = {}
+    
+    def add(label: str, content: str) -> None:
+        try:
+            report_info, records = parse_report_auth(content, limits)
+        except ReportLimitError as e:
+            print(f"レポートを拒否: {label}: {e}", file=sys.stderr)
+            failures[e.reason] = failures.get(e.reason, 0) + 1
+            return
+        except ParseError as e:
+            print(f"XMLパースエラー: {label}: {e}", file=sys.stderr)
+            failures['parse_error'] = failures.get('parse_error', 0) + 1
+            return
+        rows.add_report(report_info, records)
+    
+    files = args.files
+    if files and (since is not None or until is not None):
+        files, skipped = filter_reports(files, since, until)
+        if skipped:
+            print(f"期間外のレポートを除外: {skipped} ファイル", file=sys.stderr)
+    parse = partial(parse_report_auth, limits=limits)
+    for filepath in files:
+        parsed, error, reason = read_and_parse(filepath, parse, limits)
+        if error:
+            print(error, file=sys.stderr)
+            failures[reason] = failures.get(reason, 0) + 1
+        elif parsed is not None:
+            rows.add_report(*parsed)
+    if args.segments:
+        store = SegmentStore(args.segments)
+        for entry, content in store.iter_reports(since, until):
+            add(args.segments, content)
+    print_failures(failures)
+    
+    result = simulate(rows, candidates, args.top or DEFAULT_TOP)
+    
+    report = generate_simulation_report(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+        print(f"レポートを {args.output} に保存しました")
+    else:
+        print(report)
+    
+    if args.json:
+        import json
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"JSON形式で {args.json} に保存しました")
+
+def main():
+    if sys.argv[1:2] == ['merge']:
+        merge_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['diff']:
+        diff_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['simulate']:
+        simulate_main(sys.argv[2:])
+        return
+    
+    parser = argparse.ArgumentParser(description='DMARC集約レポート分析ツール',
+                                     epilog='集計ファイルの結合: %(prog)s merge FILE... / '
+                                            '期間の比較: %(prog)s diff FILE... --split DATE / '
+                                            'ポリシーの試算: %(prog)s simulate FILE... --policy SPEC')
+    parser.add_argument('files', nargs='*', help='DMARCレポートファイル（XML、GZ、ZIP）')
+    parser.add_argument('--json', help='JSON形式で出力', metavar='FILE')
+    parser.add_argument('--output', '-o', help='レポートをファイルに保存', metavar='FILE')
+    parser.add_argument('--spf-domain', help='SPF失敗をこのドメインのSPFレコードで分類', metavar='DOMAIN')
+    parser.add_argument('--spf-stub', help='SPF展開に使うスタブDNSレコード（JSON）', metavar='FILE')
+    parser.add_argument('--shard', help='ファイル名ハッシュで分割したシャードのみ処理（例: 0/4）', metavar='I/N')
+    parser.add_argument('--dump-aggregate', help='集計をファイルに保存（merge で結合可能）', metavar='FILE')
+    parser.add_argument('--segments', help='check-dmarc-reports.py --archive のセグメントストアから読み込む', metavar='DIR')
+    parser.add_argument('--since', help='この日付以降のレポートのみ（YYYY-MM-DD）', metavar='DATE')
+    parser.add_argument('--until', help='この日付より前のレポートのみ（YYYY-MM-DD）', metavar='DATE')
+    parser.add_argument('--header-cache', help='--since/--until の絞り込みと --baseline の並べ替えに使うヘッダーキャッシュ（JSON）', metavar='FILE')
+    parser.add_argument('--pipeline', action='store_true',
+                       help='読み込み・展開・パース・逆引きを並行実行する非同期パイプラインで処理')
+    parser.add_argument('--workers', type=int, help='--pipeline のパース用プロセス数（デフォルト: CPU数）')
+    parser.add_argument('--engine', choices=('dict', 'numpy'), default='dict',
+                       help='送信元別統計の計算エンジン（numpy: 列指向のベクトル演算、要 NumPy）')
+    parser.add_argument('--breakdown', action='append', metavar='FIELDS',
+                       help='指定列の組み合わせ別の内訳を表示（例: spf,dkim / disposition、--engine numpy）')
+    parser.add_argument('--row-cache', help='解析済みレコードのバイナリキャッシュ（入力が同じなら再利用）', metavar='FILE')
+    parser.add_argument('--xml-backend', choices=('expat', 'etree'),
+                       help='XMLパースのバックエンド（デフォルト: expat、mail-auth-tools.py bench-xml で比較）')
+    parser.add_argument('--max-memory', metavar='SIZE',
+                       help='集計に使うメモリの上限（例: 512M）。超えそうになったら一時ファイルに退避して外部マージ')
+    parser.add_argument('--spill-dir', help='--max-memory の退避先ディレクトリ（デフォルト: TMPDIR）', metavar='DIR')
+    parser.add_argument('--baseline', metavar='FILE',
+                       help='送信元・報告組織別の履歴（EWMA）と比べて異常を検知し、履歴をこのファイルに更新保存')
+    from dmarc_parse import add_limit_arguments, limits_from_args
+    add_limit_arguments(parser)
+    parser.add_argument('--auth-results', action='store_true',
+                       help='レコードの auth_results も同じパースで読み、DKIMセレクター別・SPFドメイン別に集計')
+    
+    args = parser.parse_args()
+    
+    from dmarc_aggregate import parse_shard, in_shard
+    from dmarc_segments import SegmentStore, parse_date
+    
+    if not args.files and not args.segments:
+        parser.error('レポートファイルか --segments を指定してください')
+    try:
+        since = parse_date(args.since) if args.since else None
+        until = parse_date(args.until) if args.until else None
+    except ValueError:
+        parser.error('日付は YYYY-MM-DD 形式で指定してください')
+    
+    files = args.files
+    if args.shard:
+        try:
+            shard_index, shard_count = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+        files = [f for f in files if in_shard(f, shard_index, shard_count)]
+    
+    # レポート自身の期間で絞り込み（report_metadata だけを読み、残りは展開しない）
+    header_cache = None
+    if files and (since is not None or until is not None):
+        from dmarc_parse import ReportHeaderCache, filter_reports
+        header_cache = ReportHeaderCache(args.header_cache)
+        files, skipped = filter_reports(files, since, until, cache=header_cache)
+        print(f"期間外のレポートを除外: {skipped} ファイル"
+              f"（ヘッダーキャッシュ: {header_cache.hits} ヒット / {header_cache.misses} 読み込み）")
+    
+    # ベースラインはレポートを期間順に取り込むため、ファイルもヘッダーの期間順に読む
+    if files and args.baseline:
+        from dmarc_baseline import Baseline
+        from dmarc_parse import ReportHeaderCache, sort_reports
+        files = sort_reports(files, Baseline.order_key,
+                             header_cache or ReportHeaderCache(args.header_cache))
+    
+    spf_evaluator = None
+    if args.spf_domain:
+        import json
+        from dmarc_spf import SPFEvaluator, StubDNSSource
+        try:
+            dns_source = StubDNSSource.from_file(args.spf_stub) if args.spf_stub else None
+            spf_evaluator = SPFEvaluator(args.spf_domain, dns_source)
+        except (RuntimeError, OSError, json.JSONDecodeError) as e:
+            print(f"エラー: {e}", file=sys.stderr)
+            sys.exit(1)
+    
+    analyzer = DMARCReportAnalyzer(spf_evaluator)
+    analyzer.xml_backend = args.xml_backend
+    if args.auth_results:
+        if args.row_cache:
+            # バイナリキャッシュは auth_results を保持しない
+            parser.error('--auth-results は --row-cache と併用できません')
+        analyzer.auth_results = True
+    analyzer.limits = limits_from_args(parser, args)
+    
+    if args.max_memory:
+        from dmarc_spill import AGGREGATE_MEMORY_SHARE, SummarySpill, parse_size
+        if args.engine == 'numpy' or args.breakdown:
+            parser.error('--max-memory は --engine numpy / --breakdown と併用できません')
+        if args.dump_aggregate:
+            parser.error('--max-memory は --dump-aggregate と併用できません')
+        try:
+            max_memory = parse_size(args.max_memory)
+        except ValueError as e:
+            parser.error(str(e))
+        analyzer.spill = SummarySpill(int(max_memory * AGGREGATE_MEMORY_SHARE), args.spill_dir)
+    
+    if args.baseline:
+        from dmarc_baseline import Baseline
+        try:
+            analyzer.baseline = Baseline(args.baseline)
+        except (OSError, ValueError) as e:
+            print(f"エラー: ベースラインを読み込めません: {e}", file=sys.stderr)
+            sys.exit(1)
+    
+    if args.breakdown:
+        args.engine = 'numpy'
+    if args.engine == 'numpy':
+        from dmarc_columns import BREAKDOWN_FIELDS, ColumnarRows, require_numpy
+        try:
+            require_numpy()
+        except RuntimeError as e:
+            print(f"エラー: {e}", file=sys.stderr)
+            sys.exit(1)
+        for value in args.breakdown or []:
+            fields = [f.strip() for f in value.split(',') if f.strip()]
+            if not fields or any(f not in BREAKDOWN_FIELDS for f in fields):
+                parser.error(f"--breakdown には {', '.join(BREAKDOWN_FIELDS)} をカンマ区切りで指定してください")
+            analyzer.breakdowns.append(fields)
+    
+    # 入力が前回と同じならバイナリキャッシュから集計
+    cache = None
+    if args.row_cache:
+        from dmarc_parse import DEFAULT_LIMITS
+        from dmarc_rowcache import RowCache, RowCacheWriter, file_signature
+        inputs = [file_signature(f) for f in files if os.path.exists(f)]
+        # 上限が変われば除外されるレポートも変わるため、有効な上限もキャッシュの条件に含める
+        limits = analyzer.limits or DEFAULT_LIMITS
+        inputs.append(['limits', limits.file_bytes, limits.xml_bytes, limits.records, limits.depth])
+        if args.segments:
+            store = SegmentStore(args.segments)
+            inputs.append(['segments', since, until])
+            inputs.extend(file_signature(os.path.join(args.segments, name + ext))
+                          for name in store.segment_names() for ext in ('.seg', '.idx'))
+        cache = RowCache.open_if_valid(args.row_cache, inputs)
+        if cache is None:
+            analyzer.row_writer = RowCacheWriter(args.row_cache)
+            analyzer.row_sinks.append(analyzer.row_writer)
+    
+    if args.engine == 'numpy' and cache is None:
+        analyzer.use_columns()
+    
+    if cache is not None:
+        print(f"キャッシュから読み込み中: {args.row_cache} ({cache.row_count:,} レコード)")
+        if args.engine == 'numpy':
+            analyzer.columns = ColumnarRows.from_row_cache(cache)
+        analyzer.load_row_cache(cache)
+        cache.close()
+    else:
+        try:
+            # すべてのファイルを読み込み
+            existing = []
+            for filepath in files:
+                if os.path.exists(filepath):
+                    existing.append(filepath)
+                else:
+                    print(f"警告: ファイルが見つかりません: {filepath}", file=sys.stderr)
+            
+            if args.pipeline:
+                print(f"パイプラインで読み込み中: {len(existing)} ファイル")
+                analyzer.load_reports_pipelined(existing, args.workers)
+            else:
+                for filepath in existing:
+                    print(f"読み込み中: {filepath}")
+                    analyzer.load_report(filepath)
+            
+            # セグメントストアから読み込み
+            if args.segments:
+                store = SegmentStore(args.segments)
+                selected = store.select_segments(since, until)
+                print(f"セグメント読み込み中: {args.segments} ({len(selected)}/{len(store.segment_names())} セグメント)")
+                analyzer.load_segments(store, since, until)
+        except BaseException:
+            # 途中で失敗したら書きかけのキャッシュを残さない
+            if analyzer.row_writer is not None:
+                analyzer.row_writer.abort()
+            raise
+        
+        if analyzer.row_writer is not None:
+            analyzer.row_writer.close(inputs)
+            print(f"キャッシュを {args.row_cache} に保存しました")
+        analyzer.finish_columns()
+    
+    # 取り込み待ちのレポートをベースラインへ取り込む
+    if analyzer.baseline is not None:
+        analyzer.baseline.flush()
+    
+    # 集計の保存
+    if args.dump_aggregate:
+        analyzer.aggregate().save(args.dump_aggregate)
+        print(f"集計を {args.dump_aggregate} に保存しました")
+    
+    # レポート生成・出力
+    try:
+        output_report(analyzer, args)
+        if analyzer.baseline is not None:
+            analyzer.baseline.save()
+            print(f"ベースラインを {args.baseline} に保存しました")
+    finally:
+        if analyzer.spill is not None:
+            if analyzer.spill.spills:
+                print(f"集計を {analyzer.spill.spills} 回ディスクに退避しました", file=sys.stderr)
+            analyzer.spill.close()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+
+"""
+DMARC集計オブジェクト
+分析ツール・受信確認ツールの集計結果を結合（merge）・シリアライズ可能な形で保持する
+結合は結合則・交換則を満たすため、ファイルを任意に分割して処理した結果を合算しても
+単一実行と同じサマリーになる
+"""
+
+import os
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from dmarc_auth import AuthBreakdown
+
+AGGREGATE_FORMAT = 'dmarc-aggregate'
+AGGREGATE_VERSION = 1
+
+
+def new_source_stats() -> Dict:
+    """送信元IP別統計の初期値"""
+    return {
+        'count': 0,
+        'spf_pass': 0,
+        'dkim_pass': 0,
+        'both_pass': 0,
+        'hostname': None
+    }
+
+
+def _min_optional(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+def _max_optional(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+def new_message_stats() -> Dict:
+    """レポート数・メール数・認証成否の初期値"""
+    return {'count': 0, 'messages': 0, 'pass': 0, 'fail': 0}
+
+
+def _add_message_stats(ours: Dict, theirs: Dict) -> None:
+    for field in ('count', 'messages', 'pass', 'fail'):
+        ours[field] += theirs[field]
+
+
+def report_sort_key(info: Dict) -> Tuple:
+    """レポート情報の並び（開始日時・報告組織・レポートID順）
+
+    分割して集計した結果を結合しても単一実行と同じ並びになるよう、出力は常にこの順にする。
+    """
+    return (info.get('date_begin') or 0, info.get('org_name') or '', info.get('report_id') or '')
+
+
+def _merge_policy(ours: Dict, theirs: Dict) -> None:
+    """ポリシー別の出現状況（レポート数・最初と最後に見た時刻）を結合"""
+    ours['reports'] += theirs['reports']
+    ours['first'] = _min_optional(ours['first'], theirs['first'])
+    ours['last'] = _max_optional(ours['last'], theirs['last'])
+
+
+def _merge_auth(ours: Optional['AuthBreakdown'],
+                theirs: Optional['AuthBreakdown']) -> Optional['AuthBreakdown']:
+    """auth_results の集計を結合（どちらも持たなければ None のまま）"""
+    if theirs is None:
+        return ours
+    if ours is None:
+        from dmarc_auth import AuthBreakdown
+        ours = AuthBreakdown()
+    return ours.merge(theirs)
+
+
+def _auth_from_state(state: Dict) -> Optional['AuthBreakdown']:
+    # auth_results を集計していない（古い）集計ファイルは None
+    if 'auth_results' not in state:
+        return None
+    from dmarc_auth import AuthBreakdown
+    return AuthBreakdown.from_state(state['auth_results'])
+
+
+def _pick_hostname(ip: str, a: Optional[str], b: Optional[str]) -> Optional[str]:
+    """逆引き結果を順序に依存せず選択（解決済みのホスト名を優先）"""
+    candidates = [h for h in (a, b) if h is not None]
+    if not candidates:
+        return None
+    resolved = [h for h in candidates if h != ip]
+    return min(resolved) if resolved else ip
+
+
+def failure_details(failure_counts: Dict[Tuple, int],
+                    hostname_of: Callable[[str], Optional[str]]) -> List[Dict]:
+    """(source_ip, spf, dkim, disposition, spf_class) -> メール数 を失敗の詳細の一覧に（キー順）"""
+    failures = []
+    for key in sorted(failure_counts, key=lambda k: tuple(v or '' for v in k)):
+        source_ip, spf, dkim, disposition, spf_class = key
+        failure = {
+            'source_ip': source_ip,
+            'hostname': hostname_of(source_ip) or source_ip,
+            'count': failure_counts[key],
+            'spf': spf,
+            'dkim': dkim,
+            'disposition': disposition
+        }
+        if spf_class is not None:
+            failure['spf_class'] = spf_class
+        failures.append(failure)
+    return failures
+
+
+class Aggregate:
+    """結合・シリアライズ可能な集計の基底クラス"""
+
+    kind = ''
+
+    def merge(self, other: 'Aggregate') -> 'Aggregate':
+        """other の内容をこの集計に加算（自身を返す）"""
+        raise NotImplementedError
+
+    def to_state(self) -> Dict:
+        """シリアライズ用の状態（JSON互換）"""
+        raise NotImplementedError
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'Aggregate':
+        raise NotImplementedError
+
+    def to_bytes(self) -> bytes:
+        """gzip圧縮したコンパクトなJSON表現"""
+        import gzip
+        import json
+        payload = {
+            'format': AGGREGATE_FORMAT,
+            'version': AGGREGATE_VERSION,
+            'kind': self.kind,
+            'state': self.to_state()
+        }
+        data = json.dumps(payload, separators=(',', ':'), ensure_ascii=False, sort_keys=True)
+        return gzip.compress(data.encode('utf-8'), mtime=0)
+
+    def save(self, filepath: str) -> None:
+        with open(filepath, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'Aggregate':
+        import gzip
+        import json
+        payload = json.loads(gzip.decompress(data).decode('utf-8'))
+        if payload.get('format') != AGGREGATE_FORMAT:
+            raise ValueError("DMARC集計ファイルではありません")
+        if payload.get('version') != AGGREGATE_VERSION:
+            raise ValueError(f"未対応の集計バージョン: {payload.get('version')}")
+        kinds = {cls.kind: cls for cls in (SummaryAggregate, ReportStats)}
+        if payload.get('kind') not in kinds:
+            raise ValueError(f"未知の集計種別: {payload.get('kind')}")
+        return kinds[payload['kind']].from_state(payload['state'])
+
+    @staticmethod
+    def load(filepath: str) -> 'Aggregate':
+        with open(filepath, 'rb') as f:
+            return Aggregate.from_bytes(f.read())
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.to_state() == other.to_state()
+
+
+class SummaryAggregate(Aggregate):
+    """DMARCReportAnalyzer の集計（送信元IP別・失敗パターン別）
+
+    failure_reasons は読み込み・パースに失敗したレポートの理由（read_error・parse_error や
+    上限超過の file_size・malformed など）別の件数。
+    """
+
+    kind = 'summary'
+
+    def __init__(self):
+        self.total_messages = 0
+        self.pass_count = 0
+        self.fail_count = 0
+        self.sources: Dict[str, Dict] = {}
+        # (source_ip, spf, dkim, disposition, spf_class) -> メール数
+        self.failure_counts: Dict[Tuple, int] = {}
+        self.date_range = {'begin': None, 'end': None}
+        self.reports: List[Dict] = []
+        # DKIMセレクター別・SPFドメイン別の集計（auth_results を読んだ場合のみ）
+        self.auth_results: Optional['AuthBreakdown'] = None
+        self.failed_reports = 0
+        self.failure_reasons: Dict[str, int] = {}
+
+    def source(self, ip: str) -> Dict:
+        """送信元IPの統計（なければ作成）"""
+        stats = self.sources.get(ip)
+        if stats is None:
+            stats = self.sources[ip] = new_source_stats()
+        return stats
+
+    def add_report(self, info: Dict) -> None:
+        """レポート単位の情報を追加し期間を更新"""
+        # auth_results の集計はレポート情報には残さず、全体の集計に加える
+        self.auth_results = _merge_auth(self.auth_results, info.pop('auth_results', None))
+        self.reports.append(info)
+        self.date_range['begin'] = _min_optional(self.date_range['begin'], info.get('date_begin'))
+        self.date_range['end'] = _max_optional(self.date_range['end'], info.get('date_end'))
+
+    def add_failure(self, reason: str) -> None:
+        """読み込み・パースに失敗したレポートを理由とともに数える"""
+        self.failed_reports += 1
+        self.failure_reasons[reason] = self.failure_reasons.get(reason, 0) + 1
+
+    def add_record(self, source_ip: str, count: int, spf: str, dkim: str,
+                   disposition: str, hostname: Optional[str] = None,
+                   spf_class: Optional[str] = None) -> None:
+        """レコード（row）1件分を加算"""
+        self.total_messages += count
+
+        stats = self.source(source_ip)
+        stats['hostname'] = _pick_hostname(source_ip, stats['hostname'], hostname)
+        stats['count'] += count
+
+        if spf == 'pass':
+            stats['spf_pass'] += count
+
+        if dkim == 'pass':
+            stats['dkim_pass'] += count
+
+        if spf == 'pass' and dkim == 'pass':
+            stats['both_pass'] += count
+            self.pass_count += count
+        else:
+            self.fail_count += count
+            key = (source_ip, spf, dkim, disposition, spf_class)
+            self.failure_counts[key] = self.failure_counts.get(key, 0) + count
+
+    @property
+    def failures(self) -> List[Dict]:
+        """失敗の詳細（IP・結果の組み合わせ単位）"""
+        return failure_details(self.failure_counts,
+                               lambda ip: self.sources.get(ip, {}).get('hostname'))
+
+    def merge(self, other: 'SummaryAggregate') -> 'SummaryAggregate':
+        self.total_messages += other.total_messages
+        self.pass_count += other.pass_count
+        self.fail_count += other.fail_count
+
+        for ip, theirs in other.sources.items():
+            ours = self.source(ip)
+            for field in ('count', 'spf_pass', 'dkim_pass', 'both_pass'):
+                ours[field] += theirs[field]
+            ours['hostname'] = _pick_hostname(ip, ours['hostname'], theirs['hostname'])
+
+        for key, count in other.failure_counts.items():
+            self.failure_counts[key] = self.failure_counts.get(key, 0) + count
+
+        # 自身との結合でも追加中のリストを走査し続けないよう、コピーを走査する
+        for info in list(other.reports):
+            self.add_report(info)
+        self.reports.sort(key=report_sort_key)
+        self.auth_results = _merge_auth(self.auth_results, other.auth_results)
+        self.failed_reports += other.failed_reports
+        for reason, count in list(other.failure_reasons.items()):
+            self.failure_reasons[reason] = self.failure_reasons.get(reason, 0) + count
+        return self
+
+    def to_state(self) -> Dict:
+        state = {
+            'total_messages': self.total_messages,
+            'pass_count': self.pass_count,
+            'fail_count': self.fail_count,
+            'sources': [
+                [ip, s['count'], s['spf_pass'], s['dkim_pass'], s['both_pass'], s['hostname']]
+                for ip, s in sorted(self.sources.items())
+            ],
+            'failures': sorted(
+                ([*key, count] for key, count in self.failure_counts.items()),
+                key=lambda row: tuple('' if v is None else str(v) for v in row)
+            ),
+            'date_range': [self.date_range['begin'], self.date_range['end']],
+            'reports': sorted(self.reports, key=report_sort_key),
+            'failure_reasons': sorted(self.failure_reasons.items())
+        }
+        if self.auth_results is not None:
+            state['auth_results'] = self.auth_results.to_state()
+        return state
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'SummaryAggregate':
+        agg = cls()
+        agg.total_messages = state['total_messages']
+        agg.pass_count = state['pass_count']
+        agg.fail_count = state['fail_count']
+        for ip, count, spf_pass, dkim_pass, both_pass, hostname in state['sources']:
+            agg.sources[ip] = {
+                'count': count,
+                'spf_pass': spf_pass,
+                'dkim_pass': dkim_pass,
+                'both_pass': both_pass,
+                'hostname': hostname
+            }
+        for *key, count in state['failures']:
+            agg.failure_counts[tuple(key)] = count
+        agg.date_range = {'begin': state['date_range'][0], 'end': state['date_range'][1]}
+        agg.reports = list(state['reports'])
+        agg.auth_results = _auth_from_state(state)
+        # 失敗理由を持たない古い集計ファイルも読めるようにする
+        agg.failure_reasons = dict(state.get('failure_reasons', []))
+        agg.failed_reports = sum(agg.failure_reasons.values())
+        return agg
+
+    def to_dict(self) -> Dict:
+        """JSONエクスポート用の辞書"""
+        result = {
+            'total_messages': self.total_messages,
+            'pass_count': self.pass_count,
+            'fail_count': self.fail_count,
+            'sources': dict(sorted(self.sources.items())),
+            'failures': self.failures,
+            'date_range': self.date_range,
+            'failed_reports': self.failed_reports,
+            'failure_reasons': dict(sorted(self.failure_reasons.items()))
+        }
+        if self.auth_results is not None:
+            result['auth_results'] = self.auth_results.to_dict()
+        return result
+
+
+class ReportStats(Aggregate):
+    """DMARCReportChecker の集計（レポート数・送信元組織別・ドメイン別）
+
+    domains はポリシー公開ドメインごとに送信元組織別の統計（orgs）と、
+    公開ポリシー（p=）ごとの出現状況（policies）を持つ。
+    failure_reasons は処理失敗の理由（read_error や上限超過の file_size・entity など）別の件数。
+    auth_results は auth_results を読んだ場合のみ DKIMセレクター別・SPFドメイン別の集計を持つ。
+    """
+
+    kind = 'report_stats'
+
+    def __init__(self):
+        self.total_reports = 0
+        self.new_reports = 0
+        self.processed_reports = 0
+        self.failed_reports = 0
+        self.failure_reasons: Dict[str, int] = {}
+        self.senders: Dict[str, Dict] = {}
+        self.domains: Dict[str, Dict] = {}
+        # UNIX時刻で保持
+        self.date_range = {'earliest': None, 'latest': None}
+        self.auth_results: Optional['AuthBreakdown'] = None
+
+    def add_report(self, metadata: Dict) -> None:
+        """parse_report_metadata の結果を加算"""
+        sender = metadata['org_name']
+        report = {'count': 1, 'messages': metadata['total_messages'],
+                  'pass': metadata['pass_count'], 'fail': metadata['fail_count']}
+        _add_message_stats(self.senders.setdefault(sender, new_message_stats()), report)
+
+        # ドメイン × 送信元組織
+        domain = self.domain(metadata.get('domain') or '')
+        _add_message_stats(domain['orgs'].setdefault(sender, new_message_stats()), report)
+        if metadata.get('policy'):
+            seen = metadata['date_end'] or None
+            _merge_policy(domain['policies'].setdefault(metadata['policy'], {
+                'reports': 0, 'first': None, 'last': None
+            }), {'reports': 1, 'first': seen, 'last': seen})
+
+        self.date_range['earliest'] = _min_optional(self.date_range['earliest'],
+                                                    metadata['date_begin'] or None)
+        self.date_range['latest'] = _max_optional(self.date_range['latest'],
+                                                  metadata['date_end'] or None)
+        self.auth_results = _merge_auth(self.auth_results, metadata.get('auth_results'))
+        self.processed_reports += 1
+
+    def add_failure(self, reason: str) -> None:
+        """処理に失敗したレポートを理由とともに数える"""
+        self.failed_reports += 1
+        self.failure_reasons[reason] = self.failure_reasons.get(reason, 0) + 1
+
+    def domain(self, name: str) -> Dict:
+        """ドメイン別統計を取得（なければ作成、ドメイン名は小文字に正規化）"""
+        return self.domains.setdefault(name.lower(), {'orgs': {}, 'policies': {}})
+
+    def domain_totals(self, name: str) -> Dict:
+        """ドメイン全体のレポート数・メール数・認証成否"""
+        totals = new_message_stats()
+        for org in self.domains[name]['orgs'].values():
+            _add_message_stats(totals, org)
+        return totals
+
+    def current_policy(self, name: str) -> Optional[str]:
+        """最も新しいレポートで公開されていたポリシー（同時刻なら文字列順で決定）"""
+        policies = self.domains[name]['policies']
+        if not policies:
+            return None
+        return max(policies, key=lambda p: (policies[p]['last'] or 0, p))
+
+    def earliest(self) -> Optional[datetime]:
+        ts = self.date_range['earliest']
+        return datetime.fromtimestamp(ts) if ts is not None else None
+
+    def latest(self) -> Optional[datetime]:
+        ts = self.date_range['latest']
+        return datetime.fromtimestamp(ts) if ts is not None else None
+
+    def merge(self, other: 'ReportStats') -> 'ReportStats':
+        self.total_reports += other.total_reports
+        self.new_reports += other.new_reports
+        self.processed_reports += other.processed_reports
+        self.failed_reports += other.failed_reports
+        for reason, count in other.failure_reasons.items():
+            self.failure_reasons[reason] = self.failure_reasons.get(reason, 0) + count
+
+        for sender, theirs in other.senders.items():
+            _add_message_stats(self.senders.setdefault(sender, new_message_stats()), theirs)
+
+        for name, theirs in other.domains.items():
+            ours = self.domain(name)
+            for org, stats in theirs['orgs'].items():
+                _add_message_stats(ours['orgs'].setdefault(org, new_message_stats()), stats)
+            for policy, seen in theirs['policies'].items():
+                _merge_policy(ours['policies'].setdefault(policy, {
+                    'reports': 0, 'first': None, 'last': None
+                }), seen)
+
+        self.date_range['earliest'] = _min_optional(self.date_range['earliest'],
+                                                    other.date_range['earliest'])
+        self.date_range['latest'] = _max_optional(self.date_range['latest'],
+                                                  other.date_range['latest'])
+        self.auth_results = _merge_auth(self.auth_results, other.auth_results)
+        return self
+
+    def to_state(self) -> Dict:
+        state = {
+            'counts': [self.total_reports, self.new_reports,
+                       self.processed_reports, self.failed_reports],
+            'failure_reasons': sorted(self.failure_reasons.items()),
+            'senders': [
+                [sender, s['count'], s['messages'], s['pass'], s['fail']]
+                for sender, s in sorted(self.senders.items())
+            ],
+            'domains': [
+                [name,
+                 [[org, s['count'], s['messages'], s['pass'], s['fail']]
+                  for org, s in sorted(d['orgs'].items())],
+                 [[policy, p['reports'], p['first'], p['last']]
+                  for policy, p in sorted(d['policies'].items())]]
+                for name, d in sorted(self.domains.items())
+            ],
+            'date_range': [self.date_range['earliest'], self.date_range['latest']]
+        }
+        if self.auth_results is not None:
+            state['auth_results'] = self.auth_results.to_state()
+        return state
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'ReportStats':
+        stats = cls()
+        (stats.total_reports, stats.new_reports,
+         stats.processed_reports, stats.failed_reports) = state['counts']
+        # 失敗理由を持たない古い集計ファイルも読めるようにする
+        stats.failure_reasons = dict(state.get('failure_reasons', []))
+        for sender, count, messages, passed, failed in state['senders']:
+            stats.senders[sender] = {'count': count, 'messages': messages,
+                                     'pass': passed, 'fail': failed}
+        # ドメイン別統計を持たない古い集計ファイルも読めるようにする
+        for name, orgs, policies in state.get('domains', []):
+            domain = stats.domain(name)
+            for org, count, messages, passed, failed in orgs:
+                domain['orgs'][org] = {'count': count, 'messages': messages,
+                                       'pass': passed, 'fail': failed}
+            for policy, reports, first, last in policies:
+                domain['policies'][policy] = {'reports': reports, 'first': first, 'last': last}
+        stats.date_range = {'earliest': state['date_range'][0], 'latest': state['date_range'][1]}
+        stats.auth_results = _auth_from_state(state)
+        return stats
+
+    def to_dict(self) -> Dict:
+        """JSON出力用の辞書（日時はISO形式）"""
+        earliest, latest = self.earliest(), self.latest()
+        result = {
+            'total_reports': self.total_reports,
+            'new_reports': self.new_reports,
+            'processed_reports': self.processed_reports,
+            'failed_reports': self.failed_reports,
+            'failure_reasons': dict(sorted(self.failure_reasons.items())),
+            'senders': dict(sorted(self.senders.items())),
+            'domains': {
+                name: dict(self.domain_totals(name),
+                           policy=self.current_policy(name),
+                           policies=dict(sorted(d['policies'].items())),
+                           orgs=dict(sorted(d['orgs'].items())))
+                for name, d in sorted(self.domains.items())
+            },
+            'date_range': {
+                'earliest': earliest.isoformat() if earliest else None,
+                'latest': latest.isoformat() if latest else None
+            }
+        }
+        if self.auth_results is not None:
+            result['auth_results'] = self.auth_results.to_dict()
+        return result
+
+
+def merge_all(aggregates: Iterable[Aggregate]) -> Optional[Aggregate]:
+    """集計をまとめて結合（種別が混在する場合は ValueError）"""
+    result = None
+    for agg in aggregates:
+        if result is None:
+            result = type(agg)().merge(agg)
+        elif type(agg) is not type(result):
+            raise ValueError(f"種別の異なる集計は結合できません: {result.kind} / {agg.kind}")
+        else:
+            result.merge(agg)
+    return result
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """"I/N" 形式のシャード指定を (I, N) に変換（I は 0 始まり）"""
+    try:
+        index, count = (int(v) for v in value.split('/', 1))
+    except ValueError:
+        raise ValueError(f"シャード指定は I/N 形式で指定してください: {value}")
+    if count <= 0 or not 0 <= index < count:
+        raise ValueError(f"シャード番号が範囲外です: {value}")
+    return index, count
+
+
+def in_shard(filepath: str, index: int, count: int) -> bool:
+    """ファイル名のハッシュでシャードに属するか判定（マシン間で安定）"""
+    import zlib
+    name = os.path.basename(filepath).encode('utf-8')
+    return zlib.crc32(name) % count == index
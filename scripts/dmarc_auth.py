@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+"""
+レコードの auth_results の集計
+DKIM署名は (header_from, 署名ドメイン, セレクター) ごと、SPFは検証ドメインごとに
+結果（pass・fail・permerror など）別のメール数と、header_from とアライメントが取れた
+pass のメール数を数える
+セレクターごとの失敗は鍵のローテーション漏れ（古いセレクターの公開鍵の削除が早すぎる・
+新しいセレクターの公開が遅れている）、pass だがアライメントが取れないものは
+送信サービスの署名ドメイン・エンベロープ送信者の設定漏れの手がかりになる
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 組織ドメインの判定に使う2ラベルの公開サフィックス
+# Public Suffix List 全体は持たない近似のため、ここにないサフィックスでは
+# relaxed アライメントの判定が実際より緩く（同じ組織とみなしやすく）なる
+_MULTI_LABEL_SUFFIXES = frozenset({
+    'co.jp', 'ne.jp', 'or.jp', 'ac.jp', 'ad.jp', 'ed.jp', 'go.jp', 'gr.jp', 'lg.jp',
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'me.uk',
+    'com.au', 'net.au', 'org.au', 'co.nz', 'com.br', 'com.cn', 'com.tw', 'co.kr', 'co.in',
+})
+
+# 各一覧に表示する件数
+DEFAULT_TOP = 15
+
+
+def organizational_domain(domain: str) -> str:
+    """組織ドメイン（example.co.jp の mail.example.co.jp など、近似）"""
+    labels = domain.split('.')
+    if len(labels) >= 3 and '.'.join(labels[-2:]) in _MULTI_LABEL_SUFFIXES:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+def normalize_domain(domain: Optional[str]) -> str:
+    return (domain or '').strip().lower().rstrip('.')
+
+
+def is_aligned(domain: str, from_domain: str, mode: str) -> bool:
+    """domain が header_from と adkim/aspf の mode（s: 完全一致、それ以外: 組織ドメインが一致）で揃うか"""
+    if not domain or not from_domain:
+        return False
+    if domain == from_domain:
+        return True
+    return mode != 's' and organizational_domain(domain) == organizational_domain(from_domain)
+
+
+def _new_stats() -> List:
+    # [メール数, アライメントが取れた pass のメール数, {結果: メール数}]
+    return [0, 0, {}]
+
+
+def _add_stats(ours: List, messages: int, aligned: int, results: Dict[str, int]) -> None:
+    ours[0] += messages
+    ours[1] += aligned
+    for result, count in results.items():
+        ours[2][result] = ours[2].get(result, 0) + count
+
+
+class AuthBreakdown:
+    """DKIMセレクター別・SPFドメイン別の認証結果（結合・シリアライズ可能）
+
+    1通に複数の DKIM 署名があればそれぞれの署名に数えるため、DKIM のメール数の合計は
+    レコードのメール数の合計と一致しない。
+    """
+
+    def __init__(self):
+        # (header_from, 署名ドメイン, セレクター) -> 統計
+        self.dkim: Dict[Tuple[str, str, str], List] = {}
+        # SPF検証ドメイン -> 統計
+        self.spf: Dict[str, List] = {}
+
+    def __len__(self) -> int:
+        return len(self.dkim) + len(self.spf)
+
+    def add_record(self, count: int, header_from: Optional[str],
+                   dkim: Iterable[Tuple[Optional[str], Optional[str], Optional[str]]],
+                   spf: Iterable[Tuple[Optional[str], Optional[str]]],
+                   policy: Dict) -> None:
+        """レコード1件の auth_results を加算
+
+        dkim は (ドメイン, セレクター, 結果)、spf は (ドメイン, 結果) の並び。
+        header_from がなければポリシー公開ドメインとのアライメントを判定する。
+        メール数が0のレコードは数えない。
+        """
+        if count <= 0:
+            return
+        from_domain = normalize_domain(header_from) or normalize_domain(policy.get('domain'))
+        adkim, aspf = policy.get('adkim') or 'r', policy.get('aspf') or 'r'
+        for domain, selector, result in dkim:
+            domain, result = normalize_domain(domain), (result or '').lower() or 'none'
+            aligned = count if result == 'pass' and is_aligned(domain, from_domain, adkim) else 0
+            key = (from_domain, domain, (selector or '').strip())
+            stats = self.dkim.get(key)
+            if stats is None:
+                stats = self.dkim[key] = _new_stats()
+            _add_stats(stats, count, aligned, {result: count})
+        for domain, result in spf:
+            domain, result = normalize_domain(domain), (result or '').lower() or 'none'
+            aligned = count if result == 'pass' and is_aligned(domain, from_domain, aspf) else 0
+            stats = self.spf.get(domain)
+            if stats is None:
+                stats = self.spf[domain] = _new_stats()
+            _add_stats(stats, count, aligned, {result: count})
+
+    def merge(self, other: 'AuthBreakdown') -> 'AuthBreakdown':
+        for table, theirs in ((self.dkim, other.dkim), (self.spf, other.spf)):
+            for key, (messages, aligned, results) in theirs.items():
+                stats = table.get(key)
+                if stats is None:
+                    stats = table[key] = _new_stats()
+                _add_stats(stats, messages, aligned, results)
+        return self
+
+    def to_state(self) -> Dict:
+        return {
+            'dkim': [[*key, messages, aligned, sorted(results.items())]
+                     for key, (messages, aligned, results) in sorted(self.dkim.items())],
+            'spf': [[key, messages, aligned, sorted(results.items())]
+                    for key, (messages, aligned, results) in sorted(self.spf.items())],
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'AuthBreakdown':
+        breakdown = cls()
+        for header_from, domain, selector, messages, aligned, results in state['dkim']:
+            breakdown.dkim[(header_from, domain, selector)] = [messages, aligned, dict(results)]
+        for domain, messages, aligned, results in state['spf']:
+            breakdown.spf[domain] = [messages, aligned, dict(results)]
+        return breakdown
+
+    @staticmethod
+    def _entry(messages: int, aligned: int, results: Dict[str, int]) -> Dict:
+        return {'messages': messages, 'pass': results.get('pass', 0), 'aligned': aligned,
+                'results': dict(sorted(results.items()))}
+
+    def dkim_entries(self) -> List[Dict]:
+        """DKIM署名の統計（失敗の多い順、同数ならキー順）"""
+        items = sorted(self.dkim.items(),
+                       key=lambda x: (-(x[1][0] - x[1][2].get('pass', 0)), -x[1][0], x[0]))
+        return [dict(self._entry(*stats), header_from=header_from, domain=domain, selector=selector)
+                for (header_from, domain, selector), stats in items]
+
+    def spf_entries(self) -> List[Dict]:
+        """SPFドメインの統計（失敗の多い順、同数ならドメイン順）"""
+        items = sorted(self.spf.items(),
+                       key=lambda x: (-(x[1][0] - x[1][2].get('pass', 0)), -x[1][0], x[0]))
+        return [dict(self._entry(*stats), domain=domain) for domain, stats in items]
+
+    def to_dict(self) -> Dict:
+        """JSON出力用の辞書"""
+        return {'dkim': self.dkim_entries(), 'spf': self.spf_entries()}
+
+
+def _rate(part: int, whole: int) -> str:
+    return f"{part / whole * 100:5.1f}%" if whole else "    -"
+
+
+def _fit(text: str, width: int) -> str:
+    return text if len(text) <= width else text[:width - 3] + "..."
+
+
+def _failures(results: Dict[str, int]) -> str:
+    """pass 以外の結果（多い順）"""
+    failed = sorted(((count, result) for result, count in results.items() if result != 'pass'),
+                    key=lambda x: (-x[0], x[1]))
+    return ', '.join(f"{result} {count:,}" for count, result in failed)
+
+
+def format_breakdown(breakdown: AuthBreakdown, top: int = DEFAULT_TOP) -> List[str]:
+    """レポート用の行（DKIMセレクター別・SPFドメイン別、失敗の多い順に top 件）"""
+    lines = ["【DKIM署名（header_from / 署名ドメイン / セレクター）別】", "-" * 70]
+    entries = breakdown.dkim_entries()
+    if entries:
+        lines.append(f"{'header_from / d= / s=':<44} {'メール数':>4} {'pass':>6} {'整合':>4}  失敗")
+        for entry in entries[:top]:
+            label = f"{entry['header_from'] or '(不明)'} / {entry['domain'] or '(不明)'} / {entry['selector'] or '-'}"
+            lines.append(f"{_fit(label, 44):<44} {entry['messages']:>8,} "
+                         f"{_rate(entry['pass'], entry['messages'])} "
+                         f"{_rate(entry['aligned'], entry['messages'])}  {_failures(entry['results'])}".rstrip())
+        if len(entries) > top:
+            lines.append(f"... 他 {len(entries) - top} 件の署名")
+    else:
+        lines.append("DKIM署名の結果はありません")
+    lines.append("")
+
+    lines.extend(["【SPFドメイン別】", "-" * 70])
+    entries = breakdown.spf_entries()
+    if entries:
+        lines.append(f"{'ドメイン':<40} {'メール数':>4} {'pass':>6} {'整合':>4}  失敗")
+        for entry in entries[:top]:
+            lines.append(f"{_fit(entry['domain'] or '(不明)', 44):<44} {entry['messages']:>8,} "
+                         f"{_rate(entry['pass'], entry['messages'])} "
+                         f"{_rate(entry['aligned'], entry['messages'])}  {_failures(entry['results'])}".rstrip())
+        if len(entries) > top:
+            lines.append(f"... 他 {len(entries) - top} 件のドメイン")
+    else:
+        lines.append("SPFの結果はありません")
+    lines.append("※整合: header_from とアライメントが取れた pass の割合")
+    lines.append("")
+    return lines
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+"""
+送信元IP別・報告組織別のベースライン（EWMA）による異常検知
+レポートを1通取り込むたびに、キーごとの1レポートあたりのメール数と認証成功率
+（SPF・DKIM両方pass）の指数加重移動平均・分散を更新し、自身の履歴から大きく外れた
+観測（新しい送信元からの失敗、成功率の急落、メール数の急増）を警告する
+状態はファイルに保存して次回の実行に引き継ぐため、過去のレポートを毎回読み直さない
+"""
+
+import heapq
+import os
+import math
+from typing import Dict, List, Optional, Tuple
+
+BASELINE_FORMAT = 'dmarc-baseline'
+BASELINE_VERSION = 1
+
+# 平滑化係数（新しい観測の重み。0.2 でおおよそ直近10レポート分の履歴）
+DEFAULT_ALPHA = 0.2
+
+# 変化を判定するまでに必要なキーごとの観測数
+DEFAULT_MIN_HISTORY = 3
+
+# 判定対象とする1レポートあたりの最小メール数（静的ルールと同じ10通）
+# これより少ない観測は成功率の平均への重みも小さくする
+DEFAULT_MIN_MESSAGES = 10
+
+# 成功率の急落: 平均から max(MIN_RATE_DROP, SIGMA × 標準偏差) 以上下がったら警告
+MIN_RATE_DROP = 0.2
+SIGMA = 3.0
+
+# メール数の急増: 平均の SPIKE_FACTOR 倍以上、かつ平均 + SIGMA × 標準偏差を超えたら警告
+SPIKE_FACTOR = 5.0
+
+# 新しい送信元: 成功率がこれ未満なら警告（静的ルールと同じ50%）
+NEW_SOURCE_MAX_PASS_RATE = 0.5
+
+# 新しい送信元をまとめるプレフィックス長（IPv4 / IPv6）
+BLOCK_PREFIX = {4: 24, 6: 48}
+
+# 最新のレポートからこの日数より長く現れないキーと取り込み済みレポートIDは保存時に削除
+RETENTION_DAYS = 90
+
+# 保持する警告の件数（種別ごとの件数はすべて数える）
+MAX_ALERTS = 1000
+
+# 期間順に並べ直すために取り込みを待たせるレポートの数（これを超えたら最も古いものから取り込む）
+DEFAULT_REORDER_WINDOW = 256
+
+# キーごとの状態の並び（ファイルにも配列で保存する）
+FIELDS = ('n', 'volume', 'volume_var', 'rate', 'rate_var', 'spf', 'dkim', 'last_seen')
+N, VOLUME, VOLUME_VAR, RATE, RATE_VAR, SPF, DKIM, LAST_SEEN = range(len(FIELDS))
+
+ALERT_TYPES = ('new_source', 'pass_rate_drop', 'volume_spike')
+
+
+def ewm_update(mean: float, var: float, x: float, alpha: float) -> Tuple[float, float]:
+    """指数加重の平均・分散を1観測分更新"""
+    diff = x - mean
+    increment = alpha * diff
+    return mean + increment, (1 - alpha) * (var + diff * increment)
+
+
+def address_block(ip: str) -> str:
+    """送信元IPを含むブロック（IPv4 は /24、IPv6 は /48。不正な値はそのまま）"""
+    import ipaddress
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+    network = ipaddress.ip_network(f"{address}/{BLOCK_PREFIX[address.version]}", strict=False)
+    return str(network)
+
+
+class Baseline:
+    """送信元IP別・報告組織別のベースラインと、取り込み中に検知した警告
+
+    観測の単位はレポート1通（その中の同じ送信元IPのレコードは合算）。同じ
+    (報告組織, レポートID) は一度しか取り込まないため、同じファイルを再度読んでも
+    ベースラインは変わらない。add() したレポートは reorder_window 件まで待たせ、
+    期間の古いものから順に取り込む（flush() で残りを取り込む）。入力がおおよそ期間順
+    （order_key の順に並べたファイルなど）なら、結果はファイルの指定順によらない。
+    """
+
+    def __init__(self, path: Optional[str] = None, alpha: float = DEFAULT_ALPHA,
+                 min_history: int = DEFAULT_MIN_HISTORY,
+                 min_messages: int = DEFAULT_MIN_MESSAGES,
+                 reorder_window: int = DEFAULT_REORDER_WINDOW):
+        self.path = path
+        self.alpha = alpha
+        self.min_history = min_history
+        self.min_messages = min_messages
+        self.reorder_window = reorder_window
+        self.sources: Dict[str, List] = {}
+        self.orgs: Dict[str, List] = {}
+        # "報告組織\tレポートID" -> レポート期間の終了時刻
+        self.seen: Dict[str, Optional[int]] = {}
+        self.total_reports = 0
+        self.latest: Optional[int] = None
+        if path and os.path.exists(path):
+            self._load(path)
+        # 前回までの履歴があるか（なければ今回の実行でベースラインを作る）
+        self.history_reports = self.total_reports
+        self.ingested = 0
+        self.skipped = 0
+        self.alerts: List[Dict] = []
+        self.alert_counts: Dict[str, int] = {kind: 0 for kind in ALERT_TYPES}
+        # 取り込み待ちのレポートのヒープ: (並び順のキー, 到着順, レポート情報, 送信元IP別の値, 合計)
+        self._pending: List[Tuple] = []
+        self._arrivals = 0
+
+    def _load(self, path: str) -> None:
+        import gzip
+        import json
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            payload = json.load(f)
+        if payload.get('format') != BASELINE_FORMAT:
+            raise ValueError("DMARCベースラインのファイルではありません")
+        if payload.get('version') != BASELINE_VERSION:
+            raise ValueError(f"未対応のベースラインバージョン: {payload.get('version')}")
+        self.alpha = payload['alpha']
+        self.sources = payload['sources']
+        self.orgs = payload['orgs']
+        self.seen = payload['seen']
+        self.total_reports = payload['total_reports']
+        self.latest = payload['latest']
+
+    def save(self, path: Optional[str] = None) -> None:
+        """古いキーを削除して保存（一時ファイルからの置き換え）"""
+        import gzip
+        import json
+        path = path or self.path
+        if self.latest is not None:
+            cutoff = self.latest - RETENTION_DAYS * 86400
+            for table in (self.sources, self.orgs):
+                stale = [key for key, entry in table.items()
+                         if entry[LAST_SEEN] is not None and entry[LAST_SEEN] < cutoff]
+                for key in stale:
+                    del table[key]
+            self.seen = {key: when for key, when in self.seen.items()
+                         if when is None or when >= cutoff}
+        payload = {
+            'format': BASELINE_FORMAT,
+            'version': BASELINE_VERSION,
+            'alpha': self.alpha,
+            'total_reports': self.total_reports,
+            'latest': self.latest,
+            'sources': self.sources,
+            'orgs': self.orgs,
+            'seen': self.seen,
+        }
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+            json.dump(payload, f, separators=(',', ':'), ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def order_key(report_info: Dict) -> Tuple:
+        """取り込む順序（期間の終了時刻・報告組織・レポートID）
+
+        read_report_header のヘッダーにも使え、ファイルを事前に並べ替えられる。
+        """
+        when = report_info.get('date_end') or report_info.get('date_begin')
+        return (when or 0, report_info.get('org_name') or '', report_info.get('report_id') or '')
+
+    def add(self, report_info: Dict, rows: List[Tuple]) -> List[Dict]:
+        """parse_report の結果1通分を取り込み待ちに加え、待ちが reorder_window 件を超えたら
+        最も古いレポートを取り込む（検知した警告を返す）
+
+        待たせる間は送信元IP別に合算した値とレポートの識別情報だけを保持する。
+        """
+        info = {field: report_info.get(field)
+                for field in ('org_name', 'report_id', 'date_begin', 'date_end')}
+        heapq.heappush(self._pending, (self.order_key(info), self._arrivals, info,
+                                       *self._summarize(rows)))
+        self._arrivals += 1
+        if len(self._pending) > self.reorder_window:
+            return self._observe(*heapq.heappop(self._pending)[2:])
+        return []
+
+    def flush(self) -> List[Dict]:
+        """取り込み待ちのレポートを期間の古い順にすべて取り込み、検知した警告を返す"""
+        alerts = []
+        while self._pending:
+            alerts.extend(self._observe(*heapq.heappop(self._pending)[2:]))
+        return alerts
+
+    @staticmethod
+    def _summarize(rows: List[Tuple]) -> Tuple[Dict[str, List[int]], List[int]]:
+        """送信元IP別と全体の [メール数, 両方pass, SPF pass, DKIM pass]"""
+        per_source: Dict[str, List[int]] = {}
+        totals = [0, 0, 0, 0]
+        for source_ip, count, disposition, dkim, spf in rows:
+            values = per_source.get(source_ip)
+            if values is None:
+                values = per_source[source_ip] = [0, 0, 0, 0]
+            for target in (values, totals):
+                target[0] += count
+                if spf == 'pass':
+                    target[2] += count
+                    if dkim == 'pass':
+                        target[1] += count
+                if dkim == 'pass':
+                    target[3] += count
+        return per_source, totals
+
+    def _observe(self, report_info: Dict, per_source: Dict[str, List[int]],
+                 totals: List[int]) -> List[Dict]:
+        org = report_info.get('org_name') or ''
+        report_id = report_info.get('report_id')
+        when = report_info.get('date_end') or report_info.get('date_begin')
+        if report_id:
+            report_key = f"{org}\t{report_id}"
+            if report_key in self.seen:
+                self.skipped += 1
+                return []
+            self.seen[report_key] = when
+
+        context = {'org_name': org, 'report_id': report_id, 'date': when}
+        alerts = []
+        for source_ip, values in per_source.items():
+            alerts.extend(self._observe_key('source', self.sources, source_ip or '', values,
+                                            when, context))
+        alerts.extend(self._observe_key('org', self.orgs, org, totals, when, context))
+
+        self.total_reports += 1
+        self.ingested += 1
+        if when is not None and (self.latest is None or when > self.latest):
+            self.latest = when
+        for alert in alerts:
+            self.alert_counts[alert['type']] += 1
+            if len(self.alerts) < MAX_ALERTS:
+                self.alerts.append(alert)
+        return alerts
+
+    def _observe_key(self, scope: str, table: Dict[str, List], key: str, values: List[int],
+                     when: Optional[int], context: Dict) -> List[Dict]:
+        messages, passed, spf_pass, dkim_pass = values
+        if messages <= 0:
+            return []
+        rate = passed / messages
+        spf_rate = spf_pass / messages
+        dkim_rate = dkim_pass / messages
+        entry = table.get(key)
+        alerts = self._check(scope, key, entry, messages, rate, spf_rate, dkim_rate)
+        for alert in alerts:
+            alert.update(context)
+
+        if entry is None:
+            table[key] = [1, float(messages), 0.0, rate, 0.0, spf_rate, dkim_rate, when]
+            return alerts
+        # メール数の少ない観測は成功率への重みを小さくする（1通の失敗で平均が動かないように）
+        rate_alpha = self.alpha * min(1.0, messages / self.min_messages)
+        entry[N] += 1
+        entry[VOLUME], entry[VOLUME_VAR] = ewm_update(entry[VOLUME], entry[VOLUME_VAR],
+                                                      messages, self.alpha)
+        entry[RATE], entry[RATE_VAR] = ewm_update(entry[RATE], entry[RATE_VAR], rate, rate_alpha)
+        entry[SPF] += rate_alpha * (spf_rate - entry[SPF])
+        entry[DKIM] += rate_alpha * (dkim_rate - entry[DKIM])
+        if when is not None and (entry[LAST_SEEN] is None or when > entry[LAST_SEEN]):
+            entry[LAST_SEEN] = when
+        return alerts
+
+    def _check(self, scope: str, key: str, entry: Optional[List], messages: int,
+               rate: float, spf_rate: float, dkim_rate: float) -> List[Dict]:
+        """更新前のベースラインと比べて警告を判定"""
+        observed = {'scope': scope, 'key': key, 'messages': messages, 'pass_rate': rate,
+                    'spf_rate': spf_rate, 'dkim_rate': dkim_rate}
+        if entry is None:
+            # 報告組織が増えるのは異常ではないので、新しいキーは送信元だけを対象にする
+            if (scope == 'source' and self.history_reports >= self.min_history
+                    and messages >= self.min_messages and rate < NEW_SOURCE_MAX_PASS_RATE):
+                return [dict(observed, type='new_source', block=address_block(key))]
+            return []
+        if entry[N] < self.min_history or messages < self.min_messages:
+            return []
+
+        baseline = {'observations': entry[N], 'volume': entry[VOLUME], 'pass_rate': entry[RATE],
+                    'spf_rate': entry[SPF], 'dkim_rate': entry[DKIM]}
+        alerts = []
+        drop = entry[RATE] - rate
+        if drop >= max(MIN_RATE_DROP, SIGMA * math.sqrt(entry[RATE_VAR])):
+            alerts.append(dict(observed, type='pass_rate_drop', baseline=baseline))
+        if (messages >= SPIKE_FACTOR * entry[VOLUME]
+                and messages > entry[VOLUME] + SIGMA * math.sqrt(entry[VOLUME_VAR])):
+            alerts.append(dict(observed, type='volume_spike', baseline=baseline))
+        return alerts
+
+    def summary(self, top: int = 10) -> Dict:
+        """今回の実行で検知した警告のまとめ（新しい送信元はブロック別）"""
+        blocks: Dict[str, Dict] = {}
+        for alert in self.alerts:
+            if alert['type'] != 'new_source':
+                continue
+            block = blocks.setdefault(alert['block'], {'block': alert['block'], 'ips': [],
+                                                       'messages': 0, 'pass': 0.0})
+            if alert['key'] not in block['ips']:
+                block['ips'].append(alert['key'])
+            block['messages'] += alert['messages']
+            block['pass'] += alert['pass_rate'] * alert['messages']
+        new_blocks = []
+        for block in sorted(blocks.values(), key=lambda b: (-b['messages'], b['block']))[:top]:
+            new_blocks.append({'block': block['block'], 'ips': sorted(block['ips']),
+                               'messages': block['messages'],
+                               'pass_rate': block['pass'] / block['messages']})
+
+        def ranked(kind: str, score) -> List[Dict]:
+            alerts = [a for a in self.alerts if a['type'] == kind]
+            return sorted(alerts, key=lambda a: (-score(a), a['scope'], a['key']))[:top]
+
+        return {
+            'history_reports': self.history_reports,
+            'ingested_reports': self.ingested,
+            'skipped_reports': self.skipped,
+            'tracked': {'sources': len(self.sources), 'orgs': len(self.orgs)},
+            'counts': dict(self.alert_counts),
+            'new_blocks': new_blocks,
+            'pass_rate_drops': ranked('pass_rate_drop', lambda a: (
+                (a['baseline']['pass_rate'] - a['pass_rate']) * a['messages'])),
+            'volume_spikes': ranked('volume_spike', lambda a: a['messages'] - a['baseline']['volume']),
+        }
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+"""
+DMARCレコードの列指向分析エンジン（NumPy、任意）
+解析済みレコードを列（送信元IPの文字列ID・メール数・SPF/DKIM結果コード・処理内容コード）として保持し、
+送信元別集計・認証率・分位点・問題のある送信元の抽出・任意の内訳をベクトル演算で求める
+レコードの配置はバイナリキャッシュ（dmarc_rowcache）と同じ固定長形式のため、
+キャッシュからはパースなしで列に変換できる
+"""
+
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple
+
+from dmarc_rowcache import NO_STRING, ROW, _RowEncoder
+
+if TYPE_CHECKING:
+    from dmarc_aggregate import SummaryAggregate
+    from dmarc_rowcache import RowCache
+
+# SPF失敗の分類（送信元IP, SPF結果 -> 分類 または None）
+SPFClassifier = Callable[[str, str], Optional[str]]
+
+# 内訳（breakdown）に指定できる列
+BREAKDOWN_FIELDS = ('spf', 'dkim', 'disposition')
+
+
+def require_numpy():
+    """NumPy を読み込む（未インストールなら RuntimeError）"""
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("列指向エンジンには NumPy が必要です (pip install numpy)")
+    return numpy
+
+
+def row_dtype():
+    """ROW 構造体と同じ配置の構造化 dtype"""
+    np = require_numpy()
+    dtype = np.dtype([
+        ('ip', '<u4'), ('count', '<u8'), ('spf', 'u1'), ('dkim', 'u1'),
+        ('disposition', 'u1'), ('reserved', 'u1'), ('report', '<u4'), ('hostname', '<u4'),
+    ])
+    assert dtype.itemsize == ROW.size
+    return dtype
+
+
+class ColumnBuilder(_RowEncoder):
+    """レコードを追加しながら列データを組み立てる（RowCacheWriter と同じインターフェース）"""
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+        self.row_count = 0
+        self.report_count = 0
+
+    def add_report(self, info: Dict) -> None:
+        self.report_count += 1
+
+    def add_row(self, source_ip: str, count: int, spf: Optional[str], dkim: Optional[str],
+                disposition: Optional[str], hostname: Optional[str]) -> None:
+        self._buffer += self.pack_row(source_ip, count, spf, dkim, disposition,
+                                      self.report_count, hostname)
+        self.row_count += 1
+
+    def build(self) -> 'ColumnarRows':
+        np = require_numpy()
+        rows = np.frombuffer(bytes(self._buffer), dtype=row_dtype())
+        return ColumnarRows(rows, self.strings.values, self.results.values,
+                            self.dispositions.values)
+
+
+class ColumnarRows:
+    """列指向のレコード集合
+
+    rows は row_dtype() の構造化配列。送信元IP・ホスト名の文字列ID、結果コード・処理内容コードは
+    results・dispositions・strings の表を引いて文字列に戻す。
+    """
+
+    def __init__(self, rows, strings: List[str], results: List[str], dispositions: List[str]):
+        self.np = require_numpy()
+        self.rows = rows
+        self.strings = strings
+        self.results = results
+        self.dispositions = dispositions
+        self._sources = None
+        self._ip_group_cache = None
+        self._hostname_cache = None
+        self._failure_cache = None
+
+    @classmethod
+    def from_row_cache(cls, cache: 'RowCache') -> 'ColumnarRows':
+        """バイナリキャッシュのレコード列を列データとして読み込む（パースなし）"""
+        np = require_numpy()
+        view = cache.rows_view()
+        try:
+            # キャッシュを閉じられるようにコピーして保持する
+            rows = np.frombuffer(view, dtype=row_dtype()).copy()
+        finally:
+            view.release()
+        return cls(rows, cache.meta['strings'], cache.meta['results'],
+                   cache.meta['dispositions'])
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _code(self, table: List[str], value: str) -> int:
+        """表にない値は、どのコードにも一致しない -1"""
+        return table.index(value) if value in table else -1
+
+    def _pass_masks(self) -> Tuple:
+        spf_pass = self.rows['spf'] == self._code(self.results, 'pass')
+        dkim_pass = self.rows['dkim'] == self._code(self.results, 'pass')
+        return spf_pass, dkim_pass
+
+    def totals(self) -> Dict:
+        """全体のメール数と認証成功数（SPF・DKIM両方pass）"""
+        counts = self.rows['count']
+        spf_pass, dkim_pass = self._pass_masks()
+        total = int(counts.sum())
+        passed = int(counts[spf_pass & dkim_pass].sum())
+        return {'total': total, 'pass': passed, 'fail': total - passed,
+                'pass_rate': passed / total if total else 0.0,
+                'rows': len(self.rows), 'sources': self.source_count()}
+
+    def _ip_groups(self) -> Tuple:
+        """IPごとのグループ番号（各グループ先頭レコードの添字, レコードごとのグループ番号）
+
+        送信元IPは文字列IDなので、IDの一意化だけでグループが求まる。
+        """
+        if self._ip_group_cache is not None:
+            return self._ip_group_cache
+        np = self.np
+        # return_index は各IDが最初に現れるレコードの添字
+        _, first, inverse = np.unique(self.rows['ip'], return_index=True, return_inverse=True)
+        self._ip_group_cache = (first, inverse.reshape(-1).astype(np.int64))
+        return self._ip_group_cache
+
+    def _group_sources(self) -> Dict:
+        """送信元IP別の集計列（文字列IDの順、文字列には戻さない）"""
+        if self._sources is not None:
+            return self._sources
+        np = self.np
+        counts = self.rows['count'].astype(np.int64)
+        spf_pass, dkim_pass = self._pass_masks()
+
+        first, inverse = self._ip_groups()
+        n = len(first)
+
+        def total(mask=None):
+            weights = counts if mask is None else np.where(mask, counts, 0)
+            return np.bincount(inverse, weights=weights, minlength=n).astype(np.int64)
+
+        self._sources = {
+            'first': first,
+            'count': total(),
+            'spf_pass': total(spf_pass),
+            'dkim_pass': total(dkim_pass),
+            'both_pass': total(spf_pass & dkim_pass),
+        }
+        return self._sources
+
+    def source_count(self) -> int:
+        return len(self._group_sources()['first'])
+
+    def _source_hostnames(self):
+        """IPごとのホスト名の文字列ID（dmarc_aggregate._pick_hostname と同じ選択）
+
+        逆引きできたホスト名（IPと異なるもの）のうち文字列順で最小のもの、なければIP、
+        ホスト名のレコードがなければ NO_STRING。IPと同じ文字列は同じIDに変換されている。
+        """
+        if self._hostname_cache is not None:
+            return self._hostname_cache
+        np = self.np
+        first, inverse = self._ip_groups()
+        ips = self.rows['ip'].astype(np.int64)
+        hostnames = self.rows['hostname'].astype(np.int64)
+        result = np.full(len(first), NO_STRING, dtype=np.int64)
+
+        known = hostnames != NO_STRING
+        groups = np.unique(inverse[known])
+        result[groups] = ips[first[groups]]
+
+        resolved = known & (hostnames != ips)
+        if resolved.any():
+            ids = hostnames[resolved]
+            groups = inverse[resolved]
+            # 文字列IDを文字列順の順位に置き換え、グループ内で順位が最小のものを選ぶ
+            used = np.unique(ids)
+            rank = np.zeros(len(self.strings), dtype=np.int64)
+            rank[sorted(used.tolist(), key=self.strings.__getitem__)] = np.arange(len(used))
+            order = np.lexsort((rank[ids], groups))
+            groups, ids = groups[order], ids[order]
+            heads = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+            result[groups[heads]] = ids[heads]
+        self._hostname_cache = result
+        return result
+
+    def _source_items(self, indices, limit: Optional[int]) -> List[Tuple[str, Dict]]:
+        """indices の送信元をメール数の多い順（同数はIP文字列順）に最大 limit 件
+
+        統計の辞書は上位 limit 件に入りうる送信元（limit 位と同数のものを含む）だけ作る。
+        """
+        np = self.np
+        sources = self._group_sources()
+        counts = sources['count'][indices]
+        if limit is not None and len(indices) > limit:
+            kth = np.partition(counts, len(counts) - limit)[len(counts) - limit]
+            indices = indices[counts >= kth]
+
+        hostnames = self._source_hostnames()
+        items = []
+        for i in indices:
+            ip = self.strings[self.rows['ip'][sources['first'][i]]]
+            hostname_id = hostnames[i]
+            items.append((ip, {
+                'count': int(sources['count'][i]),
+                'spf_pass': int(sources['spf_pass'][i]),
+                'dkim_pass': int(sources['dkim_pass'][i]),
+                'both_pass': int(sources['both_pass'][i]),
+                'hostname': None if hostname_id == NO_STRING else self.strings[hostname_id],
+            }))
+        items.sort(key=lambda x: (-x[1]['count'], x[0]))
+        return items if limit is None else items[:limit]
+
+    def top_sources(self, limit: Optional[int] = None) -> List[Tuple[str, Dict]]:
+        """SummaryAggregate.sources と同じ形の (ip, 統計) をメール数の多い順に"""
+        return self._source_items(self.np.arange(self.source_count()), limit)
+
+    def problem_sources(self, min_count: int = 10, max_pass_rate: float = 0.5,
+                        limit: Optional[int] = None) -> List[Tuple[str, Dict]]:
+        """両方passの割合が max_pass_rate 未満で min_count 通以上の送信元"""
+        np = self.np
+        sources = self._group_sources()
+        count = sources['count']
+        mask = (count >= min_count) & (sources['both_pass'] < max_pass_rate * count)
+        return self._source_items(np.flatnonzero(mask), limit)
+
+    def _failure_groups(self) -> Tuple:
+        """SPF・DKIMの両方がpassでないレコードの (IPグループ, spf, dkim, disposition) 別メール数"""
+        if self._failure_cache is not None:
+            return self._failure_cache
+        np = self.np
+        spf_pass, dkim_pass = self._pass_masks()
+        failed = np.flatnonzero(~(spf_pass & dkim_pass))
+        if len(failed) == 0:
+            self._failure_cache = (np.zeros((0, 4), dtype=np.int64), np.zeros(0, dtype=np.int64))
+            return self._failure_cache
+        _, inverse = self._ip_groups()
+        rows = self.rows[failed]
+        keys = np.stack([inverse[failed], rows['spf'].astype(np.int64), rows['dkim'].astype(np.int64),
+                         rows['disposition'].astype(np.int64)], axis=1)
+        groups, group_ids = np.unique(keys, axis=0, return_inverse=True)
+        messages = np.bincount(group_ids.reshape(-1), weights=rows['count'].astype(np.int64),
+                               minlength=len(groups)).astype(np.int64)
+        self._failure_cache = (groups, messages)
+        return self._failure_cache
+
+    def failure_counts(self, classify: Optional[SPFClassifier] = None) -> Dict[Tuple, int]:
+        """SummaryAggregate.failure_counts と同じ (source_ip, spf, dkim, disposition, spf_class) -> メール数
+
+        SPF失敗の分類はレコードごとではなく組み合わせごとに1回だけ求める。
+        """
+        first, _ = self._ip_groups()
+        groups, messages = self._failure_groups()
+        result = {}
+        for (source, spf, dkim, disposition), count in zip(groups.tolist(), messages.tolist()):
+            ip = self.strings[self.rows['ip'][first[source]]]
+            spf = self.results[spf]
+            spf_class = classify(ip, spf) if classify is not None else None
+            result[(ip, spf, self.results[dkim], self.dispositions[disposition], spf_class)] = count
+        return result
+
+    def failures(self, classify: Optional[SPFClassifier] = None) -> List[Dict]:
+        """SummaryAggregate.failures と同じ形の失敗の詳細"""
+        from dmarc_aggregate import failure_details
+        first, _ = self._ip_groups()
+        hostname_ids = self._source_hostnames()
+        hostnames = {}
+        for source in self.np.unique(self._failure_groups()[0][:, 0]).tolist():
+            hostname_id = hostname_ids[source]
+            hostnames[self.strings[self.rows['ip'][first[source]]]] = (
+                None if hostname_id == NO_STRING else self.strings[hostname_id])
+        return failure_details(self.failure_counts(classify), hostnames.get)
+
+    def fill_summary(self, summary: 'SummaryAggregate',
+                     classify: Optional[SPFClassifier] = None) -> None:
+        """全体・送信元別・失敗の集計を summary に設定（レポート情報はそのまま）"""
+        totals = self.totals()
+        summary.total_messages = totals['total']
+        summary.pass_count = totals['pass']
+        summary.fail_count = totals['fail']
+        summary.sources = dict(self.top_sources())
+        summary.failure_counts = self.failure_counts(classify)
+
+    def percentiles(self, q: Sequence[float] = (50, 90, 99)) -> Dict[float, float]:
+        """送信元あたりのメール数の分位点"""
+        np = self.np
+        count = self._group_sources()['count']
+        if len(count) == 0:
+            return {p: 0.0 for p in q}
+        return dict(zip(q, (float(v) for v in np.percentile(count, q))))
+
+    def breakdown(self, fields: Sequence[str]) -> List[Dict]:
+        """指定した列（spf・dkim・disposition）の組み合わせ別のメール数・レコード数・送信元数
+
+        メール数の多い順（同数はラベル順）に返す。
+        """
+        np = self.np
+        for field in fields:
+            if field not in BREAKDOWN_FIELDS:
+                raise ValueError(f"内訳に指定できない列です: {field}")
+        if len(self.rows) == 0:
+            return []
+        # 1バイトのコード列を1つの整数キーにまとめて一次元で集約
+        keys = np.zeros(len(self.rows), dtype=np.int64)
+        for field in fields:
+            keys = (keys << 8) | self.rows[field]
+        groups, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        n = len(groups)
+        messages = np.bincount(inverse, weights=self.rows['count'].astype(np.int64),
+                               minlength=n).astype(np.int64)
+        rows = np.bincount(inverse, minlength=n)
+        # グループ内の一意なIP数
+        ip_first, ip_ids = self._ip_groups()
+        pairs = np.unique(inverse * len(ip_first) + ip_ids)
+        sources = np.bincount(pairs // len(ip_first), minlength=n)
+
+        tables = {'spf': self.results, 'dkim': self.results, 'disposition': self.dispositions}
+        result = []
+        for g in range(n):
+            codes = [(int(groups[g]) >> (8 * i)) & 0xFF for i in reversed(range(len(fields)))]
+            labels = tuple(tables[f][code] for f, code in zip(fields, codes))
+            result.append({'labels': labels, 'messages': int(messages[g]),
+                           'rows': int(rows[g]), 'sources': int(sources[g])})
+        result.sort(key=lambda r: (-r['messages'], r['labels']))
+        return result
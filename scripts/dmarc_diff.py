@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+"""
+2つの期間・2つのレポート群の比較（diff）
+送信元IP別・報告組織別にメール数と認証成功数を集計し、キー順に突き合わせて
+メール数と認証成功率の変化を影響の大きい順に並べる
+集計はキー数が上限に達するたびにキー順のランとして一時ファイルに書き出し
+（dmarc_spill.ExternalSorter）、突き合わせは両側のランを順に読みながら行うため、
+数百万キーでも両方の全集計をメモリ上に持たない
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dmarc_spill import ExternalSorter
+
+# 1キーあたりの集計値の並び
+STATS_FIELDS = ('messages', 'pass', 'spf_pass', 'dkim_pass')
+
+# メモリ上に保持するキー数の上限（超えたらランとして書き出す）
+DEFAULT_MAX_KEYS = 200000
+
+# 各一覧に表示する件数
+DEFAULT_TOP = 20
+
+SIDES = ('before', 'after')
+
+
+class KeyedCounts:
+    """キーごとのメール数・認証成功数（キー数が上限に達したらランとして退避）"""
+
+    def __init__(self, directory: str, name: str, max_keys: int = DEFAULT_MAX_KEYS):
+        self.counts: Dict[str, List[int]] = {}
+        self.sorter = ExternalSorter(directory, name, key=lambda row: row[0])
+        self.max_keys = max_keys
+
+    def add(self, key: str, values: Iterable[int]) -> None:
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * len(STATS_FIELDS)
+        for i, value in enumerate(values):
+            counts[i] += value
+        if len(self.counts) >= self.max_keys:
+            self.flush()
+
+    def flush(self) -> None:
+        self.sorter.extend([key, *counts] for key, counts in self.counts.items())
+        self.sorter.flush()
+        self.counts = {}
+
+    def __iter__(self) -> Iterator[Tuple[str, List[int]]]:
+        """キー順に（同じキーのランを合算）"""
+        # 残りはランにせずソート用バッファに入れ、ランとまとめて読む
+        self.sorter.extend([key, *counts] for key, counts in self.counts.items())
+        self.counts = {}
+        current = None
+        total = None
+        for key, *values in self.sorter:
+            if key != current:
+                if total is not None:
+                    yield current, total
+                current, total = key, [0] * len(STATS_FIELDS)
+            for i, value in enumerate(values):
+                total[i] += value
+        if total is not None:
+            yield current, total
+
+
+class DiffSide:
+    """比較の片側（期間またはレポート群）の集計"""
+
+    def __init__(self, directory: str, label: str, max_keys: int = DEFAULT_MAX_KEYS):
+        self.label = label
+        self.sources = KeyedCounts(directory, f"{label}-sources", max_keys)
+        self.orgs = KeyedCounts(directory, f"{label}-orgs", max_keys)
+        self.totals = [0] * len(STATS_FIELDS)
+        self.reports = 0
+        self.date_range = {'begin': None, 'end': None}
+
+    def add_report(self, report_info: Dict, rows: List[Tuple]) -> None:
+        """parse_report の結果を加算"""
+        self.reports += 1
+        begin, end = report_info.get('date_begin'), report_info.get('date_end')
+        if begin is not None and (self.date_range['begin'] is None or begin < self.date_range['begin']):
+            self.date_range['begin'] = begin
+        if end is not None and (self.date_range['end'] is None or end > self.date_range['end']):
+            self.date_range['end'] = end
+
+        org_totals = [0] * len(STATS_FIELDS)
+        for source_ip, count, disposition, dkim, spf in rows:
+            values = (
+                count,
+                count if spf == 'pass' and dkim == 'pass' else 0,
+                count if spf == 'pass' else 0,
+                count if dkim == 'pass' else 0,
+            )
+            self.sources.add(source_ip or '', values)
+            for i, value in enumerate(values):
+                org_totals[i] += value
+        self.orgs.add(report_info.get('org_name') or '', org_totals)
+        for i, value in enumerate(org_totals):
+            self.totals[i] += value
+
+
+def merge_join(before: Iterable[Tuple[str, List[int]]],
+               after: Iterable[Tuple[str, List[int]]]) -> Iterator[Tuple[str, Optional[List[int]], Optional[List[int]]]]:
+    """キー順の2つの列を突き合わせ、(キー, 前の値, 後の値) を返す（片側にしかなければ None）"""
+    before, after = iter(before), iter(after)
+    b = next(before, None)
+    a = next(after, None)
+    while b is not None or a is not None:
+        if a is None or (b is not None and b[0] < a[0]):
+            yield b[0], b[1], None
+            b = next(before, None)
+        elif b is None or a[0] < b[0]:
+            yield a[0], None, a[1]
+            a = next(after, None)
+        else:
+            yield b[0], b[1], a[1]
+            b = next(before, None)
+            a = next(after, None)
+
+
+def stats_dict(values: Optional[List[int]]) -> Optional[Dict]:
+    """集計値をメール数と各認証率（メール数0なら None）の辞書に"""
+    if values is None:
+        return None
+    messages, passed, spf_pass, dkim_pass = values
+
+    def rate(n: int) -> Optional[float]:
+        return n / messages if messages else None
+
+    return {'messages': messages, 'pass_rate': rate(passed),
+            'spf_rate': rate(spf_pass), 'dkim_rate': rate(dkim_pass)}
+
+
+def rate_delta(after: Optional[float], before: Optional[float]) -> Optional[float]:
+    """率の差（どちらかが不明なら None）"""
+    return None if after is None or before is None else after - before
+
+
+class _TopN:
+    """スコアの大きい順に最大 limit 件を保持（同点は先に追加したもの＝キー順で前のもの）"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.heap: List[Tuple] = []
+        self.seq = 0
+
+    def add(self, score: float, item: Dict) -> None:
+        import heapq
+        entry = (score, -self.seq, item)
+        self.seq += 1
+        if len(self.heap) < self.limit:
+            heapq.heappush(self.heap, entry)
+        elif self.heap and entry[:2] > self.heap[0][:2]:
+            heapq.heapreplace(self.heap, entry)
+
+    def items(self) -> List[Dict]:
+        return [entry[2] for entry in sorted(self.heap, key=lambda e: e[:2], reverse=True)]
+
+
+class KeyDiff:
+    """キー単位の変化を集計し、悪化・改善・新規・消滅の上位を保持
+
+    影響（impact）は両方にあるキーについて、後の期間のメールを前の期間の成功率で
+    送った場合との認証成功数の差（= 成功率の差 × 後のメール数）。正が改善、負が悪化。
+    新規・消滅のキーはメール数の多い順。
+    """
+
+    def __init__(self, top: int = DEFAULT_TOP):
+        self.worse = _TopN(top)
+        self.better = _TopN(top)
+        self.new = _TopN(top)
+        self.gone = _TopN(top)
+        self.common = 0
+        self.new_count = 0
+        self.gone_count = 0
+
+    def add(self, key: str, before: Optional[List[int]], after: Optional[List[int]]) -> None:
+        b, a = stats_dict(before), stats_dict(after)
+        entry = {'key': key, 'before': b, 'after': a,
+                 'volume_delta': (a['messages'] if a else 0) - (b['messages'] if b else 0)}
+        if b is None:
+            self.new_count += 1
+            self.new.add(a['messages'], entry)
+            return
+        if a is None:
+            self.gone_count += 1
+            self.gone.add(b['messages'], entry)
+            return
+        self.common += 1
+        for field in ('pass_rate', 'spf_rate', 'dkim_rate'):
+            entry[f"{field}_delta"] = rate_delta(a[field], b[field])
+        pass_delta = entry['pass_rate_delta']
+        impact = pass_delta * a['messages'] if pass_delta is not None else 0.0
+        entry['impact'] = impact
+        if impact < 0:
+            self.worse.add(-impact, entry)
+        elif impact > 0:
+            self.better.add(impact, entry)
+
+    def to_dict(self) -> Dict:
+        return {
+            'common': self.common,
+            'new_count': self.new_count,
+            'gone_count': self.gone_count,
+            'worse': self.worse.items(),
+            'better': self.better.items(),
+            'new': self.new.items(),
+            'gone': self.gone.items(),
+        }
+
+
+def compare(before: DiffSide, after: DiffSide, top: int = DEFAULT_TOP) -> Dict:
+    """2つの集計を送信元IP別・報告組織別に突き合わせた結果"""
+    result = {
+        'totals': {side.label: dict(stats_dict(side.totals), reports=side.reports,
+                                    date_range=side.date_range)
+                   for side in (before, after)},
+    }
+    for dimension in ('sources', 'orgs'):
+        diff = KeyDiff(top)
+        for key, b, a in merge_join(getattr(before, dimension), getattr(after, dimension)):
+            diff.add(key, b, a)
+        result[dimension] = diff.to_dict()
+    return result
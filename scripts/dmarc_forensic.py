@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+"""
+DMARCフォレンジックレポート（ruf）の逐次取り込み
+message/feedback-report 形式（ARF）のメールをディレクトリまたは mbox から1通ずつ読み、
+ARFフィールドと元メールのヘッダーだけを取り出す
+集計は送信元IP・失敗種別ごとに行い、送信元IPの数が上限を超えたら件数の少ないものから
+切り捨てるため、大量のレポートが届いてもメモリ使用量は一定に保たれる
+"""
+
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# 1通あたりに読み込む最大バイト数（元メール本文が添付されていても先頭のヘッダーで足りる）
+DEFAULT_MAX_MESSAGE_BYTES = 256 * 1024
+
+# 集計する送信元IPの上限
+DEFAULT_MAX_SOURCES = 10000
+
+# 失敗種別ごとに保持する例（From ヘッダー）の数
+SAMPLES_PER_TYPE = 3
+
+# 取り出すARFフィールド（RFC 5965 / RFC 6591）
+ARF_FIELDS = {
+    'feedback-type': 'feedback_type',
+    'user-agent': 'user_agent',
+    'version': 'version',
+    'source-ip': 'source_ip',
+    'auth-failure': 'auth_failure',
+    'reported-domain': 'reported_domain',
+    'original-mail-from': 'original_mail_from',
+    'original-rcpt-to': 'original_rcpt_to',
+    'arrival-date': 'arrival_date',
+    'delivery-result': 'delivery_result',
+    'dkim-domain': 'dkim_domain',
+    'dkim-selector': 'dkim_selector',
+    'identity-alignment': 'identity_alignment',
+}
+
+
+def iter_messages(path: str, max_bytes: int = DEFAULT_MAX_MESSAGE_BYTES) -> Iterator[Tuple[str, bytes]]:
+    """ディレクトリ内のメールファイル、または mbox から (出所, メッセージ) を1通ずつ返す"""
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                filepath = os.path.join(root, name)
+                yield from iter_messages(filepath, max_bytes)
+        return
+
+    with open(path, 'rb') as f:
+        first = f.readline()
+        if not first.startswith(b'From '):
+            # 1ファイル1通（.eml など）
+            yield path, first + f.read(max(max_bytes - len(first), 0))
+            return
+
+        # mbox: "From " 行で区切られたメッセージを1通分ずつ組み立てる
+        index = 0
+        chunks: List[bytes] = []
+        size = 0
+        previous_blank = True
+        for line in f:
+            if line.startswith(b'From ') and previous_blank:
+                yield f"{path}#{index}", b''.join(chunks)
+                index += 1
+                chunks, size = [], 0
+                previous_blank = False
+                continue
+            previous_blank = line in (b'\n', b'\r\n')
+            if size < max_bytes:
+                # mboxrd のエスケープ（>From）を戻す
+                if line.startswith(b'>') and line.lstrip(b'>').startswith(b'From '):
+                    line = line[1:]
+                chunks.append(line)
+                size += len(line)
+        yield f"{path}#{index}", b''.join(chunks)
+
+
+def _header_items(part) -> List[Tuple[str, str]]:
+    """message/* パートの中身をヘッダーの (名前, 値) として取り出す"""
+    payload = part.get_payload()
+    if isinstance(payload, list):
+        return list(payload[0].items()) if payload else []
+    from email.parser import HeaderParser
+    text = part.get_payload(decode=True) or b''
+    return list(HeaderParser().parsestr(text.decode('utf-8', 'replace')).items())
+
+
+def extract_forensic(raw: bytes) -> Optional[Dict]:
+    """フォレンジックレポート1通からARFフィールドと元メールのヘッダーを取り出す
+
+    message/feedback-report パートがなければ None。元メールのヘッダーは
+    message/rfc822 または text/rfc822-headers パートから取り出し、本文は使わない。
+    """
+    from email.parser import BytesParser
+    from email import policy
+
+    message = BytesParser(policy=policy.compat32).parsebytes(raw)
+    report = None
+    original_headers = None
+    for part in message.walk():
+        content_type = part.get_content_type()
+        if content_type == 'message/feedback-report' and report is None:
+            report = {}
+            for name, value in _header_items(part):
+                field = ARF_FIELDS.get(name.lower())
+                if field and field not in report:
+                    report[field] = ' '.join(str(value).split())
+        elif content_type == 'message/rfc822' and original_headers is None:
+            payload = part.get_payload()
+            if isinstance(payload, list) and payload:
+                original_headers = ''.join(f"{k}: {v}\n" for k, v in payload[0].items())
+        elif content_type == 'text/rfc822-headers' and original_headers is None:
+            text = part.get_payload(decode=True) or b''
+            original_headers = text.decode('utf-8', 'replace')
+
+    if report is None:
+        return None
+    report['original_headers'] = original_headers or ''
+    return report
+
+
+def failure_type(report: Dict) -> str:
+    """Auth-Failure フィールドを失敗種別として正規化（未指定は 'unspecified'）"""
+    value = (report.get('auth_failure') or '').strip().lower()
+    return value.split()[0] if value else 'unspecified'
+
+
+class ForensicStats:
+    """フォレンジックレポートの集計（送信元IPは件数上位のみ保持）
+
+    送信元IPが max_sources の2倍に達するたびに、件数の多い max_sources 件だけを残す。
+    切り捨てたIPが再び現れた場合の件数は、切り捨て時の最大件数（max_error）まで
+    少なく数えられる可能性がある。
+    """
+
+    def __init__(self, max_sources: int = DEFAULT_MAX_SOURCES):
+        self.max_sources = max_sources
+        self.total = 0
+        self.skipped = 0
+        self.by_type: Dict[str, int] = {}
+        self.by_domain: Dict[str, int] = {}
+        self.auth_results: Dict[str, int] = {}
+        # ip -> {'count': n, 'types': {種別: n}}
+        self.sources: Dict[str, Dict] = {}
+        self.pruned_sources = 0
+        self.max_error = 0
+        self.samples: Dict[str, List[str]] = {}
+
+    def add(self, report: Dict, analysis: Optional[Dict] = None) -> None:
+        """extract_forensic の結果（と元ヘッダーの解析結果）を加算"""
+        self.total += 1
+        kind = failure_type(report)
+        self.by_type[kind] = self.by_type.get(kind, 0) + 1
+        domain = (report.get('reported_domain') or '').lower()
+        self.by_domain[domain] = self.by_domain.get(domain, 0) + 1
+
+        ip = report.get('source_ip') or ''
+        source = self.sources.get(ip)
+        if source is None:
+            source = self.sources[ip] = {'count': 0, 'types': {}}
+        source['count'] += 1
+        source['types'][kind] = source['types'].get(kind, 0) + 1
+        if len(self.sources) >= 2 * self.max_sources:
+            self._prune()
+
+        if analysis is not None:
+            summary = analysis['summary']
+            key = f"dkim={summary['dkim']} spf={summary['spf']} dmarc={summary['dmarc']}"
+            self.auth_results[key] = self.auth_results.get(key, 0) + 1
+            samples = self.samples.setdefault(kind, [])
+            if len(samples) < SAMPLES_PER_TYPE and analysis['details']['from']:
+                samples.append(analysis['details']['from'][0])
+
+    def _prune(self) -> None:
+        """件数の多い max_sources 件だけを残す（同数はIP順）"""
+        ranked = sorted(self.sources.items(), key=lambda x: (-x[1]['count'], x[0]))
+        for _, dropped in ranked[self.max_sources:]:
+            self.max_error = max(self.max_error, dropped['count'])
+        self.pruned_sources += len(ranked) - self.max_sources
+        self.sources = dict(ranked[:self.max_sources])
+
+    def top_sources(self, limit: int) -> List[Tuple[str, Dict]]:
+        return sorted(self.sources.items(), key=lambda x: (-x[1]['count'], x[0]))[:limit]
+
+    def to_dict(self, top: int = 100) -> Dict:
+        """JSON出力用の辞書"""
+        return {
+            'total': self.total,
+            'skipped': self.skipped,
+            'by_type': dict(sorted(self.by_type.items())),
+            'by_domain': dict(sorted(self.by_domain.items())),
+            'auth_results': dict(sorted(self.auth_results.items())),
+            'sources': dict(self.top_sources(top)),
+            'pruned_sources': self.pruned_sources,
+            'max_error': self.max_error,
+            'samples': dict(sorted(self.samples.items())),
+        }
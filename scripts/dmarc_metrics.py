@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+"""
+Prometheus textfile collector 形式のメトリクス出力
+DMARCレポートの集計（ドメイン・送信元組織別のメール数、認証成否、レポート処理数、
+最新レポートの経過時間）とツール自身の段ごとの処理時間・スループットを書き出す
+node_exporter の --collector.textfile.directory に置くファイルを想定し、書き込みは
+一時ファイルからの置き換えで行う（収集中に途中までのファイルを読まれない）
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from dmarc_aggregate import ReportStats
+
+METRIC_PREFIX = 'dmarc'
+
+
+def escape_label(value: str) -> str:
+    """ラベル値のエスケープ（バックスラッシュ・ダブルクォート・改行）"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsWriter:
+    """メトリクスを HELP・TYPE 付きで組み立てる"""
+
+    def __init__(self, prefix: str = METRIC_PREFIX):
+        self.prefix = prefix
+        self.lines: List[str] = []
+
+    def metric(self, name: str, kind: str, help_text: str,
+               samples: List[Tuple[Dict[str, str], float]]) -> None:
+        """同じ名前のサンプルをまとめて追加（サンプルがなければ何も出力しない）"""
+        if not samples:
+            return
+        full_name = f"{self.prefix}_{name}"
+        self.lines.append(f"# HELP {full_name} {help_text}")
+        self.lines.append(f"# TYPE {full_name} {kind}")
+        for labels, value in samples:
+            if labels:
+                label_text = ','.join(f'{k}="{escape_label(str(v))}"' for k, v in labels.items())
+                self.lines.append(f"{full_name}{{{label_text}}} {_format_value(value)}")
+            else:
+                self.lines.append(f"{full_name} {_format_value(value)}")
+
+    def text(self) -> str:
+        return '\n'.join(self.lines) + '\n'
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class StageTimer:
+    """ツール自身の段ごとの処理時間と処理件数"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages: Dict[str, Dict] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict]:
+        """with ブロックの処理時間を記録（yield した辞書の 'items' に件数を設定）"""
+        record = self.stages.setdefault(name, {'seconds': 0.0, 'items': 0})
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] += time.perf_counter() - start
+
+
+def checker_metrics(stats: 'ReportStats', timer: Optional[StageTimer] = None,
+                    filtered_reports: int = 0, now: Optional[float] = None) -> str:
+    """DMARCReportChecker の集計からメトリクスのテキストを生成"""
+    now = time.time() if now is None else now
+    writer = MetricsWriter()
+
+    # ドメイン × 送信元組織
+    domain_org = []
+    for domain in sorted(stats.domains):
+        for org, data in sorted(stats.domains[domain]['orgs'].items()):
+            domain_org.append(({'domain': domain or 'unknown', 'org': org or 'unknown'}, data))
+    for name, field, help_text in (
+            ('messages', 'messages', 'Messages covered by aggregate reports in this run.'),
+            ('messages_pass', 'pass', 'Messages passing both SPF and DKIM.'),
+            ('messages_fail', 'fail', 'Messages failing SPF or DKIM.'),
+            ('reports', 'count', 'Aggregate reports processed in this run.')):
+        writer.metric(name, 'gauge', help_text + ' By published domain and reporting org.',
+                      [(labels, data[field]) for labels, data in domain_org])
+
+    pass_rates = []
+    for domain in sorted(stats.domains):
+        totals = stats.domain_totals(domain)
+        if totals['messages'] > 0:
+            pass_rates.append(({'domain': domain or 'unknown'}, totals['pass'] / totals['messages']))
+    writer.metric('pass_ratio', 'gauge', 'Share of messages passing both SPF and DKIM by domain.',
+                  pass_rates)
+
+    writer.metric('policy_info', 'gauge', 'Most recent published DMARC policy by domain.', [
+        ({'domain': domain or 'unknown', 'policy': stats.current_policy(domain)}, 1)
+        for domain in sorted(stats.domains) if stats.current_policy(domain)
+    ])
+
+    writer.metric('report_files', 'gauge', 'Report files by processing state in this run.', [
+        ({'state': 'found'}, stats.total_reports),
+        ({'state': 'processed'}, stats.processed_reports),
+        ({'state': 'failed'}, stats.failed_reports),
+        ({'state': 'filtered'}, filtered_reports),
+    ])
+    writer.metric('report_failures', 'gauge', 'Report files that failed by reason in this run.', [
+        ({'reason': reason}, count) for reason, count in sorted(stats.failure_reasons.items())
+    ])
+
+    latest = stats.date_range['latest']
+    if latest is not None:
+        writer.metric('last_report_timestamp_seconds', 'gauge',
+                      'End of the date range of the newest report.', [({}, latest)])
+        writer.metric('last_report_age_seconds', 'gauge',
+                      'Seconds since the end of the newest report date range.', [({}, now - latest)])
+
+    # ツール自身の処理時間
+    if timer is not None:
+        stages = sorted(timer.stages.items())
+        writer.metric('tool_stage_duration_seconds', 'gauge', 'Wall time spent in each stage.',
+                      [({'stage': name}, round(s['seconds'], 6)) for name, s in stages])
+        writer.metric('tool_stage_items', 'gauge', 'Items handled by each stage.',
+                      [({'stage': name}, s['items']) for name, s in stages])
+        writer.metric('tool_stage_items_per_second', 'gauge', 'Throughput of each stage.',
+                      [({'stage': name}, round(s['items'] / s['seconds'], 3))
+                       for name, s in stages if s['seconds'] > 0])
+        writer.metric('tool_run_duration_seconds', 'gauge', 'Wall time of the whole run.',
+                      [({}, round(now - timer.started, 6))])
+    writer.metric('tool_last_run_timestamp_seconds', 'gauge', 'When the tool last finished.',
+                  [({}, round(now, 3))])
+
+    return writer.text()
+
+
+def write_textfile(path: str, text: str) -> None:
+    """一時ファイルに書いてから置き換える（textfile collector が途中の内容を読まないように）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
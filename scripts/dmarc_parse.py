@@ -0,0 +1,1128 @@
+#!/usr/bin/env python3
+
+"""
+DMARC集約レポートの読み込み・パース
+分析ツール・受信確認ツールで共通の展開処理とXML解析（プロセスプールからも呼び出せる
+モジュールレベル関数として提供）
+期間・ドメイン指定時はレポート先頭（report_metadata・policy_published）だけを読む
+ヘッダー解析とヘッダーキャッシュで事前に絞り込む
+レポート本体のパースは2種類のバックエンドから選べる
+  expat: xml.parsers.expat のイベントハンドラで必要なフィールドだけを平坦な行として集める
+         （Element を作らない、デフォルト）
+  etree: ElementTree で木を組み立てて find() で取り出す（従来の実装）
+どちらも同じ結果を返す（mail-auth-tools.py bench-xml で速度を比較できる）
+指定すれば同じパースで各レコードの identifiers・auth_results も読み、DKIMセレクター別・
+SPFドメイン別に集計する（dmarc_auth）
+レポートは外部から届く信頼できない入力のため、ファイルサイズ・展開後のサイズ・レコード数・
+要素の入れ子の深さに上限（ReportLimits）を設け、読み込み・パースの途中で超えた時点で
+打ち切る。エンティティ宣言（DTD）を含むレポート・数値であるべき要素が数値でないレポートは
+拒否する
+"""
+
+import os
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from typing import (TYPE_CHECKING, Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Set,
+                    Tuple)
+
+from dmarc_rowcache import MAX_COUNT
+
+if TYPE_CHECKING:
+    import argparse
+    from dmarc_auth import AuthBreakdown
+
+ParseError = ET.ParseError
+
+# (source_ip, count, disposition, dkim, spf)
+Row = Tuple[str, int, str, str, str]
+
+HEADER_CACHE_VERSION = 2
+
+# レポート先頭（report_metadata・policy_published）だけを読むときに展開する上限
+# 大きなトークン（コメントなど）を少しずつ渡すと expat が先頭から読み直すため、
+# ヘッダーがこれより後ろにあるレポートは絞り込みの対象外として本処理に回す
+HEADER_MAX_BYTES = 1024 * 1024
+
+# パースのバックエンド（mail-auth-tools.py bench-xml で比較）
+# etree は木全体を保持するため、レポートが大きいほど循環GCの走査が増えてレコードあたりの
+# 時間が伸びる（インデント付き10万レコードで expat の約2.7倍）。expat は保持するオブジェクトが
+# 一定で時間がレコード数に比例する。etree は入れ子の深さ・レコード数の上限を検査するため
+# 要素ごとに Python のメソッドを呼ぶので、数レコードの小さなレポートでも expat より遅い
+XML_BACKENDS = ('expat', 'etree')
+DEFAULT_XML_BACKEND = 'expat'
+
+# 読み込み・パースの上限のデフォルト
+# 通常のレポートは大手の受信側でも展開後数十MB以下のため、十分な余裕を持たせている
+DEFAULT_MAX_FILE_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_XML_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_RECORDS = 1000000
+# DMARC集約レポートの入れ子は最大5段（feedback/record/auth_results/dkim/domain）
+DEFAULT_MAX_DEPTH = 32
+
+
+class ReportLimitError(ParseError):
+    """上限を超えた・エンティティ宣言を含むレポート
+
+    reason は失敗理由の識別子（file_size・xml_size・records・depth・entity・malformed）。
+    """
+
+    def __init__(self, message: str, reason: str = 'limit'):
+        super().__init__(message)
+        self.reason = reason
+
+
+class MalformedReportError(ReportLimitError):
+    """数値であるべき要素（begin・end・count）が数値でないレポート（reason は malformed）"""
+
+    def __init__(self, message: str):
+        super().__init__(message, 'malformed')
+
+
+class ReportReadError(OSError):
+    """読み込み・展開できないレポート（壊れた gzip・zip、UTF-8 でない内容など）
+
+    reason は ReportLimitError と同じく失敗理由の識別子（常に read_error）。
+    """
+
+    reason = 'read_error'
+
+
+class ReportLimits:
+    """信頼できないレポートの読み込み・パースの上限（None の項目は無制限）
+
+    file_bytes: ファイルサイズ（圧縮ファイルなら圧縮後）
+    xml_bytes: 展開後のXMLのサイズ
+    records: record 要素の数
+    depth: 要素の入れ子の深さ（ルート要素が1）
+    """
+
+    __slots__ = ('file_bytes', 'xml_bytes', 'records', 'depth')
+
+    def __init__(self, file_bytes: Optional[int] = DEFAULT_MAX_FILE_BYTES,
+                 xml_bytes: Optional[int] = DEFAULT_MAX_XML_BYTES,
+                 records: Optional[int] = DEFAULT_MAX_RECORDS,
+                 depth: Optional[int] = DEFAULT_MAX_DEPTH):
+        self.file_bytes = file_bytes
+        self.xml_bytes = xml_bytes
+        self.records = records
+        self.depth = depth
+
+    @classmethod
+    def from_options(cls, file_size: Optional[str] = None, xml_size: Optional[str] = None,
+                     records: Optional[int] = None, depth: Optional[int] = None) -> 'ReportLimits':
+        """コマンドラインの指定（サイズは '64M' 形式、省略した項目はデフォルト）から作る
+
+        不正な指定は ValueError。
+        """
+        from dmarc_spill import parse_size
+        limits = cls()
+        if file_size is not None:
+            limits.file_bytes = parse_size(file_size)
+        if xml_size is not None:
+            limits.xml_bytes = parse_size(xml_size)
+        for name, value in (('records', records), ('depth', depth)):
+            if value is not None:
+                if value <= 0:
+                    raise ValueError(f"上限は正の値で指定してください: {value}")
+                setattr(limits, name, value)
+        return limits
+
+
+DEFAULT_LIMITS = ReportLimits()
+
+
+def add_limit_arguments(parser: 'argparse.ArgumentParser') -> None:
+    """上限（--max-*）のコマンドライン引数を追加（分析ツール・受信確認ツールで共通）"""
+    mib = 1024 * 1024
+    parser.add_argument('--max-file-size', metavar='SIZE',
+                        help='これより大きいレポートファイル（圧縮後）は読まずに処理失敗とする'
+                             f'（デフォルト: {DEFAULT_MAX_FILE_BYTES // mib}M）')
+    parser.add_argument('--max-xml-size', metavar='SIZE',
+                        help='展開後のXMLがこれを超えたら展開を打ち切り処理失敗とする'
+                             f'（デフォルト: {DEFAULT_MAX_XML_BYTES // mib}M）')
+    parser.add_argument('--max-records', type=int, metavar='N',
+                        help=f'1レポートのレコード数の上限（デフォルト: {DEFAULT_MAX_RECORDS}）')
+    parser.add_argument('--max-depth', type=int, metavar='N',
+                        help=f'XML要素の入れ子の深さの上限（デフォルト: {DEFAULT_MAX_DEPTH}）')
+
+
+def limits_from_args(parser: 'argparse.ArgumentParser', args) -> Optional[ReportLimits]:
+    """add_limit_arguments の指定から ReportLimits を作る（指定がなければ None でデフォルト）
+
+    不正な指定は parser.error で終了する。
+    """
+    options = (args.max_file_size, args.max_xml_size, args.max_records, args.max_depth)
+    if all(value is None for value in options):
+        return None
+    try:
+        return ReportLimits.from_options(*options)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def _check_file_size(filepath: str, limits: ReportLimits) -> None:
+    if limits.file_bytes is not None:
+        size = os.path.getsize(filepath)
+        if size > limits.file_bytes:
+            raise ReportLimitError(
+                f"ファイルサイズが上限を超えています: {size:,} > {limits.file_bytes:,} バイト",
+                'file_size')
+
+
+def _xml_size_error(limits: ReportLimits) -> ReportLimitError:
+    return ReportLimitError(
+        f"展開後のサイズが上限（{limits.xml_bytes:,} バイト）を超えています", 'xml_size')
+
+
+def _records_error(limits: ReportLimits) -> ReportLimitError:
+    return ReportLimitError(f"レコード数が上限（{limits.records:,}）を超えています", 'records')
+
+
+def _depth_error(limits: ReportLimits) -> ReportLimitError:
+    return ReportLimitError(f"要素の入れ子が上限（{limits.depth}段）を超えています", 'depth')
+
+
+def _entity_error() -> ReportLimitError:
+    return ReportLimitError("エンティティ宣言を含むレポートは読み込みません", 'entity')
+
+
+def _int_field(value: Optional[str], name: str, minimum: Optional[int] = None,
+               maximum: Optional[int] = None) -> int:
+    """数値の要素の値を整数に（空・数値でない・minimum 未満・maximum 超なら MalformedReportError）"""
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        number = None
+    if (number is None or (minimum is not None and number < minimum)
+            or (maximum is not None and number > maximum)):
+        text = value if value is None or len(value) <= 40 else value[:37] + '...'
+        raise MalformedReportError(f"{name} の値が不正です: {text!r}")
+    return number
+
+
+def _read_errors() -> Tuple:
+    """読み込み・展開で起きうる例外（壊れた圧縮ファイルは OSError 以外の例外にもなる）"""
+    import zipfile
+    import zlib
+    return (OSError, EOFError, zipfile.BadZipFile, zlib.error, UnicodeDecodeError)
+
+
+@contextmanager
+def open_report(filepath: str) -> Iterator[Optional[BinaryIO]]:
+    """レポートファイルを開き、展開済みXMLのバイナリストリームを返す（XMLがなければ None）"""
+    if filepath.endswith('.gz'):
+        import gzip
+        with gzip.open(filepath, 'rb') as f:
+            yield f
+    elif filepath.endswith('.zip'):
+        import zipfile
+        with zipfile.ZipFile(filepath, 'r') as z:
+            # ZIP内の最初のXMLファイルを読む
+            for name in z.namelist():
+                if name.endswith('.xml'):
+                    with z.open(name) as f:
+                        yield f
+                    return
+            yield None
+    else:
+        with open(filepath, 'rb') as f:
+            yield f
+
+
+def read_report(filepath: str, limits: Optional[ReportLimits] = None) -> Optional[str]:
+    """レポートファイルを読み込み、圧縮されていれば展開してXML文字列を返す
+
+    ファイルサイズ・展開後のサイズが limits（省略時はデフォルト）の上限を超えれば
+    ReportLimitError。展開は上限を1バイト超えた時点で打ち切る（展開爆弾を最後まで展開しない）。
+    読めない・壊れた圧縮ファイル・UTF-8 でない内容は ReportReadError。
+    """
+    limits = limits or DEFAULT_LIMITS
+    try:
+        _check_file_size(filepath, limits)
+        with open_report(filepath) as f:
+            if f is None:
+                return None
+            if limits.xml_bytes is None:
+                return f.read().decode('utf-8')
+            data = f.read(limits.xml_bytes + 1)
+            if len(data) > limits.xml_bytes:
+                raise _xml_size_error(limits)
+            return data.decode('utf-8')
+    except _read_errors() as e:
+        raise ReportReadError(str(e) or type(e).__name__) from e
+
+
+def read_and_parse(filepath: str, parse: Callable[[str], Any],
+                   limits: Optional[ReportLimits] = None) -> Tuple[Any, Optional[str], Optional[str]]:
+    """read_report と parse(XML文字列) を続けて行い、(結果, エラー, 失敗理由) を返す
+
+    上限超過・読み込みの失敗・XMLの構文エラーは例外にせず、エラーメッセージと失敗理由
+    （ReportLimitError.reason・read_error・parse_error）で返す。XMLを含まないファイルは
+    (None, None, None)。
+    """
+    try:
+        content = read_report(filepath, limits)
+        if not content:
+            return None, None, None
+        return parse(content), None, None
+    except ReportLimitError as e:
+        return None, f"レポートを拒否: {filepath}: {e}", e.reason
+    except ReportReadError as e:
+        return None, f"警告: 読み込めません: {filepath}: {e}", e.reason
+    except ParseError as e:
+        return None, f"XMLパースエラー: {filepath}: {e}", 'parse_error'
+
+
+class _LimitedReader:
+    """読んだ合計が上限を超えたら ReportLimitError にするストリーム（逐次パーサーに渡す）"""
+
+    def __init__(self, f: BinaryIO, limits: ReportLimits):
+        self.f = f
+        self.limits = limits
+        self.remaining = limits.xml_bytes
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+            if self.remaining < 0:
+                raise _xml_size_error(self.limits)
+        return data
+
+
+def read_report_header(filepath: str, limits: Optional[ReportLimits] = None) -> Optional[Dict]:
+    """レポート先頭だけを読み、org_name・report_id・期間・ドメイン・ポリシーを返す
+
+    ストリームを先頭から逐次パースし、policy_published を読み終えた時点で打ち切るため、
+    レコード部分は展開もパースもしない。メタデータが読めない・上限を超えれば None
+    （本処理でエラーとして報告される）。
+    """
+    limits = limits or DEFAULT_LIMITS
+    header_limits = ReportLimits(xml_bytes=min(limits.xml_bytes or HEADER_MAX_BYTES,
+                                               HEADER_MAX_BYTES))
+    header = None
+    try:
+        _check_file_size(filepath, limits)
+        with open_report(filepath) as f:
+            if f is None:
+                return None
+            for _, elem in ET.iterparse(_LimitedReader(f, header_limits), events=('end',)):
+                if elem.tag == 'report_metadata':
+                    header = _header_from_metadata(elem)
+                elif elem.tag == 'policy_published':
+                    if header is not None:
+                        domain = elem.findtext('domain')
+                        header['domain'] = domain.lower() if domain else None
+                        header['policy'] = elem.findtext('p')
+                    return header
+                elif elem.tag == 'record':
+                    # policy_published がないレポート
+                    return header
+    except ReportLimitError:
+        return None
+    except (ParseError, ValueError) + _read_errors():
+        return header
+    return header
+
+
+def _header_from_metadata(metadata: ET.Element) -> Dict:
+    header = {'org_name': None, 'report_id': None, 'date_begin': None, 'date_end': None,
+              'domain': None, 'policy': None}
+    for field in ('org_name', 'report_id'):
+        elem = metadata.find(field)
+        if elem is not None:
+            header[field] = elem.text
+    for field, path in (('date_begin', 'date_range/begin'), ('date_end', 'date_range/end')):
+        elem = metadata.find(path)
+        if elem is not None and elem.text:
+            header[field] = _int_field(elem.text, path)
+    return header
+
+
+class ReportHeaderCache:
+    """ファイルごとのレポートヘッダーをサイズ・更新時刻とともに保存するキャッシュ
+
+    期間・ドメインでの絞り込みのたびに圧縮ファイルを開かずに済むよう、JSONファイルに永続化する。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entries: Dict[str, List] = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        if path and os.path.exists(path):
+            import json
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            # 形式が異なる（古い）キャッシュは読み直す
+            if isinstance(data, dict) and data.get('version') == HEADER_CACHE_VERSION:
+                self.entries = data['entries']
+
+    def get(self, filepath: str) -> Optional[Dict]:
+        """ヘッダーを返す（キャッシュが古ければ読み直す）"""
+        key = os.path.abspath(filepath)
+        st = os.stat(filepath)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        header = read_report_header(filepath)
+        self.entries[key] = [st.st_size, st.st_mtime_ns, header]
+        self._dirty = True
+        return header
+
+    def save(self) -> None:
+        """変更があれば保存（存在しなくなったファイルのエントリは削除）"""
+        if not self.path or not self._dirty:
+            return
+        import json
+        self.entries = {k: v for k, v in self.entries.items() if os.path.exists(k)}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': HEADER_CACHE_VERSION, 'entries': self.entries}, f,
+                      ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+def filter_reports(paths: List[str], since: Optional[int] = None, until: Optional[int] = None,
+                   domains: Optional[Set[str]] = None,
+                   cache: Optional[ReportHeaderCache] = None) -> Tuple[List[str], int]:
+    """レポート自身の期間が [since, until) と重なり、ポリシー公開ドメインが domains
+    （小文字）に含まれるファイルに絞り込む
+
+    ヘッダーが読めない・存在しないファイルは対象に残す（本処理でエラーとして報告される）。
+    (対象ファイル, 除外件数) を返す。
+    """
+    from dmarc_segments import overlaps
+
+    if since is None and until is None and domains is None:
+        return list(paths), 0
+    if cache is None:
+        cache = ReportHeaderCache()
+    selected = []
+    for filepath in paths:
+        try:
+            header = cache.get(filepath)
+        except OSError:
+            header = None
+        if header is None or (
+                overlaps(header['date_begin'], header['date_end'], since, until)
+                and (domains is None or header['domain'] in domains)):
+            selected.append(filepath)
+    cache.save()
+    return selected, len(paths) - len(selected)
+
+
+def sort_reports(paths: List[str], key: Callable[[Dict], Tuple],
+                 cache: Optional[ReportHeaderCache] = None) -> List[str]:
+    """レポート先頭のヘッダーから求めた key(ヘッダー) の順にファイルを並べ替える
+
+    ヘッダーが読めない・存在しないファイルは入力順のまま末尾に置く（本処理でエラーとして
+    報告される）。
+    """
+    if cache is None:
+        cache = ReportHeaderCache()
+    keyed, unknown = [], []
+    for filepath in paths:
+        try:
+            header = cache.get(filepath)
+        except OSError:
+            header = None
+        if header is None:
+            unknown.append(filepath)
+        else:
+            keyed.append((key(header), filepath))
+    cache.save()
+    keyed.sort(key=lambda item: item[0])
+    return [filepath for _, filepath in keyed] + unknown
+
+
+def parse_report(xml_content: str, backend: Optional[str] = None,
+                 limits: Optional[ReportLimits] = None,
+                 auth: bool = False) -> Tuple[Dict, List[Row]]:
+    """分析ツール用: レポート情報とレコード一覧を抽出
+
+    不正なXMLは ParseError、limits（省略時はデフォルト）の上限を超えれば ReportLimitError。
+    auth を指定した場合、同じパースで auth_results も読み、レポート情報の 'auth_results' に
+    DKIMセレクター別・SPFドメイン別の集計（dmarc_auth.AuthBreakdown）を入れる。
+    """
+    if (backend or DEFAULT_XML_BACKEND) == 'expat':
+        return _parse_report_expat(xml_content, limits or DEFAULT_LIMITS, auth)
+    return _parse_report_etree(xml_content, limits or DEFAULT_LIMITS, auth)
+
+
+def _check_entities(xml_content: str) -> None:
+    """ルート要素より前（DTD）にエンティティ宣言があれば ReportLimitError
+
+    ElementTree ではDTDのハンドラを設定できないため、ルート要素の開始までを expat で読む。
+    """
+    from xml.parsers import expat
+    parser = expat.ParserCreate()
+
+    def entity_decl(*args) -> None:
+        raise _entity_error()
+
+    def stop(name: str, attrs) -> None:
+        raise _StopParsing()
+
+    parser.EntityDeclHandler = entity_decl
+    parser.StartElementHandler = stop
+    try:
+        parser.Parse(xml_content, True)
+    except (_StopParsing, expat.ExpatError):
+        # 構文エラーは本体のパースで報告する
+        pass
+
+
+class _LimitedTreeBuilder(ET.TreeBuilder):
+    """入れ子の深さとルート直下の record を数えながら木を組み立てる
+
+    domains を指定した場合、policy_published のドメインが含まれないと分かった時点で
+    _StopParsing で打ち切る。要素ごとに呼ばれるため super() を使わず基底の
+    メソッドを直接呼ぶ。
+    """
+
+    def __init__(self, limits: ReportLimits, domains: Optional[Set[str]] = None):
+        super().__init__()
+        self.limits = limits
+        self.max_depth = limits.depth if limits.depth is not None else float('inf')
+        self.max_records = limits.records if limits.records is not None else float('inf')
+        self.domains = domains
+        self.matched = False
+        self.depth = 0
+        self.records = 0
+
+    def start(self, tag, attrs):
+        self.depth += 1
+        if self.depth > self.max_depth:
+            raise _depth_error(self.limits)
+        return _tree_start(self, tag, attrs)
+
+    def end(self, tag):
+        elem = _tree_end(self, tag)
+        self.depth -= 1
+        if tag == 'record' and self.depth == 1:
+            self.records += 1
+            if self.records > self.max_records:
+                raise _records_error(self.limits)
+        elif tag == 'policy_published' and self.domains is not None:
+            domain = elem.findtext('domain')
+            if (domain or '').lower() not in self.domains:
+                raise _StopParsing()
+            self.matched = True
+        return elem
+
+
+_tree_start = ET.TreeBuilder.start
+_tree_end = ET.TreeBuilder.end
+
+
+def _parse_tree(xml_content: str, limits: ReportLimits,
+                domains: Optional[Set[str]] = None) -> Optional[ET.Element]:
+    """木を組み立てて返す（入れ子の深さ・レコード数が上限を超えた時点で ReportLimitError）
+
+    domains を指定した場合、他ドメインのレコード部分は読まない。
+    対象外（policy_published がない場合を含む）なら None。
+    """
+    if '<!DOCTYPE' in xml_content:
+        _check_entities(xml_content)
+    builder = _LimitedTreeBuilder(limits, domains)
+    parser = ET.XMLParser(target=builder)
+    try:
+        parser.feed(xml_content)
+        root = parser.close()
+    except _StopParsing:
+        return None
+    return root if domains is None or builder.matched else None
+
+
+def _auth_of_element(record: ET.Element, count: int) -> Tuple:
+    """record 要素から (メール数, header_from, [(ドメイン, セレクター, 結果)], [(ドメイン, 結果)])"""
+    identifiers = record.find('identifiers')
+    header_from = identifiers.findtext('header_from') if identifiers is not None else None
+    dkim, spf = [], []
+    auth_results = record.find('auth_results')
+    if auth_results is not None:
+        dkim = [(e.findtext('domain'), e.findtext('selector'), e.findtext('result'))
+                for e in auth_results.findall('dkim')]
+        spf = [(e.findtext('domain'), e.findtext('result')) for e in auth_results.findall('spf')]
+    return count, header_from, dkim, spf
+
+
+def _auth_breakdown(policy: Dict, records: List[Tuple]) -> 'AuthBreakdown':
+    """_auth_of_element・_auth_of の結果をポリシー（アライメントモード）とともに集計"""
+    from dmarc_auth import AuthBreakdown
+    breakdown = AuthBreakdown()
+    for count, header_from, dkim, spf in records:
+        breakdown.add_record(count, header_from, dkim, spf, policy)
+    return breakdown
+
+
+def _parse_report_etree(xml_content: str, limits: ReportLimits,
+                        auth: bool = False) -> Tuple[Dict, List[Row]]:
+    root = _parse_tree(xml_content, limits)
+
+    # メタデータ取得
+    report_info = {'org_name': None, 'report_id': None, 'date_begin': None, 'date_end': None}
+    metadata = root.find('report_metadata')
+    if metadata is not None:
+        for field in ('org_name', 'report_id'):
+            elem = metadata.find(field)
+            if elem is not None:
+                report_info[field] = elem.text
+        date_range = metadata.find('date_range')
+        if date_range is not None:
+            begin = date_range.find('begin')
+            end = date_range.find('end')
+            if begin is not None:
+                report_info['date_begin'] = _int_field(begin.text, 'date_range/begin')
+            if end is not None:
+                report_info['date_end'] = _int_field(end.text, 'date_range/end')
+
+    # ポリシー情報取得
+    policy = root.find('policy_published')
+    policy_info = {}
+    if policy is not None:
+        policy_info = {
+            'domain': policy.find('domain').text if policy.find('domain') is not None else '',
+            'p': policy.find('p').text if policy.find('p') is not None else '',
+            'sp': policy.find('sp').text if policy.find('sp') is not None else '',
+            'adkim': policy.find('adkim').text if policy.find('adkim') is not None else '',
+            'aspf': policy.find('aspf').text if policy.find('aspf') is not None else '',
+        }
+    report_info['policy'] = policy_info
+
+    # レコード解析
+    rows = []
+    auth_records = []
+    for record in root.findall('record'):
+        row = record.find('row')
+        if row is None:
+            continue
+
+        source_ip = row.find('source_ip').text if row.find('source_ip') is not None else ''
+        count = _count(row.find('count').text) if row.find('count') is not None else 0
+        if auth:
+            auth_records.append(_auth_of_element(record, count))
+
+        policy_evaluated = row.find('policy_evaluated')
+        if policy_evaluated is None:
+            continue
+
+        disposition = policy_evaluated.find('disposition').text if policy_evaluated.find('disposition') is not None else ''
+
+        # DKIM結果
+        dkim_result = 'fail'
+        dkim_elem = policy_evaluated.find('dkim')
+        if dkim_elem is not None:
+            dkim_result = dkim_elem.text
+
+        # SPF結果
+        spf_result = 'fail'
+        spf_elem = policy_evaluated.find('spf')
+        if spf_elem is not None:
+            spf_result = spf_elem.text
+
+        rows.append((source_ip, count, disposition, dkim_result, spf_result))
+
+    if auth:
+        report_info['auth_results'] = _auth_breakdown(policy_info, auth_records)
+    return report_info, rows
+
+
+# ポリシー試算用のレコード
+# (source_ip, count, disposition, dkim, spf, header_from,
+#  [(DKIMのドメイン, 結果), ...], [(SPFのドメイン, 結果), ...])
+AuthRow = Tuple[str, int, str, str, str, Optional[str], List[Tuple[str, str]], List[Tuple[str, str]]]
+
+
+def parse_report_auth(xml_content: str,
+                      limits: Optional[ReportLimits] = None) -> Tuple[Dict, List[AuthRow]]:
+    """ポリシー試算用: policy_evaluated に加えて header_from と auth_results も抽出
+
+    レポート情報の policy には pct も含める。レコードの扱い（row・policy_evaluated が
+    ないものは読み飛ばす）は parse_report と同じ。
+    """
+    rows: List[AuthRow] = []
+
+    def on_record(record: Dict) -> None:
+        if 'record/row' not in record or 'record/row/policy_evaluated' not in record:
+            return
+        get = record.get
+        count = _count(record['record/row/count']) if 'record/row/count' in record else 0
+        _, header_from, dkim, spf = _auth_of(record, count)
+        rows.append((
+            get('record/row/source_ip') or '',
+            count,
+            get('record/row/policy_evaluated/disposition') or '',
+            get('record/row/policy_evaluated/dkim') or 'fail',
+            get('record/row/policy_evaluated/spf') or 'fail',
+            header_from,
+            [(domain or '', result or '') for domain, _, result in dkim],
+            [(domain or '', result or '') for domain, result in spf],
+        ))
+
+    fields = _scan_report(xml_content, on_record, limits=limits or DEFAULT_LIMITS, auth=True)
+    report_info = {'org_name': fields.get('report_metadata/org_name'),
+                   'report_id': fields.get('report_metadata/report_id'),
+                   'date_begin': None, 'date_end': None}
+    _report_dates(fields, report_info)
+    report_info['policy'] = {}
+    if 'policy_published' in fields:
+        report_info['policy'] = {name: fields.get(f'policy_published/{name}') or ''
+                                 for name in ('domain', 'p', 'sp', 'pct', 'adkim', 'aspf')}
+    return report_info, rows
+
+
+def new_report_metadata() -> Dict:
+    """受信確認ツール用メタデータの初期値"""
+    return {
+        'org_name': None,
+        'email': None,
+        'report_id': None,
+        'date_begin': None,
+        'date_end': None,
+        'domain': None,
+        'policy': None,
+        'total_messages': 0,
+        'pass_count': 0,
+        'fail_count': 0
+    }
+
+
+def parse_report_metadata(xml_content: str, domains: Optional[Set[str]] = None,
+                          backend: Optional[str] = None,
+                          limits: Optional[ReportLimits] = None,
+                          auth: bool = False) -> Optional[Dict]:
+    """受信確認ツール用: メタデータとメール数を抽出
+
+    不正なXMLは ParseError、limits（省略時はデフォルト）の上限を超えれば ReportLimitError。
+    domains（小文字）を指定した場合、ポリシー公開ドメインが含まれないレポートは None。
+    auth を指定した場合は parse_report と同じく 'auth_results' も入れる。
+    """
+    if (backend or DEFAULT_XML_BACKEND) == 'expat':
+        return _parse_report_metadata_expat(xml_content, domains, limits or DEFAULT_LIMITS, auth)
+    return _parse_report_metadata_etree(xml_content, domains, limits or DEFAULT_LIMITS, auth)
+
+
+def _parse_report_metadata_etree(xml_content: str, domains: Optional[Set[str]],
+                                 limits: ReportLimits, auth: bool = False) -> Optional[Dict]:
+    metadata = new_report_metadata()
+    root = _parse_tree(xml_content, limits, domains)
+    if root is None:
+        return None
+
+    # メタデータセクション
+    report_metadata = root.find('report_metadata')
+    if report_metadata is not None:
+        org_name = report_metadata.find('org_name')
+        if org_name is not None:
+            metadata['org_name'] = org_name.text
+
+        email_elem = report_metadata.find('email')
+        if email_elem is not None:
+            metadata['email'] = email_elem.text
+
+        report_id = report_metadata.find('report_id')
+        if report_id is not None:
+            metadata['report_id'] = report_id.text
+
+        date_range = report_metadata.find('date_range')
+        if date_range is not None:
+            begin = date_range.find('begin')
+            end = date_range.find('end')
+            if begin is not None:
+                metadata['date_begin'] = _int_field(begin.text, 'date_range/begin')
+            if end is not None:
+                metadata['date_end'] = _int_field(end.text, 'date_range/end')
+
+    # ポリシー情報
+    policy = root.find('policy_published')
+    if policy is not None:
+        domain = policy.find('domain')
+        if domain is not None:
+            metadata['domain'] = domain.text
+
+        p = policy.find('p')
+        if p is not None:
+            metadata['policy'] = p.text
+
+    # レコード統計
+    auth_records = []
+    for record in root.findall('record'):
+        row = record.find('row')
+        if row is not None and auth:
+            count = row.find('count')
+            auth_records.append(_auth_of_element(record, _count(count.text) if count is not None else 0))
+        if row is not None:
+            count = row.find('count')
+            if count is not None:
+                count_val = _count(count.text)
+                metadata['total_messages'] += count_val
+
+                policy_evaluated = row.find('policy_evaluated')
+                if policy_evaluated is not None:
+                    dkim = policy_evaluated.find('dkim')
+                    spf = policy_evaluated.find('spf')
+
+                    if dkim is not None and spf is not None:
+                        if dkim.text == 'pass' and spf.text == 'pass':
+                            metadata['pass_count'] += count_val
+                        else:
+                            metadata['fail_count'] += count_val
+
+    if auth:
+        policy_info = {}
+        if policy is not None:
+            policy_info = {name: policy.findtext(name) for name in ('domain', 'adkim', 'aspf')}
+        metadata['auth_results'] = _auth_breakdown(policy_info, auth_records)
+    return metadata
+
+
+# expat バックエンド
+# レポートのルートからの相対パスのうち、中を読む要素（コンテナ）と値を取り出す要素（葉）
+_CONTAINERS = {
+    '': ('report_metadata', 'policy_published', 'record'),
+    'report_metadata': ('date_range',),
+    'record': ('row',),
+    'record/row': ('policy_evaluated',),
+}
+_LEAVES = {
+    'report_metadata': ('org_name', 'email', 'report_id'),
+    'report_metadata/date_range': ('begin', 'end'),
+    'policy_published': ('domain', 'p', 'sp', 'adkim', 'aspf'),
+    'record/row': ('source_ip', 'count'),
+    'record/row/policy_evaluated': ('disposition', 'dkim', 'spf'),
+}
+# auth_results も読む場合に追加する要素
+# auth_results の dkim・spf は署名・検証ごとに複数あるため、出現ごとの辞書のリストとして集める
+_AUTH_CONTAINERS = {
+    'record': ('identifiers', 'auth_results'),
+    'record/auth_results': ('dkim', 'spf'),
+}
+_AUTH_LEAVES = {
+    'policy_published': ('pct',),
+    'record/identifiers': ('header_from',),
+    'record/auth_results/dkim': ('domain', 'selector', 'result'),
+    'record/auth_results/spf': ('domain', 'result'),
+}
+_REPEATED = ('record/auth_results/dkim', 'record/auth_results/spf')
+
+# 要素の種類
+_CONTAINER, _LEAF, _RECORD, _REPEAT = 0, 1, 2, 3
+# 値の格納先（レポート単位・レコード単位・繰り返し要素の1回分）
+_REPORT_SCOPE, _RECORD_SCOPE, _REPEAT_SCOPE = 0, 1, 2
+
+
+def _merge_tables(base: Dict[str, Tuple], extra: Dict[str, Tuple]) -> Dict[str, Tuple]:
+    return {parent: base.get(parent, ()) + extra.get(parent, ())
+            for parent in {**base, **extra}}
+
+
+def _build_nodes(parent: str, containers: Dict[str, Tuple], leaves: Dict[str, Tuple],
+                 scope: int = _REPORT_SCOPE) -> Dict[str, Tuple]:
+    """親のパスの子要素名 -> (パス, 種類, 格納先, 子要素の表)"""
+    nodes = {}
+    for name in containers.get(parent, ()):
+        path = f"{parent}/{name}" if parent else name
+        if path == 'record':
+            kind, inner = _RECORD, _RECORD_SCOPE
+        elif path in _REPEATED:
+            kind, inner = _REPEAT, _REPEAT_SCOPE
+        else:
+            kind, inner = _CONTAINER, scope
+        nodes[name] = (path, kind, scope, _build_nodes(path, containers, leaves, inner))
+    for name in leaves.get(parent, ()):
+        path = f"{parent}/{name}"
+        nodes[name] = (path, _LEAF, scope, {})
+    return nodes
+
+
+_ROOT_NODES = _build_nodes('', _CONTAINERS, _LEAVES)
+_AUTH_ROOT_NODES = _build_nodes('', _merge_tables(_CONTAINERS, _AUTH_CONTAINERS),
+                                _merge_tables(_LEAVES, _AUTH_LEAVES))
+
+
+class _StopParsing(Exception):
+    """対象外ドメインと分かった時点でパースを打ち切る"""
+
+
+def _scan_report(xml_content: str, on_record: Callable[[Dict], None],
+                 domains: Optional[Set[str]] = None,
+                 limits: ReportLimits = DEFAULT_LIMITS,
+                 auth: bool = False) -> Optional[Dict]:
+    """expat のイベントから必要なフィールドだけを集め、レポート単位のフィールドを返す
+
+    ElementTree の find() と同じく、各要素は親の中で最初に現れたものだけを使う
+    （2つ目以降の report_metadata や row は読み飛ばす）。名前空間付きの要素は
+    etree と同様に対象外。値は要素直下の最初の子要素より前のテキストで、空なら None。
+    返す辞書（レポート単位）と on_record に渡す辞書（レコード単位）はパスをキーとし、
+    葉は値、コンテナは出現したことを示す True を持つ。
+    domains 指定時、最初の policy_published のドメインが含まれなければ打ち切って None を返す
+    （policy_published がない場合も None）。ドメインが確定するまでのレコードは保留し、
+    対象と分かってから on_record に渡す。
+    入れ子の深さ・レコード数が limits を超えるかエンティティ宣言があれば、その時点で
+    ReportLimitError。
+    auth を指定した場合は identifiers/header_from と auth_results も読み、レコードの辞書の
+    'record/auth_results/dkim'・'record/auth_results/spf' に出現順の辞書のリストを持たせる
+    （auth_results 自体は他の要素と同じく最初の1つだけ）。
+
+    Python で呼ばれるハンドラの回数がCPU時間のほとんどを占めるため、
+    文字データは葉の中でだけ list.append で受け取り、不要な部分木（auth を指定しない
+    場合の identifiers・auth_results など）では子要素の判定を省いた軽いハンドラに切り替える。
+    """
+    from xml.parsers import expat
+    # 名前空間付きの要素名は「URI}名前」になり、どの子要素名にも一致しない
+    parser = expat.ParserCreate(namespace_separator='}')
+    parser.buffer_text = True
+
+    fields: Dict[str, object] = {}
+    record: Dict[str, object] = {}
+    # 格納先の辞書（_REPORT_SCOPE・_RECORD_SCOPE・_REPEAT_SCOPE の順）
+    targets: List[Dict] = [fields, record, {}]
+    root_nodes = _AUTH_ROOT_NODES if auth else _ROOT_NODES
+    stack: List[Tuple] = []
+    parts: List[str] = []
+    capture = parts.append
+    matched = False
+    pending: List[Dict] = []
+    records = 0
+    max_records = limits.records if limits.records is not None else float('inf')
+    max_depth = limits.depth if limits.depth is not None else float('inf')
+    # 読み飛ばし中の部分木の深さと、その上限（読む要素の深さは _CONTAINERS で決まる）
+    skip_depth = 0
+    skip_limit = 0
+
+    def start(name: str, attrs) -> None:
+        nonlocal record, skip_depth, skip_limit
+        if not stack:
+            stack.append(('', _CONTAINER, _REPORT_SCOPE, root_nodes))
+            return
+        node = stack[-1][3].get(name)
+        if node is not None:
+            path, kind, scope, _ = node
+            if kind == _RECORD:
+                record = targets[_RECORD_SCOPE] = {}
+            elif kind == _REPEAT:
+                entry = targets[_REPEAT_SCOPE] = {}
+                entries = record.get(path)
+                if entries is None:
+                    record[path] = [entry]
+                else:
+                    entries.append(entry)
+            elif path in targets[scope]:
+                # 親の中で2つ目以降の同名要素（find() は最初の1つだけを返す）
+                node = None
+            elif kind == _LEAF:
+                parts.clear()
+                parser.CharacterDataHandler = capture
+            else:
+                targets[scope][path] = True
+        if node is None:
+            skip_depth = 1
+            skip_limit = max_depth - len(stack)
+            if skip_limit < 1:
+                raise _depth_error(limits)
+            parser.CharacterDataHandler = None
+            parser.StartElementHandler = skip_start
+            parser.EndElementHandler = skip_end
+            return
+        if len(stack) >= max_depth:
+            raise _depth_error(limits)
+        stack.append(node)
+
+    def end(name: str) -> None:
+        nonlocal matched, records
+        path, kind, scope, _ = stack.pop()
+        if kind == _LEAF:
+            parser.CharacterDataHandler = None
+            targets[scope][path] = ''.join(parts) or None
+        elif kind == _RECORD:
+            records += 1
+            if records > max_records:
+                raise _records_error(limits)
+            if domains is not None and not matched:
+                pending.append(record)
+            else:
+                on_record(record)
+        elif path == 'policy_published' and domains is not None:
+            domain = fields.get('policy_published/domain')
+            if (domain or '').lower() not in domains:
+                raise _StopParsing()
+            matched = True
+            for held in pending:
+                on_record(held)
+            pending.clear()
+
+    def skip_start(name: str, attrs) -> None:
+        nonlocal skip_depth
+        skip_depth += 1
+        if skip_depth > skip_limit:
+            raise _depth_error(limits)
+
+    def skip_end(name: str) -> None:
+        nonlocal skip_depth
+        skip_depth -= 1
+        if skip_depth == 0:
+            parser.StartElementHandler = start
+            parser.EndElementHandler = end
+
+    def entity_decl(*args) -> None:
+        raise _entity_error()
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.EntityDeclHandler = entity_decl
+    try:
+        parser.Parse(xml_content, True)
+    except _StopParsing:
+        return None
+    except expat.ExpatError as e:
+        error = ParseError(f"{expat.ErrorString(e.code)}: line {e.lineno}, column {e.offset}")
+        error.code = e.code
+        error.position = (e.lineno, e.offset)
+        raise error from None
+    if domains is not None and not matched:
+        return None
+    return fields
+
+
+def _count(value: Optional[str]) -> int:
+    """row/count の値（0以上で、バイナリキャッシュ・列データに保存できる整数）"""
+    return _int_field(value, 'row/count', minimum=0, maximum=MAX_COUNT)
+
+
+def _report_dates(fields: Dict, target: Dict) -> None:
+    for field, path in (('date_begin', 'report_metadata/date_range/begin'),
+                        ('date_end', 'report_metadata/date_range/end')):
+        if path in fields:
+            target[field] = _int_field(fields[path], path.partition('/')[2])
+
+
+def _auth_of(record: Dict, count: int) -> Tuple:
+    """_scan_report(auth=True) のレコードの辞書から _auth_of_element と同じ形に"""
+    return (
+        count,
+        record.get('record/identifiers/header_from'),
+        [(e.get('record/auth_results/dkim/domain'), e.get('record/auth_results/dkim/selector'),
+          e.get('record/auth_results/dkim/result'))
+         for e in record.get('record/auth_results/dkim', ())],
+        [(e.get('record/auth_results/spf/domain'), e.get('record/auth_results/spf/result'))
+         for e in record.get('record/auth_results/spf', ())],
+    )
+
+
+def _parse_report_expat(xml_content: str, limits: ReportLimits,
+                        auth: bool = False) -> Tuple[Dict, List[Row]]:
+    rows: List[Row] = []
+    auth_records: List[Tuple] = []
+
+    def on_record(record: Dict) -> None:
+        if 'record/row' not in record:
+            return
+        get = record.get
+        count = _count(record['record/row/count']) if 'record/row/count' in record else 0
+        if auth:
+            auth_records.append(_auth_of(record, count))
+        # policy_evaluated がないレコードは etree 版と同じく読み飛ばす
+        if 'record/row/policy_evaluated' not in record:
+            return
+        rows.append((
+            get('record/row/source_ip', ''),
+            count,
+            get('record/row/policy_evaluated/disposition', ''),
+            get('record/row/policy_evaluated/dkim', 'fail'),
+            get('record/row/policy_evaluated/spf', 'fail'),
+        ))
+
+    fields = _scan_report(xml_content, on_record, limits=limits, auth=auth)
+    report_info = {
+        'org_name': fields.get('report_metadata/org_name'),
+        'report_id': fields.get('report_metadata/report_id'),
+        'date_begin': None,
+        'date_end': None,
+    }
+    _report_dates(fields, report_info)
+    policy_info = {}
+    if 'policy_published' in fields:
+        policy_info = {name: fields.get(f'policy_published/{name}', '')
+                       for name in ('domain', 'p', 'sp', 'adkim', 'aspf')}
+    report_info['policy'] = policy_info
+    if auth:
+        report_info['auth_results'] = _auth_breakdown(policy_info, auth_records)
+    return report_info, rows
+
+
+def _parse_report_metadata_expat(xml_content: str, domains: Optional[Set[str]],
+                                 limits: ReportLimits, auth: bool = False) -> Optional[Dict]:
+    metadata = new_report_metadata()
+    auth_records: List[Tuple] = []
+
+    def on_record(record: Dict) -> None:
+        if auth and 'record/row' in record:
+            count = _count(record['record/row/count']) if 'record/row/count' in record else 0
+            auth_records.append(_auth_of(record, count))
+        if 'record/row/count' not in record:
+            return
+        count = _count(record['record/row/count'])
+        metadata['total_messages'] += count
+        dkim = 'record/row/policy_evaluated/dkim'
+        spf = 'record/row/policy_evaluated/spf'
+        if dkim in record and spf in record:
+            if record[dkim] == 'pass' and record[spf] == 'pass':
+                metadata['pass_count'] += count
+            else:
+                metadata['fail_count'] += count
+
+    # ドメイン指定時は対象外と分かった時点で打ち切り、残りを読まない
+    fields = _scan_report(xml_content, on_record, domains, limits=limits, auth=auth)
+    if fields is None:
+        return None
+    for field in ('org_name', 'email', 'report_id'):
+        metadata[field] = fields.get(f'report_metadata/{field}')
+    _report_dates(fields, metadata)
+    metadata['domain'] = fields.get('policy_published/domain')
+    metadata['policy'] = fields.get('policy_published/p')
+    if auth:
+        policy_info = {name: fields.get(f'policy_published/{name}') for name in ('domain', 'adkim', 'aspf')}
+        metadata['auth_results'] = _auth_breakdown(policy_info, auth_records)
+    return metadata
+
+
+def benchmark_backends(contents: List[str], runs: int = 3) -> Dict[str, Dict]:
+    """各バックエンドで contents を parse_report し、最速の回の時間とレコード数を返す
+
+    バックエンド間で結果が異なれば ValueError。
+    """
+    import time
+    results = {}
+    expected = None
+    for backend in XML_BACKENDS:
+        best = None
+        for _ in range(runs):
+            parsed = []
+            start = time.process_time()
+            for content in contents:
+                try:
+                    parsed.append(parse_report(content, backend))
+                except ParseError as e:
+                    parsed.append(str(e))
+            elapsed = time.process_time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        if expected is None:
+            expected = parsed
+        elif parsed != expected:
+            raise ValueError(f"{backend} の結果が {XML_BACKENDS[0]} と一致しません")
+        records = sum(len(p[1]) for p in parsed if isinstance(p, tuple))
+        results[backend] = {
+            'seconds': best,
+            'records': records,
+            'us_per_record': best / records * 1e6 if records else 0.0,
+        }
+    return results
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+"""
+DMARCレポートの非同期取り込みパイプライン
+ファイル探索 → 読み込み・展開（スレッドプール）→ パース（プロセスプール）→ 逆引きDNS（非同期）
+→ 集計（単一コンシューマ）を上限付きキューでつなぎ、各段を並行に動かす
+メモリ使用量はキューの上限とワーカー数で抑えられる
+"""
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from dmarc_parse import ReportLimits
+
+# 段の終了を下流に伝える番兵
+_DONE = object()
+
+
+def parse_for_analyzer(xml_content: str, backend: Optional[str] = None,
+                       limits: Optional['ReportLimits'] = None,
+                       auth: bool = False) -> Tuple[Optional[Tuple], Optional[str], Optional[str]]:
+    """プロセスプール用: 分析ツール形式でパース（(結果, エラー, 失敗理由) を返す）"""
+    from dmarc_parse import ParseError, ReportLimitError, parse_report
+    try:
+        return parse_report(xml_content, backend, limits, auth), None, None
+    except ReportLimitError as e:
+        return None, f"レポートを拒否: {e}", e.reason
+    except ParseError as e:
+        return None, f"XMLパースエラー: {e}", 'parse_error'
+
+
+def parse_for_checker(xml_content: str, domains: Optional[Set[str]] = None,
+                      backend: Optional[str] = None,
+                      limits: Optional['ReportLimits'] = None,
+                      auth: bool = False) -> Tuple[Optional[Dict], Optional[str], Optional[str]]:
+    """プロセスプール用: 受信確認ツール形式でパース（(結果, エラー, 失敗理由) を返す）
+
+    domains 指定時、対象外ドメインのレポートは (None, None, None)。
+    """
+    from dmarc_parse import ParseError, ReportLimitError, parse_report_metadata
+    try:
+        return parse_report_metadata(xml_content, domains, backend, limits, auth), None, None
+    except ReportLimitError as e:
+        return None, f"レポートを拒否: {e}", e.reason
+    except ParseError as e:
+        return None, f"XMLパースエラー: {e}", 'parse_error'
+
+
+class PipelineItem:
+    """パイプラインを流れる1ファイル分のデータ"""
+
+    __slots__ = ('seq', 'path', 'content', 'parsed', 'error', 'error_stage', 'error_reason',
+                 'hostnames')
+
+    def __init__(self, seq: int, path: str):
+        self.seq = seq
+        self.path = path
+        self.content: Optional[str] = None
+        self.parsed = None
+        self.error: Optional[str] = None
+        # 'read' または 'parse'
+        self.error_stage: Optional[str] = None
+        # 失敗理由（read_error・parse_error、上限超過なら ReportLimitError.reason）
+        self.error_reason: Optional[str] = None
+        self.hostnames: Dict[str, str] = {}
+
+
+class IngestPipeline:
+    """上限付きキューで段をつないだ asyncio パイプライン
+
+    handle(item) は集計段で1件ずつ、到着順に呼ばれる（item.seq が入力順）。
+    ordered が True なら入力順に並べ直してから呼ぶ。並べ直しを待つ件数が増え続けないよう、
+    handle 待ちの最も古い要素から reorder_window 件先までしか探索段に流さない。
+    keep_content が False ならパース後にXML本文を破棄してメモリを抑える。
+    resolve が指定されていれば ips_of(parsed) のIPを非同期に逆引きし、
+    item.hostnames に格納してから集計段へ渡す（同じIPの問い合わせは1回だけ）。
+    """
+
+    def __init__(self, parse: Callable, handle: Callable[[PipelineItem], None],
+                 resolve: Optional[Callable[[str], str]] = None,
+                 ips_of: Optional[Callable] = None,
+                 read: Optional[Callable[[str], Optional[str]]] = None,
+                 read_workers: int = 4, parse_workers: Optional[int] = None,
+                 dns_concurrency: int = 32, queue_size: int = 16,
+                 keep_content: bool = False, ordered: bool = False,
+                 reorder_window: Optional[int] = None):
+        if read is None:
+            from dmarc_parse import read_report
+            read = read_report
+        self.read = read
+        self.parse = parse
+        self.handle = handle
+        self.resolve = resolve
+        self.ips_of = ips_of
+        self.read_workers = read_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 2
+        self.dns_concurrency = dns_concurrency
+        self.queue_size = queue_size
+        self.keep_content = keep_content
+        self.ordered = ordered
+        # デフォルトは各段のキューとワーカーがすべて埋まる件数（並べ直しで並列度を落とさない）
+        self.reorder_window = reorder_window or (4 * queue_size + read_workers + self.parse_workers)
+        self._dns_cache: Dict[str, asyncio.Future] = {}
+        self.stats = {'files': 0, 'read_errors': 0, 'parse_errors': 0, 'dns_lookups': 0}
+
+    def run(self, paths: Iterable[str]) -> Dict:
+        """パイプラインを実行し、処理件数などの統計を返す"""
+        asyncio.run(self._run(paths))
+        return self.stats
+
+    async def _run(self, paths: Iterable[str]) -> None:
+        loop = asyncio.get_running_loop()
+        discovered = asyncio.Queue(self.queue_size)
+        read_q = asyncio.Queue(self.queue_size)
+        parsed_q = asyncio.Queue(self.queue_size)
+        resolved_q = asyncio.Queue(self.queue_size)
+        # 入力順に集計する場合、handle 待ちの最古の要素から先に流せる件数
+        window = asyncio.Semaphore(self.reorder_window) if self.ordered else None
+
+        with ThreadPoolExecutor(self.read_workers) as io_pool, \
+                ThreadPoolExecutor(self.dns_concurrency) as dns_pool, \
+                ProcessPoolExecutor(self.parse_workers) as cpu_pool:
+
+            async def read_one(item: PipelineItem) -> PipelineItem:
+                try:
+                    item.content = await loop.run_in_executor(io_pool, self.read, item.path)
+                except Exception as e:
+                    item.error = f"エラー: {item.path} の展開に失敗: {e}"
+                    item.error_stage = 'read'
+                    item.error_reason = getattr(e, 'reason', 'read_error')
+                    self.stats['read_errors'] += 1
+                return item
+
+            async def parse_one(item: PipelineItem) -> PipelineItem:
+                if item.error is None and item.content:
+                    item.parsed, item.error, item.error_reason = await loop.run_in_executor(
+                        cpu_pool, self.parse, item.content)
+                    if item.error is not None:
+                        item.error_stage = 'parse'
+                        self.stats['parse_errors'] += 1
+                if not self.keep_content:
+                    item.content = None
+                return item
+
+            async def lookup(ip: str) -> str:
+                future = self._dns_cache.get(ip)
+                if future is None:
+                    self.stats['dns_lookups'] += 1
+                    future = loop.run_in_executor(dns_pool, self.resolve, ip)
+                    self._dns_cache[ip] = future
+                return await future
+
+            async def resolve_one(item: PipelineItem) -> PipelineItem:
+                if self.resolve is not None and item.parsed is not None:
+                    ips = sorted(set(self.ips_of(item.parsed)))
+                    names = await asyncio.gather(*(lookup(ip) for ip in ips))
+                    item.hostnames = dict(zip(ips, names))
+                return item
+
+            async def discover() -> None:
+                for seq, path in enumerate(paths):
+                    if window is not None:
+                        await window.acquire()
+                    self.stats['files'] += 1
+                    await discovered.put(PipelineItem(seq, path))
+                for _ in range(self.read_workers):
+                    await discovered.put(_DONE)
+
+            async def aggregate() -> None:
+                pending: Dict[int, PipelineItem] = {}
+                next_seq = 0
+                while True:
+                    item = await resolved_q.get()
+                    if item is _DONE:
+                        break
+                    if window is None:
+                        self.handle(item)
+                        continue
+                    # 最古の要素は必ず窓の中にあるため、待ちが窓の大きさを超えることはない
+                    pending[item.seq] = item
+                    while next_seq in pending:
+                        self.handle(pending.pop(next_seq))
+                        next_seq += 1
+                        window.release()
+
+            await asyncio.gather(
+                discover(),
+                self._stage(discovered, read_q, self.read_workers, read_one, self.parse_workers),
+                self._stage(read_q, parsed_q, self.parse_workers, parse_one, self.dns_concurrency),
+                self._stage(parsed_q, resolved_q, self.dns_concurrency, resolve_one, 1),
+                aggregate(),
+            )
+
+    @staticmethod
+    async def _stage(in_q: asyncio.Queue, out_q: asyncio.Queue, workers: int,
+                     func: Callable, downstream_workers: int) -> None:
+        """in_q から取り出した要素を func で処理して out_q へ（workers 個を並行実行）"""
+        async def worker() -> None:
+            while True:
+                item = await in_q.get()
+                if item is _DONE:
+                    return
+                await out_q.put(await func(item))
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        for _ in range(downstream_workers):
+            await out_q.put(_DONE)
+
+
+def report_ips(parsed: Tuple) -> List[str]:
+    """parse_for_analyzer の結果から送信元IPを取り出す"""
+    _, rows = parsed
+    return [row[0] for row in rows]
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+"""
+解析済みDMARCレコードのバイナリキャッシュ
+レコード（row）を固定長バイナリで保存し、再分析時はメモリマップして直接集計する
+（XMLの展開・パース・逆引きを省略）
+
+ファイル構成:
+  <path>       ヘッダー + 固定長レコード列
+  <path>.json  文字列テーブル・結果コード表・レポート情報・入力ファイル一覧
+"""
+
+import os
+import json
+import mmap
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple
+
+CACHE_MAGIC = b'DMRCROWS'
+# 3: 欠落した結果・処理内容（None）を空文字列と区別して保存
+CACHE_VERSION = 3
+
+# magic, version, レコード数
+HEADER = struct.Struct('<8sIQ')
+# 送信元IPの文字列ID, count, spf, dkim, disposition, 予約（0）, レポート番号, ホスト名の文字列ID
+# 送信元IPはレポートに書かれた文字列のまま保存し、XMLから集計した場合と同じ値に戻す
+ROW = struct.Struct('<IQBBBxII')
+
+NO_STRING = 0xFFFFFFFF
+# ROW の count（符号なし64ビット）に保存できる最大のメール数
+MAX_COUNT = 2 ** 64 - 1
+
+
+def file_signature(filepath: str) -> List:
+    """キャッシュの有効性判定に使うファイル情報"""
+    st = os.stat(filepath)
+    return [os.path.abspath(filepath), st.st_size, st.st_mtime_ns]
+
+
+class _Interner:
+    """文字列（または None）を連番IDに変換"""
+
+    def __init__(self, values: Optional[List[str]] = None):
+        self.values: List[Optional[str]] = list(values or [])
+        self.ids = {v: i for i, v in enumerate(self.values)}
+
+    def intern(self, value: Optional[str]) -> int:
+        index = self.ids.get(value)
+        if index is None:
+            index = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+
+class _RowEncoder:
+    """レコードを ROW 形式に変換する（文字列テーブル・結果コード表を持つ）"""
+
+    def __init__(self):
+        self.strings = _Interner()
+        # 結果コードは 1 バイトに収まる小さな表。欠落した値（None）も '' とは別のコードにする
+        self.results = _Interner(['pass', 'fail', 'none'])
+        self.dispositions = _Interner(['none', 'quarantine', 'reject'])
+
+    def pack_row(self, source_ip: str, count: int, spf: Optional[str], dkim: Optional[str],
+                 disposition: Optional[str], report_index: int, hostname: Optional[str]) -> bytes:
+        """レコード1件分のバイト列（保存できない値なら何も登録せずに ValueError）"""
+        if not 0 <= count <= MAX_COUNT:
+            raise ValueError(f"メール数が保存できる範囲外です: {count}")
+        spf_code = self.results.intern(spf)
+        dkim_code = self.results.intern(dkim)
+        disposition_code = self.dispositions.intern(disposition)
+        if max(spf_code, dkim_code, disposition_code) > 0xFF:
+            raise ValueError("結果コードの種類が多すぎます")
+        ip_id = self.strings.intern(source_ip)
+        hostname_id = NO_STRING if hostname is None else self.strings.intern(hostname)
+        return ROW.pack(ip_id, count, spf_code, dkim_code, disposition_code,
+                        report_index, hostname_id)
+
+
+class RowCacheWriter(_RowEncoder):
+    """レコードを一時ファイルに逐次書き込み、close() でキャッシュを置き換える
+
+    途中で失敗した場合は abort() で一時ファイルを削除する（既存のキャッシュはそのまま）。
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._tmp_path = path + '.tmp'
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(HEADER.pack(CACHE_MAGIC, CACHE_VERSION, 0))
+        self.row_count = 0
+        self.reports: List[Dict] = []
+
+    def add_report(self, info: Dict) -> None:
+        """レポート情報を追加（直前までに追加したレコードがこのレポートに属する）"""
+        self.reports.append(info)
+
+    def add_row(self, source_ip: str, count: int, spf: Optional[str], dkim: Optional[str],
+                disposition: Optional[str], hostname: Optional[str]) -> None:
+        self._file.write(self.pack_row(source_ip, count, spf, dkim, disposition,
+                                       len(self.reports), hostname))
+        self.row_count += 1
+
+    def close(self, files: List[List]) -> None:
+        """ヘッダーを確定し、メタデータを書き出してキャッシュを置き換える"""
+        self._file.seek(0)
+        self._file.write(HEADER.pack(CACHE_MAGIC, CACHE_VERSION, self.row_count))
+        self._file.close()
+
+        meta = {
+            'version': CACHE_VERSION,
+            'files': files,
+            'strings': self.strings.values,
+            'results': self.results.values,
+            'dispositions': self.dispositions.values,
+            'reports': self.reports
+        }
+        with open(self.path + '.json.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(self._tmp_path, self.path)
+        os.replace(self.path + '.json.tmp', self.path + '.json')
+
+    def abort(self) -> None:
+        """書き込み中の一時ファイルを削除"""
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class RowCache:
+    """キャッシュファイルをメモリマップして読み出す"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path + '.json', 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.row_count = HEADER.unpack_from(self._map, 0)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION or self.meta.get('version') != CACHE_VERSION:
+            self.close()
+            raise ValueError(f"キャッシュ形式が一致しません: {path}")
+        if HEADER.size + self.row_count * ROW.size > len(self._map):
+            self.close()
+            raise ValueError(f"キャッシュが途中で切れています: {path}")
+
+    @classmethod
+    def open_if_valid(cls, path: str, files: List[List]) -> Optional['RowCache']:
+        """入力ファイルが一致する場合のみキャッシュを開く"""
+        if not os.path.exists(path) or not os.path.exists(path + '.json'):
+            return None
+        try:
+            cache = cls(path)
+        except (OSError, ValueError):
+            return None
+        if cache.meta.get('files') != files:
+            cache.close()
+            return None
+        return cache
+
+    @property
+    def reports(self) -> List[Dict]:
+        return self.meta['reports']
+
+    def iter_rows(self) -> Iterator[Tuple[str, int, Optional[str], Optional[str], Optional[str],
+                                          Optional[str], int]]:
+        """(source_ip, count, spf, dkim, disposition, hostname, レポート番号) を順に返す"""
+        strings = self.meta['strings']
+        results = self.meta['results']
+        dispositions = self.meta['dispositions']
+        view = self.rows_view()
+        try:
+            for ip_id, count, spf, dkim, disposition, report_index, hostname_id \
+                    in ROW.iter_unpack(view):
+                hostname = None if hostname_id == NO_STRING else strings[hostname_id]
+                yield (strings[ip_id], count, results[spf], results[dkim],
+                       dispositions[disposition], hostname, report_index)
+        finally:
+            view.release()
+
+    def rows_view(self) -> memoryview:
+        """レコード列部分のメモリビュー（使用後は release() すること）"""
+        return memoryview(self._map)[HEADER.size:HEADER.size + self.row_count * ROW.size]
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+"""
+DMARCレポートのセグメントストア
+処理済みレポートを大きな圧縮セグメントファイルに追記し、サイドカーインデックス
+（report_id・送信元組織・期間・オフセット）で管理する
+再分析時は指定期間と重なるセグメントだけを順次読み込む
+"""
+
+import os
+import gzip
+import json
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+# セグメントの切り替えサイズ（圧縮後）
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+
+
+def parse_date(value: str) -> int:
+    """YYYY-MM-DD 形式の日付を UNIX 時刻に変換"""
+    return int(datetime.strptime(value, '%Y-%m-%d').timestamp())
+
+
+def overlaps(begin: Optional[int], end: Optional[int],
+             since: Optional[int], until: Optional[int]) -> bool:
+    """期間 [begin, end] が [since, until) と重なるか（期間不明は常に対象）"""
+    if begin is None or end is None:
+        return True
+    if since is not None and end < since:
+        return False
+    if until is not None and begin >= until:
+        return False
+    return True
+
+
+class SegmentStore:
+    """追記専用の圧縮セグメントストア
+
+    各レポートは独立した gzip メンバーとしてセグメントに追記されるため、
+    インデックスのオフセットから個別に読み出すことも、セグメント全体を
+    先頭から順に読むこともできる。
+    """
+
+    def __init__(self, root: str, segment_bytes: int = DEFAULT_SEGMENT_BYTES):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self._index: Dict[str, List[Dict]] = {}
+        self._known = set()
+        for name in self.segment_names():
+            entries = self._read_index(name)
+            self._index[name] = entries
+            for entry in entries:
+                self._known.add((entry.get('org_name'), entry.get('report_id')))
+
+    def segment_names(self) -> List[str]:
+        """セグメント名の一覧（作成順）"""
+        names = [f[:-len(SEGMENT_SUFFIX)] for f in os.listdir(self.root)
+                 if f.startswith(SEGMENT_PREFIX) and f.endswith(SEGMENT_SUFFIX)]
+        return sorted(names)
+
+    def _path(self, name: str, suffix: str) -> str:
+        return os.path.join(self.root, name + suffix)
+
+    def _read_index(self, name: str) -> List[Dict]:
+        path = self._path(name, INDEX_SUFFIX)
+        if not os.path.exists(path):
+            return []
+        entries = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entries.append(json.loads(line))
+        return entries
+
+    def _current_segment(self) -> str:
+        """追記先のセグメント名（サイズ超過時は新規作成）"""
+        names = self.segment_names()
+        if names:
+            last = names[-1]
+            if os.path.getsize(self._path(last, SEGMENT_SUFFIX)) < self.segment_bytes:
+                return last
+            number = int(last[len(SEGMENT_PREFIX):]) + 1
+        else:
+            number = 1
+        name = f"{SEGMENT_PREFIX}{number:06d}"
+        open(self._path(name, SEGMENT_SUFFIX), 'ab').close()
+        self._index[name] = []
+        return name
+
+    def contains(self, org_name: Optional[str], report_id: Optional[str]) -> bool:
+        return report_id is not None and (org_name, report_id) in self._known
+
+    def append(self, xml_content: str, metadata: Dict, source: str = '') -> bool:
+        """レポートを追記（同じ組織・report_id が格納済みなら False）"""
+        org_name = metadata.get('org_name')
+        report_id = metadata.get('report_id')
+        if self.contains(org_name, report_id):
+            return False
+
+        name = self._current_segment()
+        data = gzip.compress(xml_content.encode('utf-8'), mtime=0)
+        with open(self._path(name, SEGMENT_SUFFIX), 'ab') as f:
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        entry = {
+            'report_id': report_id,
+            'org_name': org_name,
+            'date_begin': metadata.get('date_begin'),
+            'date_end': metadata.get('date_end'),
+            'offset': offset,
+            'length': len(data),
+            'source': source
+        }
+        # データ書き込み後にインデックスへ追記（途中で落ちても不整合にならない）
+        with open(self._path(name, INDEX_SUFFIX), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+        self._index[name].append(entry)
+        self._known.add((org_name, report_id))
+        return True
+
+    def segment_range(self, name: str) -> Tuple[Optional[int], Optional[int]]:
+        """セグメントに含まれるレポートの期間"""
+        entries = self._index.get(name, [])
+        begins = [e['date_begin'] for e in entries if e.get('date_begin') is not None]
+        ends = [e['date_end'] for e in entries if e.get('date_end') is not None]
+        if len(begins) != len(entries) or len(ends) != len(entries) or not entries:
+            return None, None
+        return min(begins), max(ends)
+
+    def select_segments(self, since: Optional[int] = None,
+                        until: Optional[int] = None) -> List[str]:
+        """期間と重なるセグメントを選択"""
+        return [name for name in self.segment_names()
+                if self._index.get(name) and overlaps(*self.segment_range(name), since, until)]
+
+    def iter_reports(self, since: Optional[int] = None,
+                     until: Optional[int] = None) -> Iterator[Tuple[Dict, str]]:
+        """期間と重なるレポートを (インデックスエントリ, XML) で順に返す"""
+        for name in self.select_segments(since, until):
+            entries = sorted(self._index[name], key=lambda e: e['offset'])
+            with open(self._path(name, SEGMENT_SUFFIX), 'rb') as f:
+                for entry in entries:
+                    if not overlaps(entry.get('date_begin'), entry.get('date_end'), since, until):
+                        continue
+                    # オフセット順に読むため、連続するレポートはシーク不要
+                    if f.tell() != entry['offset']:
+                        f.seek(entry['offset'])
+                    data = f.read(entry['length'])
+                    yield entry, gzip.decompress(data).decode('utf-8')
+
+    def stats(self) -> Dict:
+        names = self.segment_names()
+        return {
+            'segments': len(names),
+            'reports': sum(len(self._index.get(n, [])) for n in names),
+            'bytes': sum(os.path.getsize(self._path(n, SEGMENT_SUFFIX)) for n in names)
+        }
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+"""
+DMARCポリシーの試算（シミュレーション）
+過去のレポートのレコードを候補のポリシー（p・sp・pct・adkim・aspf）で評価し直し、
+隔離・拒否されるメール数を送信元IP別・報告組織別に求める
+レコードは読み込みながら (送信元IP, 報告組織, 認証結果のビット列) ごとにメール数を
+合算した表にまとめ、候補ごとの判定はその表全体への NumPy の配列演算で行う
+（候補がいくつあってもレポートの読み込み・パースは1回）
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dmarc_auth import organizational_domain
+from dmarc_rowcache import _Interner
+
+# レコードごとの認証結果のビット
+DKIM_STRICT = 1      # adkim=s でアライメントが取れる DKIM 署名が pass
+DKIM_RELAXED = 2     # adkim=r でアライメントが取れる DKIM 署名が pass
+SPF_STRICT = 4
+SPF_RELAXED = 8
+DKIM_AUTH = 16       # アライメントに関係なく DKIM 署名が pass
+SPF_AUTH = 32        # アライメントに関係なく SPF が pass
+SUBDOMAIN = 64       # header_from がポリシー公開ドメインと異なる（sp が適用される）
+# 報告された処理内容は上位のビットに持つ
+DISPOSITION_SHIFT = 7
+
+POLICIES = ('none', 'quarantine', 'reject')
+# 報告された処理内容のコード（POLICIES の添字、それ以外は不明）
+_UNKNOWN_DISPOSITION = len(POLICIES)
+
+# 候補を指定しなかったときに試算するポリシー
+DEFAULT_CANDIDATES = (
+    'p=none',
+    'p=quarantine; pct=25',
+    'p=quarantine',
+    'p=reject',
+    'p=reject; adkim=s; aspf=s',
+)
+
+# 各一覧に表示する件数
+DEFAULT_TOP = 10
+
+# 配列演算を行う行数の単位（候補数 × この行数の配列を作る）
+BLOCK_ROWS = 262144
+
+
+class PolicyCandidate:
+    """試算するポリシー（sp を省略したときは p を使う）"""
+
+    __slots__ = ('p', 'sp', 'pct', 'adkim', 'aspf')
+
+    def __init__(self, p: str, sp: Optional[str] = None, pct: int = 100,
+                 adkim: str = 'r', aspf: str = 'r'):
+        self.p = p
+        self.sp = sp or p
+        self.pct = pct
+        self.adkim = adkim
+        self.aspf = aspf
+
+    @classmethod
+    def parse(cls, spec: str) -> 'PolicyCandidate':
+        """'p=reject; sp=quarantine; pct=50; adkim=s' の形式（区切りは ; か ,、v= は無視）
+
+        不正な指定は ValueError。
+        """
+        tags = {}
+        for part in spec.replace(',', ';').split(';'):
+            part = part.strip()
+            if not part:
+                continue
+            name, sep, value = part.partition('=')
+            name, value = name.strip().lower(), value.strip().lower()
+            if not sep or name not in ('v', 'p', 'sp', 'pct', 'adkim', 'aspf'):
+                raise ValueError(f"ポリシーの指定が不正です: {part}")
+            tags[name] = value
+        if 'p' not in tags:
+            raise ValueError(f"p= を指定してください: {spec}")
+        for name in ('p', 'sp'):
+            if name in tags and tags[name] not in POLICIES:
+                raise ValueError(f"{name}= は {'/'.join(POLICIES)} のいずれかです: {tags[name]}")
+        for name in ('adkim', 'aspf'):
+            if name in tags and tags[name] not in ('r', 's'):
+                raise ValueError(f"{name}= は r か s です: {tags[name]}")
+        pct = 100
+        if 'pct' in tags:
+            try:
+                pct = int(tags['pct'])
+            except ValueError:
+                pct = -1
+            if not 0 <= pct <= 100:
+                raise ValueError(f"pct= は 0〜100 の整数です: {tags['pct']}")
+        return cls(tags['p'], tags.get('sp'), pct, tags.get('adkim', 'r'), tags.get('aspf', 'r'))
+
+    def label(self) -> str:
+        """DMARCレコードと同じ並びの表記（既定値のタグは省略）"""
+        tags = [f"p={self.p}"]
+        if self.sp != self.p:
+            tags.append(f"sp={self.sp}")
+        if self.pct != 100:
+            tags.append(f"pct={self.pct}")
+        if self.adkim != 'r':
+            tags.append(f"adkim={self.adkim}")
+        if self.aspf != 'r':
+            tags.append(f"aspf={self.aspf}")
+        return '; '.join(tags)
+
+
+def _auth_flags(results: List[Tuple[str, str]], from_domain: str, from_org: str,
+                strict: int, relaxed: int, auth: int) -> int:
+    flags = 0
+    for domain, result in results:
+        if result != 'pass':
+            continue
+        flags |= auth
+        domain = domain.lower().rstrip('.')
+        if not from_domain or not domain:
+            continue
+        if domain == from_domain:
+            flags |= strict | relaxed
+        elif organizational_domain(domain) == from_org:
+            flags |= relaxed
+    return flags
+
+
+def _aligned(flags: int, evaluated: str, mode: str, strict: int, relaxed: int) -> int:
+    """報告側の評価（公開されていたアライメントモードでの結果）を優先してビットを確定
+
+    公開モードでの結果は policy_evaluated をそのまま使い、もう一方のモードだけを
+    auth_results から求める（strict で pass なら relaxed でも pass）。
+    """
+    passed = evaluated == 'pass'
+    if mode == 's':
+        flags &= ~strict
+        if passed:
+            flags |= strict | relaxed
+    else:
+        flags &= ~relaxed
+        if passed:
+            flags |= relaxed
+        else:
+            flags &= ~strict
+    return flags
+
+
+def row_flags(policy: Dict, row: Tuple) -> int:
+    """dmarc_parse.parse_report_auth のレコードを認証結果のビット列に"""
+    _, _, disposition, dkim, spf, header_from, dkim_auth, spf_auth = row
+    published = (policy.get('domain') or '').lower().rstrip('.')
+    from_domain = (header_from or '').lower().rstrip('.') or published
+    from_org = organizational_domain(from_domain)
+
+    flags = _auth_flags(dkim_auth, from_domain, from_org, DKIM_STRICT, DKIM_RELAXED, DKIM_AUTH)
+    flags |= _auth_flags(spf_auth, from_domain, from_org, SPF_STRICT, SPF_RELAXED, SPF_AUTH)
+    flags = _aligned(flags, dkim, policy.get('adkim') or 'r', DKIM_STRICT, DKIM_RELAXED)
+    flags = _aligned(flags, spf, policy.get('aspf') or 'r', SPF_STRICT, SPF_RELAXED)
+    if published and from_domain != published:
+        flags |= SUBDOMAIN
+    code = POLICIES.index(disposition) if disposition in POLICIES else _UNKNOWN_DISPOSITION
+    return flags | (code << DISPOSITION_SHIFT)
+
+
+class SimulationRows:
+    """試算用のレコード表（(送信元IP, 報告組織, ビット列) ごとのメール数）"""
+
+    def __init__(self):
+        self.sources = _Interner()
+        self.orgs = _Interner()
+        self.counts: Dict[Tuple[int, int, int], int] = {}
+        self.reports = 0
+        self.records = 0
+        self.date_range = {'begin': None, 'end': None}
+
+    def add_report(self, report_info: Dict, rows: Iterable[Tuple]) -> None:
+        """dmarc_parse.parse_report_auth の結果を加算"""
+        self.reports += 1
+        begin, end = report_info.get('date_begin'), report_info.get('date_end')
+        if begin is not None and (self.date_range['begin'] is None or begin < self.date_range['begin']):
+            self.date_range['begin'] = begin
+        if end is not None and (self.date_range['end'] is None or end > self.date_range['end']):
+            self.date_range['end'] = end
+
+        policy = report_info.get('policy') or {}
+        org = self.orgs.intern(report_info.get('org_name') or '')
+        counts = self.counts
+        for row in rows:
+            self.records += 1
+            key = (self.sources.intern(row[0]), org, row_flags(policy, row))
+            counts[key] = counts.get(key, 0) + row[1]
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+
+def _amount(value: float):
+    """pct による期待値は小数になるため、整数でなければ小数1桁に丸める"""
+    return int(value) if float(value).is_integer() else round(float(value), 1)
+
+
+def _top(values, messages, names: List[str], authenticated, limit: int) -> List[Dict]:
+    """影響の大きい順（同じなら名前順）に最大 limit 件（影響0は除く）
+
+    文字列との比較は上位 limit 件に入りうるもの（limit 位と同値のものを含む）だけ行う。
+    """
+    from dmarc_columns import require_numpy
+    np = require_numpy()
+    indices = np.flatnonzero(values > 0)
+    if len(indices) > limit:
+        picked = values[indices]
+        kth = np.partition(picked, len(picked) - limit)[len(picked) - limit]
+        indices = indices[picked >= kth]
+    items = sorted(indices, key=lambda i: (-values[i], names[i]))[:limit]
+    return [{'key': names[i], 'affected': _amount(values[i]),
+             'authenticated': _amount(authenticated[i]), 'messages': int(messages[i])}
+            for i in items]
+
+
+def simulate(rows: SimulationRows, candidates: Sequence[PolicyCandidate],
+             top: int = DEFAULT_TOP) -> Dict:
+    """各候補のポリシーで処理内容を求め、全体と送信元IP別・報告組織別の影響を返す
+
+    DMARC（SPF・DKIM のどちらかがアライメント付きで pass）に失敗したメールのうち
+    pct の割合に p（サブドメインなら sp）を適用し、残りには1段緩い処理（reject は
+    quarantine、quarantine は none）を適用した期待値を数える。affected は隔離・拒否の合計、
+    authenticated はそのうちアライメントは取れないが SPF か DKIM 自体は pass している
+    メール（正規の送信元の設定不備である可能性が高い）。
+    """
+    from dmarc_columns import require_numpy
+    np = require_numpy()
+
+    n = len(rows.counts)
+    keys = np.fromiter((v for key in rows.counts for v in key), dtype=np.int64,
+                       count=n * 3).reshape(n, 3)
+    source, org, flags = keys[:, 0], keys[:, 1], keys[:, 2]
+    counts = np.fromiter(rows.counts.values(), dtype=np.float64, count=n)
+    n_sources, n_orgs = len(rows.sources.values), len(rows.orgs.values)
+
+    # 候補を (候補数, 1) の列にして、行との配列演算を候補ごとにまとめて行う
+    def column(values, dtype):
+        return np.array(values, dtype=dtype).reshape(-1, 1)
+
+    dkim_bit = column([DKIM_STRICT if c.adkim == 's' else DKIM_RELAXED for c in candidates], np.int64)
+    spf_bit = column([SPF_STRICT if c.aspf == 's' else SPF_RELAXED for c in candidates], np.int64)
+    p_code = column([POLICIES.index(c.p) for c in candidates], np.int64)
+    sp_code = column([POLICIES.index(c.sp) for c in candidates], np.int64)
+    rate = column([c.pct / 100 for c in candidates], np.float64)
+
+    k = len(candidates)
+    totals = {name: np.zeros(k) for name in ('pass', 'none', 'quarantine', 'reject', 'authenticated')}
+    by_source = {name: np.zeros((k, n_sources)) for name in ('affected', 'authenticated')}
+    by_org = {name: np.zeros((k, n_orgs)) for name in ('affected', 'authenticated')}
+
+    for start in range(0, n, BLOCK_ROWS):
+        block = slice(start, start + BLOCK_ROWS)
+        f, c = flags[block], counts[block]
+        passed = ((f & dkim_bit) != 0) | ((f & spf_bit) != 0)
+        policy = np.where((f & SUBDOMAIN) != 0, sp_code, p_code)
+        failed = np.where(passed, 0.0, c)
+        enforced = failed * rate
+        sampled_out = failed - enforced
+        quarantine = np.where(policy == 1, enforced, 0.0) + np.where(policy == 2, sampled_out, 0.0)
+        reject = np.where(policy == 2, enforced, 0.0)
+        affected = quarantine + reject
+        authenticated = np.where((f & (DKIM_AUTH | SPF_AUTH)) != 0, affected, 0.0)
+
+        totals['pass'] += np.where(passed, c, 0.0).sum(axis=1)
+        totals['quarantine'] += quarantine.sum(axis=1)
+        totals['reject'] += reject.sum(axis=1)
+        totals['authenticated'] += authenticated.sum(axis=1)
+        for i in range(k):
+            for name, values in (('affected', affected[i]), ('authenticated', authenticated[i])):
+                by_source[name][i] += np.bincount(source[block], weights=values, minlength=n_sources)
+                by_org[name][i] += np.bincount(org[block], weights=values, minlength=n_orgs)
+
+    total = float(counts.sum())
+    source_messages = np.bincount(source, weights=counts, minlength=n_sources)
+    org_messages = np.bincount(org, weights=counts, minlength=n_orgs)
+    disposition = flags >> DISPOSITION_SHIFT
+    observed = {name: int(counts[disposition == code].sum()) for code, name in enumerate(POLICIES)}
+    observed['unknown'] = int(counts[disposition == _UNKNOWN_DISPOSITION].sum())
+
+    results = []
+    for i, candidate in enumerate(candidates):
+        affected = totals['quarantine'][i] + totals['reject'][i]
+        results.append({
+            'policy': candidate.label(),
+            'pass': int(totals['pass'][i]),
+            'fail': int(total - totals['pass'][i]),
+            'none': _amount(total - affected),
+            'quarantine': _amount(totals['quarantine'][i]),
+            'reject': _amount(totals['reject'][i]),
+            'affected': _amount(affected),
+            'affected_rate': affected / total if total else 0.0,
+            'authenticated': _amount(totals['authenticated'][i]),
+            'sources': _top(by_source['affected'][i], source_messages, rows.sources.values,
+                            by_source['authenticated'][i], top),
+            'orgs': _top(by_org['affected'][i], org_messages, rows.orgs.values,
+                         by_org['authenticated'][i], top),
+        })
+    return {
+        'messages': int(total),
+        'reports': rows.reports,
+        'records': rows.records,
+        'date_range': rows.date_range,
+        'observed': observed,
+        'candidates': results,
+    }
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+
+"""
+SPFレコード評価モジュール
+ドメインのSPFレコードを include/a/mx/ip4/ip6 まで展開してプレフィックス集合にコンパイルし、
+DMARCレポートでSPF失敗となった送信元IPを二分探索で分類する
+"""
+
+import json
+import ipaddress
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+# SPF失敗の分類
+SPF_NOT_IN_RECORD = 'not_in_spf'
+SPF_MISALIGNED = 'misaligned'
+SPF_INVALID_IP = 'invalid_ip'
+
+SPF_CLASS_LABELS = {
+    SPF_NOT_IN_RECORD: 'SPFレコード外',
+    SPF_MISALIGNED: 'SPF内だがアライメント不一致',
+    SPF_INVALID_IP: '不正なIP',
+}
+
+# RFC 7208 の DNS ルックアップ上限
+MAX_DNS_LOOKUPS = 10
+
+
+class DNSSource:
+    """SPF展開に使うDNS問い合わせのインターフェース"""
+
+    def txt(self, name: str) -> List[str]:
+        raise NotImplementedError
+
+    def a(self, name: str) -> List[str]:
+        raise NotImplementedError
+
+    def aaaa(self, name: str) -> List[str]:
+        raise NotImplementedError
+
+    def mx(self, name: str) -> List[str]:
+        raise NotImplementedError
+
+
+class SystemDNSSource(DNSSource):
+    """実DNSへの問い合わせ（TXT/MX は dnspython が必要）"""
+
+    def __init__(self, timeout: float = 5.0):
+        try:
+            import dns.resolver
+        except ImportError:
+            raise RuntimeError(
+                "SPF評価には dnspython が必要です (pip install dnspython)。"
+                "オフラインでは --spf-stub でスタブレコードを指定してください"
+            )
+        self._resolver = dns.resolver.Resolver()
+        self._resolver.lifetime = timeout
+
+    def _query(self, name: str, rdtype: str) -> List:
+        import dns.exception
+        try:
+            return list(self._resolver.resolve(name, rdtype))
+        except dns.exception.DNSException:
+            return []
+
+    def txt(self, name: str) -> List[str]:
+        return [b''.join(r.strings).decode('utf-8', 'replace') for r in self._query(name, 'TXT')]
+
+    def a(self, name: str) -> List[str]:
+        return [r.address for r in self._query(name, 'A')]
+
+    def aaaa(self, name: str) -> List[str]:
+        return [r.address for r in self._query(name, 'AAAA')]
+
+    def mx(self, name: str) -> List[str]:
+        return [str(r.exchange).rstrip('.') for r in self._query(name, 'MX')]
+
+
+class StubDNSSource(DNSSource):
+    """辞書で与えたレコードを返すローカルスタブ（テスト・オフライン用）
+
+    records の形式: {"example.com": {"TXT": ["v=spf1 ..."], "A": [...], "AAAA": [...], "MX": [...]}}
+    """
+
+    def __init__(self, records: Dict[str, Dict[str, List[str]]]):
+        self.records = {name.lower().rstrip('.'): rrs for name, rrs in records.items()}
+        self.queries = 0
+
+    @classmethod
+    def from_file(cls, filepath: str) -> 'StubDNSSource':
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def _lookup(self, name: str, rdtype: str) -> List[str]:
+        self.queries += 1
+        return list(self.records.get(name.lower().rstrip('.'), {}).get(rdtype, []))
+
+    def txt(self, name: str) -> List[str]:
+        return self._lookup(name, 'TXT')
+
+    def a(self, name: str) -> List[str]:
+        return self._lookup(name, 'A')
+
+    def aaaa(self, name: str) -> List[str]:
+        return self._lookup(name, 'AAAA')
+
+    def mx(self, name: str) -> List[str]:
+        return self._lookup(name, 'MX')
+
+
+def _merge_spans(spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """区間をソートし、重なり・隣接するものを統合"""
+    merged: List[List[int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def _subtract_spans(spans: List[Tuple[int, int]],
+                    removed: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """統合済みの区間 spans から統合済みの区間 removed を除いた区間"""
+    result = []
+    index = 0
+    for start, end in spans:
+        while index < len(removed) and removed[index][1] < start:
+            index += 1
+        current = start
+        cursor = index
+        while cursor < len(removed) and removed[cursor][0] <= end:
+            if removed[cursor][0] > current:
+                result.append((current, removed[cursor][0] - 1))
+            current = max(current, removed[cursor][1] + 1)
+            cursor += 1
+        if current <= end:
+            result.append((current, end))
+    return result
+
+
+def _first_match_pass(rules: List[Tuple[str, Dict[int, List[Tuple[int, int]]]]]
+                      ) -> Dict[int, List[Tuple[int, int]]]:
+    """(修飾子, 区間) の並びを先頭から評価し、最初に一致するのが + の規則になる区間
+
+    先に一致した -, ~, ? の規則の範囲は、後ろの + の規則に含まれていても pass にならない。
+    """
+    result: Dict[int, List[Tuple[int, int]]] = {}
+    for version in (4, 6):
+        decided: List[Tuple[int, int]] = []
+        passed: List[Tuple[int, int]] = []
+        for qualifier, spans in rules:
+            ranges = spans[version]
+            if not ranges:
+                continue
+            if qualifier == '+':
+                passed.extend(_subtract_spans(ranges, decided))
+            decided = _merge_spans(decided + ranges)
+        result[version] = _merge_spans(passed)
+    return result
+
+
+def _network_spans(networks: List) -> Dict[int, List[Tuple[int, int]]]:
+    spans: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+    for net in networks:
+        spans[net.version].append((int(net.network_address), int(net.broadcast_address)))
+    return {version: _merge_spans(ranges) for version, ranges in spans.items()}
+
+
+# all が一致する範囲（IPv4/IPv6 の全アドレス）
+_ALL_SPANS = {4: [(0, 2 ** 32 - 1)], 6: [(0, 2 ** 128 - 1)]}
+
+
+class SPFEvaluator:
+    """SPFレコードを展開・コンパイルして送信元IPを分類する
+
+    メカニズムは RFC 7208 と同じく先頭から評価し、最初に一致したものの修飾子を結果とする。
+    include は取り込んだレコードの結果が pass となる範囲だけが一致する。
+    展開結果（pass となる区間）はドメイン単位でメモ化し、コンパイル後のプレフィックス集合は
+    IPv4/IPv6 ごとに [start, end] のソート済み区間リストとして保持する。
+    メモ化したドメインを再び参照した場合も、DNSルックアップ数は参照のたびに数える。
+    """
+
+    def __init__(self, domain: str, dns_source: Optional[DNSSource] = None):
+        self.domain = domain.lower().rstrip('.')
+        self.dns = dns_source if dns_source is not None else SystemDNSSource()
+        self.warnings: List[str] = []
+        self.lookups = 0
+        # ドメイン -> (pass となる区間, 展開に要したDNSルックアップ数)
+        self._expansions: Dict[str, Tuple[Dict[int, List[Tuple[int, int]]], int]] = {}
+        self._ip_cache: Dict[str, str] = {}
+        self._starts: Dict[int, List[int]] = {4: [], 6: []}
+        self._ends: Dict[int, List[int]] = {4: [], 6: []}
+        self.compile()
+
+    def compile(self) -> None:
+        """SPFレコードを展開し、pass となるソート済み区間に変換"""
+        spans = self._expand(self.domain, set())
+        for version, ranges in spans.items():
+            self._starts[version] = [s for s, _ in ranges]
+            self._ends[version] = [e for _, e in ranges]
+
+        self._ip_cache.clear()
+        if self.lookups > MAX_DNS_LOOKUPS:
+            self.warnings.append(
+                f"DNSルックアップ数が上限を超えています: {self.lookups} > {MAX_DNS_LOOKUPS}"
+            )
+
+    @property
+    def prefix_count(self) -> int:
+        return len(self._starts[4]) + len(self._starts[6])
+
+    def _get_record(self, domain: str) -> Optional[str]:
+        """ドメインの v=spf1 レコードを取得"""
+        records = [r for r in self.dns.txt(domain) if r.lower().startswith('v=spf1')]
+        if not records:
+            self.warnings.append(f"SPFレコードがありません: {domain}")
+            return None
+        if len(records) > 1:
+            self.warnings.append(f"SPFレコードが複数あります: {domain}")
+        return records[0]
+
+    def _expand(self, domain: str, visiting: set) -> Dict[int, List[Tuple[int, int]]]:
+        """ドメインのSPFレコードを pass となる区間に展開（メモ化あり）"""
+        domain = domain.lower().rstrip('.')
+        cached = self._expansions.get(domain)
+        if cached is not None:
+            spans, lookups = cached
+            self.lookups += lookups
+            return spans
+        if domain in visiting:
+            self.warnings.append(f"include がループしています: {domain}")
+            return {4: [], 6: []}
+        visiting.add(domain)
+        lookups_before = self.lookups
+
+        rules: List[Tuple[str, Dict[int, List[Tuple[int, int]]]]] = []
+        redirect = None
+        saw_all = False
+        record = self._get_record(domain)
+        for term in (record.split()[1:] if record else []):
+            if term.lower().startswith('redirect='):
+                redirect = term.split('=', 1)[1]
+                continue
+            if '=' in term.split(':', 1)[0]:
+                # exp= などの修飾子は無視
+                continue
+
+            qualifier = '+'
+            if term[0] in '+-~?':
+                qualifier, term = term[0], term[1:]
+            name, _, arg = term.partition(':')
+            name = name.lower()
+            cidr4, cidr6 = 32, 128
+            try:
+                if '/' in name:
+                    name, cidr4, cidr6 = self._split_cidr(name)
+                elif '/' in arg and name not in ('ip4', 'ip6'):
+                    arg, cidr4, cidr6 = self._split_cidr(arg)
+            except ValueError:
+                self.warnings.append(f"不正なCIDR指定: {term} ({domain})")
+                continue
+
+            if name == 'all':
+                # all 以降のメカニズムと redirect は評価されない
+                rules.append((qualifier, _ALL_SPANS))
+                saw_all = True
+                break
+
+            if name == 'ip4' or name == 'ip6':
+                try:
+                    net = ipaddress.ip_network(arg, strict=False)
+                except ValueError:
+                    net = None
+                if net is None or net.version != int(name[2]):
+                    self.warnings.append(f"不正なIP指定: {term} ({domain})")
+                    continue
+                matched = _network_spans([net])
+            elif name == 'include':
+                self.lookups += 1
+                matched = self._expand(arg, visiting)
+            elif name == 'a':
+                self.lookups += 1
+                matched = _network_spans(self._host_networks(arg or domain, cidr4, cidr6))
+            elif name == 'mx':
+                self.lookups += 1
+                networks: List = []
+                for host in self.dns.mx(arg or domain):
+                    networks.extend(self._host_networks(host, cidr4, cidr6))
+                matched = _network_spans(networks)
+            else:
+                # ptr/exists はIP集合に展開できない
+                if name in ('ptr', 'exists'):
+                    self.lookups += 1
+                self.warnings.append(f"展開できないメカニズム: {term} ({domain})")
+                continue
+            rules.append((qualifier, matched))
+
+        if redirect and not saw_all:
+            # どのメカニズムにも一致しなければ redirect 先の結果になる
+            self.lookups += 1
+            rules.append(('+', self._expand(redirect, visiting)))
+
+        visiting.discard(domain)
+        spans = _first_match_pass(rules)
+        self._expansions[domain] = (spans, self.lookups - lookups_before)
+        return spans
+
+    @staticmethod
+    def _split_cidr(value: str) -> Tuple[str, int, int]:
+        """"host/24//64" 形式を (host, cidr4, cidr6) に分解（不正な長さは ValueError）"""
+        host, _, rest = value.partition('/')
+        cidr4, _, cidr6 = rest.partition('//')
+        if rest.startswith('/'):
+            cidr4, cidr6 = '', rest[1:]
+        cidr4 = int(cidr4) if cidr4 else 32
+        cidr6 = int(cidr6) if cidr6 else 128
+        if not 0 <= cidr4 <= 32 or not 0 <= cidr6 <= 128:
+            raise ValueError(f"invalid cidr length: {value}")
+        return host, cidr4, cidr6
+
+    def _host_networks(self, host: str, cidr4: int, cidr6: int) -> List:
+        """ホストの A/AAAA レコードをネットワークに変換（不正なアドレスは警告して除外）"""
+        networks = []
+        for addr, cidr in ([(a, cidr4) for a in self.dns.a(host)]
+                           + [(a, cidr6) for a in self.dns.aaaa(host)]):
+            try:
+                networks.append(ipaddress.ip_network(f"{addr}/{cidr}", strict=False))
+            except ValueError:
+                self.warnings.append(f"不正なアドレス: {addr} ({host})")
+        return networks
+
+    def contains(self, ip: str) -> Optional[bool]:
+        """IPがSPFの許可範囲に含まれるか（不正なIPは None）"""
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        value = int(addr)
+        starts = self._starts[addr.version]
+        index = bisect_right(starts, value) - 1
+        return index >= 0 and value <= self._ends[addr.version][index]
+
+    def classify_failure(self, ip: str) -> str:
+        """SPF失敗となったIPを分類（IP単位でキャッシュ）"""
+        cached = self._ip_cache.get(ip)
+        if cached is not None:
+            return cached
+
+        covered = self.contains(ip)
+        if covered is None:
+            result = SPF_INVALID_IP
+        elif covered:
+            result = SPF_MISALIGNED
+        else:
+            result = SPF_NOT_IN_RECORD
+        self._ip_cache[ip] = result
+        return result
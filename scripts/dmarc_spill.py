@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+"""
+メモリ上限付きの集計（ディスクへの退避と外部マージ）
+SummaryAggregate の送信元IP別統計・失敗パターン別件数・レポート情報の推定メモリ量が
+上限に達したら、キー順に並べた部分集計を一時ファイル（ラン）に書き出して空にする
+出力時は各ランとメモリ上の残りを heapq.merge で順に読みながら同じキーを合算するため、
+結果はメモリ上だけで集計した場合と完全に一致する
+"""
+
+import os
+import heapq
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dmarc_aggregate import _pick_hostname, report_sort_key
+
+if TYPE_CHECKING:
+    from dmarc_aggregate import SummaryAggregate
+
+# 1件あたりの推定メモリ量（バイト、tracemalloc での実測をもとに切り上げ）
+SOURCE_ENTRY_BYTES = 300
+FAILURE_ENTRY_BYTES = 200
+REPORT_ENTRY_BYTES = 600
+
+# --max-memory のうち集計（送信元・失敗パターン・レポート情報）に割り当てる割合
+# 残りはインタプリタ本体・パース中のXML・逆引きキャッシュなどに使われる
+AGGREGATE_MEMORY_SHARE = 0.5
+
+# ソート用のバッファがこの件数に達したらランとして書き出す
+SORT_BUFFER_ITEMS = 100000
+
+# 失敗の詳細で表示するIP・ホスト名の件数
+SHOWN_PER_GROUP = 5
+
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(value: str) -> int:
+    """'512M' のようなサイズ指定をバイト数に変換（K/M/G、接尾辞なしはバイト）"""
+    text = value.strip().upper().rstrip('B')
+    unit = text[-1:] if text[-1:] in _SIZE_UNITS else ''
+    number = text[:len(text) - len(unit)]
+    try:
+        size = int(float(number) * _SIZE_UNITS[unit])
+    except ValueError:
+        raise ValueError(f"サイズの形式が不正です: {value}")
+    if size <= 0:
+        raise ValueError(f"サイズは正の値で指定してください: {value}")
+    return size
+
+
+def estimated_bytes(summary: 'SummaryAggregate') -> int:
+    """集計が保持している送信元・失敗パターン・レポート情報の推定メモリ量"""
+    return (len(summary.sources) * SOURCE_ENTRY_BYTES
+            + len(summary.failure_counts) * FAILURE_ENTRY_BYTES
+            + len(summary.reports) * REPORT_ENTRY_BYTES)
+
+
+def _failure_key(row: List) -> Tuple:
+    """SummaryAggregate.failures と同じ並び（None は空文字扱い、同値なら None を後に）"""
+    key = row[:5]
+    return tuple(v or '' for v in key), tuple(v is None for v in key)
+
+
+class ExternalSorter:
+    """キー順に並べたランを一時ファイル（gzip の JSON Lines）に書き出し、まとめて順に読み出す
+
+    directory を指定しなければ書き出さず、メモリ上で並べ替えるだけになる。
+    """
+
+    def __init__(self, directory: Optional[str], name: str, key: Optional[Callable] = None,
+                 buffer_items: int = SORT_BUFFER_ITEMS):
+        self.directory = directory
+        self.name = name
+        self.key = key
+        self.buffer_items = buffer_items
+        self.buffer: List = []
+        self.runs: List[str] = []
+
+    def add(self, item) -> None:
+        self.buffer.append(item)
+        if self.directory is not None and len(self.buffer) >= self.buffer_items:
+            self.flush()
+
+    def extend(self, items: Iterable) -> None:
+        for item in items:
+            self.add(item)
+
+    def flush(self) -> None:
+        """バッファを並べ替えてランとして書き出す"""
+        if not self.buffer or self.directory is None:
+            return
+        import gzip
+        import json
+        self.buffer.sort(key=self.key)
+        path = os.path.join(self.directory, f"{self.name}-{len(self.runs):05d}.jsonl.gz")
+        with gzip.open(path, 'wt', encoding='utf-8', compresslevel=1) as f:
+            for item in self.buffer:
+                f.write(json.dumps(item, ensure_ascii=False, default=str))
+                f.write('\n')
+        self.runs.append(path)
+        self.buffer = []
+
+    @staticmethod
+    def _read_run(path: str) -> Iterator:
+        import gzip
+        import json
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def __iter__(self) -> Iterator:
+        """全ランとバッファをキー順に（同じキーはランの書き出し順）"""
+        self.buffer.sort(key=self.key)
+        if not self.runs:
+            return iter(self.buffer)
+        return heapq.merge(*(self._read_run(path) for path in self.runs), self.buffer,
+                           key=self.key)
+
+
+class SummarySpill:
+    """SummaryAggregate の退避先
+
+    退避するのは送信元（IP順）・失敗パターン（failures と同じ順）・レポート情報（report_sort_key 順）。
+    全体のメール数や期間は小さいのでメモリ上の集計に残す。
+    """
+
+    def __init__(self, max_bytes: int, directory: Optional[str] = None):
+        import tempfile
+        self.max_bytes = max_bytes
+        self.directory = tempfile.mkdtemp(prefix='dmarc-spill-', dir=directory)
+        self.sources = ExternalSorter(self.directory, 'sources', key=lambda row: row[0])
+        self.failures = ExternalSorter(self.directory, 'failures', key=_failure_key)
+        self.reports = ExternalSorter(self.directory, 'reports', key=report_sort_key)
+        self.spills = 0
+
+    def maybe_spill(self, summary: 'SummaryAggregate') -> bool:
+        """推定メモリ量が上限以上なら退避する"""
+        if estimated_bytes(summary) < self.max_bytes:
+            return False
+        self.spill(summary)
+        self.spills += 1
+        return True
+
+    def spill(self, summary: 'SummaryAggregate') -> None:
+        """メモリ上の送信元・失敗パターン・レポート情報を書き出して空にする"""
+        self.sources.extend(
+            [ip, s['count'], s['spf_pass'], s['dkim_pass'], s['both_pass'], s['hostname']]
+            for ip, s in summary.sources.items())
+        self.sources.flush()
+        self.failures.extend([*key, count] for key, count in summary.failure_counts.items())
+        self.failures.flush()
+        self.reports.extend(summary.reports)
+        self.reports.flush()
+
+        summary.sources.clear()
+        summary.failure_counts.clear()
+        summary.reports.clear()
+
+    def finish(self, summary: 'SummaryAggregate') -> None:
+        """メモリ上の残りを読み出し対象に加える（以降 iter_* で全体を読む）"""
+        if summary.sources or summary.failure_counts or summary.reports:
+            self.spill(summary)
+
+    def iter_sources(self) -> Iterator[Tuple[str, Dict]]:
+        """送信元IP別の統計をIP順に（同じIPのランを合算）"""
+        current_ip = None
+        stats = None
+        for ip, count, spf_pass, dkim_pass, both_pass, hostname in self.sources:
+            if ip != current_ip:
+                if stats is not None:
+                    yield current_ip, stats
+                current_ip = ip
+                stats = {'count': 0, 'spf_pass': 0, 'dkim_pass': 0, 'both_pass': 0,
+                         'hostname': None}
+            stats['count'] += count
+            stats['spf_pass'] += spf_pass
+            stats['dkim_pass'] += dkim_pass
+            stats['both_pass'] += both_pass
+            stats['hostname'] = _pick_hostname(ip, stats['hostname'], hostname)
+        if stats is not None:
+            yield current_ip, stats
+
+    def iter_failures(self) -> Iterator[Dict]:
+        """SummaryAggregate.failures と同じ形・同じ順の失敗の詳細"""
+        sources = self.iter_sources()
+        source_ip, source = next(sources, (None, None))
+
+        def emit(key: Tuple, count: int) -> Dict:
+            nonlocal source_ip, source
+            ip = key[0]
+            # 失敗パターンも送信元もIP順なので、突き合わせながらホスト名を引く
+            while source_ip is not None and source_ip < ip:
+                source_ip, source = next(sources, (None, None))
+            hostname = source['hostname'] if source_ip == ip else None
+            failure = {
+                'source_ip': ip,
+                'hostname': hostname or ip,
+                'count': count,
+                'spf': key[1],
+                'dkim': key[2],
+                'disposition': key[3]
+            }
+            if key[4] is not None:
+                failure['spf_class'] = key[4]
+            return failure
+
+        current = None
+        total = 0
+        for row in self.failures:
+            key = tuple(row[:5])
+            if key != current:
+                if current is not None:
+                    yield emit(current, total)
+                current, total = key, 0
+            total += row[5]
+        if current is not None:
+            yield emit(current, total)
+
+    def iter_reports(self) -> Iterator[Dict]:
+        """レポート情報を export_json と同じ順に"""
+        return iter(self.reports)
+
+    def close(self) -> None:
+        import shutil
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def top_sources(sources: Iterable[Tuple[str, Dict]], limit: int) -> List[Tuple[str, Dict]]:
+    """メール数の多い順（同数はIP順）に最大 limit 件（全件を保持しない）"""
+    return heapq.nsmallest(limit, sources, key=lambda x: (-x[1]['count'], x[0]))
+
+
+def group_failures(failures: Iterable[Dict], directory: Optional[str] = None) -> Tuple[Dict, Dict]:
+    """失敗の詳細を SPF・DKIM の組み合わせ別と SPF失敗の分類別にまとめる
+
+    値は {'count': メール数, 'shown': ソート順で先頭の SHOWN_PER_GROUP 件, 'distinct': 種類数}。
+    組み合わせ別はホスト名、分類別は送信元IPの種類を数える。辞書は failures での
+    初出順。directory を指定するとホスト名の重複除去を外部ソートで行う。
+    """
+    groups: Dict[str, Dict] = {}
+    classes: Dict[str, Dict] = {}
+    hostnames = ExternalSorter(directory, 'failure-hosts')
+    last_class_ip: Dict[str, str] = {}
+    for failure in failures:
+        key = f"{failure['spf']}_{failure['dkim']}"
+        group = groups.setdefault(key, {'count': 0, 'shown': [], 'distinct': 0})
+        group['count'] += failure['count']
+        hostnames.add([key, failure['hostname']])
+
+        if 'spf_class' in failure:
+            spf_class = failure['spf_class']
+            data = classes.setdefault(spf_class, {'count': 0, 'shown': [], 'distinct': 0})
+            data['count'] += failure['count']
+            # failures はIP順なので、直前と異なるIPだけを数えれば重複しない
+            if last_class_ip.get(spf_class) != failure['source_ip']:
+                last_class_ip[spf_class] = failure['source_ip']
+                data['distinct'] += 1
+                if len(data['shown']) < SHOWN_PER_GROUP:
+                    data['shown'].append(failure['source_ip'])
+
+    previous = None
+    for pair in hostnames:
+        pair = tuple(pair)
+        if pair == previous:
+            continue
+        previous = pair
+        group = groups[pair[0]]
+        group['distinct'] += 1
+        if len(group['shown']) < SHOWN_PER_GROUP:
+            group['shown'].append(pair[1])
+    return groups, classes
+
+
+class Streamed:
+    """dump_json で逐次書き出す配列（pairs=True ならオブジェクト）の中身"""
+
+    def __init__(self, items: Iterable, pairs: bool = False):
+        self.items = items
+        self.pairs = pairs
+
+
+def dump_json(value, f, level: int = 0) -> None:
+    """json.dump(value, f, indent=2, ensure_ascii=False, default=str) と同じ出力を逐次書き出す
+
+    Streamed の中身は1要素ずつ変換するため、全体をメモリ上に組み立てない。
+    """
+    import json
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        value = Streamed(value.items(), pairs=True)
+    if not isinstance(value, Streamed):
+        text = json.dumps(value, indent=2, ensure_ascii=False, default=str)
+        f.write(text.replace('\n', '\n' + '  ' * level))
+        return
+
+    opening, closing = ('{', '}') if value.pairs else ('[', ']')
+    inner = '\n' + '  ' * (level + 1)
+    empty = True
+    f.write(opening)
+    for item in value.items:
+        f.write(inner if empty else ',' + inner)
+        empty = False
+        if value.pairs:
+            key, item = item
+            f.write(json.dumps(key, ensure_ascii=False) + ': ')
+        dump_json(item, f, level + 1)
+    if not empty:
+        f.write('\n' + '  ' * level)
+    f.write(closing)
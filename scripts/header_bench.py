@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+
+"""
+メールヘッダー解析（EmailHeaderAnalyzer）の計測用コーパスとベンチマーク
+実際の受信メールに近いヘッダー（複数の Authentication-Results・DKIM-Signature・
+ARC・Received、折り返し行）と壊れたヘッダーをシードから再現可能に生成し、
+parse_headers・_parse_auth_results・_parse_dkim_signature・analyze ごとの
+処理速度（通/秒）と1回あたりのメモリ確保量を計測する
+結果はベースラインとして保存し、変更前後で比較できる
+"""
+
+import sys
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Tuple
+
+BENCH_FORMAT = 'header-bench'
+BENCH_VERSION = 1
+
+DEFAULT_MESSAGES = 5000
+DEFAULT_SEED = 1
+
+# 壊れたヘッダーを含める割合
+DEFAULT_MALFORMED_RATIO = 0.1
+
+# メモリ確保量を計測する通数（tracemalloc は遅いので一部だけ）
+ALLOC_SAMPLE = 500
+
+# 比較時にこの割合を超えて遅くなったら劣化とみなす
+DEFAULT_MAX_REGRESSION = 0.10
+
+BENCH_TARGETS = ('parse_headers', '_parse_auth_results', '_parse_dkim_signature', 'analyze')
+
+_SENDER_DOMAINS = ('example.com', 'example.net', 'mail.example.org', 'news.example.jp',
+                   'bounce.example.co.jp', 'em.example.io')
+_RELAYS = ('mx1.example.com', 'mx2.example.com', 'mail-qk1-f169.google.com',
+           'mail-eopbgr1300045.outbound.protection.outlook.com', 'smtp.sendgrid.net',
+           'a27-18.smtp-out.amazonses.com', 'relay.example.net', 'localhost')
+_RESULTS = ('pass', 'pass', 'pass', 'pass', 'fail', 'neutral', 'none', 'softfail', 'temperror')
+_SUBJECTS = ('Your invoice is ready', 'Weekly report', 'Re: meeting notes',
+             '=?UTF-8?B?44GK55+l44KJ44Gb?=', '=?ISO-2022-JP?B?GyRCJCpDTiRpJDsbKEI=?=',
+             'Password reset request', 'Fwd: [list] discussion thread about folding')
+_SIGNED_HEADERS = ('from', 'to', 'subject', 'date', 'message-id', 'mime-version',
+                   'content-type', 'reply-to', 'list-unsubscribe', 'feedback-id')
+_B64 = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+
+def _fold(name: str, value: str, rng: random.Random, width: int = 76) -> str:
+    """ヘッダーを空白位置で折り返す（続きの行はタブまたは空白で始める）"""
+    line = f"{name}: "
+    lines = []
+    for word in value.split(' '):
+        if len(line) + len(word) > width and line.strip():
+            lines.append(line.rstrip())
+            line = rng.choice(('\t', ' ', '        '))
+        line += word + ' '
+    lines.append(line.rstrip())
+    return '\n'.join(lines)
+
+
+def _b64(rng: random.Random, nbytes: int, wrap: int = 0) -> str:
+    """nbytes バイト相当のbase64文字列（wrap > 0 ならその文字数ごとに空白を入れる）"""
+    chars = -(-nbytes // 3) * 4
+    text = ''.join(rng.choice(_B64) for _ in range(chars))
+    if wrap:
+        text = ' '.join(text[i:i + wrap] for i in range(0, len(text), wrap))
+    return text
+
+
+def _ip(rng: random.Random) -> str:
+    if rng.random() < 0.15:
+        return f"2001:db8:{rng.randrange(65536):x}::{rng.randrange(65536):x}"
+    return f"{rng.choice((192, 198, 203, 209))}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+
+
+def _date(when: datetime) -> str:
+    from email.utils import format_datetime
+    return format_datetime(when)
+
+
+def _received(rng: random.Random, sender: str, by: str, when: datetime) -> str:
+    ip = _ip(rng)
+    bracket = f"IPv6:{ip}" if ':' in ip else ip
+    protocol = rng.choice(('ESMTPS', 'ESMTP', 'SMTP', 'ESMTPSA', 'LMTP'))
+    comment = rng.choice((
+        '', ' (using TLSv1.3 with cipher TLS_AES_256_GCM_SHA384 (256/256 bits))',
+        ' (Postfix, from userid 1000)', ' (version=TLS1_2 cipher=ECDHE-RSA-AES128-GCM-SHA256 bits=128/128)'))
+    queue_id = ''.join(rng.choice('0123456789ABCDEF') for _ in range(12))
+    return (f"from {sender} ({sender} [{bracket}]) by {by}{comment} with {protocol} "
+            f"id {queue_id} for <user@example.com>; {_date(when)}")
+
+
+def _auth_results(rng: random.Random, server: str, domain: str, selector: str,
+                  with_arc: bool) -> str:
+    dkim, spf, dmarc = rng.choice(_RESULTS), rng.choice(_RESULTS), rng.choice(_RESULTS[:6])
+    parts = [f"{server};"]
+    parts.append(f"dkim={dkim} header.i=@{domain} header.s={selector} header.b={_b64(rng, 6)};")
+    if rng.random() < 0.3:
+        # 2つ目の署名（ESP の署名など）
+        parts.append(f"dkim={rng.choice(_RESULTS)} (1024-bit key) header.d=sendgrid.info "
+                     f"header.i=@sendgrid.info header.s=smtpapi header.b={_b64(rng, 6)};")
+    reason = rng.choice(('', f" ({server}: domain of bounce@{domain} designates {_ip(rng)} as permitted sender)"))
+    parts.append(f"spf={spf}{reason} smtp.mailfrom=bounce@{domain};")
+    parts.append(f"dmarc={dmarc} (p={rng.choice(('NONE', 'QUARANTINE', 'REJECT'))} "
+                 f"sp={rng.choice(('NONE', 'REJECT'))} dis={rng.choice(('NONE', 'QUARANTINE'))}) "
+                 f"header.from={domain}")
+    if with_arc:
+        parts[-1] += ';'
+        parts.append(f"arc={rng.choice(('pass', 'none', 'fail'))} (i=1 spf=pass spfdomain={domain})")
+    return ' '.join(parts)
+
+
+def _dkim_signature(rng: random.Random, domain: str, selector: str, when: datetime) -> str:
+    algorithm = rng.choice(('rsa-sha256', 'rsa-sha256', 'rsa-sha256', 'ed25519-sha256', 'rsa-sha1'))
+    key_bytes = 64 if algorithm.startswith('ed25519') else rng.choice((128, 256, 256, 512))
+    headers = ':'.join(rng.sample(_SIGNED_HEADERS, rng.randrange(4, len(_SIGNED_HEADERS) + 1)))
+    timestamp = int(when.timestamp())
+    tags = ["v=1", f"a={algorithm}", f"c={rng.choice(('relaxed/relaxed', 'relaxed/simple', 'simple/simple'))}",
+            f"d={domain}", f"s={selector}", f"t={timestamp}"]
+    if rng.random() < 0.3:
+        tags.append(f"x={timestamp + 604800}")
+    tags += [f"h={headers}", f"bh={_b64(rng, 32)}", f"b={_b64(rng, key_bytes, wrap=rng.choice((0, 64, 76)))}"]
+    return '; '.join(tags)
+
+
+def _arc_set(rng: random.Random, instance: int, server: str, domain: str,
+             when: datetime) -> List[Tuple[str, str]]:
+    selector = f"arc-{when.year}"
+    results = _auth_results(rng, server, domain, 's1', with_arc=instance > 1)
+    return [
+        ('ARC-Seal', f"i={instance}; a=rsa-sha256; t={int(when.timestamp())}; cv={'none' if instance == 1 else 'pass'}; "
+                     f"d={server.split('.', 1)[-1]}; s={selector}; b={_b64(rng, 256, wrap=76)}"),
+        ('ARC-Message-Signature', f"i={instance}; a=rsa-sha256; c=relaxed/relaxed; d={server.split('.', 1)[-1]}; "
+                                  f"s={selector}; h=from:to:subject:date:message-id; bh={_b64(rng, 32)}; "
+                                  f"b={_b64(rng, 256, wrap=76)}"),
+        ('ARC-Authentication-Results', f"i={instance}; {results}"),
+    ]
+
+
+def _malform(lines: List[str], rng: random.Random) -> List[str]:
+    """よく見かける壊れ方を1つ加える"""
+    kind = rng.randrange(8)
+    if kind == 0:
+        # コロンのない行
+        lines.insert(rng.randrange(len(lines) + 1), 'this line has no header name')
+    elif kind == 1:
+        # 途中で切れた Authentication-Results
+        lines.insert(0, 'Authentication-Results: mx.example.com; dkim=')
+    elif kind == 2:
+        # 日時のない・日時が壊れた Received
+        lines.insert(0, 'Received: from unknown by mx.example.com with SMTP; not a date')
+        lines.insert(0, 'Received: by mx.example.com')
+    elif kind == 3:
+        # 終端の ; がなく、タグが重複した DKIM-Signature
+        lines.insert(0, 'DKIM-Signature: v=1; a=rsa-sha256; d=example.com; d=example.net; s=; t=abc; x=; b')
+    elif kind == 4:
+        # 先頭が継続行（直前のヘッダーがない）
+        lines.insert(0, '\tcontinuation without a header')
+    elif kind == 5:
+        # コロンの後に空白がない・値が空
+        lines.insert(0, 'Subject:')
+        lines.insert(0, 'X-Empty:no-space')
+    elif kind == 6:
+        # 非常に長い1行のヘッダー
+        lines.insert(0, 'X-Long: ' + 'a' * rng.randrange(2000, 8000))
+    else:
+        # 閉じていないコメントを含む Received
+        lines.insert(0, 'Received: from host (unclosed [10.0.0.1] by mx.example.com with ESMTP; '
+                        'Mon, 1 Jan 2024 00:00:00 +0000')
+    return lines
+
+
+def generate_header(rng: random.Random, malformed: bool = False) -> str:
+    """1通分のヘッダー（改行区切り、折り返しあり）"""
+    domain = rng.choice(_SENDER_DOMAINS)
+    selector = rng.choice(('s1', 's2', 'google', 'selector1', 'k1', f"{rng.randrange(2019, 2025)}q{rng.randrange(1, 5)}"))
+    sent = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=rng.randrange(365 * 86400))
+
+    # 送信から受信までの中継（新しいものが先頭）
+    hop_count = rng.randrange(2, 7)
+    relays = rng.sample(_RELAYS, hop_count)
+    when = sent
+    received = []
+    for i in range(hop_count):
+        when += timedelta(seconds=rng.choice((0, 1, 1, 2, 5, 30, 120, 900)))
+        sender = relays[i - 1] if i else f"mail.{domain}"
+        received.insert(0, _received(rng, sender, relays[i], when))
+
+    fields: List[Tuple[str, str]] = []
+    arc_instances = rng.choice((0, 0, 0, 1, 2))
+    for instance in range(arc_instances, 0, -1):
+        fields += _arc_set(rng, instance, relays[min(instance, hop_count - 1)], domain, when)
+    for i in range(rng.choice((1, 1, 2, 3))):
+        fields.append(('Authentication-Results', _auth_results(rng, relays[-1 - i % hop_count], domain,
+                                                                selector, with_arc=arc_instances > 0)))
+    fields += [('Received', value) for value in received]
+    for _ in range(rng.choice((1, 1, 1, 2))):
+        fields.append(('DKIM-Signature', _dkim_signature(rng, domain, selector, sent)))
+    fields += [
+        ('From', f"\"Example Sender\" <news@{domain}>"),
+        ('To', 'user@example.com'),
+        ('Subject', rng.choice(_SUBJECTS)),
+        ('Date', _date(sent)),
+        ('Message-ID', f"<{rng.randrange(10 ** 12)}.{rng.randrange(10 ** 6)}@{domain}>"),
+        ('MIME-Version', '1.0'),
+        ('Content-Type', 'multipart/alternative; boundary="b1_' + _b64(rng, 12) + '"'),
+    ]
+    if rng.random() < 0.4:
+        fields.append(('List-Unsubscribe', f"<mailto:unsubscribe@{domain}>, <https://{domain}/u/{_b64(rng, 24)}>"))
+
+    lines = [_fold(name, value, rng) for name, value in fields]
+    if malformed:
+        lines = _malform(lines, rng)
+    text = '\n'.join(lines)
+    if rng.random() < 0.2:
+        text = text.replace('\n', '\r\n')
+    return text
+
+
+def generate_corpus(messages: int = DEFAULT_MESSAGES, seed: int = DEFAULT_SEED,
+                    malformed_ratio: float = DEFAULT_MALFORMED_RATIO) -> List[str]:
+    """シードが同じなら毎回同じヘッダーの一覧"""
+    rng = random.Random(seed)
+    return [generate_header(rng, rng.random() < malformed_ratio) for _ in range(messages)]
+
+
+def write_mbox(path: str, headers: List[str]) -> None:
+    """ヘッダーだけのメールを mbox 形式で書き出す（analyze-email-headers.py のバッチモード用）"""
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        for text in headers:
+            f.write('From bench@example.com Mon Jan  1 00:00:00 2024\n')
+            for line in text.replace('\r\n', '\n').split('\n'):
+                f.write('>' + line + '\n' if line.lstrip('>').startswith('From ') else line + '\n')
+            f.write('\nbody\n\n')
+
+
+def _time_best(func: Callable[[], None], runs: int) -> float:
+    import time
+    best = None
+    for _ in range(runs):
+        start = time.process_time()
+        func()
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _alloc_per_call(func: Callable, args: List) -> Dict:
+    """1回あたりのメモリ確保量（tracemalloc のピーク、バイト）の平均と最大"""
+    import tracemalloc
+    peaks = []
+    tracemalloc.start()
+    try:
+        for arg in args:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            try:
+                func(arg)
+            except Exception:
+                pass
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return {'alloc_bytes_avg': sum(peaks) / len(peaks) if peaks else 0.0,
+            'alloc_bytes_max': max(peaks, default=0)}
+
+
+def benchmark_headers(analyzer_class, headers: List[str], runs: int = 3,
+                      alloc_sample: int = ALLOC_SAMPLE) -> Dict[str, Dict]:
+    """各処理の処理速度（1秒あたりの件数、CPU時間で最速の回）とメモリ確保量
+
+    parse_headers と analyze は1通単位、_parse_auth_results と _parse_dkim_signature は
+    コーパス中のヘッダー値1つ単位。例外は処理を止めずに件数だけ数える。
+    """
+    parsed = []
+    auth_values: List[str] = []
+    dkim_values: List[str] = []
+    for text in headers:
+        analyzer = analyzer_class()
+        analyzer.parse_headers(text)
+        parsed.append(analyzer)
+        auth_values.extend(analyzer.headers.get('authentication-results', []))
+        dkim_values.extend(analyzer.headers.get('dkim-signature', []))
+    probe = analyzer_class()
+
+    def parse_one(text: str) -> None:
+        analyzer_class().parse_headers(text)
+
+    targets = {
+        'parse_headers': (parse_one, headers),
+        '_parse_auth_results': (probe._parse_auth_results, auth_values),
+        '_parse_dkim_signature': (probe._parse_dkim_signature, dkim_values),
+        'analyze': (lambda analyzer: analyzer.analyze(), parsed),
+    }
+    results = {}
+    for name in BENCH_TARGETS:
+        func, items = targets[name]
+        errors = 0
+        for item in items:
+            try:
+                func(item)
+            except Exception:
+                errors += 1
+
+        def run_all() -> None:
+            for item in items:
+                try:
+                    func(item)
+                except Exception:
+                    pass
+
+        seconds = _time_best(run_all, runs)
+        results[name] = dict({
+            'items': len(items),
+            'errors': errors,
+            'seconds': seconds,
+            'per_second': len(items) / seconds if seconds else None,
+            'us_per_item': seconds / len(items) * 1e6 if items else None,
+        }, **_alloc_per_call(func, items[:alloc_sample]))
+    return results
+
+
+def bench_payload(results: Dict[str, Dict], messages: int, seed: int,
+                  malformed_ratio: float, corpus_bytes: int) -> Dict:
+    """ベースラインとして保存する内容"""
+    return {
+        'format': BENCH_FORMAT,
+        'version': BENCH_VERSION,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'corpus': {'messages': messages, 'seed': seed, 'malformed_ratio': malformed_ratio,
+                   'bytes': corpus_bytes},
+        'results': results,
+    }
+
+
+def load_baseline(path: str) -> Dict:
+    import json
+    with open(path, encoding='utf-8') as f:
+        payload = json.load(f)
+    if payload.get('format') != BENCH_FORMAT:
+        raise ValueError("ヘッダー解析ベンチマークの結果ファイルではありません")
+    if payload.get('version') != BENCH_VERSION:
+        raise ValueError(f"未対応の結果バージョン: {payload.get('version')}")
+    return payload
+
+
+def compare_results(baseline: Dict, current: Dict,
+                    max_regression: float = DEFAULT_MAX_REGRESSION) -> List[Dict]:
+    """処理ごとの速度とメモリ確保量の変化（regressed: 速度が max_regression を超えて低下）"""
+    rows = []
+    for name in BENCH_TARGETS:
+        before = baseline['results'].get(name)
+        after = current['results'].get(name)
+        if not before or not after or not before['us_per_item'] or not after['us_per_item']:
+            continue
+        time_change = after['us_per_item'] / before['us_per_item'] - 1
+        alloc_change = (after['alloc_bytes_avg'] / before['alloc_bytes_avg'] - 1
+                        if before['alloc_bytes_avg'] else None)
+        rows.append({'name': name, 'before_us': before['us_per_item'], 'after_us': after['us_per_item'],
+                     'time_change': time_change, 'alloc_change': alloc_change,
+                     'regressed': time_change > max_regression})
+    return rows
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+"""
+メールヘッダー解析結果の永続キャッシュ
+折り返しを戻したヘッダー（名前と値の並び）のハッシュをキーに analyze() の結果を
+SQLite に保存し、同じアーカイブを繰り返し解析するときは新しいメール・変わった
+メールだけを解析する
+解析ツールのバージョンが変わったら全件を破棄し、合計サイズが上限を超えたら
+最後に使われた実行が古いものから削除する
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# キャッシュの合計サイズ（解析結果）の上限
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# 上限を超えたとき、この割合まで削除する（毎回の実行で少しずつ削除しないように）
+EVICT_TARGET = 0.9
+
+# この件数ごとにコミットする
+COMMIT_INTERVAL = 5000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS results (
+    key BLOB PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used INTEGER NOT NULL,
+    value BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+"""
+
+
+def header_key(fields: Iterable[Tuple[str, str]]) -> bytes:
+    """ヘッダーの (名前, 値) の並びのハッシュ（折り返し位置や改行コードの違いは同じキー）
+
+    Message-ID だけをキーにしないのは、同じメールでも受信箱ごとに Received が異なり
+    解析結果も異なるため（Message-ID ヘッダー自体は並びに含まれる）。
+    """
+    import hashlib
+    digest = hashlib.blake2b(digest_size=16)
+    for name, value in fields:
+        digest.update(name.encode('utf-8', 'surrogatepass'))
+        digest.update(b'\0')
+        digest.update(value.encode('utf-8', 'surrogatepass'))
+        digest.update(b'\1')
+    return digest.digest()
+
+
+class HeaderResultCache:
+    """ヘッダーのハッシュ -> analyze() の結果（marshal 形式）
+
+    解析結果の読み込みは解析し直す時間より十分短い必要があるため、JSON より数倍速く
+    読める marshal で保存する（圧縮も展開の時間が解析の節約分を食うので行わない）。
+    marshal の形式は Python のバージョンで変わりうるので、バージョンの文字列に含める。
+    保存時のバージョン（解析ツールのバージョン）が version と異なれば開いた時点で全件削除する。
+    使われた実行の番号を記録し、close() で合計サイズが max_bytes を超えていれば古いものから削除する。
+    """
+
+    def __init__(self, path: str, version: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        import sys
+        import marshal
+        import sqlite3
+        version = f"{version}/py{sys.version_info[0]}.{sys.version_info[1]}/marshal{marshal.version}"
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.invalidated = False
+        self._used: List[bytes] = []
+        self._pending = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(_SCHEMA)
+
+        meta = dict(self.conn.execute('SELECT name, value FROM meta'))
+        if meta.get('version') != version:
+            self.invalidated = 'version' in meta
+            self.conn.execute('DELETE FROM results')
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+        # 実行ごとの番号（last_used に記録し、古い順の削除に使う）
+        self.run = int(meta.get('run', 0)) + 1
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('run', ?)", (str(self.run),))
+        self.conn.commit()
+
+    def get(self, key: bytes) -> Optional[Dict]:
+        import marshal
+        row = self.conn.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        analysis = None
+        if row is not None:
+            try:
+                analysis = marshal.loads(row[0])
+            except (EOFError, ValueError, TypeError):
+                # 壊れたエントリは解析し直して上書きする
+                analysis = None
+        if analysis is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used.append(key)
+        return analysis
+
+    def put(self, key: bytes, analysis: Dict) -> None:
+        import marshal
+        value = marshal.dumps(analysis)
+        self.conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                          (key, len(value), self.run, value))
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self.conn.commit()
+            self._pending = 0
+
+    def total_bytes(self) -> int:
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def evict(self) -> int:
+        """合計サイズが上限を超えていれば、最後に使われた実行の古いものから上限の EVICT_TARGET まで削除"""
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return 0
+        target = int(self.max_bytes * EVICT_TARGET)
+        doomed = []
+        for key, size in self.conn.execute('SELECT key, size FROM results ORDER BY last_used, key'):
+            if total <= target:
+                break
+            doomed.append((key,))
+            total -= size
+        self.conn.executemany('DELETE FROM results WHERE key = ?', doomed)
+        self.evicted += len(doomed)
+        return len(doomed)
+
+    def close(self) -> None:
+        """使われたエントリの実行番号を更新し、上限を超えた分を削除して閉じる"""
+        self.conn.executemany('UPDATE results SET last_used = ? WHERE key = ?',
+                              ((self.run, key) for key in self._used))
+        self._used = []
+        self.evict()
+        self.conn.commit()
+        self.conn.close()
+        if self.evicted:
+            # 削除した領域をファイルサイズにも反映する
+            import sqlite3
+            conn = sqlite3.connect(self.path)
+            conn.execute('VACUUM')
+            conn.close()
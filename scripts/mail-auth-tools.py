@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+
+"""
+メール認証ツール 統合エントリーポイント
+DMARCレポート受信確認・DMARCレポート分析・フォレンジックレポート分析・メールヘッダー解析を
+サブコマンドで実行する
+各ツールはサブコマンド実行時に初めて読み込むため、cron やフックからの小さな呼び出しでも
+不要なモジュールの import が発生しない
+
+使い方:
+  mail-auth-tools.py recent [--dir DIR] [--days N]   最近のレポート有無のみ確認
+  mail-auth-tools.py check [...]                      check-dmarc-reports.py と同じ
+  mail-auth-tools.py analyze [...]                    dmarc-report-analyzer.py と同じ
+  mail-auth-tools.py headers                          analyze-email-headers.py と同じ
+  mail-auth-tools.py forensic PATH...                 analyze-dmarc-forensic.py と同じ
+  mail-auth-tools.py bench-startup [--runs N]         起動時間の計測と予算チェック
+  mail-auth-tools.py bench-xml [FILE...]              XMLパースのバックエンド比較
+  mail-auth-tools.py bench-headers [--save FILE]      メールヘッダー解析の処理速度とベースライン比較
+"""
+
+import os
+import sys
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# サブコマンド -> (スクリプト, 先頭に付与する引数, 説明)
+SUBCOMMANDS = {
+    'recent': ('check-dmarc-reports.py', ['--recent-only'], '最近のDMARCレポート有無を確認'),
+    'check': ('check-dmarc-reports.py', [], 'DMARCレポート受信確認・集計'),
+    'analyze': ('dmarc-report-analyzer.py', [], 'DMARC集約レポート分析'),
+    'headers': ('analyze-email-headers.py', [], 'メールヘッダー認証解析'),
+    'forensic': ('analyze-dmarc-forensic.py', [], 'DMARCフォレンジックレポート（ruf）分析'),
+}
+
+# 起動時間の予算（ミリ秒、インタープリタ自体の起動時間を除いた追加分の中央値）
+# 各スクリプトが imaplib/xml/gzip/zipfile/json などを先頭で import していた頃は 80ms 前後
+STARTUP_BUDGET_MS = {
+    'recent': 50,
+    'analyze --help': 50,
+}
+
+
+def load_script(script: str):
+    """ハイフン付きのツールスクリプトをモジュールとして読み込む
+
+    通常の import 機構を使うため importlib.util の読み込みが不要で、バイトコードも
+    __pycache__ にキャッシュされる。
+    """
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.insert(0, SCRIPTS_DIR)
+    return __import__(os.path.splitext(script)[0])
+
+
+def run_subcommand(command: str, argv: list) -> None:
+    """サブコマンドに対応するツールの main() を実行"""
+    script, prefix, _ = SUBCOMMANDS[command]
+    module = load_script(script)
+    sys.argv = [f"{os.path.basename(sys.argv[0])} {command}"] + prefix + argv
+    module.main()
+
+
+def _measure(cmd: list, runs: int) -> list:
+    """コマンドの実行時間（ミリ秒）を runs 回計測"""
+    import subprocess
+    import time
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _import_profile(cmd: list, top: int = 5) -> list:
+    """-X importtime の出力から累積時間の大きいトップレベル import を取得"""
+    import subprocess
+
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + cmd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        # インデントなし = トップレベルの import
+        if not name.startswith('  '):
+            modules.append((int(cumulative) / 1000, name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def bench_startup(argv: list) -> int:
+    """各サブコマンドのコールドスタート時間を計測し、予算超過なら 1 を返す"""
+    import argparse
+    import statistics
+    import tempfile
+
+    parser = argparse.ArgumentParser(prog='mail-auth-tools.py bench-startup',
+                                     description='起動時間の計測と予算チェック')
+    parser.add_argument('--runs', type=int, default=10, help='計測回数（デフォルト: 10）')
+    parser.add_argument('--profile', action='store_true', help='重い import の内訳を表示')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as reports_dir:
+        cases = {
+            'recent': ['recent', '--dir', reports_dir, '--days', '7'],
+            'analyze --help': ['analyze', '--help'],
+        }
+        baseline = statistics.median(_measure([sys.executable, '-c', 'pass'], args.runs))
+        print(f"インタープリタ起動: {baseline:.1f} ms（中央値、{args.runs}回）")
+        if sys.dont_write_bytecode:
+            print("⚠️  PYTHONDONTWRITEBYTECODE が有効なため、毎回コンパイルが発生します")
+        print("-" * 60)
+        print(f"{'サブコマンド':<20} {'中央値':>10} {'追加分':>10} {'予算':>8}")
+        print("-" * 60)
+
+        over_budget = False
+        for label, case_argv in cases.items():
+            cmd = [sys.executable, os.path.abspath(__file__)] + case_argv
+            median = statistics.median(_measure(cmd, args.runs))
+            overhead = median - baseline
+            budget = STARTUP_BUDGET_MS[label]
+            status = '✅' if overhead <= budget else '❌'
+            over_budget = over_budget or overhead > budget
+            print(f"{label:<20} {median:>8.1f}ms {overhead:>8.1f}ms {budget:>6}ms {status}")
+
+            if args.profile:
+                for ms, name in _import_profile([os.path.abspath(__file__)] + case_argv):
+                    print(f"    {name:<30} {ms:>7.1f}ms")
+
+    return 1 if over_budget else 0
+
+
+def _synthetic_report(records: int) -> str:
+    """計測用のインデント付き集約レポート（主要な送信元と同じ構造のレコード）"""
+    parts = ['<?xml version="1.0" encoding="UTF-8" ?>\n<feedback>\n  <report_metadata>\n'
+             '    <org_name>example.net</org_name>\n    <report_id>bench</report_id>\n'
+             '    <date_range>\n      <begin>1700000000</begin>\n      <end>1700086400</end>\n'
+             '    </date_range>\n  </report_metadata>\n  <policy_published>\n'
+             '    <domain>example.com</domain>\n    <p>none</p>\n  </policy_published>\n']
+    for i in range(records):
+        spf = 'pass' if i % 5 else 'fail'
+        parts.append(
+            f"  <record>\n    <row>\n      <source_ip>198.51.{i // 256 % 256}.{i % 256}</source_ip>\n"
+            f"      <count>{i % 7 + 1}</count>\n      <policy_evaluated>\n"
+            f"        <disposition>none</disposition>\n        <dkim>pass</dkim>\n"
+            f"        <spf>{spf}</spf>\n      </policy_evaluated>\n    </row>\n"
+            f"    <identifiers>\n      <header_from>example.com</header_from>\n    </identifiers>\n"
+            f"    <auth_results>\n      <dkim>\n        <domain>example.com</domain>\n"
+            f"        <selector>s1</selector>\n        <result>pass</result>\n      </dkim>\n"
+            f"      <spf>\n        <domain>example.com</domain>\n        <result>{spf}</result>\n"
+            f"      </spf>\n    </auth_results>\n  </record>\n")
+    parts.append('</feedback>\n')
+    return ''.join(parts)
+
+
+def bench_xml(argv: list) -> int:
+    """XMLパースのバックエンドごとのレコードあたりCPU時間を比較"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='mail-auth-tools.py bench-xml',
+                                     description='XMLパースのバックエンド比較（結果の一致も確認）')
+    parser.add_argument('files', nargs='*', help='レポートファイル（省略時は合成レポート）')
+    parser.add_argument('--records', type=int, default=20000,
+                        help='合成レポートのレコード数（デフォルト: 20000）')
+    parser.add_argument('--runs', type=int, default=3, help='計測回数（最速の回を採用、デフォルト: 3）')
+    args = parser.parse_args(argv)
+
+    load_script('dmarc_parse.py')
+    from dmarc_parse import DEFAULT_XML_BACKEND, benchmark_backends, read_report
+
+    if args.files:
+        contents = [c for c in (read_report(path) for path in args.files) if c]
+        label = f"{len(contents)} ファイル"
+    else:
+        contents = [_synthetic_report(args.records)]
+        label = f"合成レポート {args.records:,} レコード"
+    try:
+        results = benchmark_backends(contents, args.runs)
+    except ValueError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        return 1
+
+    print(f"XMLパース比較: {label}（CPU時間、{args.runs}回中の最速）")
+    print("-" * 60)
+    print(f"{'バックエンド':<12} {'時間':>10} {'レコード':>10} {'µs/レコード':>12}")
+    print("-" * 60)
+    fastest = min(results, key=lambda b: results[b]['seconds'])
+    for backend, r in results.items():
+        mark = ' (デフォルト)' if backend == DEFAULT_XML_BACKEND else ''
+        print(f"{backend:<12} {r['seconds']:>9.3f}s {r['records']:>10,} {r['us_per_record']:>12.2f}{mark}")
+    if fastest != DEFAULT_XML_BACKEND:
+        print(f"⚠️  この入力では {fastest} の方が速いため、--xml-backend {fastest} を検討してください")
+    return 0
+
+
+def bench_headers(argv: list) -> int:
+    """合成ヘッダーで EmailHeaderAnalyzer の処理ごとの速度を計測し、ベースラインより劣化していれば 1 を返す"""
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(prog='mail-auth-tools.py bench-headers',
+                                     description='メールヘッダー解析の処理速度・メモリ確保量の計測')
+    parser.add_argument('--messages', type=int, help='合成するメール数（デフォルト: 5000）')
+    parser.add_argument('--seed', type=int, help='合成に使う乱数のシード（デフォルト: 1）')
+    parser.add_argument('--malformed', type=float, help='壊れたヘッダーの割合（デフォルト: 0.1）')
+    parser.add_argument('--runs', type=int, default=3, help='計測回数（最速の回を採用、デフォルト: 3）')
+    parser.add_argument('--save', metavar='FILE', help='結果をベースラインとして保存')
+    parser.add_argument('--compare', metavar='FILE', help='保存したベースラインと比較')
+    parser.add_argument('--max-regression', type=float, metavar='PCT', default=10,
+                        help='--compare でこの割合（%%）を超えて遅くなったら終了コード 1（デフォルト: 10）')
+    parser.add_argument('--write-corpus', metavar='FILE',
+                        help='合成したヘッダーを mbox として保存（バッチモードの入力に使える）')
+    args = parser.parse_args(argv)
+
+    load_script('header_bench.py')
+    from header_bench import (DEFAULT_MALFORMED_RATIO, DEFAULT_MESSAGES, DEFAULT_SEED,
+                              bench_payload, benchmark_headers, compare_results,
+                              generate_corpus, load_baseline, write_mbox)
+
+    baseline = None
+    if args.compare:
+        try:
+            baseline = load_baseline(args.compare)
+        except (OSError, ValueError) as e:
+            print(f"エラー: ベースラインを読み込めません: {e}", file=sys.stderr)
+            return 1
+    # 比較時は指定がなければベースラインと同じコーパスを作る
+    corpus = baseline['corpus'] if baseline else {}
+    messages = args.messages or corpus.get('messages', DEFAULT_MESSAGES)
+    seed = args.seed if args.seed is not None else corpus.get('seed', DEFAULT_SEED)
+    malformed = args.malformed if args.malformed is not None else corpus.get('malformed_ratio', DEFAULT_MALFORMED_RATIO)
+
+    headers = generate_corpus(messages, seed, malformed)
+    corpus_bytes = sum(len(text.encode('utf-8')) for text in headers)
+    if args.write_corpus:
+        write_mbox(args.write_corpus, headers)
+        print(f"コーパスを {args.write_corpus} に保存しました")
+
+    analyzer_class = load_script('analyze-email-headers.py').EmailHeaderAnalyzer
+    results = benchmark_headers(analyzer_class, headers, args.runs)
+    payload = bench_payload(results, messages, seed, malformed, corpus_bytes)
+
+    print(f"ヘッダー解析ベンチマーク: {messages:,} 通（{corpus_bytes / 1024 / 1024:.1f} MB、"
+          f"シード {seed}、壊れたヘッダー {malformed:.0%}、CPU時間、{args.runs}回中の最速）")
+    print("-" * 78)
+    print(f"{'処理':<24} {'件数':>8} {'件/秒':>10} {'µs/件':>9} {'確保量平均':>11} {'最大':>9} {'例外':>5}")
+    print("-" * 78)
+    for name, r in results.items():
+        rate = f"{r['per_second']:,.0f}" if r['per_second'] else '-'
+        per_item = f"{r['us_per_item']:.1f}" if r['us_per_item'] else '-'
+        print(f"{name:<24} {r['items']:>8,} {rate:>10} {per_item:>9} "
+              f"{r['alloc_bytes_avg'] / 1024:>9.1f}KB {r['alloc_bytes_max'] / 1024:>7.1f}KB {r['errors']:>5}")
+
+    status = 0
+    if baseline:
+        if baseline['corpus'] != payload['corpus']:
+            print("⚠️  ベースラインとコーパスの条件が異なるため、比較は参考値です")
+        print("")
+        print(f"ベースラインとの比較: {args.compare}（{baseline['timestamp']}、Python {baseline['python']}）")
+        for row in compare_results(baseline, payload, args.max_regression / 100):
+            alloc = f"{row['alloc_change']:+.1%}" if row['alloc_change'] is not None else '-'
+            mark = '❌' if row['regressed'] else '✅'
+            print(f"  {row['name']:<24} {row['before_us']:>8.1f} → {row['after_us']:>8.1f} µs/件 "
+                  f"({row['time_change']:+.1%})  確保量 {alloc} {mark}")
+            if row['regressed']:
+                status = 1
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, indent=2, ensure_ascii=False)
+        print(f"結果を {args.save} に保存しました")
+    return status
+
+
+def print_usage() -> None:
+    print("使い方: mail-auth-tools.py <サブコマンド> [引数...]")
+    print("")
+    for command, (script, _, description) in SUBCOMMANDS.items():
+        print(f"  {command:<14} {description}（{script}）")
+    print(f"  {'bench-startup':<14} 起動時間の計測と予算チェック")
+    print(f"  {'bench-xml':<14} XMLパースのバックエンド比較")
+    print(f"  {'bench-headers':<14} メールヘッダー解析の処理速度とベースライン比較")
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print_usage()
+        sys.exit(0 if len(sys.argv) >= 2 else 2)
+
+    command, argv = sys.argv[1], sys.argv[2:]
+    if command == 'bench-startup':
+        sys.exit(bench_startup(argv))
+    if command == 'bench-xml':
+        sys.exit(bench_xml(argv))
+    if command == 'bench-headers':
+        sys.exit(bench_headers(argv))
+    if command not in SUBCOMMANDS:
+        print(f"エラー: 不明なサブコマンド: {command}", file=sys.stderr)
+        print_usage()
+        sys.exit(2)
+    run_subcommand(command, argv)
+
+
+if __name__ == "__main__":
+    main()
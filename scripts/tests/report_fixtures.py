@@ -0,0 +1,140 @@
+"""
+テスト用のDMARC集約レポート（XML）の生成
+"""
+
+import os
+import sys
+from typing import Dict, List, Optional, Sequence
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+DAY = 86400
+
+
+def load_script(filename: str):
+    """ハイフン付きのスクリプト（dmarc-report-analyzer.py など）をモジュールとして読み込む"""
+    import importlib.util
+    name = os.path.splitext(filename)[0].replace('-', '_')
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPTS_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def offline_analyzer(module, **kwargs):
+    """逆引きDNSをしない（ホスト名はIPのまま）DMARCReportAnalyzer"""
+    analyzer = module.DMARCReportAnalyzer(**kwargs)
+    analyzer._get_hostname = lambda ip: ip
+    return analyzer
+
+
+def export(analyzer, directory: str, name: str = 'out.json') -> Dict:
+    """export_json の出力を読み戻す"""
+    import json
+    path = os.path.join(directory, name)
+    analyzer.export_json(path)
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def record(ip: str, count: int, disposition: str = 'none', dkim: str = 'pass', spf: str = 'pass',
+           header_from: Optional[str] = 'example.com',
+           auth_dkim: Sequence[tuple] = (), auth_spf: Sequence[tuple] = ()) -> Dict:
+    """レコード1件（auth_dkim は (ドメイン, セレクター, 結果)、auth_spf は (ドメイン, 結果) の並び）"""
+    return {'ip': ip, 'count': count, 'disposition': disposition, 'dkim': dkim, 'spf': spf,
+            'header_from': header_from, 'auth_dkim': list(auth_dkim), 'auth_spf': list(auth_spf)}
+
+
+def make_report(report_id: str, begin: int, records: List[Dict], org: str = 'google.com',
+                domain: str = 'example.com', p: str = 'none', sp: Optional[str] = None,
+                adkim: str = 'r', aspf: str = 'r', days: int = 1) -> str:
+    """集約レポートのXML"""
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<feedback>',
+        '  <report_metadata>',
+        f'    <org_name>{org}</org_name>',
+        f'    <report_id>{report_id}</report_id>',
+        f'    <date_range><begin>{begin}</begin><end>{begin + days * DAY}</end></date_range>',
+        '  </report_metadata>',
+        '  <policy_published>',
+        f'    <domain>{domain}</domain>',
+        f'    <adkim>{adkim}</adkim>',
+        f'    <aspf>{aspf}</aspf>',
+        f'    <p>{p}</p>',
+        f'    <sp>{sp or p}</sp>',
+        '    <pct>100</pct>',
+        '  </policy_published>',
+    ]
+    for rec in records:
+        lines.extend([
+            '  <record>',
+            '    <row>',
+            f"      <source_ip>{rec['ip']}</source_ip>",
+            f"      <count>{rec['count']}</count>",
+            '      <policy_evaluated>',
+            f"        <disposition>{rec['disposition']}</disposition>",
+            f"        <dkim>{rec['dkim']}</dkim>",
+            f"        <spf>{rec['spf']}</spf>",
+            '      </policy_evaluated>',
+            '    </row>',
+            '    <identifiers>',
+        ])
+        if rec['header_from'] is not None:
+            lines.append(f"      <header_from>{rec['header_from']}</header_from>")
+        lines.extend(['    </identifiers>', '    <auth_results>'])
+        for auth_domain, selector, result in rec['auth_dkim']:
+            lines.append(f'      <dkim><domain>{auth_domain}</domain><selector>{selector}</selector>'
+                         f'<result>{result}</result></dkim>')
+        for auth_domain, result in rec['auth_spf']:
+            lines.append(f'      <spf><domain>{auth_domain}</domain><result>{result}</result></spf>')
+        lines.extend(['    </auth_results>', '  </record>'])
+    lines.append('</feedback>')
+    return '\n'.join(lines) + '\n'
+
+
+def sample_reports() -> List[str]:
+    """送信元・結果・期間・auth_results の組み合わせが異なるレポート群（入力順は期間順ではない）"""
+    base = 1700000000
+    return [
+        make_report('r3', base + 2 * DAY, [
+            record('192.0.2.5', 40, auth_dkim=[('example.com', 's1', 'pass')],
+                   auth_spf=[('example.com', 'pass')]),
+            record('203.0.113.200', 12, dkim='fail', spf='fail', disposition='quarantine',
+                   auth_dkim=[('example.com', 's0', 'fail')], auth_spf=[('bounce.example.net', 'pass')]),
+        ], p='quarantine'),
+        make_report('r1', base, [
+            record('192.0.2.5', 30, auth_dkim=[('example.com', 's1', 'pass')],
+                   auth_spf=[('example.com', 'pass')]),
+            record('2001:DB8::1', 5, spf='fail', auth_dkim=[('example.com', 's1', 'pass')],
+                   auth_spf=[('example.com', 'softfail')]),
+        ]),
+        make_report('r2', base + DAY, [
+            record('192.0.2.9', 7, dkim='fail', auth_dkim=[('mail.example.com', 's2', 'permerror')],
+                   auth_spf=[('example.com', 'pass')]),
+            record('192.0.2.5', 25, header_from=None, auth_dkim=[('example.com', 's1', 'pass'),
+                                                                ('esp.example.org', 'k1', 'pass')]),
+        ], org='yahoo.com'),
+        make_report('r4', base + 3 * DAY, [
+            record('198.51.100.7', 60, dkim='fail', spf='fail', disposition='none',
+                   header_from='news.example.com', auth_dkim=[('esp.example.org', 'k1', 'pass')],
+                   auth_spf=[('esp.example.org', 'pass')]),
+            record('not-an-ip', 2, dkim='fail', spf='fail'),
+        ], org='yahoo.com', sp='reject'),
+    ]
+
+
+def write_reports(directory: str, reports: List[str]) -> List[str]:
+    """レポートを report-N.xml として書き出し、パスを入力順に返す"""
+    paths = []
+    for index, content in enumerate(reports):
+        path = os.path.join(directory, f'report-{index}.xml')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        paths.append(path)
+    return paths
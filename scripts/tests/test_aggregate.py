@@ -0,0 +1,73 @@
+"""
+dmarc_aggregate: 分割して集計した結果の結合とシリアライズ
+"""
+
+import os
+import tempfile
+import unittest
+
+from report_fixtures import export, load_script, offline_analyzer, sample_reports, write_reports
+
+from dmarc_aggregate import Aggregate, SummaryAggregate, in_shard, merge_all
+
+
+class ShardMergeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.paths = write_reports(self.tmp.name, sample_reports())
+        self.module = load_script('dmarc-report-analyzer.py')
+
+    def single_run(self, paths):
+        analyzer = offline_analyzer(self.module)
+        for path in paths:
+            analyzer.load_report(path)
+        return analyzer
+
+    def test_sharded_then_merged_equals_single_run(self):
+        expected = export(self.single_run(self.paths), self.tmp.name, 'single.json')
+
+        shard_files = []
+        for index in range(3):
+            shard = [p for p in self.paths if in_shard(p, index, 3)]
+            path = os.path.join(self.tmp.name, f'shard-{index}.agg')
+            self.single_run(shard).summary.save(path)
+            shard_files.append(path)
+
+        # 結合の順序によらない
+        for order in (shard_files, shard_files[::-1]):
+            merged = merge_all(Aggregate.load(path) for path in order)
+            analyzer = offline_analyzer(self.module)
+            analyzer.summary = merged
+            self.assertEqual(export(analyzer, self.tmp.name, 'merged.json'), expected)
+
+    def test_report_order_does_not_depend_on_input_order(self):
+        forward = export(self.single_run(self.paths), self.tmp.name, 'a.json')
+        backward = export(self.single_run(self.paths[::-1]), self.tmp.name, 'b.json')
+        self.assertEqual(forward, backward)
+        begins = [r['date_begin'] for r in forward['reports']]
+        self.assertEqual(begins, sorted(begins))
+
+    def test_state_round_trip(self):
+        summary = self.single_run(self.paths).summary
+        restored = Aggregate.from_bytes(summary.to_bytes())
+        self.assertIsInstance(restored, SummaryAggregate)
+        self.assertEqual(restored, summary)
+
+
+class SelfMergeTest(unittest.TestCase):
+
+    def test_merging_into_itself_doubles_counts(self):
+        summary = SummaryAggregate()
+        summary.add_report({'org_name': 'google.com', 'report_id': 'r1', 'date_begin': 1, 'date_end': 2})
+        summary.add_record('192.0.2.1', 3, 'fail', 'pass', 'none')
+        summary.merge(summary)
+        self.assertEqual(len(summary.reports), 2)
+        self.assertEqual(summary.total_messages, 6)
+        self.assertEqual(summary.sources['192.0.2.1']['count'], 6)
+        self.assertEqual(summary.failure_counts[('192.0.2.1', 'fail', 'pass', 'none', None)], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
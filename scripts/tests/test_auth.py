@@ -0,0 +1,112 @@
+"""
+dmarc_auth: DKIMセレクター別・SPFドメイン別の集計（--auth-results）
+"""
+
+import os
+import tempfile
+import unittest
+
+from report_fixtures import export, load_script, offline_analyzer, sample_reports, write_reports
+
+from dmarc_aggregate import Aggregate, in_shard, merge_all
+from dmarc_auth import AuthBreakdown
+from dmarc_parse import XML_BACKENDS, parse_report, parse_report_metadata
+from dmarc_spill import SummarySpill
+
+
+def auth_state(result):
+    """レポート情報の auth_results を比較できる形（to_state）に"""
+    info = dict(result[0] if isinstance(result, tuple) else result)
+    info['auth_results'] = info['auth_results'].to_state()
+    return (info, result[1]) if isinstance(result, tuple) else info
+
+
+class AuthBreakdownTest(unittest.TestCase):
+
+    def test_breakdown_of_report(self):
+        info, _ = parse_report(sample_reports()[2], auth=True)
+        # header_from のないレコードはポリシー公開ドメインとのアライメントを見る
+        self.assertEqual(info['auth_results'].to_state(), {
+            'dkim': [['example.com', 'esp.example.org', 'k1', 25, 0, [('pass', 25)]],
+                     ['example.com', 'example.com', 's1', 25, 25, [('pass', 25)]],
+                     ['example.com', 'mail.example.com', 's2', 7, 0, [('permerror', 7)]]],
+            'spf': [['example.com', 7, 7, [('pass', 7)]]],
+        })
+
+    def test_backends_agree(self):
+        for content in sample_reports():
+            results = [auth_state(parse_report(content, backend, auth=True))
+                       for backend in XML_BACKENDS]
+            metadata = [auth_state(parse_report_metadata(content, None, backend, auth=True))
+                        for backend in XML_BACKENDS]
+            with self.subTest(content=content[:200]):
+                self.assertEqual(results[1:], results[:1] * (len(results) - 1))
+                self.assertEqual(metadata[1:], metadata[:1] * (len(metadata) - 1))
+                # 同じパースで読んでも、レコードの集計は auth なしと変わらない
+                self.assertEqual(results[0][1], parse_report(content)[1])
+
+    def test_state_round_trip_and_merge(self):
+        breakdowns = [parse_report(content, auth=True)[0]['auth_results']
+                      for content in sample_reports()]
+        merged = AuthBreakdown()
+        for breakdown in breakdowns:
+            merged.merge(breakdown)
+        restored = AuthBreakdown.from_state(merged.to_state())
+        self.assertEqual(restored.to_state(), merged.to_state())
+        self.assertEqual(restored.to_dict(), merged.to_dict())
+        # 結合の順序によらない
+        backward = AuthBreakdown()
+        for breakdown in breakdowns[::-1]:
+            backward.merge(breakdown)
+        self.assertEqual(backward.to_state(), merged.to_state())
+
+
+class AnalyzerAuthResultsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.paths = write_reports(self.tmp.name, sample_reports())
+        self.module = load_script('dmarc-report-analyzer.py')
+
+    def analyzer(self):
+        analyzer = offline_analyzer(self.module)
+        analyzer.auth_results = True
+        return analyzer
+
+    def sequential(self, paths):
+        analyzer = self.analyzer()
+        for path in paths:
+            analyzer.load_report(path)
+        return analyzer
+
+    def test_pipeline_spill_and_shards_match_sequential(self):
+        expected = export(self.sequential(self.paths), self.tmp.name, 'sequential.json')
+        self.assertIn('auth_results', expected['summary'])
+
+        pipelined = self.analyzer()
+        pipelined.load_reports_pipelined(self.paths, workers=2)
+        self.assertEqual(export(pipelined, self.tmp.name, 'pipeline.json'), expected)
+
+        spilled = self.analyzer()
+        spilled.spill = SummarySpill(512, self.tmp.name)
+        try:
+            for path in self.paths:
+                spilled.load_report(path)
+            self.assertGreater(spilled.spill.spills, 0)
+            self.assertEqual(export(spilled, self.tmp.name, 'spilled.json'), expected)
+        finally:
+            spilled.spill.close()
+
+        shard_files = []
+        for index in range(2):
+            path = os.path.join(self.tmp.name, f'shard-{index}.agg')
+            self.sequential([p for p in self.paths if in_shard(p, index, 2)]).summary.save(path)
+            shard_files.append(path)
+        merged = self.analyzer()
+        merged.summary = merge_all(Aggregate.load(path) for path in shard_files)
+        self.assertEqual(export(merged, self.tmp.name, 'merged.json'), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
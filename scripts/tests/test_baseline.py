@@ -0,0 +1,96 @@
+"""
+dmarc_baseline: 送信元・報告組織別の EWMA ベースライン
+"""
+
+import os
+import tempfile
+import unittest
+
+from report_fixtures import DAY, make_report, record, write_reports
+
+from dmarc_baseline import Baseline
+from dmarc_parse import parse_report, read_report, sort_reports
+
+
+def daily_reports(days=8):
+    """同じ送信元の日ごとのレポート（最終日だけ成功率が急落する）"""
+    reports = []
+    for day in range(days):
+        spf = 'fail' if day == days - 1 else 'pass'
+        info = {'org_name': 'google.com', 'report_id': f'r{day}',
+                'date_begin': 1700000000 + day * DAY, 'date_end': 1700000000 + (day + 1) * DAY}
+        rows = [('192.0.2.5', 50 + day, 'none', 'pass', spf), ('192.0.2.9', 20, 'none', 'pass', 'pass')]
+        reports.append((info, rows))
+    return reports
+
+
+def run(reports, path=None):
+    baseline = Baseline(path)
+    for info, rows in reports:
+        baseline.add(info, rows)
+    alerts = baseline.flush()
+    return baseline, alerts
+
+
+class BaselineOrderTest(unittest.TestCase):
+
+    def test_state_and_alerts_do_not_depend_on_input_order(self):
+        reports = daily_reports()
+        forward, forward_alerts = run(reports)
+        shuffled = reports[3:] + reports[:3][::-1]
+        backward, backward_alerts = run(shuffled)
+        self.assertEqual(backward.sources, forward.sources)
+        self.assertEqual(backward.orgs, forward.orgs)
+        self.assertEqual(backward_alerts, forward_alerts)
+        # 急落した最終日のレポートで、送信元と報告組織の両方が警告される
+        self.assertEqual(sorted((a['type'], a['scope'], a['key'], a['report_id']) for a in forward_alerts),
+                         [('pass_rate_drop', 'org', 'google.com', 'r7'),
+                          ('pass_rate_drop', 'source', '192.0.2.5', 'r7')])
+
+    def test_pending_reports_are_bounded_by_the_window(self):
+        reports = daily_reports()
+        baseline = Baseline(reorder_window=2)
+        alerts = []
+        for added, (info, rows) in enumerate(reports, 1):
+            alerts.extend(baseline.add(info, rows))
+            self.assertLessEqual(len(baseline._pending), 2)
+            self.assertEqual(baseline.ingested + len(baseline._pending), added)
+        alerts.extend(baseline.flush())
+        # 期間順の入力なら、窓が小さくても全件を待たせた場合と同じ結果になる
+        expected, expected_alerts = run(reports)
+        self.assertEqual(baseline.sources, expected.sources)
+        self.assertEqual(alerts, expected_alerts)
+
+    def test_reports_sorted_by_header_are_ingested_in_period_order(self):
+        reports = daily_reports()
+        with tempfile.TemporaryDirectory() as tmp:
+            contents = [make_report(info['report_id'], info['date_begin'],
+                                    [record(ip, count, spf=spf, dkim=dkim)
+                                     for ip, count, _, dkim, spf in rows])
+                        for info, rows in reports]
+            # ファイル名の順は期間の逆順
+            paths = write_reports(tmp, contents[::-1])
+            ordered = sort_reports(paths, Baseline.order_key)
+            self.assertEqual(ordered, paths[::-1])
+            baseline = Baseline(reorder_window=1)
+            for path in ordered:
+                info, rows = parse_report(read_report(path))
+                baseline.add(info, rows)
+            baseline.flush()
+            self.assertEqual(baseline.sources, run(reports)[0].sources)
+
+    def test_saved_state_is_reused_and_duplicates_skipped(self):
+        reports = daily_reports()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'baseline.json.gz')
+            first, _ = run(reports[:5], path)
+            first.save()
+            second, _ = run(reports, path)
+            self.assertEqual(second.history_reports, 5)
+            self.assertEqual(second.skipped, 5)
+            self.assertEqual(second.ingested, 3)
+            self.assertEqual(second.sources, run(reports)[0].sources)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""
+dmarc_columns: 列指向エンジン（--engine numpy）と辞書での集計の一致
+"""
+
+import os
+import tempfile
+import unittest
+from importlib.util import find_spec
+
+from report_fixtures import (export, load_script, make_report, offline_analyzer, record, sample_reports,
+                             write_reports)
+
+from dmarc_rowcache import RowCache, RowCacheWriter
+from dmarc_spf import SPFEvaluator, StubDNSSource
+
+
+def varying_hostnames():
+    """同じIPでも呼ぶたびに異なる逆引き結果（IPのまま・文字列順の逆順）を返す関数"""
+    names = {
+        '192.0.2.5': ['192.0.2.5', 'mx2.example.com', 'mx1.example.com', 'mx3.example.com'],
+        '203.0.113.200': ['203.0.113.200'],
+        '198.51.100.7': ['z.example.org', 'a.example.org'],
+    }
+    calls = {}
+
+    def resolve(ip):
+        candidates = names.get(ip, [ip])
+        index = calls[ip] = calls.get(ip, -1) + 1
+        return candidates[index % len(candidates)]
+    return resolve
+
+
+def hostname_reports():
+    """同じ送信元が複数のレポートに現れるレポート群"""
+    return sample_reports() + [
+        make_report('r5', 1700000000 + 5 * 86400, [
+            record('192.0.2.5', 3), record('198.51.100.7', 20, dkim='fail', spf='fail'),
+            record('192.0.2.5', 1, spf='fail'),
+        ]),
+    ]
+
+
+@unittest.skipUnless(find_spec('numpy'), 'NumPy が必要')
+class ColumnHostnameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.paths = write_reports(self.tmp.name, hostname_reports())
+        self.module = load_script('dmarc-report-analyzer.py')
+
+    def test_hostname_choice_matches_dict_engine(self):
+        from dmarc_columns import ColumnBuilder
+        analyzer = offline_analyzer(self.module)
+        analyzer._get_hostname = varying_hostnames()
+        builder = ColumnBuilder()
+        analyzer.row_sinks.append(builder)
+        for path in self.paths:
+            analyzer.load_report(path)
+        columns = builder.build()
+
+        expected = sorted(analyzer.summary.sources.items(), key=lambda x: (-x[1]['count'], x[0]))
+        self.assertEqual(columns.top_sources(), expected)
+        self.assertEqual(dict(expected)['192.0.2.5']['hostname'], 'mx1.example.com')
+        self.assertEqual(dict(expected)['203.0.113.200']['hostname'], '203.0.113.200')
+        problems = [(ip, stats) for ip, stats in expected if analyzer._is_problem_source(stats)]
+        self.assertEqual(columns.problem_sources(), problems)
+
+    def test_rows_without_hostname(self):
+        from dmarc_aggregate import SummaryAggregate
+        from dmarc_columns import ColumnBuilder
+        rows = [
+            ('192.0.2.1', 4, 'pass', 'pass', 'none', None),
+            ('192.0.2.2', 3, 'pass', 'pass', 'none', None),
+            ('192.0.2.2', 2, 'fail', 'pass', 'none', '192.0.2.2'),
+            ('192.0.2.3', 1, 'pass', 'pass', 'none', 'b.example.net'),
+            ('192.0.2.3', 1, 'pass', 'pass', 'none', None),
+        ]
+        summary = SummaryAggregate()
+        builder = ColumnBuilder()
+        for row in rows:
+            summary.add_record(*row[:5], hostname=row[5])
+            builder.add_row(*row)
+        self.assertEqual(builder.build().top_sources(),
+                         sorted(summary.sources.items(), key=lambda x: (-x[1]['count'], x[0])))
+
+
+
+def without_column_sections(report):
+    """列指向エンジンだけが出力する分布の節を除いたレポート"""
+    lines = report.split('\n')
+    start = lines.index('【送信元あたりのメール数の分布】')
+    end = lines.index('', start)
+    return '\n'.join(lines[:start] + lines[end + 1:])
+
+
+@unittest.skipUnless(find_spec('numpy'), 'NumPy が必要')
+class EngineEquivalenceTest(unittest.TestCase):
+    """--engine numpy は辞書での集計をせず、列データから同じレポート・JSONを作る"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.paths = write_reports(self.tmp.name, hostname_reports())
+        self.module = load_script('dmarc-report-analyzer.py')
+
+    def analyzer(self, columnar):
+        spf = SPFEvaluator('example.com', StubDNSSource(
+            {'example.com': {'TXT': ['v=spf1 ip4:192.0.2.0/24 -all']}}))
+        analyzer = offline_analyzer(self.module, spf_evaluator=spf)
+        analyzer._get_hostname = varying_hostnames()
+        if columnar:
+            analyzer.use_columns()
+        return analyzer
+
+    def results(self, analyzer, name):
+        analyzer.finish_columns()
+        report = analyzer.generate_report()
+        if analyzer.columns is not None:
+            report = without_column_sections(report)
+        return report, export(analyzer, self.tmp.name, name)
+
+    def test_reports_and_exports_match(self):
+        expected = self.analyzer(False)
+        for path in self.paths:
+            expected.load_report(path)
+        expected = self.results(expected, 'dict.json')
+        self.assertIn('spf_class', str(expected[1]['summary']['failures']))
+
+        sequential = self.analyzer(True)
+        for path in self.paths:
+            sequential.load_report(path)
+        # レコードは列データにだけ集計し、summary にはレポート情報だけが入る
+        self.assertEqual((sequential.summary.total_messages, sequential.summary.sources), (0, {}))
+        self.assertEqual(self.results(sequential, 'sequential.json'), expected)
+
+        # パイプラインは同じIPを1回だけ逆引きするため、辞書での集計もパイプラインで比べる
+        pipelined = [self.analyzer(columnar) for columnar in (False, True)]
+        for analyzer in pipelined:
+            analyzer.load_reports_pipelined(self.paths, workers=2)
+        self.assertEqual(self.results(pipelined[1], 'pipelined.json'),
+                         self.results(pipelined[0], 'pipelined-dict.json'))
+
+        cache_path = os.path.join(self.tmp.name, 'rows.bin')
+        writer = self.analyzer(True)
+        writer.row_writer = RowCacheWriter(cache_path)
+        writer.row_sinks.append(writer.row_writer)
+        for path in self.paths:
+            writer.load_report(path)
+        writer.row_writer.close([])
+        cache = RowCache.open_if_valid(cache_path, [])
+        cached = self.analyzer(False)
+        try:
+            from dmarc_columns import ColumnarRows
+            cached.columns = ColumnarRows.from_row_cache(cache)
+            self.assertEqual(cached.load_row_cache(cache), cache.row_count)
+        finally:
+            cache.close()
+        self.assertEqual(cached.summary.sources, {})
+        self.assertEqual(self.results(cached, 'cached.json'), expected)
+
+    def test_aggregate_matches_dict_engine(self):
+        dict_engine, columnar = self.analyzer(False), self.analyzer(True)
+        for analyzer in (dict_engine, columnar):
+            for path in self.paths:
+                analyzer.load_report(path)
+            analyzer.finish_columns()
+        self.assertEqual(columnar.aggregate(), dict_engine.aggregate())
+
+
+if __name__ == '__main__':
+    unittest.main()
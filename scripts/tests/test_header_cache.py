@@ -0,0 +1,93 @@
+"""
+header_cache: メールヘッダー解析結果の永続キャッシュ
+"""
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from report_fixtures import load_script
+
+from header_bench import generate_corpus, write_mbox
+from header_cache import HeaderResultCache, header_key
+
+
+class HeaderCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.module = load_script('analyze-email-headers.py')
+        self.headers = generate_corpus(120, seed=7, malformed_ratio=0.2)
+        self.cache_path = os.path.join(self.tmp.name, 'headers.sqlite')
+
+    def analyze(self, text):
+        analyzer = self.module.EmailHeaderAnalyzer()
+        fields = list(self.module.iter_header_fields(text))
+        for name, value in fields:
+            analyzer._add_header(name, value)
+        return header_key(fields), analyzer.analyze()
+
+    def test_cached_results_equal_fresh_analysis(self):
+        cache = HeaderResultCache(self.cache_path, 'test')
+        for text in self.headers:
+            key, analysis = self.analyze(text)
+            if cache.get(key) is None:
+                cache.put(key, analysis)
+        cache.close()
+
+        cache = HeaderResultCache(self.cache_path, 'test')
+        try:
+            for text in self.headers:
+                key, analysis = self.analyze(text)
+                self.assertEqual(cache.get(key), analysis)
+            self.assertEqual(cache.misses, 0)
+        finally:
+            cache.close()
+
+    def test_version_change_discards_results(self):
+        key, analysis = self.analyze(self.headers[0])
+        cache = HeaderResultCache(self.cache_path, 'v1')
+        cache.put(key, analysis)
+        cache.close()
+        cache = HeaderResultCache(self.cache_path, 'v2')
+        try:
+            self.assertTrue(cache.invalidated)
+            self.assertIsNone(cache.get(key))
+        finally:
+            cache.close()
+
+    def test_folding_and_line_endings_share_a_key(self):
+        text = 'Subject: a long\n subject line\nFrom: a@example.com'
+        self.assertEqual(self.analyze(text)[0], self.analyze(text.replace('\n', '\r\n'))[0])
+
+    def batch(self, mbox, cache_path=None):
+        """(JSON 出力, キャッシュ行を除いたレポート, キャッシュ行)"""
+        json_path = os.path.join(self.tmp.name, 'batch.json')
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.module.batch_main([mbox], json_path, cache_path)
+        with open(json_path, encoding='utf-8') as f:
+            result = json.load(f)
+        lines = out.getvalue().splitlines()
+        notes = [line for line in lines if line.startswith('キャッシュ:')]
+        report = [line for line in lines if not line.startswith('キャッシュ:')]
+        return result, report, notes
+
+    def test_batch_output_is_identical_with_and_without_cache(self):
+        mbox = os.path.join(self.tmp.name, 'corpus.mbox')
+        write_mbox(mbox, self.headers)
+        expected, report, _ = self.batch(mbox)
+        first = self.batch(mbox, self.cache_path)
+        second = self.batch(mbox, self.cache_path)
+        for result in (first, second):
+            self.assertEqual(result[:2], (expected, report))
+        # 2回目はすべてキャッシュから集計される
+        self.assertEqual(second[2], [f"キャッシュ: {len(self.headers):,} 件ヒット / 0 件を解析"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+"""
+dmarc_parse: 信頼できないレポートの上限（展開爆弾・エンティティ・入れ子・レコード数・不正な数値）
+"""
+
+import contextlib
+import gzip
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+
+from report_fixtures import load_script, make_report, offline_analyzer, record
+
+from dmarc_parse import (XML_BACKENDS, MalformedReportError, ReportLimitError, ReportLimits,
+                         ReportReadError, parse_report, parse_report_auth, parse_report_metadata,
+                         read_report, read_report_header)
+
+GOOD = make_report('good', 1700000000, [record('192.0.2.1', 3), record('192.0.2.2', 4)])
+
+
+def malformed_reports():
+    """数値であるべき要素が数値でないレポート（名前 -> XML）"""
+    return {
+        'count': GOOD.replace('<count>3</count>', '<count>zz</count>'),
+        'empty_count': GOOD.replace('<count>3</count>', '<count></count>'),
+        'negative_count': GOOD.replace('<count>3</count>', '<count>-3</count>'),
+        'huge_count': GOOD.replace('<count>3</count>', f'<count>{2 ** 64}</count>'),
+        'begin': GOOD.replace('<begin>1700000000</begin>', '<begin>abc</begin>'),
+        'end': GOOD.replace('</begin><end>', '</begin><end>1.5e9'),
+    }
+
+
+def bomb(size):
+    """展開すると size バイトを超えるXML（圧縮後はごく小さい）"""
+    return GOOD.replace('</feedback>', '<!--' + ' ' * size + '--></feedback>').encode('utf-8')
+
+
+def write_bad_files(directory):
+    """上限・不正な内容ごとに1ファイルずつ書き出し、{ファイル名: 失敗理由} を返す"""
+    expected = {}
+
+    def write(name, data, reason):
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(data)
+        expected[name] = reason
+
+    write('bomb.xml.gz', gzip.compress(bomb(4096)), 'xml_size')
+    with zipfile.ZipFile(os.path.join(directory, 'bomb.zip'), 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('report.xml', bomb(4096))
+    expected['bomb.zip'] = 'xml_size'
+    write('large.xml', GOOD.encode('utf-8') + b' ' * 8192, 'file_size')
+    write('entity.xml', GOOD.replace('<feedback>', '<!DOCTYPE feedback [<!ENTITY a "x">]>\n<feedback>')
+          .encode('utf-8'), 'entity')
+    write('deep.xml', GOOD.replace('<domain>', '<domain><a><b><c><d><e>x</e></d></c></b></a>', 1)
+          .encode('utf-8'), 'depth')
+    write('many.xml', make_report('many', 1700000000, [record(f'192.0.2.{i}', 1) for i in range(3)])
+          .encode('utf-8'), 'records')
+    write('count.xml', malformed_reports()['count'].encode('utf-8'), 'malformed')
+    write('begin.xml', malformed_reports()['begin'].encode('utf-8'), 'malformed')
+    write('truncated.xml.gz', gzip.compress(GOOD.encode('utf-8'))[:60], 'read_error')
+    write('corrupt.zip', b'PK\x03\x04 not a zip', 'read_error')
+    write('latin1.xml', GOOD.replace('google.com', 'göogle.com').encode('latin-1'), 'read_error')
+    write('syntax.xml', GOOD[:len(GOOD) // 2].encode('utf-8'), 'parse_error')
+    return expected
+
+
+# 各ファイルの上限を超え、GOOD は超えない値
+TEST_LIMITS = ReportLimits(file_bytes=len(GOOD) + 4096, xml_bytes=len(GOOD) + 1024,
+                           records=2, depth=6)
+
+
+def reasons(expected, exclude=()):
+    counts = {}
+    for reason in expected.values():
+        if reason not in exclude:
+            counts[reason] = counts.get(reason, 0) + 1
+    return counts
+
+
+class ReadLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.expected = write_bad_files(self.tmp.name)
+
+    def test_each_file_is_rejected_with_its_reason(self):
+        for name, reason in self.expected.items():
+            path = os.path.join(self.tmp.name, name)
+            with self.subTest(name=name):
+                try:
+                    content = read_report(path, TEST_LIMITS)
+                    parse_report(content, limits=TEST_LIMITS)
+                except ReportLimitError as e:
+                    self.assertEqual(e.reason, reason)
+                except ReportReadError as e:
+                    self.assertEqual(e.reason, reason)
+                except SyntaxError:
+                    self.assertEqual(reason, 'parse_error')
+                else:
+                    self.fail(f"{name} が拒否されません")
+
+    def test_decompression_stops_at_the_limit(self):
+        path = os.path.join(self.tmp.name, 'huge.xml.gz')
+        with open(path, 'wb') as f:
+            f.write(gzip.compress(bomb(64 * 1024 * 1024)))
+        with self.assertRaises(ReportLimitError) as cm:
+            read_report(path, ReportLimits(xml_bytes=1024 * 1024))
+        self.assertEqual(cm.exception.reason, 'xml_size')
+
+    def test_header_of_malformed_report_is_unknown(self):
+        # 絞り込みでは対象に残し、本処理で処理失敗として数える
+        self.assertIsNone(read_report_header(os.path.join(self.tmp.name, 'begin.xml')))
+        self.assertIsNone(read_report_header(os.path.join(self.tmp.name, 'corrupt.zip')))
+
+
+class MalformedNumberTest(unittest.TestCase):
+
+    def test_all_parsers_reject_malformed_numbers(self):
+        for name, content in malformed_reports().items():
+            for backend in XML_BACKENDS:
+                for func, args in ((parse_report, (content, backend)),
+                                   (parse_report, (content, backend, None, True)),
+                                   (parse_report_metadata, (content, None, backend)),
+                                   (parse_report_metadata, (content, None, backend, None, True))):
+                    with self.subTest(name=name, backend=backend, func=func.__name__, args=len(args)):
+                        with self.assertRaises(MalformedReportError) as cm:
+                            func(*args)
+                        self.assertEqual(cm.exception.reason, 'malformed')
+            with self.subTest(name=name, func='parse_report_auth'):
+                with self.assertRaises(MalformedReportError):
+                    parse_report_auth(content)
+
+    def test_whitespace_around_numbers_is_accepted(self):
+        content = GOOD.replace('<count>3</count>', '<count> 3 </count>')
+        for backend in XML_BACKENDS:
+            self.assertEqual(parse_report(content, backend)[1][0][1], 3)
+
+
+class RunContinuesTest(unittest.TestCase):
+    """上限を超えたファイルは理由とともに処理失敗として数え、残りのファイルの処理を続ける"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.expected = write_bad_files(self.tmp.name)
+        with open(os.path.join(self.tmp.name, 'good.xml'), 'w', encoding='utf-8') as f:
+            f.write(GOOD)
+        self.paths = sorted(os.path.join(self.tmp.name, name) for name in os.listdir(self.tmp.name))
+
+    def analyzer(self):
+        analyzer = offline_analyzer(load_script('dmarc-report-analyzer.py'))
+        analyzer.limits = TEST_LIMITS
+        return analyzer
+
+    def test_analyzer(self):
+        sequential = self.analyzer()
+        pipelined = self.analyzer()
+        with contextlib.redirect_stderr(io.StringIO()):
+            for path in self.paths:
+                sequential.load_report(path)
+            pipelined.load_reports_pipelined(self.paths, workers=2)
+        for analyzer in (sequential, pipelined):
+            self.assertEqual(analyzer.summary.failure_reasons, reasons(self.expected))
+            self.assertEqual(analyzer.summary.failed_reports, len(self.expected))
+            self.assertEqual(analyzer.summary.total_messages, 7)
+            self.assertEqual([r['report_id'] for r in analyzer.reports], ['good'])
+
+    def test_checker(self):
+        module = load_script('check-dmarc-reports.py')
+        for pipelined in (False, True):
+            checker = module.DMARCReportChecker({'reports_dir': self.tmp.name, 'create_dirs': False,
+                                                 'limits': TEST_LIMITS})
+            with contextlib.redirect_stdout(io.StringIO()):
+                if pipelined:
+                    checker.analyze_reports_pipelined(self.paths, workers=2)
+                else:
+                    checker.analyze_reports(self.paths)
+            with self.subTest(pipelined=pipelined):
+                # 受信確認ツールは XML の構文エラーを処理失敗に数えない
+                self.assertEqual(checker.stats.failure_reasons,
+                                 reasons(self.expected, exclude=('parse_error',)))
+                self.assertEqual(checker.stats.processed_reports, 1)
+                self.assertEqual(checker.stats.senders['google.com']['messages'], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
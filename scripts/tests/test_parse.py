@@ -0,0 +1,82 @@
+"""
+dmarc_parse: XMLバックエンド（expat・etree）の結果の一致
+"""
+
+import unittest
+
+from report_fixtures import make_report, record, sample_reports
+
+from dmarc_parse import (XML_BACKENDS, ParseError, ReportLimitError, ReportLimits,
+                         parse_report, parse_report_metadata)
+
+
+def edge_case_reports():
+    """値の前後の空白・欠けた要素・未知の要素・レコードなしなどを含むレポート"""
+    base = make_report('edge', 1700000000, [record('192.0.2.1', 3)])
+    return [
+        base.replace('<count>3</count>', '<count> 3 </count>')
+            .replace('<source_ip>192.0.2.1</source_ip>', '<source_ip>\n 192.0.2.1 \n</source_ip>'),
+        base.replace('<count>3</count>', ''),
+        base.replace('<disposition>none</disposition>', '').replace('<spf>pass</spf>', ''),
+        base.replace('<row>', '<row><unknown><count>99</count></unknown>'),
+        base.replace('<report_metadata>', '<version>1.0</version><report_metadata>')
+            .replace('</record>', '</record><extension><record>x</record></extension>'),
+        make_report('empty', 1700000000, []),
+        base.replace('<policy_published>', '<policy_published><!-- comment -->'),
+        base.replace('<org_name>google.com</org_name>', '<org_name><![CDATA[Example & Co]]></org_name>'),
+        base.replace('<date_range><begin>1700000000</begin>', '<date_range><begin>oops</begin>'),
+        base.replace('</policy_published>', '</policy_published>' * 2),
+        base[:len(base) // 2],
+        '',
+    ]
+
+
+def call(func, *args, **kwargs):
+    """結果か、例外の種類（上限超過なら理由も）"""
+    try:
+        return 'ok', func(*args, **kwargs)
+    except ReportLimitError as e:
+        return 'limit', e.reason
+    except ParseError:
+        return 'error',
+
+
+class BackendEquivalenceTest(unittest.TestCase):
+
+    def assert_backends_agree(self, func, content, *args, **kwargs):
+        results = {backend: call(func, content, *args, backend=backend, **kwargs)
+                   for backend in XML_BACKENDS}
+        expat = results.pop('expat')
+        for backend, result in results.items():
+            self.assertEqual(result, expat, f"{backend} と expat の結果が異なります")
+        return expat
+
+    def test_parse_report(self):
+        for content in sample_reports() + edge_case_reports():
+            with self.subTest(content=content[:200]):
+                self.assert_backends_agree(parse_report, content)
+
+    def test_parse_report_metadata(self):
+        for content in sample_reports() + edge_case_reports():
+            for domains in (None, {'example.com'}, {'other.example'}):
+                with self.subTest(content=content[:200], domains=domains):
+                    self.assert_backends_agree(parse_report_metadata, content, domains)
+
+    def test_limits(self):
+        content = make_report('many', 1700000000, [record(f'192.0.2.{i}', 1) for i in range(5)])
+        result = self.assert_backends_agree(parse_report, content,
+                                            limits=ReportLimits(records=4))
+        self.assertEqual(result, ('limit', 'records'))
+        result = self.assert_backends_agree(parse_report, content, limits=ReportLimits(depth=3))
+        self.assertEqual(result, ('limit', 'depth'))
+        self.assertEqual(self.assert_backends_agree(parse_report, content,
+                                                    limits=ReportLimits(records=5))[0], 'ok')
+
+    def test_entity_declarations_are_rejected(self):
+        content = make_report('ent', 1700000000, [record('192.0.2.1', 1)]).replace(
+            '<feedback>', '<!DOCTYPE feedback [<!ENTITY a "x">]>\n<feedback>')
+        self.assertEqual(self.assert_backends_agree(parse_report, content), ('limit', 'entity'))
+
+
+if __name__ == '__main__':
+    unittest.main()
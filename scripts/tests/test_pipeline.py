@@ -0,0 +1,65 @@
+"""
+dmarc_pipeline: 非同期取り込みパイプライン
+"""
+
+import random
+import tempfile
+import threading
+import time
+import unittest
+
+from report_fixtures import export, load_script, offline_analyzer, sample_reports, write_reports
+
+from dmarc_pipeline import IngestPipeline, parse_for_analyzer
+
+
+class OrderedPipelineTest(unittest.TestCase):
+
+    def run_pipeline(self, count, window):
+        handled = []
+        lock = threading.Lock()
+        ahead = []
+        xml = sample_reports()[0]
+
+        def read(path):
+            # 読み込みの完了順をばらつかせ、並べ直しが必要な状況を作る
+            with lock:
+                ahead.append(int(path) - len(handled))
+            time.sleep(random.random() * 0.005)
+            return xml
+
+        pipeline = IngestPipeline(parse_for_analyzer, lambda item: handled.append(item.seq),
+                                  read=read, parse_workers=2, ordered=True, reorder_window=window)
+        pipeline.run([str(i) for i in range(count)])
+        return handled, max(ahead)
+
+    def test_items_are_handled_in_input_order(self):
+        handled, _ = self.run_pipeline(60, None)
+        self.assertEqual(handled, list(range(60)))
+
+    def test_reorder_window_bounds_items_in_flight(self):
+        for window in (1, 4):
+            handled, ahead = self.run_pipeline(40, window)
+            self.assertEqual(handled, list(range(40)))
+            # handle 待ちの最古の要素から window 件先までしか読み込みが始まらない
+            self.assertLess(ahead, window)
+
+
+class AnalyzerPipelineTest(unittest.TestCase):
+
+    def test_pipeline_matches_sequential(self):
+        module = load_script('dmarc-report-analyzer.py')
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = write_reports(tmp, sample_reports())
+            sequential = offline_analyzer(module)
+            for path in paths:
+                sequential.load_report(path)
+            pipelined = offline_analyzer(module)
+            pipelined.load_reports_pipelined(paths, workers=2)
+            self.assertEqual(export(pipelined, tmp, 'pipeline.json'),
+                             export(sequential, tmp, 'sequential.json'))
+            self.assertEqual(pipelined.reports, sequential.reports)
+
+
+if __name__ == '__main__':
+    unittest.main()
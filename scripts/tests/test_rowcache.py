@@ -0,0 +1,147 @@
+"""
+dmarc_rowcache: 解析済みレコードのバイナリキャッシュ
+"""
+
+import os
+import tempfile
+import unittest
+from importlib.util import find_spec
+
+from report_fixtures import (export, load_script, make_report, offline_analyzer, record, sample_reports,
+                             write_reports)
+
+from dmarc_rowcache import MAX_COUNT, RowCache, RowCacheWriter, file_signature
+
+
+class RowCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache_path = os.path.join(self.tmp.name, 'rows.bin')
+
+    def test_rows_round_trip_unchanged(self):
+        rows = [
+            ('192.0.2.5', 40, 'pass', 'pass', 'none', 'mail.example.com'),
+            ('2001:DB8::1', 5, 'fail', 'pass', 'none', None),
+            ('not-an-ip', 2, 'fail', 'fail', 'reject', None),
+            ('', 1, 'softfail', 'temperror', 'quarantine', 'x.example.net'),
+            ('192.0.2.5', 3, 'pass', 'fail', 'none', 'mail.example.com'),
+        ]
+        writer = RowCacheWriter(self.cache_path)
+        for row in rows[:2]:
+            writer.add_row(*row)
+        writer.add_report({'org_name': 'google.com', 'report_id': 'r1'})
+        for row in rows[2:]:
+            writer.add_row(*row)
+        writer.add_report({'org_name': 'yahoo.com', 'report_id': 'r2'})
+        writer.close([['input', 1, 2]])
+
+        cache = RowCache.open_if_valid(self.cache_path, [['input', 1, 2]])
+        self.assertIsNotNone(cache)
+        try:
+            self.assertEqual(cache.row_count, len(rows))
+            self.assertEqual(list(cache.iter_rows()),
+                             [row + (0 if i < 2 else 1,) for i, row in enumerate(rows)])
+            self.assertEqual([r['report_id'] for r in cache.reports], ['r1', 'r2'])
+        finally:
+            cache.close()
+
+    def test_missing_results_are_kept_apart_from_empty_strings(self):
+        rows = [
+            ('192.0.2.5', 4, None, None, None, None),
+            ('192.0.2.5', 3, '', '', '', None),
+            ('192.0.2.6', MAX_COUNT, 'none', 'pass', 'none', None),
+        ]
+        writer = RowCacheWriter(self.cache_path)
+        for row in rows:
+            writer.add_row(*row)
+        writer.add_report({})
+        writer.close([])
+        cache = RowCache.open_if_valid(self.cache_path, [])
+        try:
+            self.assertEqual(list(cache.iter_rows()), [row + (0,) for row in rows])
+        finally:
+            cache.close()
+
+    def test_out_of_range_count_leaves_previous_cache(self):
+        writer = RowCacheWriter(self.cache_path)
+        writer.add_row('192.0.2.5', 1, 'pass', 'pass', 'none', None)
+        writer.add_report({})
+        writer.close([])
+
+        writer = RowCacheWriter(self.cache_path)
+        writer.add_row('192.0.2.5', 2, 'pass', 'pass', 'none', None)
+        for count in (-1, MAX_COUNT + 1):
+            with self.subTest(count=count):
+                with self.assertRaises(ValueError):
+                    writer.add_row('192.0.2.9', count, 'fail', 'fail', 'reject', 'bad.example.net')
+        # 拒否したレコードは書き込まず、文字列・結果コードも登録しない
+        self.assertEqual((writer.row_count, writer.strings.values, writer.dispositions.values),
+                         (1, ['192.0.2.5'], ['none', 'quarantine', 'reject']))
+        writer.abort()
+        self.assertFalse(os.path.exists(self.cache_path + '.tmp'))
+        cache = RowCache.open_if_valid(self.cache_path, [])
+        try:
+            self.assertEqual([row[1] for row in cache.iter_rows()], [1])
+        finally:
+            cache.close()
+
+    def test_changed_inputs_invalidate(self):
+        writer = RowCacheWriter(self.cache_path)
+        writer.add_row('192.0.2.5', 1, 'pass', 'pass', 'none', None)
+        writer.add_report({})
+        writer.close([['input', 1, 2]])
+        self.assertIsNone(RowCache.open_if_valid(self.cache_path, [['input', 1, 3]]))
+
+    def test_cached_run_matches_fresh_run(self):
+        module = load_script('dmarc-report-analyzer.py')
+        # 結果が空のレコード（None）も含める
+        empty = make_report('empty', 1700000000, [record('192.0.2.77', 6, dkim='fail')])
+        paths = write_reports(self.tmp.name, sample_reports() + [
+            empty.replace('<dkim>fail</dkim>', '<dkim></dkim>', 1)])
+
+        fresh = offline_analyzer(module)
+        fresh.row_writer = RowCacheWriter(self.cache_path)
+        fresh.row_sinks.append(fresh.row_writer)
+        for path in paths:
+            fresh.load_report(path)
+        inputs = [file_signature(path) for path in paths]
+        fresh.row_writer.close(inputs)
+
+        cache = RowCache.open_if_valid(self.cache_path, inputs)
+        self.assertIsNotNone(cache)
+        cached = offline_analyzer(module)
+        try:
+            cached.load_row_cache(cache)
+        finally:
+            cache.close()
+        self.assertEqual(export(cached, self.tmp.name, 'cached.json'),
+                         export(fresh, self.tmp.name, 'fresh.json'))
+        # 正規化されていないIP・IPでない値もレポートの文字列のまま
+        self.assertIn('2001:DB8::1', cached.summary.sources)
+        self.assertIn('not-an-ip', cached.summary.sources)
+
+    @unittest.skipUnless(find_spec('numpy'), 'NumPy が必要')
+    def test_columns_from_cache_match_dict_engine(self):
+        from dmarc_columns import ColumnarRows
+        module = load_script('dmarc-report-analyzer.py')
+        paths = write_reports(self.tmp.name, sample_reports())
+        analyzer = offline_analyzer(module)
+        analyzer.row_writer = RowCacheWriter(self.cache_path)
+        analyzer.row_sinks.append(analyzer.row_writer)
+        for path in paths:
+            analyzer.load_report(path)
+        analyzer.row_writer.close([])
+
+        cache = RowCache.open_if_valid(self.cache_path, [])
+        try:
+            columns = ColumnarRows.from_row_cache(cache)
+        finally:
+            cache.close()
+        expected = sorted(analyzer.summary.sources.items(), key=lambda x: (-x[1]['count'], x[0]))
+        self.assertEqual(columns.top_sources(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+dmarc_simulate: DMARCポリシーの試算
+"""
+
+import unittest
+from importlib.util import find_spec
+
+from report_fixtures import make_report, record
+
+from dmarc_parse import parse_report_auth
+from dmarc_simulate import PolicyCandidate, SimulationRows, simulate
+
+
+class PolicyCandidateTest(unittest.TestCase):
+
+    def test_parse(self):
+        candidate = PolicyCandidate.parse('v=DMARC1; p=Reject, sp=quarantine; pct=50; adkim=s')
+        self.assertEqual((candidate.p, candidate.sp, candidate.pct, candidate.adkim, candidate.aspf),
+                         ('reject', 'quarantine', 50, 's', 'r'))
+        self.assertEqual(candidate.label(), 'p=reject; sp=quarantine; pct=50; adkim=s')
+        # 既定値のタグは表記から省く（sp を省略したときは p と同じ）
+        candidate = PolicyCandidate.parse('p=quarantine; pct=100; aspf=r')
+        self.assertEqual(candidate.sp, 'quarantine')
+        self.assertEqual(candidate.label(), 'p=quarantine')
+
+    def test_invalid_specs(self):
+        for spec in ('', 'sp=reject', 'p=block', 'p=none; sp=drop', 'p=none; adkim=x',
+                     'p=none; pct=101', 'p=none; pct=-1', 'p=none; pct=half', 'p=none; rua=x',
+                     'p=none; reject'):
+            with self.subTest(spec=spec):
+                with self.assertRaises(ValueError):
+                    PolicyCandidate.parse(spec)
+
+
+def sample_rows() -> SimulationRows:
+    """アライメント成功 40通、失敗 20通、サブドメインでの失敗 10通と、relaxed でだけ成功する 8通"""
+    content = make_report('sim', 1700000000, [
+        record('192.0.2.5', 40, auth_dkim=[('example.com', 's1', 'pass')]),
+        record('203.0.113.9', 20, dkim='fail', spf='fail'),
+        # 第三者の署名は pass しているがアライメントは取れない
+        record('198.51.100.7', 10, dkim='fail', spf='fail', header_from='news.example.com',
+               auth_dkim=[('esp.example.org', 'k1', 'pass')]),
+        record('198.51.100.20', 8, spf='fail', header_from='news.example.com',
+               auth_dkim=[('example.com', 's1', 'pass')]),
+    ])
+    rows = SimulationRows()
+    rows.add_report(*parse_report_auth(content))
+    return rows
+
+
+@unittest.skipUnless(find_spec('numpy'), 'NumPy が必要')
+class SimulateTest(unittest.TestCase):
+
+    def run_candidates(self, *specs):
+        result = simulate(sample_rows(), [PolicyCandidate.parse(spec) for spec in specs])
+        self.assertEqual((result['messages'], result['records']), (78, 4))
+        return result['candidates']
+
+    def totals(self, candidate):
+        return {name: candidate[name] for name in
+                ('pass', 'fail', 'none', 'quarantine', 'reject', 'affected', 'authenticated')}
+
+    def test_pct_applies_one_level_weaker_policy_to_sampled_out_mail(self):
+        reject, quarantine, disabled = self.run_candidates(
+            'p=reject; pct=50', 'p=quarantine; pct=25', 'p=reject; pct=0')
+        self.assertEqual(self.totals(reject), {
+            'pass': 48, 'fail': 30, 'none': 48, 'quarantine': 15, 'reject': 15,
+            'affected': 30, 'authenticated': 10})
+        self.assertEqual(self.totals(quarantine), {
+            'pass': 48, 'fail': 30, 'none': 70.5, 'quarantine': 7.5, 'reject': 0,
+            'affected': 7.5, 'authenticated': 2.5})
+        self.assertEqual((disabled['quarantine'], disabled['reject']), (30, 0))
+        self.assertEqual([(s['key'], s['affected'], s['authenticated']) for s in reject['sources']],
+                         [('203.0.113.9', 20, 0), ('198.51.100.7', 10, 10)])
+        self.assertEqual([(o['key'], o['affected'], o['messages']) for o in reject['orgs']],
+                         [('google.com', 30, 78)])
+
+    def test_sp_applies_to_subdomains(self):
+        candidate, = self.run_candidates('p=none; sp=reject')
+        self.assertEqual((candidate['quarantine'], candidate['reject']), (0, 10))
+        self.assertEqual([s['key'] for s in candidate['sources']], ['198.51.100.7'])
+
+    def test_strict_alignment(self):
+        relaxed, strict = self.run_candidates('p=quarantine', 'p=quarantine; adkim=s')
+        self.assertEqual(relaxed['quarantine'], 30)
+        # news.example.com に example.com の署名では strict のアライメントが取れない
+        self.assertEqual((strict['pass'], strict['quarantine'], strict['authenticated']), (40, 38, 18))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+dmarc_spf: SPFレコードの展開と送信元IPの分類
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dmarc_spf import (MAX_DNS_LOOKUPS, SPF_INVALID_IP, SPF_MISALIGNED, SPF_NOT_IN_RECORD,
+                       SPFEvaluator, StubDNSSource)
+
+
+def evaluator(records, domain='example.com'):
+    stub = {name: {'TXT': [txt]} if isinstance(txt, str) else txt for name, txt in records.items()}
+    return SPFEvaluator(domain, StubDNSSource(stub))
+
+
+class QualifierTest(unittest.TestCase):
+
+    def test_earlier_fail_mechanism_wins_over_later_pass(self):
+        spf = evaluator({'example.com': 'v=spf1 -ip4:192.0.2.4 ip4:192.0.2.0/24 -all'})
+        self.assertFalse(spf.contains('192.0.2.4'))
+        self.assertTrue(spf.contains('192.0.2.3'))
+        self.assertTrue(spf.contains('192.0.2.5'))
+        self.assertFalse(spf.contains('198.51.100.1'))
+
+    def test_softfail_and_neutral_are_not_pass(self):
+        spf = evaluator({'example.com': 'v=spf1 ~ip4:192.0.2.0/25 ?ip6:2001:db8::/32 ip4:192.0.2.0/24'})
+        self.assertFalse(spf.contains('192.0.2.1'))
+        self.assertTrue(spf.contains('192.0.2.200'))
+        self.assertFalse(spf.contains('2001:db8::1'))
+
+    def test_later_fail_does_not_remove_earlier_pass(self):
+        spf = evaluator({'example.com': 'v=spf1 ip4:192.0.2.0/24 -ip4:192.0.2.4 -all'})
+        self.assertTrue(spf.contains('192.0.2.4'))
+
+    def test_include_matches_only_where_included_record_passes(self):
+        spf = evaluator({
+            'example.com': 'v=spf1 include:_spf.example.net ip4:198.51.100.0/24 -all',
+            '_spf.example.net': 'v=spf1 -ip4:198.51.100.9 ip4:203.0.113.0/24 ~all',
+        })
+        self.assertTrue(spf.contains('203.0.113.7'))
+        # include 先で fail なら include は一致せず、後ろのメカニズムで pass になる
+        self.assertTrue(spf.contains('198.51.100.9'))
+
+    def test_fail_qualified_include_blocks_later_pass(self):
+        spf = evaluator({
+            'example.com': 'v=spf1 -include:bad.example.net ip4:203.0.113.0/24',
+            'bad.example.net': 'v=spf1 ip4:203.0.113.128/25',
+        })
+        self.assertTrue(spf.contains('203.0.113.1'))
+        self.assertFalse(spf.contains('203.0.113.200'))
+
+    def test_redirect_applies_only_without_all(self):
+        records = {'other.example.net': 'v=spf1 ip4:203.0.113.0/24'}
+        spf = evaluator(dict(records, **{'example.com': 'v=spf1 -ip4:203.0.113.1 redirect=other.example.net'}))
+        self.assertTrue(spf.contains('203.0.113.2'))
+        self.assertFalse(spf.contains('203.0.113.1'))
+        spf = evaluator(dict(records, **{'example.com': 'v=spf1 -all redirect=other.example.net'}))
+        self.assertFalse(spf.contains('203.0.113.2'))
+
+    def test_pass_all_covers_everything(self):
+        spf = evaluator({'example.com': 'v=spf1 -ip4:192.0.2.1 +all'})
+        self.assertTrue(spf.contains('198.51.100.1'))
+        self.assertTrue(spf.contains('2001:db8::1'))
+        self.assertFalse(spf.contains('192.0.2.1'))
+
+    def test_classify_failure(self):
+        spf = evaluator({'example.com': 'v=spf1 -ip4:192.0.2.4 ip4:192.0.2.0/24 -all'})
+        self.assertEqual(spf.classify_failure('192.0.2.4'), SPF_NOT_IN_RECORD)
+        self.assertEqual(spf.classify_failure('192.0.2.5'), SPF_MISALIGNED)
+        self.assertEqual(spf.classify_failure('not-an-ip'), SPF_INVALID_IP)
+
+
+class MalformedRecordTest(unittest.TestCase):
+
+    def test_malformed_terms_are_skipped_with_warning(self):
+        spf = evaluator({
+            'example.com': {
+                'TXT': ['v=spf1 a:mail.example.com/99 ip4:192.0.2.0/40 ip4:2001:db8::1 '
+                        'ip6:2001:db8::/200 mx/abc a ip4:198.51.100.0/24 -all'],
+                'A': ['203.0.113.1', 'bogus'],
+            },
+        })
+        self.assertTrue(spf.contains('198.51.100.1'))
+        self.assertTrue(spf.contains('203.0.113.1'))
+        self.assertFalse(spf.contains('192.0.2.1'))
+        self.assertFalse(spf.contains('2001:db8::1'))
+        self.assertEqual(len(spf.warnings), 6)
+
+
+class LookupLimitTest(unittest.TestCase):
+
+    def test_memoized_include_counts_on_every_reference(self):
+        spf = evaluator({
+            'example.com': 'v=spf1 include:a.example.net include:a.example.net include:a.example.net -all',
+            'a.example.net': 'v=spf1 include:b.example.net a mx',
+            'b.example.net': 'v=spf1 ip4:192.0.2.0/24',
+        })
+        # include 1回あたり: include 自身 + include:b + a + mx = 4
+        self.assertEqual(spf.lookups, 12)
+        self.assertGreater(spf.lookups, MAX_DNS_LOOKUPS)
+        self.assertTrue(any('上限' in warning for warning in spf.warnings))
+
+    def test_within_limit_has_no_warning(self):
+        spf = evaluator({
+            'example.com': 'v=spf1 include:a.example.net include:a.example.net -all',
+            'a.example.net': 'v=spf1 ip4:192.0.2.0/24',
+        })
+        self.assertEqual(spf.lookups, 2)
+        self.assertEqual(spf.warnings, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+dmarc_spill: メモリ上限付きの集計（ディスクへの退避と外部マージ）
+"""
+
+import tempfile
+import unittest
+
+from report_fixtures import (DAY, export, load_script, make_report, offline_analyzer, record,
+                             sample_reports, write_reports)
+
+from dmarc_spill import SummarySpill, parse_size
+
+
+def many_reports():
+    """退避が何度も起きるよう、送信元・失敗パターンの多いレポート群"""
+    reports = sample_reports()
+    for index in range(6):
+        records = [record(f'198.51.{index}.{host}', host + 1,
+                          dkim='fail' if host % 3 else 'pass', spf='fail' if host % 2 else 'pass')
+                   for host in range(40)]
+        # 期間を入力順と逆にして、レポート情報の並べ替えも確かめる
+        reports.append(make_report(f'bulk-{index}', 1700000000 - index * DAY, records, org='bulk.example'))
+    return reports
+
+
+class SpillTest(unittest.TestCase):
+
+    def test_spilled_export_matches_in_memory(self):
+        module = load_script('dmarc-report-analyzer.py')
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = write_reports(tmp, many_reports())
+            in_memory = offline_analyzer(module)
+            for path in paths:
+                in_memory.load_report(path)
+
+            spilled = offline_analyzer(module)
+            spilled.spill = SummarySpill(2048, tmp)
+            try:
+                for path in paths:
+                    spilled.load_report(path)
+                self.assertGreater(spilled.spill.spills, 1)
+                self.assertEqual(export(spilled, tmp, 'spilled.json'),
+                                 export(in_memory, tmp, 'memory.json'))
+            finally:
+                spilled.spill.close()
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('512M'), 512 * 1024 ** 2)
+        self.assertEqual(parse_size('1.5k'), 1536)
+        self.assertEqual(parse_size('2GB'), 2 * 1024 ** 3)
+        for value in ('0', '-1M', 'abc'):
+            with self.assertRaises(ValueError):
+                parse_size(value)
+
+
+if __name__ == '__main__':
+    unittest.main()
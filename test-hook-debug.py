@@ -7,146 +7,631 @@ import json
 import sys
 import subprocess
 import os
+import time
+import argparse
+import tempfile
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-def test_hook_execution():
-    """Test if hooks are being called by Claude Code"""
-    
-    print("=== HOOK DEBUG TEST ===")
-    print(f"Time: {datetime.now().isoformat()}")
-    print()
-    
-    # Check hook directory
-    hooks_dir = os.path.expanduser("~/.claude/hooks")
-    print(f"1. Checking hooks directory: {hooks_dir}")
-    if os.path.exists(hooks_dir):
-        print("   ✅ Directory exists")
-        hooks = os.listdir(hooks_dir)
-        for hook in hooks:
-            hook_path = os.path.join(hooks_dir, hook)
-            if os.path.isfile(hook_path):
-                is_exec = os.access(hook_path, os.X_OK)
-                print(f"   - {hook}: {'✅ executable' if is_exec else '❌ not executable'}")
-    else:
-        print("   ❌ Directory does not exist")
-    
-    print()
+LOG_FILE = os.path.expanduser("~/.claude/hooks.log")
+HOOK_SCRIPT = os.path.expanduser("~/.claude/hooks/user_prompt_submit.py")
+# Sparse time index for hooks.log: one (timestamp, offset) point every INDEX_STRIDE bytes
+INDEX_STRIDE = 1024 * 1024
+
+# Prompts of different sizes, so the benchmark sees realistic payloads
+BENCH_PROMPTS = [
+    "Debug test",
+    "Fix the failing test in src/app/api/posts/route.ts and explain what was wrong.",
+    "Refactor this component to use React.memo and explain the trade-offs:\n```tsx\n"
+    + "export function PostItem({ post }: PostItemProps) {\n  return <div>{post.title}</div>;\n}\n" * 40
+    + "```",
+]
+
+def tail_lines(path, count, block_size=8192):
+    """Return the last `count` lines of a file by reading blocks backwards from the end"""
+    if count <= 0:
+        return []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        # count + 1 newlines guarantees `count` complete lines (the last line may lack one)
+        while position > 0 and data.count(b'\n') <= count:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    lines = data.decode('utf-8', errors='replace').splitlines()
+    return lines[-count:]
+
+def parse_log_lines(lines):
+    """Parse JSON log lines, skipping anything that is not a JSON object"""
+    entries = []
+    for line in lines:
+        try:
+            entry = json.loads(line.strip())
+        except ValueError:
+            continue
+        if isinstance(entry, dict):
+            entries.append(entry)
+    return entries
+
+def read_recent_entries(path, count):
+    """Return up to `count` of the most recent JSON entries from the hook log"""
+    return parse_log_lines(tail_lines(path, count))
+
+def format_entry(entry):
+    return f"{entry.get('timestamp', 'unknown')}: {entry.get('event', 'unknown')}"
+
+def follow_log(path, interval=1.0, initial_lines=5):
+    """Print the last few entries, then only lines appended after that (like tail -f)"""
+    print(f"Following {path} (Ctrl+C to stop)")
+    offset = 0
+    if os.path.exists(path):
+        for entry in read_recent_entries(path, initial_lines):
+            print(f"- {format_entry(entry)}")
+        offset = os.path.getsize(path)
     
-    # Check Claude Code process
-    print("2. Checking Claude Code process:")
+    pending = b''
+    try:
+        while True:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            if size < offset:
+                # Log was truncated or rotated - start over from the beginning
+                print("(log truncated, restarting from the beginning)")
+                offset, pending = 0, b''
+            if size > offset:
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    chunk = f.read(size - offset)
+                offset += len(chunk)
+                data = pending + chunk
+                # Keep an incomplete trailing line until the rest of it is written
+                complete, _, pending = data.rpartition(b'\n')
+                if complete:
+                    lines = complete.decode('utf-8', errors='replace').split('\n')
+                    for entry in parse_log_lines(lines):
+                        print(f"- {format_entry(entry)}")
+                    sys.stdout.flush()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print()
+
+def parse_timestamp(value):
+    """Parse an ISO timestamp from a log entry to epoch seconds (None if invalid)"""
     try:
-        result = subprocess.run(['ps', 'aux'], capture_output=True, text=True)
-        claude_procs = [line for line in result.stdout.split('\n') if 'claude' in line.lower() and 'grep' not in line]
-        if claude_procs:
-            print("   ✅ Claude Code is running")
-            for proc in claude_procs[:3]:
-                print(f"   {proc[:120]}...")
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def parse_time_arg(value):
+    """Parse a --since/--until value: ISO time, or relative like 30m, 6h, 2d"""
+    units = {'m': 60, 'h': 3600, 'd': 86400}
+    if value and value[-1] in units and value[:-1].isdigit():
+        return time.time() - int(value[:-1]) * units[value[-1]]
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        raise argparse.ArgumentTypeError(f"invalid time: {value} (use ISO format or e.g. 6h, 2d)")
+    return parsed
+
+def _iter_log_from(f, offset):
+    """Yield (offset, timestamp, entry) for each JSON line starting at offset"""
+    f.seek(offset)
+    while True:
+        line = f.readline()
+        if not line:
+            break
+        if line.endswith(b'\n'):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                entry = None
+            if isinstance(entry, dict):
+                ts = parse_timestamp(entry.get('timestamp'))
+                if ts is not None:
+                    yield offset, ts, entry
         else:
-            print("   ❌ Claude Code process not found")
-    except Exception as e:
-        print(f"   ❌ Error checking process: {e}")
+            # Incomplete last line still being written
+            break
+        offset += len(line)
+
+class LogTimeIndex:
+    """Sparse timestamp -> byte offset index for the append-only hook log
+
+    The index is stored next to the log and extended incrementally: only bytes
+    appended since the last run are scanned. If the log is rotated or
+    truncated, it is rebuilt.
+    """
     
-    print()
+    def __init__(self, log_path, index_path=None, stride=INDEX_STRIDE):
+        self.log_path = log_path
+        self.index_path = index_path or log_path + '.idx'
+        self.stride = stride
+        self.points = []  # [(timestamp, offset)], timestamps non-decreasing
+        self.indexed_bytes = 0
+        self.inode = None
     
-    # Check if hooks are being triggered
-    print("3. Checking hook logs:")
-    log_file = os.path.expanduser("~/.claude/hooks.log")
-    if os.path.exists(log_file):
-        print(f"   ✅ Log file exists: {log_file}")
+    def _load(self):
         try:
-            with open(log_file, 'r') as f:
-                lines = f.readlines()
-                recent_logs = lines[-5:] if len(lines) > 5 else lines
-                print("   Recent entries:")
-                for line in recent_logs:
-                    try:
-                        entry = json.loads(line.strip())
-                        timestamp = entry.get('timestamp', 'unknown')
-                        event = entry.get('event', 'unknown')
-                        print(f"   - {timestamp}: {event}")
-                    except:
-                        pass
-        except Exception as e:
-            print(f"   ❌ Error reading log: {e}")
-    else:
-        print("   ❌ Log file does not exist")
+            with open(self.index_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('stride') == self.stride:
+            self.points = [tuple(p) for p in data.get('points', [])]
+            self.indexed_bytes = data.get('indexed_bytes', 0)
+            self.inode = data.get('inode')
     
-    print()
+    def _save(self):
+        data = {'stride': self.stride, 'inode': self.inode,
+                'indexed_bytes': self.indexed_bytes, 'points': self.points}
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.index_path)
     
-    # Test hook script directly
-    print("4. Testing user_prompt_submit.py hook directly:")
-    hook_script = os.path.expanduser("~/.claude/hooks/user_prompt_submit.py")
-    if os.path.exists(hook_script):
-        test_payload = {
-            "prompt": "Debug test",
-            "session_id": "debug-" + str(os.getpid()),
-            "timestamp": datetime.now().isoformat()
-        }
+    def update(self):
+        """Bring the index up to date with the log; returns the number of bytes scanned"""
+        self._load()
+        st = os.stat(self.log_path)
+        if st.st_ino != self.inode or st.st_size < self.indexed_bytes:
+            self.points, self.indexed_bytes, self.inode = [], 0, st.st_ino
+        if st.st_size == self.indexed_bytes:
+            return 0
         
-        try:
-            result = subprocess.run(
-                ['python3', hook_script],
-                input=json.dumps(test_payload),
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            
-            if result.returncode == 0:
-                print("   ✅ Hook executed successfully")
-                if result.stderr:
-                    print("   Output (stderr):")
-                    for line in result.stderr.split('\n')[:10]:
-                        if line.strip():
-                            print(f"   {line}")
-            else:
-                print(f"   ❌ Hook failed with code {result.returncode}")
-                if result.stderr:
-                    print(f"   Error: {result.stderr[:200]}")
-        except subprocess.TimeoutExpired:
-            print("   ❌ Hook timed out")
-        except Exception as e:
-            print(f"   ❌ Error executing hook: {e}")
-    else:
-        print("   ❌ Hook script not found")
+        start = self.indexed_bytes
+        next_point = (self.points[-1][1] + self.stride) if self.points else 0
+        last_ts = self.points[-1][0] if self.points else None
+        offset = start
+        with open(self.log_path, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Partial write: leave it for the next update
+                    break
+                if offset >= next_point:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        entry = None
+                    ts = parse_timestamp(entry.get('timestamp')) if isinstance(entry, dict) else None
+                    if ts is not None and (last_ts is None or ts >= last_ts):
+                        self.points.append((ts, offset))
+                        last_ts = ts
+                        next_point = offset + self.stride
+                offset += len(line)
+        self.indexed_bytes = offset
+        self._save()
+        return offset - start
     
-    print()
+    def offset_for(self, since):
+        """Byte offset from which scanning is guaranteed to include all entries >= since"""
+        if since is None or not self.points:
+            return 0
+        index = bisect_right([p[0] for p in self.points], since) - 1
+        return self.points[index][1] if index >= 0 else 0
+
+def analyze_log_window(log_path, since=None, until=None, gap_seconds=3600, index=None):
+    """Per-event counts, rates and activity gaps for a time window of the hook log"""
+    index = index or LogTimeIndex(log_path)
+    scanned_for_index = index.update()
+    start_offset = index.offset_for(since)
     
-    # Check environment variables
-    print("5. Checking environment:")
-    print(f"   PATH: {os.environ.get('PATH', 'not set')[:100]}...")
-    print(f"   HOME: {os.environ.get('HOME', 'not set')}")
-    print(f"   USER: {os.environ.get('USER', 'not set')}")
+    counts = {}
+    timestamps = []
+    with open(log_path, 'rb') as f:
+        for offset, ts, entry in _iter_log_from(f, start_offset):
+            if until is not None and ts >= until:
+                break
+            if since is not None and ts < since:
+                continue
+            event = entry.get('event', 'unknown')
+            counts[event] = counts.get(event, 0) + 1
+            timestamps.append(ts)
+    
+    window_start = since if since is not None else (timestamps[0] if timestamps else None)
+    window_end = until if until is not None else time.time()
+    gaps = []
+    if window_start is not None:
+        # Include the window edges, so a window with no activity at its start or end counts too
+        points = [window_start] + timestamps + [window_end]
+        for prev, cur in zip(points, points[1:]):
+            if cur - prev >= gap_seconds:
+                gaps.append((prev, cur))
+    
+    hours = max((window_end - window_start) / 3600, 1e-9) if window_start is not None else None
+    return {
+        'since': window_start,
+        'until': window_end,
+        'total': len(timestamps),
+        'events': {event: {'count': count, 'per_hour': count / hours if hours else None}
+                   for event, count in sorted(counts.items(), key=lambda x: -x[1])},
+        'gaps': gaps,
+        'index_points': len(index.points),
+        'bytes_indexed_now': scanned_for_index,
+        'start_offset': start_offset,
+    }
+
+def print_log_analytics(result, gap_seconds):
+    def fmt(ts):
+        return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
     
+    print("=== HOOK LOG ANALYTICS ===")
+    if result['since'] is None:
+        print("No hook activity found")
+        return
+    print(f"Window: {fmt(result['since'])} - {fmt(result['until'])}")
+    print(f"Index: {result['index_points']} points "
+          f"(scanned {result['bytes_indexed_now']:,} new bytes, query started at byte {result['start_offset']:,})")
     print()
-    print("=== ANALYSIS ===")
+    print(f"Total entries: {result['total']}")
+    for event, data in result['events'].items():
+        print(f"   - {event}: {data['count']} ({data['per_hour']:.1f}/hour)")
+    print()
+    if result['gaps']:
+        print(f"⚠️  Gaps of {gap_seconds / 60:.0f}+ minutes:")
+        for start, end in result['gaps']:
+            print(f"   - no hook activity between {fmt(start)} and {fmt(end)} "
+                  f"({(end - start) / 3600:.1f} hours)")
+    else:
+        print(f"✅ No gaps of {gap_seconds / 60:.0f}+ minutes")
+
+def make_hook_payload(index):
+    """Build a UserPromptSubmit payload shaped like the ones Claude Code sends"""
+    return {
+        "session_id": f"bench-{os.getpid()}-{index}",
+        "transcript_path": os.path.expanduser(f"~/.claude/projects/bench/{index}.jsonl"),
+        "cwd": os.getcwd(),
+        "hook_event_name": "UserPromptSubmit",
+        "prompt": BENCH_PROMPTS[index % len(BENCH_PROMPTS)],
+        "timestamp": datetime.now().isoformat()
+    }
+
+def run_hook_once(hook_script, payload, timeout=5.0, env=None):
+    """Run the hook once and return wall time, exit code and peak RSS of the child"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(['python3', hook_script], stdin=subprocess.PIPE,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    timer = threading.Timer(timeout, proc.kill)
+    timer.start()
+    try:
+        try:
+            proc.stdin.write(json.dumps(payload).encode('utf-8'))
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        # wait4 reaps the child and returns its resource usage in one call
+        _, status, usage = os.wait4(proc.pid, 0)
+    finally:
+        timer.cancel()
+    elapsed = (time.perf_counter() - start) * 1000
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss_kb = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    return {'ms': elapsed, 'returncode': proc.returncode, 'rss_kb': rss_kb}
+
+def percentile(values, pct):
+    """Percentile with linear interpolation between closest ranks"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def summarize_runs(runs):
+    timings = [r['ms'] for r in runs]
+    return {
+        'runs': len(runs),
+        'failures': sum(1 for r in runs if r['returncode'] != 0),
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+        'max_ms': max(timings) if timings else None,
+        'peak_rss_kb': max((r['rss_kb'] for r in runs), default=None)
+    }
+
+def benchmark_hook(hook_script, runs=20, cold_runs=5, concurrency=4, timeout=5.0):
+    """Measure hook latency cold, warm (sequential) and under concurrency"""
+    # Interpreter startup alone, to see how much of the hook latency it explains
+    startup = []
+    for _ in range(5):
+        start = time.perf_counter()
+        subprocess.run(['python3', '-c', 'pass'], check=False)
+        startup.append((time.perf_counter() - start) * 1000)
+    startup_ms = percentile(startup, 50)
     
-    # Analyze results
-    issues = []
+    # Cold: every run gets an empty bytecode cache, as after installing a new hook version
+    cold = []
+    for i in range(cold_runs):
+        with tempfile.TemporaryDirectory() as pycache:
+            env = dict(os.environ, PYTHONPYCACHEPREFIX=pycache)
+            env.pop('PYTHONDONTWRITEBYTECODE', None)
+            cold.append(run_hook_once(hook_script, make_hook_payload(i), timeout, env))
     
-    if not os.path.exists(hooks_dir):
-        issues.append("Hooks directory does not exist")
+    # Warm: one untimed run fills the bytecode cache, then sequential runs
+    run_hook_once(hook_script, make_hook_payload(0), timeout)
+    warm = [run_hook_once(hook_script, make_hook_payload(i), timeout) for i in range(runs)]
+    
+    # Concurrent: several prompts submitted at once (e.g. multiple sessions)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        concurrent = list(pool.map(
+            lambda i: run_hook_once(hook_script, make_hook_payload(i), timeout), range(runs)))
     
+    warm_summary = summarize_runs(warm)
+    return {
+        'hook': hook_script,
+        'hook_mtime': datetime.fromtimestamp(os.path.getmtime(hook_script)).isoformat(),
+        'python': sys.version.split()[0],
+        'timestamp': datetime.now().isoformat(),
+        'interpreter_startup_ms': startup_ms,
+        'startup_share_warm_p50': (startup_ms / warm_summary['p50_ms']) if warm_summary['p50_ms'] else None,
+        'cold': summarize_runs(cold),
+        'warm': warm_summary,
+        'concurrent': dict(summarize_runs(concurrent), concurrency=concurrency),
+    }
+
+def print_benchmark(results):
+    print("=== HOOK LATENCY BENCHMARK ===")
+    print(f"Hook: {results['hook']}")
+    print(f"Interpreter startup (p50): {results['interpreter_startup_ms']:.1f} ms")
+    print()
+    print(f"{'mode':<12} {'runs':>5} {'fail':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'peak RSS':>10}")
+    for mode in ('cold', 'warm', 'concurrent'):
+        r = results[mode]
+        if not r['runs']:
+            continue
+        label = mode if mode != 'concurrent' else f"conc x{r['concurrency']}"
+        print(f"{label:<12} {r['runs']:>5} {r['failures']:>5} {r['p50_ms']:>7.1f}ms "
+              f"{r['p95_ms']:>7.1f}ms {r['p99_ms']:>7.1f}ms {r['peak_rss_kb'] / 1024:>8.1f}MB")
+    if results['startup_share_warm_p50'] is not None:
+        print()
+        print(f"Interpreter startup accounts for {results['startup_share_warm_p50'] * 100:.0f}% "
+              f"of warm p50 latency")
+
+def read_proc_processes(proc_root='/proc'):
+    """Yield (pid, argv, exe) for every process by reading /proc directly (no ps fork)"""
+    my_pid = os.getpid()
+    for name in os.listdir(proc_root):
+        if not name.isdigit() or int(name) == my_pid:
+            continue
+        try:
+            with open(os.path.join(proc_root, name, 'cmdline'), 'rb') as f:
+                raw = f.read()
+        except OSError:
+            # The process exited or is not ours to inspect
+            continue
+        if not raw:
+            # Kernel threads have an empty cmdline
+            continue
+        argv = [arg.decode('utf-8', errors='replace') for arg in raw.rstrip(b'\0').split(b'\0')]
+        try:
+            exe = os.readlink(os.path.join(proc_root, name, 'exe'))
+        except OSError:
+            exe = None
+        yield int(name), argv, exe
+
+def read_ps_processes():
+    """Fallback for systems without /proc (macOS): one ps call, pid and full command line"""
+    result = subprocess.run(['ps', '-axo', 'pid=,command='], capture_output=True, text=True)
+    my_pid = os.getpid()
+    for line in result.stdout.splitlines():
+        pid, _, command = line.strip().partition(' ')
+        if pid.isdigit() and int(pid) != my_pid and command:
+            yield int(pid), command.split(), None
+
+def find_processes(match='claude', exe=None, proc_root='/proc'):
+    """Processes whose command line contains `match` (case-insensitive)
+
+    If `exe` is given, only processes whose executable (or argv[0] when the
+    executable link is not readable) has that basename are returned.
+    """
+    source = read_proc_processes(proc_root) if os.path.isdir(proc_root) else read_ps_processes()
+    needle = match.lower() if match else None
+    found = []
+    for pid, argv, exe_path in source:
+        if exe is not None:
+            names = {os.path.basename(argv[0])}
+            if exe_path:
+                names.add(os.path.basename(exe_path))
+            if exe not in names:
+                continue
+        command = ' '.join(argv)
+        if needle is not None and needle not in command.lower():
+            continue
+        found.append({'pid': pid, 'exe': exe_path, 'command': command})
+    return found
+
+def check_hooks_dir(hooks_dir, hook_script):
+    lines = []
+    issues = []
     if not os.path.exists(hook_script):
         issues.append("user_prompt_submit.py hook not found")
     elif not os.access(hook_script, os.X_OK):
         issues.append("Hook script is not executable")
-    
+    if not os.path.exists(hooks_dir):
+        lines.append("   ❌ Directory does not exist")
+        return {'ok': False, 'lines': lines, 'issues': ["Hooks directory does not exist"] + issues}
+    lines.append("   ✅ Directory exists")
+    hooks = {}
+    for hook in os.listdir(hooks_dir):
+        hook_path = os.path.join(hooks_dir, hook)
+        if os.path.isfile(hook_path):
+            is_exec = os.access(hook_path, os.X_OK)
+            hooks[hook] = is_exec
+            lines.append(f"   - {hook}: {'✅ executable' if is_exec else '❌ not executable'}")
+    return {'ok': True, 'lines': lines, 'issues': issues, 'hooks': hooks}
+
+def check_processes(match='claude', exe=None):
+    processes = find_processes(match, exe)
+    if not processes:
+        return {'ok': False, 'lines': ["   ❌ Claude Code process not found"], 'issues': [],
+                'processes': []}
+    lines = ["   ✅ Claude Code is running"]
+    for proc in processes[:3]:
+        lines.append(f"   {proc['pid']:>7} {proc['command'][:110]}")
+    if len(processes) > 3:
+        lines.append(f"   ... and {len(processes) - 3} more")
+    return {'ok': True, 'lines': lines, 'issues': [], 'processes': processes}
+
+def check_log(log_file, recent_count=5):
     if not os.path.exists(log_file):
-        issues.append("Hook log file does not exist - hooks may not be running")
+        return {'ok': False, 'lines': ["   ❌ Log file does not exist"],
+                'issues': ["Hook log file does not exist - hooks may not be running"]}
+    lines = [f"   ✅ Log file exists: {log_file}"]
+    issues = []
+    # Only the tail of the log is read, so this is cheap even for huge logs
+    recent_entries = read_recent_entries(log_file, recent_count)
+    lines.append("   Recent entries:")
+    for entry in recent_entries:
+        lines.append(f"   - {format_entry(entry)}")
+    last_age = None
+    if recent_entries:
+        last_time = parse_timestamp(recent_entries[-1].get('timestamp'))
+        if last_time is not None:
+            last_age = time.time() - last_time
+            if last_age > 3600:  # More than 1 hour
+                issues.append(f"No recent hook activity (last: {last_age/3600:.1f} hours ago)")
+    return {'ok': True, 'lines': lines, 'issues': issues,
+            'recent_entries': len(recent_entries), 'last_activity_seconds': last_age}
+
+def check_hook_run(hook_script, timeout=5.0):
+    if not os.path.exists(hook_script):
+        # Reported as an issue by the hooks directory check
+        return {'ok': False, 'lines': ["   ❌ Hook script not found"], 'issues': []}
+    issues = []
+    test_payload = {
+        "prompt": "Debug test",
+        "session_id": "debug-" + str(os.getpid()),
+        "timestamp": datetime.now().isoformat()
+    }
+    lines = []
+    try:
+        result = subprocess.run(
+            ['python3', hook_script],
+            input=json.dumps(test_payload),
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        lines.append("   ❌ Hook timed out")
+        return {'ok': False, 'lines': lines, 'issues': issues + ["Hook timed out"]}
+    
+    if result.returncode == 0:
+        lines.append("   ✅ Hook executed successfully")
+        if result.stderr:
+            lines.append("   Output (stderr):")
+            for line in result.stderr.split('\n')[:10]:
+                if line.strip():
+                    lines.append(f"   {line}")
     else:
-        # Check if there are recent entries (within last hour)
+        lines.append(f"   ❌ Hook failed with code {result.returncode}")
+        if result.stderr:
+            lines.append(f"   Error: {result.stderr[:200]}")
+        issues.append(f"Hook exited with code {result.returncode}")
+    return {'ok': result.returncode == 0, 'lines': lines, 'issues': issues,
+            'returncode': result.returncode}
+
+def check_environment():
+    lines = [
+        f"   PATH: {os.environ.get('PATH', 'not set')[:100]}...",
+        f"   HOME: {os.environ.get('HOME', 'not set')}",
+        f"   USER: {os.environ.get('USER', 'not set')}",
+    ]
+    return {'ok': True, 'lines': lines, 'issues': []}
+
+def run_checks(checks, timeout):
+    """Run independent checks concurrently, each bounded by `timeout` seconds
+
+    `checks` is a list of (name, title, function). Daemon threads are used so a
+    check stuck in blocking I/O (e.g. a hung network home directory) is reported
+    as timed out and does not keep the process alive. Results keep the input order.
+    """
+    results = {}
+    
+    def run(name, func):
+        start = time.perf_counter()
         try:
-            with open(log_file, 'r') as f:
-                lines = f.readlines()
-                if lines:
-                    last_entry = json.loads(lines[-1].strip())
-                    last_time = datetime.fromisoformat(last_entry.get('timestamp', '2000-01-01'))
-                    time_diff = (datetime.now() - last_time).total_seconds()
-                    if time_diff > 3600:  # More than 1 hour
-                        issues.append(f"No recent hook activity (last: {time_diff/3600:.1f} hours ago)")
-        except:
-            pass
+            result = func()
+        except Exception as e:
+            result = {'ok': False, 'lines': [f"   ❌ Error: {e}"], 'issues': [f"{name} check failed: {e}"]}
+        result['ms'] = (time.perf_counter() - start) * 1000
+        results[name] = result
+    
+    start = time.perf_counter()
+    threads = []
+    for name, _, func in checks:
+        thread = threading.Thread(target=run, args=(name, func), daemon=True)
+        thread.start()
+        threads.append(thread)
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.monotonic(), 0))
+    
+    ordered = []
+    for name, title, _ in checks:
+        result = results.get(name)
+        if result is None:
+            result = {'ok': False, 'timed_out': True, 'ms': timeout * 1000,
+                      'lines': [f"   ❌ Check did not finish within {timeout:g}s"],
+                      'issues': [f"{name} check timed out after {timeout:g}s"]}
+        ordered.append(dict(result, name=name, title=title))
+    return ordered, (time.perf_counter() - start) * 1000
+
+def health_checks(recent_count=5, process_match='claude', process_exe=None,
+                  run_hook=True, timeout=5.0):
+    """Run health checks concurrently (the log check waits for the hook test);
+    returns (results, total wall ms, issues)"""
+    hooks_dir = os.path.expanduser("~/.claude/hooks")
+    checks = [
+        ('hooks_dir', f"Checking hooks directory: {hooks_dir}", lambda: check_hooks_dir(hooks_dir, HOOK_SCRIPT)),
+        ('processes', "Checking Claude Code process:", lambda: check_processes(process_match, process_exe)),
+        ('log', "Checking hook logs:", lambda: check_log(LOG_FILE, recent_count)),
+    ]
+    if run_hook:
+        # The hook gets its own timeout; the check timeout leaves it a little slack
+        checks.append(('hook_run', "Testing user_prompt_submit.py hook directly:",
+                       lambda: check_hook_run(HOOK_SCRIPT, timeout)))
+    checks.append(('environment', "Checking environment:", check_environment))
+    if run_hook:
+        # The log check runs after the hook test so it can see the entry the hook just wrote
+        first, first_ms = run_checks([c for c in checks if c[0] != 'log'], timeout + 1)
+        second, second_ms = run_checks([c for c in checks if c[0] == 'log'], timeout + 1)
+        by_name = {result['name']: result for result in first + second}
+        results = [by_name[name] for name, _, _ in checks]
+        total_ms = first_ms + second_ms
+    else:
+        results, total_ms = run_checks(checks, timeout + 1)
+    issues = [issue for result in results for issue in result['issues']]
+    return results, total_ms, issues
+
+def test_hook_execution(recent_count=5, process_match='claude', process_exe=None,
+                        run_hook=True, timeout=5.0):
+    """Test if hooks are being called by Claude Code"""
+    
+    print("=== HOOK DEBUG TEST ===")
+    print(f"Time: {datetime.now().isoformat()}")
+    print()
+    
+    results, total_ms, issues = health_checks(recent_count, process_match, process_exe,
+                                              run_hook, timeout)
+    for number, result in enumerate(results, 1):
+        print(f"{number}. {result['title']} ({result['ms']:.1f} ms)")
+        for line in result['lines']:
+            print(line)
+        print()
+    slowest = max(results, key=lambda r: r['ms'])
+    print(f"Checks ran concurrently in {total_ms:.1f} ms (slowest: {slowest['name']}, {slowest['ms']:.1f} ms)")
+    
+    print()
+    print("=== ANALYSIS ===")
     
     if issues:
         print("⚠️  ISSUES FOUND:")
@@ -176,5 +661,87 @@ def test_hook_execution():
         print("3. Check if Do Not Disturb mode is enabled")
         print("4. Try running: terminal-notifier -message 'Test' -title 'Test'")
 
+def main():
+    parser = argparse.ArgumentParser(description='Debug Claude Code hooks integration')
+    parser.add_argument('--follow', '-f', action='store_true',
+                        help='Follow the hook log and print new entries as they are appended')
+    parser.add_argument('--lines', '-n', type=int, default=5,
+                        help='Number of recent log entries to show (default: 5)')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='Polling interval in seconds for --follow (default: 1.0)')
+    parser.add_argument('--bench', action='store_true',
+                        help='Benchmark the user_prompt_submit.py hook latency')
+    parser.add_argument('--hook', default=HOOK_SCRIPT,
+                        help='Hook script to benchmark (default: user_prompt_submit.py)')
+    parser.add_argument('--runs', type=int, default=20,
+                        help='Number of warm and concurrent runs for --bench (default: 20)')
+    parser.add_argument('--cold-runs', type=int, default=5,
+                        help='Number of cold (empty bytecode cache) runs for --bench (default: 5)')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Parallel hook invocations for --bench (default: 4)')
+    parser.add_argument('--timeout', type=float, default=5.0,
+                        help='Per-invocation timeout in seconds (default: 5)')
+    parser.add_argument('--bench-output', metavar='FILE',
+                        help='Write --bench results as JSON for comparing hook versions')
+    parser.add_argument('--analytics', action='store_true',
+                        help='Report per-event counts, rates and gaps in the hook log for a time window')
+    parser.add_argument('--since', type=parse_time_arg, default=None,
+                        help='Start of the --analytics window: ISO time or relative (e.g. 6h, 2d; default: 24h)')
+    parser.add_argument('--until', type=parse_time_arg, default=None,
+                        help='End of the --analytics window (default: now)')
+    parser.add_argument('--gap-minutes', type=float, default=60,
+                        help='Report periods without hook activity at least this long (default: 60)')
+    parser.add_argument('--json', action='store_true',
+                        help='Print --analytics or health check results as JSON '
+                             '(health check exits with status 1 if issues are found)')
+    parser.add_argument('--process-match', default='claude',
+                        help='Substring to look for in process command lines (default: claude)')
+    parser.add_argument('--process-exe', metavar='NAME',
+                        help='Only count processes whose executable is named NAME (e.g. node)')
+    parser.add_argument('--skip-hook-run', action='store_true',
+                        help='Do not run the hook in the health check (keeps periodic '
+                             'monitoring from writing test entries to the hook log)')
+    args = parser.parse_args()
+    
+    if args.analytics:
+        if not os.path.exists(LOG_FILE):
+            print(f"❌ Log file does not exist: {LOG_FILE}")
+            sys.exit(1)
+        since = args.since if args.since is not None else time.time() - 86400
+        gap_seconds = args.gap_minutes * 60
+        result = analyze_log_window(LOG_FILE, since, args.until, gap_seconds)
+        if args.json:
+            print(json.dumps(result, indent=2))
+        else:
+            print_log_analytics(result, gap_seconds)
+    elif args.bench:
+        if not os.path.exists(args.hook):
+            print(f"❌ Hook script not found: {args.hook}")
+            sys.exit(1)
+        results = benchmark_hook(args.hook, args.runs, args.cold_runs,
+                                 args.concurrency, args.timeout)
+        print_benchmark(results)
+        if args.bench_output:
+            with open(args.bench_output, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"\nResults written to {args.bench_output}")
+    elif args.follow:
+        follow_log(LOG_FILE, args.interval, args.lines)
+    elif args.json:
+        results, total_ms, issues = health_checks(args.lines, args.process_match, args.process_exe,
+                                                  not args.skip_hook_run, args.timeout)
+        print(json.dumps({
+            'timestamp': datetime.now().isoformat(),
+            'ok': not issues,
+            'issues': issues,
+            'total_ms': total_ms,
+            'checks': {r['name']: {k: v for k, v in r.items() if k not in ('name', 'title', 'lines')}
+                       for r in results},
+        }, indent=2))
+        sys.exit(1 if issues else 0)
+    else:
+        test_hook_execution(args.lines, args.process_match, args.process_exe,
+                            not args.skip_hook_run, args.timeout)
+
 if __name__ == "__main__":
-    test_hook_execution()
\ No newline at end of file
+    main()
\ No newline at end of file